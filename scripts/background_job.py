@@ -0,0 +1,91 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Background process for running a long-running command outside of the charm hooks."""
+
+import json
+import os
+import pwd
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+def now() -> str:
+    """Return the current time in the format used in the job status file."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def read_job(job_file: str) -> dict:
+    """Read the job status file."""
+    with open(job_file) as file:
+        return json.load(file)
+
+
+def write_job(job_file: str, job: dict) -> None:
+    """Atomically replace the job status file."""
+    temporary_file = f"{job_file}.tmp"
+    with open(temporary_file, "w") as file:
+        json.dump(job, file)
+    os.replace(temporary_file, job_file)
+
+
+def demote(user):
+    """Return a function that switches the command to the given user."""
+    pw_record = pwd.getpwnam(user)
+
+    def result():
+        os.setgid(pw_record.pw_gid)
+        os.setuid(pw_record.pw_uid)
+
+    return result
+
+
+def dispatch(run_cmd, unit, charm_dir, custom_event):
+    """Use the input juju-run command to dispatch a custom event."""
+    dispatch_sub_cmd = "JUJU_DISPATCH_PATH=hooks/{} {}/dispatch"
+    # Input is generated by the charm
+    subprocess.run([run_cmd, "-u", unit, dispatch_sub_cmd.format(custom_event, charm_dir)])  # noqa: S603
+
+
+def run_job(job_file: str) -> dict:
+    """Run the command of the job, recording its state in the job status file."""
+    job = read_job(job_file)
+    with open(job["stdout-file"], "w") as stdout, open(job["stderr-file"], "w") as stderr:
+        try:
+            # Input is generated by the charm
+            process = subprocess.Popen(  # noqa: S603
+                job["command"],
+                stdout=stdout,
+                stderr=stderr,
+                preexec_fn=demote(job["user"]) if job.get("user") else None,
+            )
+        except (KeyError, OSError) as e:
+            stderr.write(f"Failed to start the command: {e}\n")
+            job.update({"state": "finished", "return-code": -1, "finished-at": now()})
+            write_job(job_file, job)
+            return job
+
+        job.update({
+            "state": "running",
+            "pid": process.pid,
+            "worker-pid": os.getpid(),
+            "started-at": now(),
+        })
+        write_job(job_file, job)
+        return_code = process.wait()
+
+    job.update({"state": "finished", "return-code": return_code, "finished-at": now()})
+    write_job(job_file, job)
+    return job
+
+
+def main():
+    """Run the job and dispatch an event to let the charm handle its completion."""
+    job_file, run_cmd, unit, charm_dir = sys.argv[1:]
+    run_job(job_file)
+    dispatch(run_cmd, unit, charm_dir, "background_job_completed")
+
+
+if __name__ == "__main__":
+    main()
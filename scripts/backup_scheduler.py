@@ -0,0 +1,28 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Background process that waits for the next scheduled backup."""
+
+import subprocess
+import sys
+from time import sleep, time
+
+
+def dispatch(run_cmd, unit, charm_dir, custom_event):
+    """Use the input juju-run command to dispatch a custom event."""
+    dispatch_sub_cmd = "JUJU_DISPATCH_PATH=hooks/{} {}/dispatch"
+    # Input is generated by the charm
+    subprocess.run([run_cmd, "-u", unit, dispatch_sub_cmd.format(custom_event, charm_dir)])  # noqa: S603
+
+
+def main():
+    """Sleep until the scheduled backup is due and dispatch an event to start it."""
+    due, run_cmd, unit, charm_dir = sys.argv[1:]
+    # Sleep in steps, so suspending the machine doesn't delay the backup.
+    while (remaining := float(due) - time()) > 0:
+        sleep(min(remaining, 60))
+    dispatch(run_cmd, unit, charm_dir, "scheduled_backup")
+
+
+if __name__ == "__main__":
+    main()
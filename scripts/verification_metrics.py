@@ -0,0 +1,48 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Background process that serves the metrics of the backup repository verifications."""
+
+import sys
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the metrics file written by the charm on /metrics."""
+
+    def __init__(self, *args, metrics_file: str, **kwargs):
+        self.metrics_file = metrics_file
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        """Return the content of the metrics file (empty if the charm didn't write it yet)."""
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            with open(self.metrics_file, "rb") as file:
+                content = file.read()
+        except OSError:
+            content = b""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # noqa: A002
+        """Don't log every scrape."""
+
+
+def main():
+    """Serve the metrics file until the process is stopped."""
+    address, port, metrics_file = sys.argv[1:]
+    server = ThreadingHTTPServer(
+        (address, int(port)), partial(MetricsHandler, metrics_file=metrics_file)
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Long-running commands executed outside of the charm hooks.
+
+Each job is described by a JSON status file in BACKGROUND_JOBS_PATH. The charm writes
+the file and spawns scripts/background_job.py, which runs the command, keeps the status
+file updated and dispatches a BackgroundJobCompletedEvent once the command finishes.
+"""
+
+import json
+import logging
+import os
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from ops.framework import EventBase, Object
+
+from constants import BACKGROUND_JOBS_PATH
+
+if TYPE_CHECKING:
+    from charm import PostgresqlOperatorCharm
+
+logger = logging.getLogger(__name__)
+
+# File path for the spawned background job processes to write logs.
+LOG_FILE_PATH = "/var/log/background_jobs.log"
+
+# Number of already processed jobs whose files are kept for troubleshooting.
+PROCESSED_JOBS_TO_KEEP = 10
+# Seconds after which a job whose worker process never started is considered lost.
+PENDING_JOB_TIMEOUT = 300
+
+JOB_STATE_PENDING = "pending"
+JOB_STATE_RUNNING = "running"
+JOB_STATE_FINISHED = "finished"
+# The worker process died before recording the result of the command.
+JOB_STATE_LOST = "lost"
+
+
+class BackgroundJobCompletedEvent(EventBase):
+    """A custom event for the completion of a background job."""
+
+
+class BackgroundJobs(Object):
+    """Starts and tracks the commands run in the background."""
+
+    def __init__(
+        self,
+        charm: "PostgresqlOperatorCharm",
+        run_cmd: str,
+        jobs_path: str = BACKGROUND_JOBS_PATH,
+    ):
+        """Constructor for BackgroundJobs.
+
+        Args:
+            charm: the charm that is instantiating the library.
+            run_cmd: run command to use to dispatch events.
+            jobs_path: directory where the jobs status and output files are stored.
+        """
+        super().__init__(charm, "background-jobs")
+
+        self._charm = charm
+        self._run_cmd = run_cmd
+        self._jobs_path = Path(jobs_path)
+
+    def _job_file(self, job_id: str) -> Path:
+        return self._jobs_path / f"{job_id}.json"
+
+    def _write_job(self, job: dict) -> None:
+        temporary_file = self._job_file(job["id"]).with_suffix(".tmp")
+        temporary_file.write_text(json.dumps(job))
+        temporary_file.replace(self._job_file(job["id"]))
+
+    @staticmethod
+    def _is_worker_alive(job: dict) -> bool:
+        try:
+            os.kill(int(job["worker-pid"]), 0)
+            return True
+        except (KeyError, OSError, ValueError):
+            return False
+
+    def start(
+        self,
+        job_type: str,
+        command: list[str],
+        metadata: dict | None = None,
+        user: str | None = "snap_daemon",
+    ) -> str:
+        """Start running a command in the background.
+
+        Args:
+            job_type: kind of job (e.g. "backup"), used to look up the job later.
+            command: command to run.
+            metadata: data the charm needs when handling the job completion.
+            user: user to run the command as.
+
+        Returns:
+            The id of the started job.
+        """
+        self._jobs_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        job_id = f"{job_type}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')}"
+        job = {
+            "id": job_id,
+            "type": job_type,
+            "command": command,
+            "user": user,
+            "state": JOB_STATE_PENDING,
+            "created-at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "stdout-file": str(self._jobs_path / f"{job_id}.stdout"),
+            "stderr-file": str(self._jobs_path / f"{job_id}.stderr"),
+            "metadata": metadata or {},
+            "processed": False,
+        }
+        self._write_job(job)
+
+        # We need to trick Juju into thinking that we are not running
+        # in a hook context, as Juju will disallow use of juju-run.
+        new_env = os.environ.copy()
+        new_env.pop("JUJU_CONTEXT_ID", None)
+
+        logger.info(f"Starting background job {job_id}")
+        # Input is generated by the charm
+        pid = subprocess.Popen(  # noqa: S603
+            [
+                "/usr/bin/python3",
+                "scripts/background_job.py",
+                str(self._job_file(job_id)),
+                self._run_cmd,
+                self._charm.unit.name,
+                self._charm.charm_dir,
+            ],
+            # File shouldn't close
+            stdout=open(LOG_FILE_PATH, "a"),  # noqa: SIM115
+            stderr=subprocess.STDOUT,
+            env=new_env,
+            # Keep the job running after the hook finishes.
+            start_new_session=True,
+        ).pid
+        logger.info(f"Started background job {job_id} with PID {pid}")
+        return job_id
+
+    def get(self, job_id: str) -> dict | None:
+        """Return the status of a job, or None if the job doesn't exist."""
+        try:
+            job = json.loads(self._job_file(job_id).read_text())
+        except (OSError, ValueError):
+            return None
+        if job["state"] == JOB_STATE_RUNNING and not self._is_worker_alive(job):
+            job["state"] = JOB_STATE_LOST
+        elif job["state"] == JOB_STATE_PENDING:
+            created_at = datetime.strptime(job["created-at"], "%Y-%m-%dT%H:%M:%SZ").replace(
+                tzinfo=timezone.utc
+            )
+            if (datetime.now(timezone.utc) - created_at).total_seconds() > PENDING_JOB_TIMEOUT:
+                job["state"] = JOB_STATE_LOST
+        return job
+
+    def jobs(self, job_type: str | None = None) -> list[dict]:
+        """Return the status of the known jobs, oldest first."""
+        if not self._jobs_path.is_dir():
+            return []
+        jobs = []
+        for job_file in sorted(self._jobs_path.glob("*.json")):
+            job = self.get(job_file.stem)
+            if job is not None and (job_type is None or job["type"] == job_type):
+                jobs.append(job)
+        return jobs
+
+    def running(self, job_type: str | None = None) -> list[dict]:
+        """Return the jobs whose command didn't finish yet."""
+        return [
+            job
+            for job in self.jobs(job_type)
+            if job["state"] in [JOB_STATE_PENDING, JOB_STATE_RUNNING]
+        ]
+
+    def completed(self, job_type: str | None = None) -> list[dict]:
+        """Return the finished (or lost) jobs whose completion wasn't handled yet."""
+        return [
+            job
+            for job in self.jobs(job_type)
+            if job["state"] in [JOB_STATE_FINISHED, JOB_STATE_LOST] and not job["processed"]
+        ]
+
+    def read_output(self, job: dict) -> tuple[str, str]:
+        """Return the stdout and stderr of a job."""
+        output = []
+        for output_file in [job["stdout-file"], job["stderr-file"]]:
+            try:
+                output.append(Path(output_file).read_text(errors="replace"))
+            except OSError:
+                output.append("")
+        return output[0], output[1]
+
+    def mark_processed(self, job: dict) -> None:
+        """Record that the completion of a job was handled and prune the old jobs."""
+        job["processed"] = True
+        self._write_job(job)
+
+        processed_jobs = [
+            processed_job for processed_job in self.jobs(job["type"]) if processed_job["processed"]
+        ]
+        for old_job in processed_jobs[:-PROCESSED_JOBS_TO_KEEP]:
+            for path in [old_job["stdout-file"], old_job["stderr-file"]]:
+                Path(path).unlink(missing_ok=True)
+            self._job_file(old_job["id"]).unlink(missing_ok=True)
@@ -0,0 +1,310 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Scheduled backups.
+
+The schedules are cron expressions (in UTC) set in the backup_schedule_* config options.
+The charm computes the next scheduled backup (or repository verification) and spawns
+scripts/backup_scheduler.py, which sleeps until then and dispatches a ScheduledBackupEvent.
+The event handler starts the backup and the timer of the following one.
+
+As every unit runs its own timer, the leader picks the unit that takes each scheduled backup
+and publishes it as a claim in the application peer data. Only the unit holding the claim
+starts the backup.
+"""
+
+import json
+import logging
+import os
+import signal
+import subprocess
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+from ops.framework import EventBase, Object, StoredState
+
+if TYPE_CHECKING:
+    from charm import PostgresqlOperatorCharm
+
+logger = logging.getLogger(__name__)
+
+# File path for the spawned backup scheduler process to write logs.
+LOG_FILE_PATH = "/var/log/backup_scheduler.log"
+
+# Backup types (and the verification of the repository) in order of precedence, when several
+# schedules are due at the same time.
+SCHEDULED_BACKUP_TYPES = ["full", "differential", "incremental", "auto", "local", "verify"]
+
+# Allowed values of the cron fields: minute, hour, day of month, month and day of week.
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+# Years searched for the next time matching a cron expression (e.g. "0 0 29 2 *").
+CRON_SEARCH_YEARS = 5
+# Seconds after which a claim for a scheduled backup is no longer started (e.g. when the unit
+# holding it only sees it after being down for a long time).
+SCHEDULED_BACKUP_CLAIM_TIMEOUT = 60 * 60
+
+
+class CronSchedule:
+    """A cron expression with the standard five fields (e.g. "30 2 * * 0")."""
+
+    def __init__(self, expression: str):
+        """Parses a cron expression.
+
+        Raises:
+            ValueError: if the expression is not valid.
+        """
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELD_RANGES):
+            raise ValueError(f"Cron expression must have five fields: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, days_of_week = (
+            self._parse_field(field, minimum, maximum)
+            for field, (minimum, maximum) in zip(fields, CRON_FIELD_RANGES, strict=True)
+        )
+        # Both 0 and 7 are Sunday.
+        self.days_of_week = {day % 7 for day in days_of_week}
+        # When both days fields are restricted, a day matching any of them matches (as in cron).
+        self._any_day = fields[2] != "*" and fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, minimum: int, maximum: int) -> set[int]:
+        values = set()
+        for part in field.split(","):
+            value_range, _, step = part.partition("/")
+            if value_range == "*":
+                start, end = minimum, maximum
+            elif "-" in value_range:
+                start, end = (int(value) for value in value_range.split("-", 1))
+            else:
+                start = int(value_range)
+                end = maximum if step else start
+            step = int(step) if step else 1
+            if not minimum <= start <= end <= maximum or step < 1:
+                raise ValueError(f"Invalid cron field: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _matches_day(self, moment: datetime) -> bool:
+        matches_day = moment.day in self.days
+        # Python weekdays start on Monday (0), cron ones on Sunday (0).
+        matches_day_of_week = (moment.weekday() + 1) % 7 in self.days_of_week
+        if self._any_day:
+            return matches_day or matches_day_of_week
+        return matches_day and matches_day_of_week
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Returns the first time matching the expression after the given moment.
+
+        Raises:
+            ValueError: if no time matches the expression (e.g. "0 0 31 2 *").
+        """
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * CRON_SEARCH_YEARS)
+        while moment < limit:
+            if moment.month not in self.months:
+                # Go to the first day of the next month.
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(
+                    day=1
+                )
+            elif not self._matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+
+class ScheduledBackupEvent(EventBase):
+    """A custom event for the time of a scheduled backup."""
+
+
+class BackupScheduler(Object):
+    """Keeps a timer process running until the next scheduled backup."""
+
+    _stored = StoredState()
+
+    def __init__(self, charm: "PostgresqlOperatorCharm", run_cmd: str):
+        """Constructor for BackupScheduler.
+
+        Args:
+            charm: the charm that is instantiating the library.
+            run_cmd: run command to use to dispatch events.
+        """
+        super().__init__(charm, "backup-scheduler")
+
+        self._charm = charm
+        self._run_cmd = run_cmd
+        self._stored.set_default(pid=0, backup_type="", schedule="", claimed_backup=0.0)
+
+        self.framework.observe(self._charm.on.scheduled_backup, self._on_scheduled_backup)
+
+    @property
+    def schedules(self) -> dict[str, CronSchedule]:
+        """Returns the configured schedule of each backup type."""
+        config = self._charm.config
+        expressions = {
+            "full": config.backup_schedule_full,
+            "differential": config.backup_schedule_differential,
+            "incremental": config.backup_schedule_incremental,
+            "auto": config.backup_schedule_auto,
+            "local": config.backup_schedule_local,
+            "verify": config.backup_schedule_verify,
+        }
+        return {
+            backup_type: CronSchedule(expression)
+            for backup_type, expression in expressions.items()
+            if expression
+        }
+
+    @property
+    def jitter(self) -> int:
+        """Seconds by which this cluster delays its scheduled backups.
+
+        The delay is derived from the stanza name, so the units of a cluster agree on it
+        while the clusters sharing a S3 endpoint don't all start their backups at once.
+        """
+        max_jitter = self._charm.config.backup_schedule_jitter
+        if not max_jitter:
+            return 0
+        return zlib.crc32(self._charm.backup.stanza_name.encode()) % (max_jitter + 1)
+
+    def next_scheduled_backup(self, moment: datetime) -> tuple[datetime, str] | None:
+        """Returns the time and type of the first scheduled backup after the given moment."""
+        # Look for the backups scheduled after the moment minus the delay, so a backup whose
+        # delay didn't elapse yet isn't skipped.
+        jitter = timedelta(seconds=self.jitter)
+        scheduled_backups = []
+        for backup_type, schedule in self.schedules.items():
+            try:
+                scheduled_backups.append((
+                    schedule.next_after(moment - jitter),
+                    SCHEDULED_BACKUP_TYPES.index(backup_type),
+                    backup_type,
+                ))
+            except ValueError as e:
+                logger.warning(f"Ignoring the backup_schedule_{backup_type} option: {e!s}")
+        if not scheduled_backups:
+            return None
+        due, _, backup_type = min(scheduled_backups)
+        return due + jitter, backup_type
+
+    def _is_timer_running(self) -> bool:
+        if not self._stored.pid:
+            return False
+        try:
+            os.kill(self._stored.pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def start_scheduler(self) -> None:
+        """Start the timer of the next scheduled backup, if it isn't running yet."""
+        schedule = " | ".join([
+            self._charm.config.backup_schedule_full,
+            self._charm.config.backup_schedule_differential,
+            self._charm.config.backup_schedule_incremental,
+            self._charm.config.backup_schedule_auto,
+            self._charm.config.backup_schedule_local,
+            self._charm.config.backup_schedule_verify,
+            str(self.jitter),
+        ])
+        if self._stored.schedule == schedule and self._is_timer_running():
+            return
+        self.stop_scheduler()
+
+        if self._charm._peers is None or "stanza" not in self._charm.app_peer_data:
+            return
+        if (
+            next_scheduled_backup := self.next_scheduled_backup(datetime.now(timezone.utc))
+        ) is None:
+            return
+        due, backup_type = next_scheduled_backup
+
+        # We need to trick Juju into thinking that we are not running
+        # in a hook context, as Juju will disallow use of juju-run.
+        new_env = os.environ.copy()
+        new_env.pop("JUJU_CONTEXT_ID", None)
+
+        # Input is generated by the charm
+        pid = subprocess.Popen(  # noqa: S603
+            [
+                "/usr/bin/python3",
+                "scripts/backup_scheduler.py",
+                str(due.timestamp()),
+                self._run_cmd,
+                self._charm.unit.name,
+                self._charm.charm_dir,
+            ],
+            # File shouldn't close
+            stdout=open(LOG_FILE_PATH, "a"),  # noqa: SIM115
+            stderr=subprocess.STDOUT,
+            env=new_env,
+            # Keep the timer running after the hook finishes.
+            start_new_session=True,
+        ).pid
+
+        self._stored.pid = pid
+        self._stored.backup_type = backup_type
+        self._stored.schedule = schedule
+        operation = (
+            "a repository verification" if backup_type == "verify" else f"a {backup_type} backup"
+        )
+        logger.info(f"Scheduled {operation} at {due.isoformat()} (timer PID {pid})")
+
+    def stop_scheduler(self) -> None:
+        """Stop the timer of the next scheduled backup, if any."""
+        if self._is_timer_running():
+            try:
+                os.kill(self._stored.pid, signal.SIGTERM)
+                logger.info(f"Stopped the backup scheduler timer with PID {self._stored.pid}")
+            except OSError:
+                pass
+        self._stored.pid = 0
+        self._stored.backup_type = ""
+
+    def _on_scheduled_backup(self, _) -> None:
+        """Start the scheduled backup and the timer of the next one."""
+        backup_type = self._stored.backup_type
+        # The timer process exits once this event is handled.
+        self._stored.pid = 0
+        if backup_type == "verify":
+            self._charm.backup.create_scheduled_verification()
+        elif backup_type and self._charm.unit.is_leader():
+            self._claim_backup(backup_type)
+        self.start_scheduler()
+
+    def _claim_backup(self, backup_type: str) -> None:
+        """Assign the scheduled backup to a single unit through the application peer data."""
+        if (unit := self._charm.backup.scheduled_backup_unit(backup_type)) is None:
+            logger.warning(f"Skipping the scheduled {backup_type} backup: no unit can take it")
+            return
+        self._charm.app_peer_data["scheduled-backup"] = json.dumps({
+            "requested-at": time.time(),
+            "type": backup_type,
+            "unit": unit,
+        })
+        logger.info(f"Assigned the scheduled {backup_type} backup to {unit}")
+        self.start_claimed_backup()
+
+    def start_claimed_backup(self) -> None:
+        """Start the scheduled backup the leader assigned to this unit, once per claim."""
+        if self._charm._peers is None or not (
+            claim := self._charm.app_peer_data.get("scheduled-backup")
+        ):
+            return
+        claim = json.loads(claim)
+        if (
+            claim["unit"] != self._charm.unit.name
+            or claim["requested-at"] == self._stored.claimed_backup
+        ):
+            return
+        self._stored.claimed_backup = claim["requested-at"]
+        if time.time() - claim["requested-at"] > SCHEDULED_BACKUP_CLAIM_TIMEOUT:
+            logger.warning(f"Skipping the scheduled {claim['type']} backup: the claim expired")
+            return
+        self._charm.backup.create_scheduled_backup(claim["type"])
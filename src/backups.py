@@ -8,14 +8,18 @@ import logging
 import os
 import pwd
 import re
+import shlex
 import shutil
 import tempfile
 import time
+from bisect import bisect_right
+from collections.abc import Callable
 from datetime import datetime, timezone
-from functools import cached_property
+from functools import cached_property, lru_cache
 from io import BytesIO
 from pathlib import Path
-from subprocess import TimeoutExpired, run
+from subprocess import Popen, TimeoutExpired, run
+from typing import BinaryIO
 
 from boto3.session import Session
 from botocore.client import Config
@@ -25,16 +29,30 @@ from botocore.regions import EndpointResolver
 from charmlibs import snap
 from charms.data_platform_libs.v0.s3 import CredentialsChangedEvent, S3Requirer
 from jinja2 import Template
-from ops.charm import ActionEvent, HookEvent
-from ops.framework import Object
+from ops.charm import ActionEvent
+from ops.framework import Object, StoredState
 from ops.jujuversion import JujuVersion
-from ops.model import ActiveStatus, MaintenanceStatus
-from tenacity import RetryError, Retrying, stop_after_attempt, wait_fixed
-
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from tenacity import RetryError
+
+from background_jobs import JOB_STATE_LOST
+from compression_benchmark import (
+    BENCHMARK_LEVELS,
+    COMPRESS_TOOLS,
+    DEFAULT_COMPRESS_LEVELS,
+    compress_command,
+    is_available,
+    run_benchmark,
+    write_sample,
+)
 from constants import (
+    AUTO_BACKUP_TYPE,
     BACKUP_ID_FORMAT,
+    BACKUP_OUTPUT_PATH,
     BACKUP_TYPE_OVERRIDES,
     BACKUP_USER,
+    LOCAL_BACKUP_TYPE,
+    LOCAL_BACKUPS_STORAGE,
     PATRONI_CONF_PATH,
     PGBACKREST_ARCHIVE_TIMEOUT_ERROR_CODE,
     PGBACKREST_BACKUP_ID_FORMAT,
@@ -43,9 +61,24 @@ from constants import (
     PGBACKREST_EXECUTABLE,
     PGBACKREST_LOGROTATE_FILE,
     PGBACKREST_LOGS_PATH,
+    PGBACKREST_SPOOL_PATH,
+    PGBACKREST_TIMEOUT_ERROR_CODE,
     POSTGRESQL_DATA_PATH,
+    POSTGRESQL_DELTA_RESTORE_PATH,
+    POSTGRESQL_STANDBY_RESTORE_PATH,
+)
+from progress import (
+    MB,
+    PROGRESS_REPORT_INTERVAL,
+    backup_progress,
+    format_duration,
+    format_progress,
+    format_size,
+    format_throughput,
+    restore_progress,
 )
 from relations.async_replication import REPLICATION_CONSUMER_RELATION, REPLICATION_OFFER_RELATION
+from utils import concatenate_files, label2name, search_file_backwards, tail_file
 
 logger = logging.getLogger(__name__)
 
@@ -54,8 +87,84 @@ FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE = (
     "failed to access/create the bucket, check your S3 settings"
 )
 FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE = "failed to initialize stanza, check your S3 settings"
+# Followed by the pgBackRest error (e.g. a timeout reaching S3).
+STANZA_INITIALISATION_TIMED_OUT_MESSAGE = "stanza initialisation timed out, retrying"
 CANNOT_RESTORE_PITR = "cannot restore PITR, juju debug-log for details"
 
+# Seconds during which the repository contents read from pgBackRest are reused.
+BACKUP_CATALOG_TTL = 60
+# Type of the background jobs that create backups.
+BACKUP_JOB_TYPE = "backup"
+# Lines from the end of the backup output read to extract the error messages.
+BACKUP_OUTPUT_TAIL_LINES = 200
+# Number of outputs of the backups created by the create-backup action that are kept.
+BACKUP_OUTPUTS_TO_KEEP = 3
+# e.g. "2025-01-01 10:00:00.123 P00   INFO: new backup label = 20250101-100000F"
+BACKUP_LABEL_PATTERN = re.compile(r"new backup label = ([0-9]{8}[-][0-9]{6}[F])$")
+# Job type of the verifications of the repository run in the background.
+VERIFY_JOB_TYPE = "verify"
+# The verification reads every file of the repository, so it's limited to a single process
+# (on top of the throttling of the backups) to keep its load on S3 and on the unit low.
+PGBACKREST_VERIFY_PROCESS_MAX = 1
+# e.g. "status: error" and "backup: 20230101-090000F, status: valid, total files checked: 10"
+VERIFY_STATUS_PATTERN = re.compile(r"^status: (\S+)", re.MULTILINE)
+VERIFY_BACKUP_PATTERN = re.compile(r"backup: (\S+), status: ([^,\n]+)")
+# Job type of the creation and check of the stanza.
+STANZA_JOB_TYPE = "stanza"
+# States of the stanza initialisation published by the primary.
+STANZA_STATE_RUNNING = "running"
+STANZA_STATE_DONE = "done"
+STANZA_STATE_TIMED_OUT = "timed-out"
+# Attempts of each step of the stanza initialisation, and seconds between them.
+STANZA_INITIALISATION_ATTEMPTS = 6
+STANZA_INITIALISATION_RETRY_INTERVAL = 10
+# Seconds before a stanza initialisation that timed out is started again (on update status).
+STANZA_INITIALISATION_TIMEOUT_RETRY_DELAY = 5 * 60
+# Job type of the refresh of the planner statistics after a restore.
+ANALYZE_JOB_TYPE = "analyze"
+# Statistics targets generated by `vacuumdb --analyze-in-stages`, in order.
+ANALYZE_STAGES = ["minimal", "medium", "default"]
+# e.g. 'vacuumdb: processing database "postgres": Generating minimal optimizer statistics (1 target)'
+ANALYZE_STAGE_PATTERN = re.compile(
+    r'processing database "(?P<database>[^"]+)": Generating (?P<stage>minimal|medium|default)'
+)
+# Settings of each stage of `vacuumdb --analyze-in-stages`, to run the stages one by one.
+ANALYZE_STAGE_OPTIONS = {
+    "minimal": "-c default_statistics_target=1 -c vacuum_cost_delay=0",
+    "medium": "-c default_statistics_target=10 -c vacuum_cost_delay=0",
+    "default": "",
+}
+# e.g. 'vacuumdb: failed to analyze database "app-db" (stage minimal)'
+ANALYZE_FAILURE_PATTERN = re.compile(r'failed to analyze database "(?P<database>[^"]+)"')
+# Databases that don't accept connections (template0) are skipped by vacuumdb --all too.
+ANALYZE_DATABASES_QUERY = "SELECT datname FROM pg_database WHERE datallowconn ORDER BY datname"
+# Job type of the restores run by the replicas in a cluster-wide restore.
+RESTORE_JOB_TYPE = "restore"
+# States of the units in a cluster-wide restore: the leader publishes when it starts
+# bootstrapping the restored cluster, and the replicas how their own restore went.
+RESTORE_FAN_OUT_STATE_BOOTSTRAPPING = "bootstrapping"
+RESTORE_FAN_OUT_STATE_RESTORING = "restoring"
+RESTORE_FAN_OUT_STATE_RESTORED = "restored"
+RESTORE_FAN_OUT_STATE_FAILED = "failed"
+RESTORE_FAN_OUT_STATE_DONE = "done"
+# Seconds the leader waits for the replicas to start restoring in a cluster-wide restore, before
+# bootstrapping the restored cluster anyway (the replicas that didn't start are cloned instead).
+RESTORE_FAN_OUT_START_TIMEOUT = 10 * 60
+# CPUs left to PostgreSQL when the number of pgBackRest processes is derived from the CPUs.
+PGBACKREST_CPU_HEADROOM = 2
+# WAL archiving runs continuously next to the database, so it gets fewer processes.
+PGBACKREST_ARCHIVE_PROCESS_MAX = 4
+# Replay lag (in bytes, one WAL segment) under which standbys are considered equally up to date
+# when choosing the backup source, so the choice doesn't flip on every new transaction.
+BACKUP_SOURCE_LAG_TOLERANCE = 16 * 1024 * 1024
+# Load average (per CPU) under which standbys are considered equally loaded. The units only
+# publish their load when it moves to another step, so update-status doesn't write the peer
+# relation (and wake up every other unit) every time.
+BACKUP_SOURCE_LOAD_STEP = 0.25
+# Creates the transient scope that applies the cgroup weights to the backup processes.
+SYSTEMD_RUN_EXECUTABLE = "systemd-run"
+IONICE_CLASSES = {"best-effort": ["-c", "2", "-n", "7"], "idle": ["-c", "3"]}
+
 S3_BLOCK_MESSAGES = [
     ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE,
     FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE,
@@ -75,10 +184,213 @@ STANDBY_CLUSTER_RESTORE_ERROR_MESSAGE = (
 )
 
 
+@lru_cache
+def _aws_s3_endpoint_data(region: str | None) -> dict | None:
+    """Returns the AWS S3 endpoint of a region (loading the botocore endpoints data once)."""
+    resolver = EndpointResolver(create_loader().load_data("endpoints"))
+    return resolver.construct_endpoint("s3", region)
+
+
 class ListBackupsError(Exception):
     """Raised when pgBackRest fails to list backups."""
 
 
+class BackupCatalog(Object):
+    """Cached view of the pgBackRest repository contents (backups and timelines).
+
+    Every read of the repository spawns pgBackRest and lists the S3 bucket, so the results
+    of `pgbackrest info` and of the timeline history files listing are kept in the unit's
+    stored state for a short time and shared by all the backup code paths. The cache is
+    dropped when it expires, when the repository (S3 settings or stanza) changes and after
+    any operation that changes the repository contents (backup, restore, expire).
+
+    The points where the archived timelines start, needed to resolve the restore targets,
+    are kept without expiration: they only change when a timeline is created, which
+    `pgbackrest info` reveals through the timeline of the last archived WAL segment, or when
+    this cluster creates one.
+
+    The results of the verifications of the repository are published by the unit that ran
+    them in the peer relation, so every unit can report the last one.
+    """
+
+    _stored = StoredState()
+
+    def __init__(self, backups: "PostgreSQLBackups", ttl: int = BACKUP_CATALOG_TTL):
+        super().__init__(backups, "catalog")
+        self._backups = backups
+        self.ttl = ttl
+        self._stored.set_default(
+            repository="",
+            info=None,
+            info_loaded_at=0.0,
+            timelines=None,
+            timelines_loaded_at=0.0,
+            timeline_switches=None,
+            timeline_switches_repository="",
+        )
+
+    @property
+    def _repository(self) -> str:
+        """Identifier of the repository the cached contents belong to."""
+        s3_parameters, _ = self._backups._retrieve_s3_parameters()
+        return (
+            "|".join(
+                str(s3_parameters.get(key, "")) for key in ("endpoint", "bucket", "path", "region")
+            )
+            + f"|{self._backups.stanza_name}"
+        )
+
+    def _is_fresh(self, key: str) -> bool:
+        if self._stored.repository != self._repository:
+            self.invalidate()
+            return False
+        return (
+            getattr(self._stored, key) is not None
+            and time.time() - getattr(self._stored, f"{key}_loaded_at") < self.ttl
+        )
+
+    def _store(self, key: str, value: str) -> None:
+        self._stored.repository = self._repository
+        setattr(self._stored, key, value)
+        setattr(self._stored, f"{key}_loaded_at", time.time())
+
+    def invalidate(self) -> None:
+        """Drop the cached repository contents, so they're read again on the next access."""
+        self._stored.info = None
+        self._stored.info_loaded_at = 0.0
+        self._stored.timelines = None
+        self._stored.timelines_loaded_at = 0.0
+
+    def info(self, timeout: int | None = None) -> list[dict]:
+        """Return the parsed output of `pgbackrest info`.
+
+        Raises:
+            ListBackupsError: if pgBackRest fails to read the repository.
+            TimeoutExpired: if pgBackRest didn't finish in the given timeout.
+        """
+        if not self._is_fresh("info"):
+            return_code, output, stderr = self._backups._execute_command(
+                [PGBACKREST_EXECUTABLE, PGBACKREST_CONFIGURATION_FILE, "info", "--output=json"],
+                timeout=timeout,
+            )
+            if return_code != 0:
+                extracted_error = self._backups._extract_error_message(output, stderr)
+                raise ListBackupsError(f"Failed to list backups with error: {extracted_error}")
+            self._store("info", output)
+        return json.loads(self._stored.info)
+
+    def timelines(self) -> dict[str, dict]:
+        """Return the parsed listing of the timeline history files in the archive.
+
+        Raises:
+            ListBackupsError: if pgBackRest fails to list the repository.
+        """
+        if not self._is_fresh("timelines"):
+            return_code, output, stderr = self._backups._execute_command([
+                PGBACKREST_EXECUTABLE,
+                PGBACKREST_CONFIGURATION_FILE,
+                *self._backups._repository_option(self._backups._s3_repository),
+                "repo-ls",
+                "archive",
+                "--recurse",
+                "--filter",
+                "\\.history$",
+                "--output=json",
+            ])
+            if return_code != 0:
+                extracted_error = self._backups._extract_error_message(output, stderr)
+                raise ListBackupsError(f"Failed to list repository with error: {extracted_error}")
+            self._store("timelines", output)
+        return json.loads(self._stored.timelines)
+
+    def last_archived_segment(self) -> tuple[str, str, str] | None:
+        """Return the stanza, archive id and name of the last WAL segment in the S3 repository.
+
+        Raises:
+            ListBackupsError: if pgBackRest fails to read the repository.
+        """
+        stanza_info = next(iter(self.info()), None)
+        archives = [
+            archive
+            for archive in (stanza_info or {}).get("archive") or []
+            if archive.get("max") and self._backups._in_s3_repository(archive)
+        ]
+        if not archives:
+            return None
+        archive = max(archives, key=lambda archive: archive["max"])
+        return stanza_info["name"], archive["id"], archive["max"]
+
+    def timeline_switches(self) -> dict[str, list[str]]:
+        """Return the points where the archived timelines start: time => [stanza, timeline].
+
+        Raises:
+            ListBackupsError: if pgBackRest fails to read the repository.
+        """
+        last_archived_segment = self.last_archived_segment()
+        # The first eight digits of a WAL segment name are its timeline (in hexadecimal).
+        last_archived_timeline = (
+            last_archived_segment[2][:8].lstrip("0") if last_archived_segment else "1"
+        )
+        switches = (
+            json.loads(self._stored.timeline_switches)
+            if self._stored.timeline_switches is not None
+            and self._stored.timeline_switches_repository == self._repository
+            else None
+        )
+        # The first timeline has no history file, so it never has a switch point.
+        if switches is None or (
+            last_archived_timeline != "1"
+            and last_archived_timeline not in {timeline for _, timeline in switches.values()}
+        ):
+            switches = {}
+            for history_file, history_file_object in self.timelines().items():
+                if history_file.endswith("backup.history"):
+                    continue
+                # 0 is the stanza -1 is the timeline file
+                path = history_file.split("/")
+                switched_at = datetime.fromtimestamp(history_file_object["time"], timezone.utc)
+                switches[switched_at.strftime(BACKUP_ID_FORMAT)] = [
+                    path[0],
+                    path[-1].split(".")[0].lstrip("0"),
+                ]
+            self._store_timeline_switches(switches)
+        return switches
+
+    def invalidate_timeline_switches(self) -> None:
+        """Drop the switch points, so they're listed again from the archive on the next access.
+
+        Used when this cluster creates a timeline (e.g. by a restore): its switch point is
+        the archive time of the new timeline history file, which isn't known by then.
+        """
+        self._stored.timeline_switches = None
+        self._stored.timeline_switches_repository = ""
+
+    def _store_timeline_switches(self, switches: dict[str, list[str]]) -> None:
+        self._stored.timeline_switches = json.dumps(switches)
+        self._stored.timeline_switches_repository = self._repository
+
+    def record_verification(self, verification: dict) -> None:
+        """Publish the result of a verification of the repository run by this unit."""
+        self._backups.charm.unit_peer_data["backup-verification"] = json.dumps(verification)
+
+    def last_verification(self) -> dict | None:
+        """Return the result of the last verification of the stanza, with the unit that ran it."""
+        charm = self._backups.charm
+        if charm._peers is None:
+            return None
+        verifications = []
+        for unit in [charm.unit, *charm._peers.units]:
+            try:
+                verification = json.loads(charm._peers.data[unit].get("backup-verification", ""))
+            except ValueError:
+                continue
+            if verification.get("stanza") == self._backups.stanza_name:
+                verifications.append({**verification, "unit": unit.name})
+        return max(
+            verifications, key=lambda verification: verification["finished-at"], default=None
+        )
+
+
 class PostgreSQLBackups(Object):
     """In this class, we manage PostgreSQL backups."""
 
@@ -87,6 +399,12 @@ class PostgreSQLBackups(Object):
         super().__init__(charm, "backup")
         self.charm = charm
         self.relation_name = relation_name
+        self.catalog = BackupCatalog(self)
+        # S3 resources (and their connection pools) by connection settings, reused by
+        # all the S3 requests of the hook.
+        self._s3_resources = {}
+        # Set while the local repository storage is being detached (it's still listed).
+        self._local_repository_detaching = False
 
         # s3 relation handles the config options for s3 backups
         self.s3_client = S3Requirer(self.charm, self.relation_name)
@@ -100,12 +418,53 @@ class PostgreSQLBackups(Object):
         self.framework.observe(self.charm.on.create_backup_action, self._on_create_backup_action)
         self.framework.observe(self.charm.on.list_backups_action, self._on_list_backups_action)
         self.framework.observe(self.charm.on.restore_action, self._on_restore_action)
+        self.framework.observe(
+            self.charm.on.benchmark_compression_action, self._on_benchmark_compression_action
+        )
+        self.framework.observe(
+            self.charm.on.background_job_completed, self._on_background_job_completed
+        )
+        # Also check on update status, in case the completion event couldn't be dispatched.
+        self.framework.observe(self.charm.on.update_status, self._on_background_job_completed)
+        self.framework.observe(
+            self.charm.on[LOCAL_BACKUPS_STORAGE].storage_attached,
+            self._on_local_backups_storage_attached,
+        )
+        self.framework.observe(
+            self.charm.on[LOCAL_BACKUPS_STORAGE].storage_detaching,
+            self._on_local_backups_storage_detaching,
+        )
 
     @cached_property
     def stanza_name(self) -> str:
         """Stanza name, composed by model and cluster name."""
         return f"{self.model.name}.{self.charm.cluster_name}"
 
+    @property
+    def local_repository_path(self) -> str | None:
+        """Path of the local repository, if the local-backups storage is attached."""
+        storages = self.model.storages[LOCAL_BACKUPS_STORAGE]
+        if self._local_repository_detaching or not storages:
+            return None
+        return str(storages[0].location / "pgbackrest")
+
+    @property
+    def _s3_repository(self) -> int:
+        """Index of the S3 repository in the pgBackRest configuration.
+
+        The local repository, when there is one, is repo1: restore and archive-get look for
+        backups and WAL in the repositories in order, so they prefer the local copies.
+        """
+        return 2 if self.local_repository_path else 1
+
+    def _repository_option(self, repository: int) -> list[str]:
+        """Returns the option that selects a repository, when there are several."""
+        return [f"--repo={repository}"] if self.local_repository_path else []
+
+    def _in_s3_repository(self, item: dict) -> bool:
+        """Returns whether a backup or archive listed by `pgbackrest info` is in S3."""
+        return item.get("database", {}).get("repo-key", 1) == self._s3_repository
+
     @property
     def _tls_ca_chain_filename(self) -> str:
         """Returns the path to the TLS CA chain file."""
@@ -115,6 +474,15 @@ class PostgreSQLBackups(Object):
         return ""
 
     def _get_s3_session_resource(self, s3_parameters: dict):
+        key = tuple(
+            str(s3_parameters.get(parameter))
+            for parameter in ("access-key", "secret-key", "region", "endpoint", "tls-ca-chain")
+        )
+        if key not in self._s3_resources:
+            self._s3_resources[key] = self._create_s3_session_resource(s3_parameters)
+        return self._s3_resources[key]
+
+    def _create_s3_session_resource(self, s3_parameters: dict):
         kwargs = {
             "aws_access_key_id": s3_parameters["access-key"],
             "aws_secret_access_key": s3_parameters["secret-key"],
@@ -164,8 +532,15 @@ class PostgreSQLBackups(Object):
             )
         )
 
-    def _can_unit_perform_backup(self) -> tuple[bool, str | None]:
-        """Validates whether this unit can perform a backup."""
+    def _can_unit_perform_backup(
+        self, check_backup_source: bool = True
+    ) -> tuple[bool, str | None]:
+        """Validates whether this unit can perform a backup.
+
+        Args:
+            check_backup_source: whether a replica must also be the best backup source (the
+                scheduled backups are assigned to a unit by the leader instead).
+        """
         if self._is_standby_cluster():
             return False, STANDBY_CLUSTER_CREATE_BACKUP_ERROR_MESSAGE
 
@@ -197,8 +572,170 @@ class PostgreSQLBackups(Object):
         if "stanza" not in self.charm.app_peer_data:
             return False, "Stanza was not initialised"
 
+        if check_backup_source and not is_primary:
+            backup_source = self.backup_source()
+            if backup_source not in [None, self.charm.unit.name]:
+                return (
+                    False,
+                    f"Unit cannot perform backups as {backup_source} is a better backup source",
+                )
+
+        return self._are_backup_settings_ok()
+
+    def _can_unit_perform_local_backup(self) -> tuple[bool, str | None]:
+        """Validates whether this unit can take a backup into its local repository.
+
+        Only the primary archives the WAL, so only its local repository can hold the WAL
+        needed by a backup.
+        """
+        if self._is_standby_cluster():
+            return False, STANDBY_CLUSTER_CREATE_BACKUP_ERROR_MESSAGE
+
+        if self.local_repository_path is None:
+            return False, f"Unit has no {LOCAL_BACKUPS_STORAGE} storage"
+
+        try:
+            is_primary = self.charm.is_primary
+        except RetryError:
+            return False, "Unit cannot perform backups as the database seems to be offline"
+        if not is_primary:
+            return False, "Local backups are taken by the primary"
+
+        if self.charm.unit_peer_data.get("local-repository-stanza") != self.stanza_name:
+            return False, "The local repository was not initialised"
+
+        return self._are_backup_settings_ok()
+
+    def _can_unit_verify_repository(self) -> tuple[bool, str | None]:
+        """Validates whether this unit should verify the repository.
+
+        The verification only reads the repository, so it runs on the standby that would take
+        the backups, keeping its load off the primary (unless the cluster has a single unit).
+        """
+        if self._is_standby_cluster():
+            return False, "The repository is verified by the primary cluster"
+
+        if "stanza" not in self.charm.app_peer_data:
+            return False, "Stanza was not initialised"
+
+        if (
+            self.charm.app.planned_units() > 1
+            and (backup_source := self.backup_source()) != self.charm.unit.name
+        ):
+            return (
+                False,
+                f"Unit doesn't verify the repository as {backup_source or 'no standby'} is"
+                " the backup source",
+            )
+
         return self._are_backup_settings_ok()
 
+    def backup_source(self) -> str | None:
+        """Returns the standby that should take the backups, if any.
+
+        Asynchronous standbys are preferred, as synchronous standbys sit on the commit path,
+        then the least lagged ones and finally the least loaded ones (using the load average
+        step that each unit publishes in the peer relation).
+        """
+        try:
+            members = self.charm._patroni.cluster_status()
+        except RetryError:
+            logger.debug("Failed to retrieve the cluster members to choose the backup source")
+            return None
+
+        candidates = []
+        for member in members:
+            # Skip the primary and the standbys that aren't replicating (Patroni reports
+            # an unknown lag for them).
+            if (
+                member["role"] not in ["replica", "sync_standby"]
+                or member["state"] not in ["running", "streaming"]
+                or not isinstance(member.get("lag"), int)
+            ):
+                continue
+            unit = self.model.get_unit(label2name(member["name"]))
+            try:
+                load = float(self.charm._peers.data[unit].get("load-average", 0))
+            except (KeyError, ValueError):
+                load = 0.0
+            candidates.append((
+                member["role"] == "sync_standby",
+                member["lag"] // BACKUP_SOURCE_LAG_TOLERANCE,
+                load,
+                unit.name,
+            ))
+        if not candidates:
+            return None
+
+        is_sync_standby, _, load, backup_source = min(candidates)
+        logger.info(
+            f"Chose {backup_source} as backup source"
+            f" ({'synchronous' if is_sync_standby else 'asynchronous'} standby,"
+            f" load average {load})"
+        )
+        return backup_source
+
+    def publish_load_average(self) -> None:
+        """Publishes the load average step of the unit, used to choose the backup source."""
+        load = os.getloadavg()[1] / self.charm.cpu_count
+        load_step = f"{load // BACKUP_SOURCE_LOAD_STEP * BACKUP_SOURCE_LOAD_STEP:.2f}"
+        if self.charm.unit_peer_data.get("load-average") != load_step:
+            self.charm.unit_peer_data.update({"load-average": load_step})
+
+    def can_bootstrap_replicas_from_repository(self) -> bool:
+        """Returns whether new replicas can be restored from the latest backup.
+
+        The latest backup in S3 must be recent enough for the replica to catch up with the
+        primary without replaying too much WAL, otherwise replicas are cloned from the primary.
+        """
+        if (
+            not self.charm.config.backup_replica_bootstrap
+            or "stanza" not in self.charm.app_peer_data
+        ):
+            return False
+
+        # A standby cluster doesn't own the repository of the primary cluster.
+        if not self._are_backup_settings_ok()[0] or self._is_standby_cluster():
+            return False
+
+        try:
+            backups = [
+                backup
+                for backup in self.catalog.info(timeout=30)[0]["backup"]
+                if not backup["error"] and self._in_s3_repository(backup)
+            ]
+            last_backup_stop = backups[-1]["timestamp"]["stop"]
+        except (ListBackupsError, TimeoutExpired, ValueError, KeyError, IndexError, TypeError):
+            logger.debug("Failed to retrieve the last backup to bootstrap replicas from")
+            return False
+
+        max_age = self.charm.config.backup_replica_bootstrap_max_age * 60 * 60
+        return time.time() - last_backup_stop < max_age
+
+    @property
+    def replica_bootstrap_from_repository(self) -> bool:
+        """Returns whether new replicas are restored from the repository, as published."""
+        return (
+            self.charm.config.backup_replica_bootstrap
+            and self.charm.app_peer_data.get("replica-bootstrap-from-repository") == "True"
+        )
+
+    def refresh_replica_bootstrap(self) -> None:
+        """Checks again whether new replicas can be restored from the latest backup.
+
+        It may read the repository, so the leader does it on update-status and after its
+        backups instead of on every update of the Patroni configuration, and publishes the
+        result for all the units: a new unit gets it before rendering its first Patroni
+        configuration.
+        """
+        if self.charm._peers is None or not self.charm.unit.is_leader():
+            return
+        can_bootstrap = "True" if self.can_bootstrap_replicas_from_repository() else ""
+        if can_bootstrap == self.charm.app_peer_data.get("replica-bootstrap-from-repository", ""):
+            return
+        self.charm.app_peer_data.update({"replica-bootstrap-from-repository": can_bootstrap})
+        self.charm.update_config()
+
     def _is_standby_cluster(self) -> bool:
         """Return whether this unit belongs to a standby cluster."""
         if (
@@ -224,24 +761,18 @@ class PostgreSQLBackups(Object):
             return False, ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
 
         try:
-            return_code, stdout, stderr = self._execute_command(
-                [PGBACKREST_EXECUTABLE, PGBACKREST_CONFIGURATION_FILE, "info", "--output=json"],
-                timeout=30,
-            )
+            repository_info = self.catalog.info(timeout=30)
         except TimeoutExpired as e:
             # Raise an error if the connection timeouts, so the user has the possibility to
             # fix network issues and call juju resolve to re-trigger the hook that calls
             # this method.
             logger.error(f"error: {e!s} - please fix the error and call juju resolve on this unit")
             raise TimeoutError from e
+        except ListBackupsError as e:
+            logger.error(f"Failed to run pgbackrest: {e!s}")
+            return False, FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE
 
-        else:
-            if return_code != 0:
-                extracted_error = self._extract_error_message(stdout, stderr)
-                logger.error(f"Failed to run pgbackrest: {extracted_error}")
-                return False, FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE
-
-        for stanza in json.loads(stdout):
+        for stanza in repository_info:
             if (stanza_name := stanza.get("name")) and stanza_name == "[invalid]":
                 logger.error("Invalid stanza name from s3")
                 return False, FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE
@@ -252,7 +783,7 @@ class PostgreSQLBackups(Object):
                 return False, ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
 
             return_code, system_identifier_from_instance, error = self._execute_command([
-                f"/snap/charmed-postgresql/current/usr/lib/postgresql/{self.charm._patroni.get_postgresql_version().split('.')[0]}/bin/pg_controldata",
+                self._postgresql_executable("pg_controldata"),
                 POSTGRESQL_DATA_PATH,
             ])
             if return_code != 0:
@@ -287,13 +818,8 @@ class PostgreSQLBackups(Object):
         # Use the provided endpoint if a region is not needed.
         endpoint = s3_parameters["endpoint"]
 
-        # Load endpoints data.
-        loader = create_loader()
-        data = loader.load_data("endpoints")
-
         # Construct the endpoint using the region.
-        resolver = EndpointResolver(data)
-        endpoint_data = resolver.construct_endpoint("s3", s3_parameters.get("region"))
+        endpoint_data = _aws_s3_endpoint_data(s3_parameters.get("region"))
 
         # Use the built endpoint if it is an AWS endpoint.
         if endpoint_data and endpoint.endswith(endpoint_data["dnsSuffix"]):
@@ -370,6 +896,24 @@ class PostgreSQLBackups(Object):
 
         return True
 
+    def _keep_data_files_for_delta_restore(self) -> bool:
+        """Move the PostgreSQL data directory aside to be reused by a delta restore.
+
+        Patroni only bootstraps a cluster over an empty data directory, so the existing
+        files are moved back in place by the restore command right before pgBackRest runs.
+        """
+        try:
+            delta_restore_path = Path(POSTGRESQL_DELTA_RESTORE_PATH)
+            # Remove the leftovers of a previous delta restore that didn't start.
+            if delta_restore_path.exists():
+                shutil.rmtree(delta_restore_path)
+            os.rename(POSTGRESQL_DATA_PATH, delta_restore_path)
+        except OSError as e:
+            logger.warning(f"Failed to move the data directory aside with error: {e!s}")
+            return False
+
+        return True
+
     def _execute_command(
         self,
         command: list[str],
@@ -377,26 +921,94 @@ class PostgreSQLBackups(Object):
         timeout: int | None = None,
     ) -> tuple[int, str, str]:
         """Execute a command in the workload container."""
-
-        def demote():
-            pw_record = pwd.getpwnam("snap_daemon")
-
-            def result():
-                os.setgid(pw_record.pw_gid)
-                os.setuid(pw_record.pw_uid)
-
-            return result
-
         # Input is generated by the charm
         process = run(  # noqa: S603
             command,
             input=command_input,
             capture_output=True,
-            preexec_fn=demote(),
+            preexec_fn=self._demote(command),
             timeout=timeout,
         )
         return process.returncode, process.stdout.decode(), process.stderr.decode()
 
+    def _stream_command(
+        self,
+        command: list[str],
+        stdout_file: str,
+        stderr_file: str,
+        progress_callback: Callable[[], None] | None = None,
+    ) -> int:
+        """Execute a command in the workload container, writing its output to files.
+
+        The output isn't kept in memory, so it can be as large as the command needs (e.g. the
+        debug logs of a backup). When a progress callback is provided, it's called every
+        PROGRESS_REPORT_INTERVAL seconds while the command runs.
+
+        Returns:
+            The return code of the command.
+        """
+        with (
+            open(stdout_file, "wb") as stdout,
+            open(stderr_file, "wb") as stderr,
+            # Input is generated by the charm
+            Popen(  # noqa: S603
+                command, stdout=stdout, stderr=stderr, preexec_fn=self._demote(command)
+            ) as process,
+        ):
+            while True:
+                try:
+                    process.wait(timeout=PROGRESS_REPORT_INTERVAL)
+                    break
+                except TimeoutExpired:
+                    if progress_callback is not None:
+                        progress_callback()
+        return process.returncode
+
+    def _demote(self, command: list[str]) -> Callable[[], None] | None:
+        """Returns the function that switches a command to its user before running it."""
+        if self._command_user(command) is None:
+            return None
+
+        pw_record = pwd.getpwnam("snap_daemon")
+
+        def result():
+            os.setgid(pw_record.pw_gid)
+            os.setuid(pw_record.pw_uid)
+
+        return result
+
+    @staticmethod
+    def _command_user(command: list[str]) -> str | None:
+        """Returns the user to run a command as.
+
+        systemd-run needs root to create the scope and switches to snap_daemon by itself.
+        """
+        return None if command[0] == SYSTEMD_RUN_EXECUTABLE else "snap_daemon"
+
+    def _throttle_command(self, command: list[str]) -> list[str]:
+        """Lowers the CPU and I/O scheduling priority of a pgBackRest command."""
+        prefix = []
+        cpu_weight = self.charm.config.backup_cgroup_cpu_weight
+        io_weight = self.charm.config.backup_cgroup_io_weight
+        if cpu_weight or io_weight:
+            prefix += [
+                SYSTEMD_RUN_EXECUTABLE,
+                "--scope",
+                "--quiet",
+                "--uid=snap_daemon",
+                "--gid=snap_daemon",
+            ]
+            if cpu_weight:
+                prefix += ["--property", f"CPUWeight={cpu_weight}"]
+            if io_weight:
+                prefix += ["--property", f"IOWeight={io_weight}"]
+            prefix.append("--")
+        if self.charm.config.backup_nice:
+            prefix += ["nice", "-n", str(self.charm.config.backup_nice)]
+        if self.charm.config.backup_ionice_class != "none":
+            prefix += ["ionice", *IONICE_CLASSES[self.charm.config.backup_ionice_class]]
+        return prefix + command
+
     @staticmethod
     def _extract_error_message(stdout: str, stderr: str) -> str:
         """Extract key error message from pgBackRest output.
@@ -438,7 +1050,7 @@ class PostgreSQLBackups(Object):
         backups = [
             "Storage bucket name: {:s}".format(s3_parameters["bucket"]),
             "Backups base path: {:s}/backup/\n".format(s3_parameters["path"]),
-            "{:<20s} | {:<19s} | {:<8s} | {:<20s} | {:<23s} | {:<20s} | {:<20s} | {:<8s} | {:s}".format(
+            "{:<20s} | {:<19s} | {:<8s} | {:<20s} | {:<23s} | {:<20s} | {:<20s} | {:<8s} | {:<12s} | {:s}".format(
                 "backup-id",
                 "action",
                 "status",
@@ -447,6 +1059,7 @@ class PostgreSQLBackups(Object):
                 "start-time",
                 "finish-time",
                 "timeline",
+                "verification",
                 "backup-path",
             ),
         ]
@@ -460,30 +1073,24 @@ class PostgreSQLBackups(Object):
             start,
             stop,
             backup_timeline,
+            verification,
             path,
         ) in backup_list:
             backups.append(
-                f"{backup_id:<20s} | {backup_action:<19s} | {backup_status:<8s} | {reference:<20s} | {lsn_start_stop:<23s} | {start:<20s} | {stop:<20s} | {backup_timeline:<8s} | {path:s}"
+                f"{backup_id:<20s} | {backup_action:<19s} | {backup_status:<8s} | {reference:<20s} | {lsn_start_stop:<23s} | {start:<20s} | {stop:<20s} | {backup_timeline:<8s} | {verification:<12s} | {path:s}"
             )
         return "\n".join(backups)
 
     def _generate_backup_list_output(self) -> str:
         """Generates a list of backups in a formatted table.
 
-        List contains successful and failed backups in order of ascending time.
+        List contains successful and failed backups in order of ascending time, with their
+        status in the last verification of the repository.
         """
         backup_list = []
-        return_code, output, stderr = self._execute_command([
-            PGBACKREST_EXECUTABLE,
-            PGBACKREST_CONFIGURATION_FILE,
-            "info",
-            "--output=json",
-        ])
-        if return_code != 0:
-            extracted_error = self._extract_error_message(output, stderr)
-            raise ListBackupsError(f"Failed to list backups with error: {extracted_error}")
-
-        backups = json.loads(output)[0]["backup"]
+        last_verification = self.catalog.last_verification()
+        verified_backups = last_verification["backups"] if last_verification else {}
+        backups = self.catalog.info()[0]["backup"]
         for backup in backups:
             backup_id, backup_type = self._parse_backup_id(backup["label"])
             backup_action = f"{backup_type} backup"
@@ -503,6 +1110,8 @@ class PostgreSQLBackups(Object):
                 else ""
             )
             backup_path = f"/{self.stanza_name}/{backup['label']}"
+            if not self._in_s3_repository(backup):
+                backup_path = f"{self.local_repository_path}/backup{backup_path}"
             error = backup["error"]
             backup_status = "finished"
             if error:
@@ -516,9 +1125,12 @@ class PostgreSQLBackups(Object):
                 time_start,
                 time_stop,
                 backup_timeline,
+                verified_backups.get(backup["label"], "unverified"),
                 backup_path,
             ))
 
+        backup_list.extend(self._running_backup_jobs())
+
         for timeline, (_, timeline_id) in self._list_timelines().items():
             backup_list.append((
                 timeline,
@@ -530,34 +1142,38 @@ class PostgreSQLBackups(Object):
                 "n/a",
                 timeline_id,
                 "n/a",
+                "n/a",
             ))
 
         backup_list.sort(key=lambda x: x[0])
 
-        return self._format_backup_list(backup_list)
+        output = self._format_backup_list(backup_list)
+        if last_verification:
+            output += (
+                f"\n\nLast verification: {last_verification['status']} at"
+                f" {last_verification['finished-at']} on {last_verification['unit']}"
+                f" (took {format_duration(last_verification['duration'])})"
+            )
+        return output
 
-    def _list_backups(self, show_failed: bool, parse=True) -> dict[str, tuple[str, str]]:
+    def _list_backups(
+        self, show_failed: bool, parse=True, include_local=False
+    ) -> dict[str, tuple[str, str]]:
         """Retrieve the list of backups.
 
+        Only the backups in S3 are listed by default, as the local repository of a unit
+        can't be read by the other units.
+
         Args:
             show_failed: whether to also return the failed backups.
             parse: whether to convert backup labels to their IDs or not.
+            include_local: whether to also return the backups in the local repository.
 
         Returns:
             a dict of previously created backups: id => (stanza, timeline) or an empty dict if there is no backups in
                 the S3 bucket.
         """
-        return_code, output, stderr = self._execute_command([
-            PGBACKREST_EXECUTABLE,
-            PGBACKREST_CONFIGURATION_FILE,
-            "info",
-            "--output=json",
-        ])
-        if return_code != 0:
-            extracted_error = self._extract_error_message(output, stderr)
-            raise ListBackupsError(f"Failed to list backups with error: {extracted_error}")
-
-        repository_info = next(iter(json.loads(output)), None)
+        repository_info = next(iter(self.catalog.info()), None)
 
         # If there are no backups, returns an empty dict.
         if repository_info is None:
@@ -573,7 +1189,8 @@ class PostgreSQLBackups(Object):
                 else "",
             )
             for backup in backups
-            if show_failed or not backup["error"]
+            if (show_failed or not backup["error"])
+            and (include_local or self._in_s3_repository(backup))
         })
 
     def _list_timelines(self) -> dict[str, tuple[str, str]]:
@@ -582,51 +1199,60 @@ class PostgreSQLBackups(Object):
         Returns:
             a dict of timelines: id => (stanza, timeline) or an empty dict if there is no timelines in the S3 bucket.
         """
+        return {
+            switched_at: (stanza, timeline)
+            for switched_at, (stanza, timeline) in self.catalog.timeline_switches().items()
+        }
+
+    def _get_nearest_timeline(self, timestamp: str) -> tuple[str, str] | None:
+        """Finds the nearest timeline or backup prior to the specified timeline.
+
+        Returns:
+            (stanza, timeline) of the nearest timeline or backup. None, if there are no matches.
+        """
+        # The ids (in BACKUP_ID_FORMAT) sort in time order.
+        restore_points = sorted(
+            (self._list_backups(show_failed=False) | self._list_timelines()).items()
+        )
+        if timestamp == "latest":
+            return restore_points[-1][1] if restore_points else None
+        # The ids have no fractional seconds, so truncating the timestamp keeps the comparison.
+        nearest = bisect_right(
+            restore_points,
+            self._parse_psql_timestamp(timestamp).strftime(BACKUP_ID_FORMAT),
+            key=lambda restore_point: restore_point[0],
+        )
+        return restore_points[nearest - 1][1] if nearest > 0 else None
+
+    def _wal_archived_until(self) -> datetime | None:
+        """Returns when the last WAL segment in the repository was archived (timezone-naive UTC).
+
+        Only the directory of the last segment is listed, not the whole archive.
+
+        Raises:
+            ListBackupsError: if pgBackRest fails to read the repository.
+        """
+        if (last_archived_segment := self.catalog.last_archived_segment()) is None:
+            return None
+        stanza, archive_id, segment = last_archived_segment
         return_code, output, stderr = self._execute_command([
             PGBACKREST_EXECUTABLE,
             PGBACKREST_CONFIGURATION_FILE,
+            *self._repository_option(self._s3_repository),
             "repo-ls",
-            "archive",
-            "--recurse",
+            # The segments are grouped in directories named after their first 16 digits.
+            f"archive/{stanza}/{archive_id}/{segment[:16]}",
             "--filter",
-            "\\.history$",
+            f"^{segment}",
             "--output=json",
         ])
         if return_code != 0:
             extracted_error = self._extract_error_message(output, stderr)
             raise ListBackupsError(f"Failed to list repository with error: {extracted_error}")
-
-        repository = json.loads(output).items()
-        output = dict[str, tuple[str, str]]()
-        if repository:
-            for timeline, timeline_object in repository:
-                if not timeline.endswith("backup.history"):
-                    # 0 is the stanza -1 is the timeline file
-                    path = timeline.split("/")
-                    output[
-                        datetime.strftime(
-                            datetime.fromtimestamp(timeline_object["time"], timezone.utc),
-                            BACKUP_ID_FORMAT,
-                        )
-                    ] = (path[0], path[-1].split(".")[0].lstrip("0"))
-        return output
-
-    def _get_nearest_timeline(self, timestamp: str) -> tuple[str, str] | None:
-        """Finds the nearest timeline or backup prior to the specified timeline.
-
-        Returns:
-            (stanza, timeline) of the nearest timeline or backup. None, if there are no matches.
-        """
-        timelines = self._list_backups(show_failed=False) | self._list_timelines()
-        if timestamp == "latest":
-            return max(timelines.items())[1] if len(timelines) > 0 else None
-        filtered_timelines = [
-            (timeline_key, timeline_object)
-            for timeline_key, timeline_object in timelines.items()
-            if datetime.strptime(timeline_key, BACKUP_ID_FORMAT)
-            <= self._parse_psql_timestamp(timestamp)
-        ]
-        return max(filtered_timelines)[1] if len(filtered_timelines) > 0 else None
+        archived_at = [segment_file["time"] for segment_file in json.loads(output).values()]
+        if not archived_at:
+            return None
+        return datetime.fromtimestamp(max(archived_at), timezone.utc).replace(tzinfo=None)
 
     def _is_psql_timestamp(self, timestamp: str) -> bool:
         if not re.match(
@@ -675,152 +1301,220 @@ class PostgreSQLBackups(Object):
             backup_type,
         )
 
-    def _initialise_stanza(self, event: HookEvent) -> bool:
-        """Initialize the stanza.
-
-        A stanza is the configuration for a PostgreSQL database cluster that defines where it is located, how it will
-        be backed up, archiving options, etc. (more info in
-        https://pgbackrest.org/user-guide.html#quickstart/configure-stanza).
-
-        Returns:
-            whether stanza initialization were successful.
-        """
-        # Enable stanza initialisation if the backup settings were fixed after being invalid
-        # or pointing to a repository where there are backups from another cluster.
-        if self.charm.is_blocked and self.charm.unit.status.message not in S3_BLOCK_MESSAGES:
-            logger.warning("couldn't initialize stanza due to a blocked status, deferring event")
-            event.defer()
-            return False
-
-        self.charm.unit.status = MaintenanceStatus("initialising stanza")
-
-        # Create the stanza.
+    def _stanza_initialisation(self, unit_data=None) -> dict | None:
+        """Returns the initialisation of the stanza run by a unit (this one by default)."""
+        if unit_data is None:
+            unit_data = self.charm.unit_peer_data
         try:
-            # If the tls is enabled, it requires all the units in the cluster to run the pgBackRest service to
-            # successfully complete validation, and upon receiving the same parent event other units should start it.
-            # Therefore, the first retry may fail due to the delay of these other units to start this service. 60s given
-            # for that or else the s3 initialization sequence will fail.
-            for attempt in Retrying(stop=stop_after_attempt(6), wait=wait_fixed(10), reraise=True):
-                with attempt:
-                    return_code, _, stderr = self._execute_command([
-                        PGBACKREST_EXECUTABLE,
-                        PGBACKREST_CONFIGURATION_FILE,
-                        f"--stanza={self.stanza_name}",
-                        "stanza-create",
-                    ])
-                    if return_code == 49:
-                        # Raise an error if the connection timeouts, so the user has the possibility to
-                        # fix network issues and call juju resolve to re-trigger the hook that calls
-                        # this method.
-                        logger.error(
-                            f"error: {stderr} - please fix the error and call juju resolve on this unit"
-                        )
-                        raise TimeoutError
-                    if return_code != 0:
-                        raise Exception(stderr)
-        except TimeoutError as e:
-            raise e
-        except Exception:
-            # If the check command doesn't succeed, remove the stanza name
-            # and rollback the configuration.
-            logger.exception("Failed to initialise stanza:")
-            self._s3_initialization_set_failure(FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE)
-            return False
+            return json.loads(unit_data["stanza-initialisation"])
+        except (KeyError, ValueError):
+            return None
 
-        self.start_stop_pgbackrest_service()
+    def _record_stanza_initialisation(
+        self,
+        request: str,
+        state: str,
+        stanza: str = "",
+        block_message: str = "",
+        retry_after: float | None = None,
+    ) -> None:
+        """Publishes the state of the stanza initialisation run by this unit for a request."""
+        initialisation = {
+            "request": request,
+            "state": state,
+            "stanza": stanza,
+            "block-message": block_message,
+        }
+        if retry_after is not None:
+            initialisation["retry-after"] = retry_after
+        self.charm.unit_peer_data["stanza-initialisation"] = json.dumps(initialisation)
 
-        # Rest of the successful s3 initialization sequence such as s3-initialization-start and s3-initialization-done
-        # are left to the check_stanza func.
-        if self.charm.unit.is_leader():
-            self.charm.app_peer_data.update({
-                "stanza": self.stanza_name,
-            })
-        else:
-            self.charm.unit_peer_data.update({
-                "stanza": self.stanza_name,
-            })
+    @property
+    def stanza_initialisation_timed_out_message(self) -> str | None:
+        """Returns the block message of the pending stanza initialisation if it timed out."""
+        if self.charm._peers is None:
+            return None
+        initialisation = self._stanza_initialisation()
+        if (
+            initialisation
+            and initialisation["state"] == STANZA_STATE_TIMED_OUT
+            and initialisation["request"]
+            == self.charm.app_peer_data.get("s3-initialization-start")
+        ):
+            return initialisation["block-message"]
+        return None
 
-        return True
+    def is_s3_block_message(self, message: str) -> bool:
+        """Returns whether a block message comes from the S3 settings or the stanza."""
+        return (
+            message in S3_BLOCK_MESSAGES or message == self.stanza_initialisation_timed_out_message
+        )
 
-    def check_stanza(self) -> bool:
-        """Runs the pgbackrest stanza validation.
+    @property
+    def configured_stanza(self) -> str | None:
+        """Returns the stanza WAL is archived to.
 
-        Returns:
-            whether stanza validation was successful.
+        It's the stanza published by the leader or, on the primary, the one being initialised
+        (pgbackrest check needs the WAL to be archived).
         """
-        # Update the configuration to use pgBackRest as the archiving mechanism.
-        self.charm.update_config()
+        if stanza := self.charm.app_peer_data.get("stanza"):
+            return stanza
+        initialisation = self._stanza_initialisation()
+        if initialisation and initialisation["request"] == self.charm.app_peer_data.get(
+            "s3-initialization-start"
+        ):
+            return initialisation["stanza"] or None
+        return None
 
-        self.charm.unit.status = MaintenanceStatus("checking stanza")
+    def _stanza_initialisation_command(self) -> list[str]:
+        """Returns the command that creates and checks the stanza, retrying each step.
+
+        When TLS is enabled, the check needs the pgBackRest server of every unit, which the
+        other units may still be starting, so each step is retried for a minute.
+        """
+        return [
+            "/bin/sh",
+            "-c",
+            'retry() { attempt=1; until "$@"; do code=$?;'
+            f" [ $attempt -ge {STANZA_INITIALISATION_ATTEMPTS} ] && return $code;"
+            f" attempt=$((attempt + 1)); sleep {STANZA_INITIALISATION_RETRY_INTERVAL}; done; }};"
+            ' retry "$@" stanza-create && retry "$@" check',
+            "sh",
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            f"--stanza={self.stanza_name}",
+        ]
+
+    def _start_stanza_initialisation(self, request: str) -> None:
+        """Checks the repository and starts creating and checking the stanza in the background.
+
+        A stanza is the configuration for a PostgreSQL database cluster that defines where it is
+        located, how it will be backed up, archiving options, etc. (more info in
+        https://pgbackrest.org/user-guide.html#quickstart/configure-stanza).
+        """
+        # Enable stanza initialisation if the backup settings were fixed after being invalid
+        # or pointing to a repository where there are backups from another cluster.
+        if self.charm.is_blocked and not self.is_s3_block_message(self.charm.unit.status.message):
+            logger.warning("Couldn't initialise the stanza due to a blocked status")
+            return
 
         try:
-            # If the tls is enabled, it requires all the units in the cluster to run the pgBackRest service to
-            # successfully complete validation, and upon receiving the same parent event other units should start it.
-            # Therefore, the first retry may fail due to the delay of these other units to start this service. 60s given
-            # for that or else the s3 initialization sequence will fail.
-            for attempt in Retrying(stop=stop_after_attempt(6), wait=wait_fixed(10), reraise=True):
-                with attempt:
-                    return_code, stdout, stderr = self._execute_command([
-                        PGBACKREST_EXECUTABLE,
-                        PGBACKREST_CONFIGURATION_FILE,
-                        f"--stanza={self.stanza_name}",
-                        "check",
-                    ])
-                    if return_code == PGBACKREST_ARCHIVE_TIMEOUT_ERROR_CODE:
-                        # Raise an error if the archive command timeouts, so the user has the possibility
-                        # to fix network issues and call juju resolve to re-trigger the hook that calls
-                        # this method.
-                        extracted_error = self._extract_error_message(stdout, stderr)
-                        logger.error(
-                            f"error: {extracted_error} - please fix the error and call juju resolve on this unit"
-                        )
-                        raise TimeoutError
-                    if return_code != 0:
-                        raise Exception(stderr)
-            self.charm._set_primary_status_message()
-        except TimeoutError:
-            # Re-raise to put charm in error state (not blocked), allowing juju resolve
-            raise
-        except Exception as e:
-            # If the check command doesn't succeed, remove the stanza name
-            # and rollback the configuration.
-            logger.exception(e)
+            self._create_bucket_if_not_exists()
+        except (ClientError, ValueError, ParamValidationError, SSLError):
+            self._s3_initialization_set_failure(FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE)
+            return
+
+        can_use_s3_repository, validation_message = self.can_use_s3_repository()
+        if not can_use_s3_repository:
+            self._s3_initialization_set_failure(validation_message)
+            return
+
+        self.charm.unit.status = MaintenanceStatus("initialising stanza")
+        self._record_stanza_initialisation(request, STANZA_STATE_RUNNING, self.stanza_name)
+        # Archive the WAL to the new stanza, which the check verifies.
+        self.charm.update_config()
+        try:
+            job_id = self.charm.background_jobs.start(
+                STANZA_JOB_TYPE, self._stanza_initialisation_command(), {"request": request}
+            )
+        except OSError as e:
+            logger.error(f"Failed to start the stanza initialisation: {e!s}")
             self._s3_initialization_set_failure(FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE)
             self.charm.update_config()
-            return False
+            return
+        logger.info(f"Initialising the stanza in background job {job_id}")
+
+    def _process_stanza_initialisation_result(self, job: dict) -> None:
+        """Publishes the result of the stanza initialisation run in a background job."""
+        request = job["metadata"]["request"]
+        return_code = job.get("return-code")
+        stdout, stderr = self.charm.background_jobs.read_output(job)
+        if job["state"] == JOB_STATE_LOST or return_code in [
+            PGBACKREST_TIMEOUT_ERROR_CODE,
+            PGBACKREST_ARCHIVE_TIMEOUT_ERROR_CODE,
+        ]:
+            # Network issues are retried on update status, once the retry delay elapsed.
+            extracted_error = self._extract_error_message(stdout, stderr)
+            logger.error(
+                f"Stanza initialisation timed out: {extracted_error} - it will be retried in"
+                f" {STANZA_INITIALISATION_TIMEOUT_RETRY_DELAY} seconds"
+            )
+            self._record_stanza_initialisation(
+                request,
+                STANZA_STATE_TIMED_OUT,
+                block_message=f"{STANZA_INITIALISATION_TIMED_OUT_MESSAGE}: {extracted_error}",
+                retry_after=time.time() + STANZA_INITIALISATION_TIMEOUT_RETRY_DELAY,
+            )
+            self.charm.unit.status = BlockedStatus(self.stanza_initialisation_timed_out_message)
+            self.charm.update_config()
+            return
+        if return_code != 0:
+            logger.error(
+                f"Failed to initialise the stanza: {self._extract_error_message(stdout, stderr)}"
+            )
+            self._s3_initialization_set_failure(
+                FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE, request=request
+            )
+            self.charm.update_config()
+            return
 
-        if self.charm.unit.is_leader():
-            self.charm.app_peer_data.update({
-                "s3-initialization-start": "",
-            })
-        else:
-            self.charm.unit_peer_data.update({"s3-initialization-done": "True"})
+        self.start_stop_pgbackrest_service()
+        self.catalog.invalidate()
+        s3_parameters, _ = self._retrieve_s3_parameters()
+        self._upload_content_to_s3(self.model.uuid, "model-uuid.txt", s3_parameters)
+        self._record_stanza_initialisation(request, STANZA_STATE_DONE, self.stanza_name)
+        logger.info(f"Initialised the stanza {self.stanza_name}")
+        # Clear the "initialising stanza" status, which the leader only does for itself.
+        self.charm._set_primary_status_message()
 
-        return True
+    def coordinate_stanza_fields(self, retry_timed_out: bool = False) -> None:
+        """Moves the initialisation of the stanza requested by the leader forward.
 
-    def coordinate_stanza_fields(self) -> None:
-        """Coordinate the stanza name between the primary and the leader units."""
-        if (
-            not self.charm.unit.is_leader()
-            or "s3-initialization-start" not in self.charm.app_peer_data
+        The leader requests an initialisation by setting s3-initialization-start, the primary
+        runs it in a background job and publishes its result in its unit data, and the leader
+        publishes that result for the whole cluster (stanza and s3-initialization-block-message)
+        in a single update, which ends the request. The results are tied to their request, so
+        they're never cleared and the results of older requests are ignored.
+
+        Args:
+            retry_timed_out: whether to start again an initialisation that timed out, once its
+                retry delay elapsed (done on update status only).
+        """
+        if self.charm._peers is None or not (
+            request := self.charm.app_peer_data.get("s3-initialization-start")
         ):
             return
 
-        for _unit, unit_data in self.charm._peers.data.items():
-            if "s3-initialization-done" not in unit_data:
-                continue
-
-            self.charm.app_peer_data.update({
-                "stanza": unit_data.get("stanza", ""),
-                "s3-initialization-block-message": unit_data.get(
-                    "s3-initialization-block-message", ""
-                ),
-                "s3-initialization-start": "",
-                "s3-initialization-done": "True",
-            })
+        if self.charm.unit.is_leader():
+            for unit in [self.charm.unit, *self.charm._peers.units]:
+                initialisation = self._stanza_initialisation(self.charm._peers.data[unit])
+                if (
+                    initialisation
+                    and initialisation["request"] == request
+                    and initialisation["state"] == STANZA_STATE_DONE
+                ):
+                    self.charm.app_peer_data.update({
+                        "stanza": initialisation["stanza"],
+                        "s3-initialization-block-message": initialisation["block-message"],
+                        "s3-initialization-start": "",
+                    })
+                    self.charm.update_config()
+                    self.charm._set_primary_status_message()
+                    return
 
-            self.charm.update_config()
-            break
+        initialisation = self._stanza_initialisation()
+        if (
+            initialisation is not None
+            and initialisation["request"] == request
+            and not (
+                retry_timed_out
+                and initialisation["state"] == STANZA_STATE_TIMED_OUT
+                and time.time() >= initialisation.get("retry-after", 0)
+            )
+        ):
+            return
+        if not self.charm.background_jobs.running(STANZA_JOB_TYPE) and self.charm.is_primary:
+            self._start_stanza_initialisation(request)
 
     @property
     def _is_primary_pgbackrest_service_running(self) -> bool:
@@ -841,7 +1535,7 @@ class PostgreSQLBackups(Object):
         return return_code == 0
 
     def _on_s3_credential_changed(self, event: CredentialsChangedEvent):
-        """Call the stanza initialization when the credentials or the connection info change."""
+        """Request the stanza initialisation when the credentials or the connection info change."""
         if not self.charm.is_cluster_initialised:
             logger.debug("Cannot set pgBackRest configurations, PostgreSQL has not yet started.")
             event.defer()
@@ -863,12 +1557,15 @@ class PostgreSQLBackups(Object):
             logger.debug("Cannot set pgBackRest configurations, missing configurations.")
             return
 
+        # Read the repository contents again with the new settings.
+        self.catalog.invalidate()
+
         if not self._can_initialise_stanza:
             logger.debug("Cannot initialise stanza yet.")
             event.defer()
             return
 
-        # Start the pgBackRest service for the check_stanza to be successful. It's required to run on all the units if the tls is enabled.
+        # Start the pgBackRest service for the stanza check to be successful. It's required to run on all the units if the tls is enabled.
         self.start_stop_pgbackrest_service()
 
         if self.charm.unit.is_leader():
@@ -876,75 +1573,48 @@ class PostgreSQLBackups(Object):
                 "s3-initialization-block-message": "",
                 "s3-initialization-start": time.asctime(time.gmtime()),
                 "stanza": "",
-                "s3-initialization-done": "",
             })
             if not self.charm.is_primary:
                 self.charm._set_primary_status_message()
 
-        if self.charm.is_primary and "s3-initialization-done" not in self.charm.unit_peer_data:
-            self._on_s3_credential_changed_primary(event)
+        # The primary starts the initialisation once it sees the request of the leader.
+        self.coordinate_stanza_fields()
 
         if self.charm.is_standby_leader:
             logger.info(
                 "S3 credentials will not be connected on standby cluster until it becomes primary"
             )
 
-    def _on_s3_credential_changed_primary(self, event: HookEvent) -> bool:
-        """Stanza must be cleared before calling this function."""
-        self.charm.update_config()
-
-        try:
-            self._create_bucket_if_not_exists()
-        except (ClientError, ValueError, ParamValidationError, SSLError):
-            self._s3_initialization_set_failure(FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE)
-            return False
-
-        can_use_s3_repository, validation_message = self.can_use_s3_repository()
-        if not can_use_s3_repository:
-            self._s3_initialization_set_failure(validation_message)
-            return False
-
-        if not self._initialise_stanza(event):
-            return False
-
-        if not self.check_stanza():
-            return False
-
-        s3_parameters, _ = self._retrieve_s3_parameters()
-        self._upload_content_to_s3(
-            self.model.uuid,
-            "model-uuid.txt",
-            s3_parameters,
-        )
-
-        return True
-
     def _on_s3_credential_gone(self, _) -> None:
+        self.catalog.invalidate()
+        is_s3_blocked = self.charm.is_blocked and self.is_s3_block_message(
+            self.charm.unit.status.message
+        )
         if self.charm.unit.is_leader():
             self.charm.app_peer_data.update({
                 "stanza": "",
                 "s3-initialization-start": "",
-                "s3-initialization-done": "",
                 "s3-initialization-block-message": "",
             })
-        self.charm.unit_peer_data.update({
-            "stanza": "",
-            "s3-initialization-start": "",
-            "s3-initialization-done": "",
-            "s3-initialization-block-message": "",
-        })
-        if self.charm.is_blocked and self.charm.unit.status.message in S3_BLOCK_MESSAGES:
+        self.charm.unit_peer_data.pop("stanza-initialisation", None)
+        if is_s3_blocked:
             self.charm._set_primary_status_message()
 
-    def _on_create_backup_action(self, event) -> None:
+    def _on_create_backup_action(self, event) -> None:  # noqa: C901
         """Request that pgBackRest creates a backup."""
         backup_type = event.params.get("type", "full")
-        if backup_type not in BACKUP_TYPE_OVERRIDES:
-            error_message = f"Invalid backup type: {backup_type}. Possible values: {', '.join(BACKUP_TYPE_OVERRIDES.keys())}."
+        if backup_type not in [*BACKUP_TYPE_OVERRIDES, AUTO_BACKUP_TYPE]:
+            error_message = f"Invalid backup type: {backup_type}. Possible values: {', '.join([*BACKUP_TYPE_OVERRIDES, AUTO_BACKUP_TYPE])}."
             logger.error(f"Backup failed: {error_message}")
             event.fail(error_message)
             return
 
+        if backup_type == AUTO_BACKUP_TYPE:
+            plan = self._plan_backup()
+            logger.info(f"Planned a {plan['type']} backup: {plan['reason']}")
+            event.set_results({"backup-plan": plan})
+            backup_type = plan["type"]
+
         if (
             backup_type in ["differential", "incremental"]
             and len(self._list_backups(show_failed=False)) == 0
@@ -956,8 +1626,18 @@ class PostgreSQLBackups(Object):
             event.fail(error_message)
             return
 
+        if self.is_backup_running_in_background:
+            error_message = "A backup is already being created in the background"
+            logger.error(f"Backup failed: {error_message}")
+            event.fail(error_message)
+            return
+
         logger.info(f"A {backup_type} backup has been requested on unit")
-        can_unit_perform_backup, validation_message = self._can_unit_perform_backup()
+        can_unit_perform_backup, validation_message = (
+            self._can_unit_perform_local_backup()
+            if backup_type == LOCAL_BACKUP_TYPE
+            else self._can_unit_perform_backup()
+        )
         if not can_unit_perform_backup:
             logger.error(f"Backup failed: {validation_message}")
             event.fail(validation_message)
@@ -968,18 +1648,7 @@ class PostgreSQLBackups(Object):
 
         # Test uploading metadata to S3 to test credentials before backup.
         datetime_backup_requested = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        juju_version = JujuVersion.from_environ()
-        metadata = f"""Date Backup Requested: {datetime_backup_requested}
-Model Name: {self.model.name}
-Application Name: {self.model.app.name}
-Unit Name: {self.charm.unit.name}
-Juju Version: {juju_version!s}
-"""
-        if not self._upload_content_to_s3(
-            metadata,
-            f"backup/{self.stanza_name}/latest",
-            s3_parameters,
-        ):
+        if not self._upload_backup_metadata(datetime_backup_requested, s3_parameters):
             error_message = "Failed to upload metadata to provided S3"
             logger.error(f"Backup failed: {error_message}")
             event.fail(error_message)
@@ -995,7 +1664,12 @@ Juju Version: {juju_version!s}
         # (reference: https://github.com/pgbackrest/pgbackrest/issues/2007)
         self.charm.update_config(is_creating_backup=True)
 
-        self._run_backup(event, s3_parameters, datetime_backup_requested, backup_type)
+        if event.params.get("background", False):
+            if self._start_background_backup(event, datetime_backup_requested, backup_type):
+                # The unit state is restored when the job completes.
+                return
+        else:
+            self._run_backup(event, s3_parameters, datetime_backup_requested, backup_type)
 
         if not self.charm.is_primary:
             # Remove the rule that marks the cluster as in a creating backup state
@@ -1004,85 +1678,742 @@ Juju Version: {juju_version!s}
 
         self.charm.update_config(is_creating_backup=False)
         self.charm.unit.status = ActiveStatus()
+        # The new backup may be recent enough to restore the new replicas from.
+        self.refresh_replica_bootstrap()
 
-    def _run_backup(
-        self,
-        event: ActionEvent,
-        s3_parameters: dict,
-        datetime_backup_requested: str,
-        backup_type: str,
-    ) -> None:
+    def _upload_backup_metadata(self, datetime_backup_requested: str, s3_parameters: dict) -> bool:
+        """Uploads the metadata of a requested backup, which also tests the S3 credentials."""
+        juju_version = JujuVersion.from_environ()
+        metadata = f"""Date Backup Requested: {datetime_backup_requested}
+Model Name: {self.model.name}
+Application Name: {self.model.app.name}
+Unit Name: {self.charm.unit.name}
+Juju Version: {juju_version!s}
+"""
+        return self._upload_content_to_s3(
+            metadata,
+            f"backup/{self.stanza_name}/latest",
+            s3_parameters,
+        )
+
+    def _start_backup_job(self, datetime_backup_requested: str, backup_type: str) -> str:
+        """Starts a background job that creates the backup and returns its id.
+
+        Raises:
+            OSError: if the job cannot be started.
+        """
+        command = self._backup_command(backup_type)
+        job_id = self.charm.background_jobs.start(
+            BACKUP_JOB_TYPE,
+            command,
+            metadata={
+                "backup-type": backup_type,
+                "datetime-backup-requested": datetime_backup_requested,
+                "restore-connectivity": not self.charm.is_primary,
+            },
+            user=self._command_user(command),
+        )
+        self.charm.unit_peer_data["backup-job"] = json.dumps({
+            "job-id": job_id,
+            "backup-type": backup_type,
+            "started-at": datetime_backup_requested,
+        })
+        logger.info(f"Backup started in the background with job id {job_id}")
+        return job_id
+
+    def _start_background_backup(
+        self, event: ActionEvent, datetime_backup_requested: str, backup_type: str
+    ) -> bool:
+        """Starts a background job that creates the backup.
+
+        Returns:
+            Whether the job was started.
+        """
+        try:
+            job_id = self._start_backup_job(datetime_backup_requested, backup_type)
+        except OSError as e:
+            error_message = f"Failed to start the backup job: {e!s}"
+            logger.error(f"Backup failed: {error_message}")
+            event.fail(error_message)
+            return False
+
+        event.set_results({"backup-status": "backup started", "job-id": job_id})
+        return True
+
+    def _last_backup_chain(self) -> list[dict]:
+        """Returns the last full backup of the S3 repository and the backups taken since.
+
+        The list is empty when there is no full backup to reference.
+        """
+        try:
+            backups = [
+                backup
+                for backup in self.catalog.info()[0]["backup"]
+                if not backup["error"] and self._in_s3_repository(backup)
+            ]
+            last_full_backup = max(
+                index for index, backup in enumerate(backups) if backup["type"] == "full"
+            )
+        except (ListBackupsError, ValueError, KeyError, IndexError, TypeError):
+            return []
+        return backups[last_full_backup:]
+
+    def _is_older_than_retention(self, backup: dict) -> bool:
+        """Returns whether a backup is older than the retention period of the S3 repository."""
+        s3_parameters, _ = self._retrieve_s3_parameters()
+        retention_period = int(s3_parameters["delete-older-than-days"]) * 24 * 60 * 60
+        return time.time() - backup["timestamp"]["stop"] > retention_period
+
+    def _scheduled_backup_type(self, backup_type: str) -> str:
+        """Returns the type of a scheduled backup, starting a new chain of backups if needed.
+
+        Differential and incremental backups are taken as full backups when there is no full
+        backup to reference, or when the last one is older than the retention period, so the
+        chains of backups expire with the retention policy of the repository. The type of the
+        auto backups is chosen by the planner.
+        """
+        if backup_type in ["full", LOCAL_BACKUP_TYPE]:
+            return backup_type
+        if backup_type == AUTO_BACKUP_TYPE:
+            plan = self._plan_backup()
+            logger.info(f"Planned a {plan['type']} backup: {plan['reason']}")
+            return plan["type"]
+
+        if not (chain := self._last_backup_chain()):
+            logger.info(
+                f"No full backup to reference, taking a full backup instead of {backup_type}"
+            )
+            return "full"
+
+        if self._is_older_than_retention(chain[0]):
+            logger.info(
+                f"The last full backup is older than the retention period, taking a full backup"
+                f" instead of {backup_type}"
+            )
+            return "full"
+        return backup_type
+
+    def _plan_backup(self) -> dict[str, str]:
+        """Chooses the type of the next backup from the last chain of backups in S3.
+
+        A full backup starts a new chain when the last one can't be referenced, is too old or
+        when most of the database changed since (a differential backup would copy almost as
+        much data). Otherwise, a differential backup ends a long run of incremental backups,
+        so restores read fewer backups, and an incremental backup copies the least data.
+
+        Returns:
+            The chosen type, the reason and the measurements it's based on.
+        """
+        if not (chain := self._last_backup_chain()):
+            return {"type": "full", "reason": "no full backup to reference"}
+        if self._is_older_than_retention(chain[0]):
+            return {
+                "type": "full",
+                "reason": "the last full backup is older than the retention period",
+            }
+
+        config = self.charm.config
+        full_backup_age = time.time() - chain[0]["timestamp"]["stop"]
+        # Backups since the last full or differential one (its own changes aren't counted in
+        # the differential one).
+        last_differential = max(
+            index for index, backup in enumerate(chain) if backup["type"] in ["full", "diff"]
+        )
+        incremental_chain = len(chain) - last_differential - 1
+        changed_size = sum(
+            backup["info"]["delta"] for backup in chain[max(last_differential, 1) :]
+        )
+        changed_ratio = changed_size / max(chain[-1]["info"]["size"], 1)
+        plan = {
+            "last-full-age": f"{full_backup_age / (24 * 60 * 60):.1f} days",
+            "changed-ratio": f"{changed_ratio:.2f}",
+            "incremental-chain": str(incremental_chain),
+            "chain-length": str(len(chain)),
+        }
+
+        if full_backup_age > config.backup_auto_full_max_age * 24 * 60 * 60:
+            return {
+                "type": "full",
+                "reason": f"the last full backup is older than {config.backup_auto_full_max_age}"
+                " days",
+                **plan,
+            }
+        if changed_ratio >= config.backup_auto_full_changed_ratio:
+            return {
+                "type": "full",
+                "reason": f"{changed_ratio:.0%} of the database changed since the last full"
+                " backup",
+                **plan,
+            }
+        if incremental_chain >= config.backup_auto_incremental_chain_max:
+            return {
+                "type": "differential",
+                "reason": f"{incremental_chain} incremental backups since the last full or"
+                " differential backup",
+                **plan,
+            }
+        return {
+            "type": "incremental",
+            "reason": "few changes since the last full backup and a short chain of backups",
+            **plan,
+        }
+
+    def scheduled_backup_unit(self, backup_type: str) -> str | None:
+        """Returns the unit that should take a scheduled backup, chosen once by the leader.
+
+        Local backups are taken by the primary. The S3 ones by the best backup source when
+        TLS lets the standbys take them, otherwise by the primary too.
+        """
+        if (
+            backup_type != LOCAL_BACKUP_TYPE
+            and self.charm.app.planned_units() > 1
+            and "tls" in self.charm.unit_peer_data
+        ):
+            return self.backup_source()
+        return self.charm._patroni.get_primary(unit_name_pattern=True)
+
+    def create_scheduled_backup(self, backup_type: str) -> None:
+        """Starts a scheduled backup in the background, as the leader assigned it to this unit."""
+        if self.is_backup_running_in_background or self.charm._patroni.is_creating_backup:
+            logger.info(
+                f"Skipping the scheduled {backup_type} backup: a backup is already running"
+            )
+            return
+
+        # The leader already chose this unit as the backup source.
+        can_unit_perform_backup, validation_message = (
+            self._can_unit_perform_local_backup()
+            if backup_type == LOCAL_BACKUP_TYPE
+            else self._can_unit_perform_backup(check_backup_source=False)
+        )
+        if not can_unit_perform_backup:
+            logger.debug(f"Skipping the scheduled {backup_type} backup: {validation_message}")
+            return
+
+        backup_type = self._scheduled_backup_type(backup_type)
+        logger.info(f"Starting the scheduled {backup_type} backup")
+        s3_parameters, _ = self._retrieve_s3_parameters()
+        datetime_backup_requested = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        if not self._upload_backup_metadata(datetime_backup_requested, s3_parameters):
+            logger.error("Scheduled backup failed: Failed to upload metadata to provided S3")
+            return
+
+        if not self.charm.is_primary:
+            self._change_connectivity_to_database(connectivity=False)
+        self.charm.unit.status = MaintenanceStatus("creating backup")
+        self.charm.update_config(is_creating_backup=True)
+
+        try:
+            self._start_backup_job(datetime_backup_requested, backup_type)
+        except OSError as e:
+            logger.error(f"Scheduled backup failed: Failed to start the backup job: {e!s}")
+            if not self.charm.is_primary:
+                self._change_connectivity_to_database(connectivity=True)
+            self.charm.update_config(is_creating_backup=False)
+            self.charm.unit.status = ActiveStatus()
+
+    def create_scheduled_verification(self) -> None:
+        """Starts a scheduled verification of the repository, if this unit should run it."""
+        if self.charm.background_jobs.running(VERIFY_JOB_TYPE):
+            logger.info("Skipping the scheduled verification: a verification is already running")
+            return
+
+        can_unit_verify_repository, validation_message = self._can_unit_verify_repository()
+        if not can_unit_verify_repository:
+            logger.debug(f"Skipping the scheduled verification: {validation_message}")
+            return
+
+        command = self._verify_command()
+        try:
+            job_id = self.charm.background_jobs.start(
+                VERIFY_JOB_TYPE,
+                command,
+                metadata={"stanza": self.stanza_name},
+                user=self._command_user(command),
+            )
+        except OSError as e:
+            logger.error(f"Scheduled verification failed: Failed to start the job: {e!s}")
+            return
+        logger.info(f"Repository verification started in the background with job id {job_id}")
+
+    def _verify_command(self) -> list[str]:
+        """Returns the pgBackRest command that checks the backups and WAL in the repository."""
+        return self._throttle_command([
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            f"--stanza={self.stanza_name}",
+            f"--process-max={PGBACKREST_VERIFY_PROCESS_MAX}",
+            *self._repository_option(self._s3_repository),
+            "--output=text",
+            # Report the status of every backup, not only the invalid ones.
+            "--verbose",
+            "verify",
+        ])
+
+    def _process_verification_result(self, job: dict) -> None:
+        """Records the result of a background verification of the repository."""
+        stdout, stderr = self.charm.background_jobs.read_output(job)
+        finished_at = job.get("finished-at") or datetime.now(timezone.utc).strftime(
+            BACKUP_ID_FORMAT
+        )
+        started_at = job.get("started-at") or job.get("created-at") or finished_at
+        duration = datetime.strptime(finished_at, BACKUP_ID_FORMAT) - datetime.strptime(
+            started_at, BACKUP_ID_FORMAT
+        )
+        status = VERIFY_STATUS_PATTERN.search(stdout)
+        verification = {
+            "stanza": job["metadata"].get("stanza", self.stanza_name),
+            "finished-at": finished_at,
+            "duration": int(duration.total_seconds()),
+            # "ok" or "error" (invalid files found), or "failed" if the command couldn't run.
+            "status": status.group(1) if status else "failed",
+            "backups": dict(VERIFY_BACKUP_PATTERN.findall(stdout)),
+        }
+        if verification["status"] == "ok":
+            logger.info(
+                f"Repository verification job {job['id']} finished in"
+                f" {format_duration(verification['duration'])}"
+            )
+        else:
+            logger.error(
+                f"Repository verification job {job['id']} {verification['status']}:"
+                f" {self._extract_error_message(stdout, stderr)}"
+            )
+        self.catalog.record_verification(verification)
+
+    def _backup_command(self, backup_type: str) -> list[str]:
+        """Returns the pgBackRest command that creates a backup of the given type."""
         command = [
             PGBACKREST_EXECUTABLE,
             PGBACKREST_CONFIGURATION_FILE,
             f"--stanza={self.stanza_name}",
             "--log-level-console=debug",
             f"--type={BACKUP_TYPE_OVERRIDES[backup_type]}",
+            *self._repository_option(
+                1 if backup_type == LOCAL_BACKUP_TYPE else self._s3_repository
+            ),
             "backup",
         ]
         if self.charm.is_primary:
             # Force the backup to run in the primary if it's not possible to run it
             # on the replicas (that happens when TLS is not enabled).
             command.append("--no-backup-standby")
-        return_code, stdout, stderr = self._execute_command(command)
+        # The backup also expires the backups that are out of the retention period.
+        return self._throttle_command(command)
+
+    def _run_backup(
+        self,
+        event: ActionEvent,
+        s3_parameters: dict,
+        datetime_backup_requested: str,
+        backup_type: str,
+    ) -> None:
+        started_at = time.time()
+
+        def report_progress() -> None:
+            if message := self._backup_progress_message(started_at):
+                event.log(f"Backup progress: {message}")
+                self.charm.unit.status = MaintenanceStatus(f"creating backup: {message}")
+
+        stdout_file, stderr_file = self._rotate_backup_output()
+        return_code = self._stream_command(
+            self._backup_command(backup_type),
+            stdout_file,
+            stderr_file,
+            progress_callback=report_progress,
+        )
+        error_message = self._process_backup_result(
+            return_code,
+            stdout_file,
+            stderr_file,
+            s3_parameters,
+            datetime_backup_requested,
+            backup_type,
+        )
+        if error_message:
+            logger.error(f"Backup failed: {error_message}")
+            event.fail(error_message)
+        else:
+            event.set_results({"backup-status": "backup created"})
+
+    def _rotate_backup_output(self) -> tuple[str, str]:
+        """Returns the files for the output of a new backup, keeping the previous ones.
+
+        Returns:
+            The paths of the stdout and stderr files.
+        """
+        output_path = Path(BACKUP_OUTPUT_PATH)
+        output_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        output_files = []
+        for stream in ["stdout", "stderr"]:
+            # backup.stdout becomes backup.stdout.1, backup.stdout.1 becomes backup.stdout.2...
+            for index in range(BACKUP_OUTPUTS_TO_KEEP - 1, 0, -1):
+                suffix = f".{index - 1}" if index > 1 else ""
+                if (previous_file := output_path / f"backup.{stream}{suffix}").exists():
+                    previous_file.replace(output_path / f"backup.{stream}.{index}")
+            output_files.append(str(output_path / f"backup.{stream}"))
+        return output_files[0], output_files[1]
+
+    @staticmethod
+    def _read_output_tail(output_file: str) -> str:
+        """Returns the last lines of a command output file."""
+        try:
+            return tail_file(output_file, BACKUP_OUTPUT_TAIL_LINES)
+        except OSError:
+            return ""
+
+    def _process_backup_result(
+        self,
+        return_code: int,
+        stdout_file: str,
+        stderr_file: str,
+        s3_parameters: dict,
+        datetime_backup_requested: str,
+        backup_type: str,
+    ) -> str | None:
+        """Uploads the backup logs to S3.
+
+        The output of the backup command is read from its files: only its last lines are
+        loaded in memory, and the logs are streamed to S3.
+
+        Returns:
+            The error message if the backup failed, None otherwise.
+        """
+        # The backup (and the expiration of old backups that pgBackRest runs after it)
+        # changed the repository contents.
+        self.catalog.invalidate()
         if return_code != 0:
+            stdout = self._read_output_tail(stdout_file)
+            stderr = self._read_output_tail(stderr_file)
             logger.error(stderr)
 
             # Recover the backup id from the logs.
-            backup_label_stdout_line = re.findall(
-                r"(new backup label = )([0-9]{8}[-][0-9]{6}[F])$", stdout, re.MULTILINE
-            )
-            if len(backup_label_stdout_line) > 0:
-                backup_id = backup_label_stdout_line[0][1]
+            try:
+                backup_label = search_file_backwards(stdout_file, BACKUP_LABEL_PATTERN)
+            except OSError:
+                backup_label = None
+            if backup_label is not None:
+                backup_id = backup_label.group(1)
             else:
                 # Generate a backup id from the current date and time if the backup failed before
                 # generating the backup label (our backup id).
                 backup_id = self._generate_fake_backup_id(backup_type)
 
-            # Upload the logs to S3.
-            logs = f"""Stdout:
-{stdout}
+            # Upload the logs to S3.
+            self._upload_backup_logs(
+                stdout_file,
+                stderr_file,
+                f"backup/{self.stanza_name}/{backup_id}/backup.log",
+                s3_parameters,
+            )
+            extracted_error = self._extract_error_message(stdout, stderr)
+            return f"Failed to backup PostgreSQL with error: {extracted_error}"
+
+        try:
+            backup_id = list(self._list_backups(show_failed=True, include_local=True).keys())[-1]
+        except ListBackupsError:
+            error_message = "Failed to retrieve backup id"
+            logger.exception(error_message)
+            return error_message
+
+        if summary := self._backup_summary():
+            logger.info(summary)
+
+        # Upload the logs to S3 and fail the action if it doesn't succeed.
+        if not self._upload_backup_logs(
+            stdout_file,
+            stderr_file,
+            f"backup/{self.stanza_name}/{backup_id}/backup.log",
+            s3_parameters,
+            summary,
+        ):
+            return "Error uploading logs to S3"
+
+        logger.info(f"Backup succeeded: with backup-id {datetime_backup_requested}")
+        return None
+
+    def _backup_summary(self) -> str | None:
+        """Returns the size, duration and throughput of the last backup in the repository."""
+        try:
+            backup = self.catalog.info()[0]["backup"][-1]
+            size = backup["info"]["size"]
+            duration = backup["timestamp"]["stop"] - backup["timestamp"]["start"]
+        except (ListBackupsError, ValueError, KeyError, IndexError, TypeError):
+            logger.debug("Failed to retrieve the last backup information for the summary")
+            return None
+        return (
+            f"Backup {backup['label']}: {format_size(size)} in {format_duration(duration)}"
+            f" ({format_throughput(size, duration)})"
+        )
+
+    def _backup_progress_message(self, started_at: float) -> str | None:
+        """Returns the progress of the backup running for the stanza, if any."""
+        try:
+            return_code, output, _ = self._execute_command(
+                [
+                    PGBACKREST_EXECUTABLE,
+                    PGBACKREST_CONFIGURATION_FILE,
+                    f"--stanza={self.stanza_name}",
+                    "info",
+                    "--output=json",
+                ],
+                timeout=PROGRESS_REPORT_INTERVAL,
+            )
+            if return_code != 0:
+                return None
+            progress = backup_progress(json.loads(output), self.stanza_name)
+        except (TimeoutExpired, ValueError):
+            return None
+        if progress is None:
+            return None
+        copied_size, total_size = progress
+        return format_progress(copied_size / total_size, time.time() - started_at, total_size)
+
+    def background_backup_status_message(self) -> str:
+        """Returns the unit status message for a backup running in the background."""
+        for job in self.charm.background_jobs.running(BACKUP_JOB_TYPE):
+            if "started-at" not in job:
+                continue
+            started_at = (
+                datetime
+                .strptime(job["started-at"], BACKUP_ID_FORMAT)
+                .replace(tzinfo=timezone.utc)
+                .timestamp()
+            )
+            if message := self._backup_progress_message(started_at):
+                return f"creating backup: {message}"
+        return "creating backup"
+
+    def restore_status_message(self) -> str | None:
+        """Returns the unit status message for a restore run by Patroni, if it's running."""
+        restore_stanza = self.charm.app_peer_data.get("restore-stanza")
+        if not restore_stanza:
+            return None
+        progress = restore_progress(f"{PGBACKREST_LOGS_PATH}/{restore_stanza}-restore.log")
+        if progress is None:
+            return None
+        fraction, elapsed = progress
+
+        # The backup size gives the restored bytes and the throughput.
+        total_size = None
+        if restoring_backup := self.charm.app_peer_data.get("restoring-backup"):
+            try:
+                total_size = next(
+                    (
+                        backup["info"]["size"]
+                        for stanza in self.catalog.info()
+                        for backup in stanza.get("backup", [])
+                        if backup["label"] == restoring_backup
+                    ),
+                    None,
+                )
+            except (ListBackupsError, ValueError, KeyError):
+                logger.debug("Failed to retrieve the size of the backup being restored")
+        return f"restoring backup: {format_progress(fraction, elapsed, total_size)}"
+
+    @property
+    def is_backup_running_in_background(self) -> bool:
+        """Returns whether this unit is creating a backup in a background job."""
+        return len(self.charm.background_jobs.running(BACKUP_JOB_TYPE)) > 0
+
+    def _postgresql_executable(self, name: str) -> str:
+        """Returns the path of a PostgreSQL client program of the snap."""
+        version = self.charm._patroni.get_postgresql_version().split(".")[0]
+        return f"/snap/charmed-postgresql/current/usr/lib/postgresql/{version}/bin/{name}"
+
+    def _analyze_command(self, skip_databases: list[str]) -> list[str] | None:
+        """Returns the command that analyzes the databases in stages, or None if none is left.
+
+        vacuumdb can't exclude databases from --all, so when some are skipped the stages are
+        run one by one (as vacuumdb does) over all the other databases. A database that fails
+        doesn't stop the others: it's reported in the output and the command fails at the end.
+        """
+        command = [
+            self._postgresql_executable("vacuumdb"),
+            "--host=/tmp",
+            f"--username={BACKUP_USER}",
+            f"--jobs={self.charm.cpu_count}",
+        ]
+        if not skip_databases:
+            return [*command, "--analyze-in-stages", "--all"]
+
+        return_code, stdout, stderr = self._execute_command([
+            self._postgresql_executable("psql"),
+            "--host=/tmp",
+            f"--username={BACKUP_USER}",
+            "--dbname=postgres",
+            "--tuples-only",
+            "--no-align",
+            f"--command={ANALYZE_DATABASES_QUERY}",
+        ])
+        if return_code != 0:
+            raise Exception(stderr)
+        databases = [
+            database for database in stdout.splitlines() if database not in skip_databases
+        ]
+        if not databases:
+            return None
+        script = ["status=0"]
+        for stage, options in ANALYZE_STAGE_OPTIONS.items():
+            for database in databases:
+                analyze = shlex.join([*command, "--analyze-only", f"--dbname={database}"])
+                if options:
+                    analyze = f"PGOPTIONS={shlex.quote(options)} {analyze}"
+                # Same progress message as vacuumdb --analyze-in-stages.
+                processing = (
+                    f'vacuumdb: processing database "{database}":'
+                    f" Generating {stage} optimizer statistics"
+                )
+                failed = f'vacuumdb: failed to analyze database "{database}" (stage {stage})'
+                script.extend([
+                    f"echo {shlex.quote(processing)}",
+                    f"{analyze} || {{ echo {shlex.quote(failed)}; status=1; }}",
+                ])
+        script.append('exit "$status"')
+        return ["/bin/sh", "-c", "\n".join(script)]
+
+    def start_post_restore_analyze(self, skip_databases: list[str]) -> None:
+        """Refresh the planner statistics of the restored databases in a background job.
+
+        The statistics are generated in stages (with 1, then 10 targets, then the configured
+        default), so the queries get usable plans long before the full statistics are ready.
+        """
+        try:
+            command = self._analyze_command(skip_databases)
+        except Exception as e:
+            logger.error(f"Failed to list the databases to analyze: {e!s}")
+            return
+        if command is None:
+            logger.info("All the restored databases are skipped, not analyzing them")
+            return
+        job_id = self.charm.background_jobs.start(
+            ANALYZE_JOB_TYPE, command, {"skip-databases": skip_databases}
+        )
+        logger.info(f"Analyzing the restored databases in background job {job_id}")
+        self.charm.unit.status = MaintenanceStatus(self.analyze_status_message())
+
+    @property
+    def is_analyze_running(self) -> bool:
+        """Returns whether this unit is analyzing the restored databases."""
+        return len(self.charm.background_jobs.running(ANALYZE_JOB_TYPE)) > 0
+
+    def analyze_status_message(self) -> str:
+        """Returns the unit status message while the restored databases are analyzed."""
+        for job in self.charm.background_jobs.running(ANALYZE_JOB_TYPE):
+            stdout, _ = self.charm.background_jobs.read_output(job)
+            if not (stages := list(ANALYZE_STAGE_PATTERN.finditer(stdout))):
+                continue
+            stage = stages[-1]
+            return (
+                "analyzing restored databases: stage"
+                f" {ANALYZE_STAGES.index(stage['stage']) + 1}/{len(ANALYZE_STAGES)}"
+                f" ({stage['database']})"
+            )
+        return "analyzing restored databases"
+
+    def _on_background_job_completed(self, _) -> None:  # noqa: C901
+        """Handles the background jobs (backups, verifications, restores...) that finished.
 
-Stderr:
-{stderr}
-"""
-            self._upload_content_to_s3(
-                logs,
-                f"backup/{self.stanza_name}/{backup_id}/backup.log",
-                s3_parameters,
-            )
-            extracted_error = self._extract_error_message(stdout, stderr)
-            error_message = f"Failed to backup PostgreSQL with error: {extracted_error}"
-            logger.error(f"Backup failed: {error_message}")
-            event.fail(error_message)
-        else:
-            try:
-                backup_id = list(self._list_backups(show_failed=True).keys())[-1]
-            except ListBackupsError:
-                error_message = "Failed to retrieve backup id"
-                logger.exception(error_message)
-                logger.error(f"Backup failed: {error_message}")
-                event.fail(error_message)
-                return
+        The logs of the backups are uploaded and the unit state is restored, and the results
+        of the verifications and of the restores of the replicas are recorded.
+        """
+        for job in self.charm.background_jobs.completed(STANZA_JOB_TYPE):
+            self._process_stanza_initialisation_result(job)
+            self.charm.background_jobs.mark_processed(job)
+            # The leader publishes the result right away when it's also the primary.
+            self.coordinate_stanza_fields()
+
+        for job in self.charm.background_jobs.completed(VERIFY_JOB_TYPE):
+            self._process_verification_result(job)
+            self.charm.background_jobs.mark_processed(job)
+            self.charm.verification_metrics.update()
+
+        for job in self.charm.background_jobs.completed(ANALYZE_JOB_TYPE):
+            if job["state"] == JOB_STATE_LOST or job.get("return-code") != 0:
+                stdout, stderr = self.charm.background_jobs.read_output(job)
+                if failed_databases := list(
+                    dict.fromkeys(
+                        failure["database"] for failure in ANALYZE_FAILURE_PATTERN.finditer(stdout)
+                    )
+                ):
+                    logger.error(
+                        f"Failed to analyze the restored databases {', '.join(failed_databases)}"
+                        f" in job {job['id']}: {stderr.strip()}"
+                    )
+                else:
+                    logger.error(
+                        f"Failed to analyze the restored databases in job {job['id']}:"
+                        f" {stderr.strip()}"
+                    )
+            else:
+                logger.info(f"Analyzed the restored databases in job {job['id']}")
+            self.charm.background_jobs.mark_processed(job)
+            self.charm._set_primary_status_message()
 
-            # Upload the logs to S3 and fail the action if it doesn't succeed.
-            logs = f"""Stdout:
-{stdout}
+        for job in self.charm.background_jobs.completed(RESTORE_JOB_TYPE):
+            self._process_standby_restore_result(job)
+            self.charm.background_jobs.mark_processed(job)
+            # Switch to the restored data right away if the primary is already restored.
+            self.coordinate_restore_fan_out()
 
-Stderr:
-{stderr}
-"""
-            if not self._upload_content_to_s3(
-                logs,
-                f"backup/{self.stanza_name}/{backup_id}/backup.log",
+        for job in self.charm.background_jobs.completed(BACKUP_JOB_TYPE):
+            return_code = job.get("return-code")
+            if job["state"] == JOB_STATE_LOST or return_code is None:
+                return_code = -1
+                try:
+                    with open(job["stderr-file"], "a") as stderr:
+                        stderr.write("\nThe backup process was interrupted before finishing.")
+                except OSError:
+                    logger.warning(f"Failed to record the interruption of backup job {job['id']}")
+            metadata = job["metadata"]
+            s3_parameters, _ = self._retrieve_s3_parameters()
+            error_message = self._process_backup_result(
+                return_code,
+                job["stdout-file"],
+                job["stderr-file"],
                 s3_parameters,
-            ):
-                error_message = "Error uploading logs to S3"
-                logger.error(f"Backup failed: {error_message}")
-                event.fail(error_message)
+                metadata["datetime-backup-requested"],
+                metadata["backup-type"],
+            )
+            if error_message:
+                logger.error(f"Backup job {job['id']} failed: {error_message}")
             else:
-                logger.info(f"Backup succeeded: with backup-id {datetime_backup_requested}")
-                event.set_results({"backup-status": "backup created"})
+                logger.info(f"Backup job {job['id']} finished")
+
+            self.charm.background_jobs.mark_processed(job)
+            self.charm.unit_peer_data.pop("backup-job", None)
+            if metadata.get("restore-connectivity"):
+                # Remove the rule that marks the cluster as in a creating backup state
+                # and update the Patroni configuration.
+                self._change_connectivity_to_database(connectivity=True)
+
+            self.charm.update_config(is_creating_backup=False)
+            self.charm.unit.status = ActiveStatus()
+            # The new backup may be recent enough to restore the new replicas from.
+            self.refresh_replica_bootstrap()
+
+    def _running_backup_jobs(self) -> list[tuple]:
+        """Returns the backups being created in the background by the cluster units."""
+        running_jobs = []
+        if self.charm._peers is None:
+            return running_jobs
+        for unit in [self.charm.unit, *self.charm._peers.units]:
+            if not (backup_job := self.charm._peers.data[unit].get("backup-job")):
+                continue
+            backup_job = json.loads(backup_job)
+            running_jobs.append((
+                backup_job["started-at"],
+                f"{backup_job['backup-type']} backup",
+                "running",
+                "None",
+                "n/a",
+                backup_job["started-at"],
+                "n/a",
+                "",
+                "n/a",
+                f"{unit.name} (job {backup_job['job-id']})",
+            ))
+        return running_jobs
 
     def _on_list_backups_action(self, event) -> None:
         """List the previously created backups."""
@@ -1104,6 +2435,65 @@ Stderr:
             logger.exception(e)
             event.fail(f"Failed to list PostgreSQL backups with error: {e!s}")
 
+    def _on_benchmark_compression_action(self, event: ActionEvent) -> None:
+        """Compress a sample of the data directory with each compression setting."""
+        sample_size = event.params.get("sample-size", 64) * MB
+        types = event.params.get("types", ",".join(COMPRESS_TOOLS)).split(",")
+        if unknown_types := [
+            compress_type for compress_type in types if compress_type not in COMPRESS_TOOLS
+        ]:
+            event.fail(f"Unknown compression types: {', '.join(unknown_types)}")
+            return
+
+        configured_levels = {}
+        for type_option, level_option in [
+            ("backup_compress_type", "backup_compress_level"),
+            ("backup_archive_push_compress_type", "backup_archive_push_compress_level"),
+        ]:
+            compress_type = getattr(self.charm.config, type_option)
+            if compress_type in COMPRESS_TOOLS:
+                level = self._pgbackrest_compress_level(getattr(self.charm.config, level_option))
+                configured_levels.setdefault(compress_type, set()).add(
+                    DEFAULT_COMPRESS_LEVELS[compress_type] if level is None else level
+                )
+
+        results = {}
+        with tempfile.TemporaryFile() as sample:
+            try:
+                sample_size = write_sample(POSTGRESQL_DATA_PATH, sample_size, sample)
+            except OSError as e:
+                event.fail(f"Failed to read a sample of the data directory: {e!s}")
+                return
+            if not sample_size:
+                event.fail("There is no data to benchmark in the data directory")
+                return
+
+            for compress_type in types:
+                if not is_available(compress_type):
+                    results[compress_type] = "unavailable"
+                    continue
+                levels = set(BENCHMARK_LEVELS[compress_type]) | configured_levels.get(
+                    compress_type, set()
+                )
+                for level in sorted(levels):
+                    key = (
+                        f"{compress_type}-fast-{-level}"
+                        if level < 0
+                        else f"{compress_type}-{level}"
+                    )
+                    event.log(f"Benchmarking {key}")
+                    try:
+                        results[key] = run_benchmark(
+                            self._throttle_command(compress_command(compress_type, level)),
+                            sample,
+                            sample_size,
+                        )
+                    except OSError as e:
+                        logger.warning(f"Failed to benchmark {key}: {e!s}")
+                        results[key] = "failed"
+
+        event.set_results({"sample-size": format_size(sample_size), "results": results})
+
     def _on_restore_action(self, event):  # noqa: C901
         """Request that pgBackRest restores a backup."""
         if not self._pre_restore_checks(event):
@@ -1111,19 +2501,47 @@ Stderr:
 
         backup_id = event.params.get("backup-id")
         restore_to_time = event.params.get("restore-to-time")
+        # There is nothing to reuse without a data directory.
+        delta = event.params.get("delta", False) and Path(POSTGRESQL_DATA_PATH).is_dir()
+        # The other units restore the backup in parallel with this one.
+        fan_out_units = (
+            sorted(unit.name for unit in self.charm._peers.units if unit != self.charm.unit)
+            if event.params.get("cluster-wide", False)
+            else []
+        )
+        analyze_skip_databases = [
+            database.strip()
+            for database in event.params.get("analyze-skip-databases", "").split(",")
+            if database.strip()
+        ]
         logger.info(
-            f"A restore with backup-id {backup_id}"
+            f"A {'delta ' if delta else ''}restore with backup-id {backup_id}"
             f"{f' to time point {restore_to_time}' if restore_to_time else ''}"
-            f" has been requested on the unit"
+            f" has been requested on the {'cluster' if fan_out_units else 'unit'}"
         )
 
         # Validate the provided backup id and restore to time.
         logger.info("Validating provided backup-id and restore-to-time")
         try:
-            backups = self._list_backups(show_failed=False)
+            # The backups in the local repository of this unit can only be restored here, so
+            # they're not offered when the other units restore the backup too.
+            backups = self._list_backups(show_failed=False, include_local=not fan_out_units)
             timelines = self._list_timelines()
             is_backup_id_real = backup_id and backup_id in backups
             is_backup_id_timeline = backup_id and not is_backup_id_real and backup_id in timelines
+            if (
+                fan_out_units
+                and backup_id
+                and not is_backup_id_real
+                and backup_id in self._list_backups(show_failed=False, include_local=True)
+            ):
+                error_message = (
+                    f"Backup {backup_id} is in the local repository of this unit, which the"
+                    " other units can't restore from"
+                )
+                logger.error(f"Restore failed: {error_message}")
+                event.fail(error_message)
+                return
             if backup_id and not is_backup_id_real and not is_backup_id_timeline:
                 error_message = f"Invalid backup-id: {backup_id}"
                 logger.error(f"Restore failed: {error_message}")
@@ -1158,6 +2576,38 @@ Stderr:
                 logger.info(
                     f"Chosen timeline {restore_stanza_timeline[1]} as nearest for the specified timestamp {restore_to_time}"
                 )
+            if restore_to_time and restore_to_time != "latest":
+                archived_until = self._wal_archived_until()
+                if archived_until is None or (
+                    self._parse_psql_timestamp(restore_to_time) > archived_until
+                ):
+                    error_message = (
+                        f"The WAL needed to restore to {restore_to_time} is not archived yet"
+                        f"{f' (archived up to {archived_until.strftime(BACKUP_ID_FORMAT)})' if archived_until else ''}"
+                    )
+                    logger.error(f"Restore failed: {error_message}")
+                    event.fail(error_message)
+                    return
+            # The replicas can only read the S3 repository: they restore the requested backup
+            # or the last S3 backup before the target, which this unit may restore from its
+            # local repository instead (pgBackRest looks for the backup set there first).
+            restore_set = None
+            if fan_out_units:
+                restore_set = (
+                    self._fetch_backup_from_id(backup_id)
+                    if is_backup_id_real
+                    else self._last_backup_before(
+                        restore_to_time,
+                        restore_stanza_timeline[1] if is_backup_id_timeline else None,
+                    )
+                )
+                if restore_set is None:
+                    error_message = (
+                        f"There is no backup before {restore_to_time} to restore the replicas from"
+                    )
+                    logger.error(f"Restore failed: {error_message}")
+                    event.fail(error_message)
+                    return
         except ListBackupsError as e:
             logger.exception(e)
             error_message = "Failed to retrieve backups list"
@@ -1186,28 +2636,86 @@ Stderr:
             self._restart_database()
             return
 
-        logger.info("Removing the contents of the data directory")
-        if not self._empty_data_files():
-            error_message = "Failed to remove contents of the data directory"
-            logger.error(f"Restore failed: {error_message}")
-            event.fail(error_message)
-            self._restart_database()
-            return
+        if delta:
+            logger.info("Keeping the contents of the data directory for a delta restore")
+            if not self._keep_data_files_for_delta_restore():
+                error_message = "Failed to move the data directory aside for a delta restore"
+                logger.error(f"Restore failed: {error_message}")
+                event.fail(error_message)
+                self._restart_database()
+                return
+        else:
+            logger.info("Removing the contents of the data directory")
+            if not self._empty_data_files():
+                error_message = "Failed to remove contents of the data directory"
+                logger.error(f"Restore failed: {error_message}")
+                event.fail(error_message)
+                self._restart_database()
+                return
 
         # Mark the cluster as in a restoring backup state and update the Patroni configuration.
         logger.info("Configuring Patroni to restore the backup")
+        restoring_backup = (
+            self._fetch_backup_from_id(backup_id, include_local=not fan_out_units)
+            if is_backup_id_real
+            else None
+        )
+        # Restore the requested backup from the repository that holds it, when there are several.
+        restore_repository = (
+            self._backup_repository(restoring_backup)
+            if restoring_backup and self.local_repository_path
+            else None
+        )
         self.charm.app_peer_data.update({
-            "restoring-backup": self._fetch_backup_from_id(backup_id) if is_backup_id_real else "",
+            "restoring-backup": restoring_backup or "",
+            "restore-repository": str(restore_repository) if restore_repository else "",
             "restore-stanza": restore_stanza_timeline[0],
             "restore-timeline": restore_stanza_timeline[1] if restore_to_time else "",
             "restore-to-time": restore_to_time or "",
+            "restore-delta": "True" if delta else "",
+            "restore-analyze": (
+                json.dumps(analyze_skip_databases) if event.params.get("analyze", False) else ""
+            ),
+            "restore-fan-out": json.dumps({
+                "request": time.asctime(time.gmtime()),
+                "deadline": int(time.time()) + RESTORE_FAN_OUT_START_TIMEOUT,
+                "units": fan_out_units,
+                "set": restore_set,
+                "stanza": restore_stanza_timeline[0],
+            })
+            if fan_out_units
+            else "",
             "s3-initialization-block-message": "",
         })
         self.charm.update_config()
 
+        if fan_out_units:
+            # The cluster is bootstrapped once no replica can take it over with the old data.
+            logger.info(f"Waiting for {', '.join(fan_out_units)} to start restoring the backup")
+            self.charm.unit.status = MaintenanceStatus(
+                "waiting for the replicas to start restoring"
+            )
+            event.set_results({"restore-status": "restore started on all the units"})
+            return
+
+        if error_message := self._start_restored_cluster():
+            logger.error(f"Restore failed: {error_message}")
+            event.fail(error_message)
+            return
+
+        event.set_results({"restore-status": "restore started"})
+
+    def _start_restored_cluster(self) -> str | None:
+        """Starts Patroni to restore the backup and removes the previous cluster information.
+
+        Returns:
+            the error message if the previous cluster information couldn't be removed.
+        """
         # Start the database to start the restore process.
         logger.info("Configuring Patroni to restore the backup")
         self.charm._patroni.start_patroni()
+        # The restore creates a new timeline in the repository.
+        self.catalog.invalidate()
 
         # Remove previous cluster information to make it possible to initialise a new cluster.
         logger.info("Removing previous cluster information")
@@ -1224,18 +2732,306 @@ Stderr:
         )
         if return_code != 0:
             extracted_error = self._extract_error_message(stdout, stderr)
-            error_message = (
-                f"Failed to remove previous cluster information with error: {extracted_error}"
+            return f"Failed to remove previous cluster information with error: {extracted_error}"
+        return None
+
+    def _last_backup_before(self, timestamp: str, timeline: str | None = None) -> str | None:
+        """Returns the label of the last S3 backup finished before a restore target.
+
+        It's the backup set that pgBackRest selects when restoring to that target, on the
+        requested timeline if there is one.
+        """
+        repository_info = next(iter(self.catalog.info()), None)
+        if repository_info is None:
+            return None
+        backups = [
+            backup
+            for backup in repository_info["backup"]
+            if not backup["error"]
+            and self._in_s3_repository(backup)
+            and (
+                timeline is None
+                or (
+                    backup["archive"]
+                    and (backup["archive"]["start"] or "")[:8].lstrip("0") == timeline
+                )
             )
-            logger.error(f"Restore failed: {error_message}")
-            event.fail(error_message)
+        ]
+        if timestamp != "latest":
+            target = self._parse_psql_timestamp(timestamp)
+            backups = [
+                backup
+                for backup in backups
+                if datetime.fromtimestamp(backup["timestamp"]["stop"], timezone.utc).replace(
+                    tzinfo=None
+                )
+                <= target
+            ]
+        return backups[-1]["label"] if backups else None
+
+    def _restore_fan_out(self) -> dict | None:
+        """Returns the cluster-wide restore requested by the leader, if any."""
+        if self.charm._peers is None:
+            return None
+        try:
+            return json.loads(self.charm.app_peer_data.get("restore-fan-out") or "null")
+        except json.JSONDecodeError:
+            return None
+
+    def _restore_fan_out_state(self, request: str, unit_data=None) -> str | None:
+        """Returns the state of a unit in a cluster-wide restore (by default this unit)."""
+        unit_data = self.charm.unit_peer_data if unit_data is None else unit_data
+        try:
+            record = json.loads(unit_data.get("restore-fan-out") or "{}")
+        except json.JSONDecodeError:
+            return None
+        return record.get("state") if record.get("request") == request else None
+
+    def _record_restore_fan_out_state(self, request: str, state: str) -> None:
+        self.charm.unit_peer_data.update({
+            "restore-fan-out": json.dumps({"request": request, "state": state})
+        })
+
+    @property
+    def is_restore_fan_out_pending(self) -> bool:
+        """Returns whether this replica didn't switch to the restored data yet.
+
+        Patroni mustn't promote it meanwhile, as it would take over the cluster with the old data.
+        """
+        fan_out = self._restore_fan_out()
+        if fan_out is None or self.charm.unit.name not in fan_out["units"]:
+            return False
+        return self._restore_fan_out_state(fan_out["request"]) != RESTORE_FAN_OUT_STATE_DONE
+
+    def coordinate_restore_fan_out(self) -> bool:
+        """Moves this unit forward in the cluster-wide restore requested by the leader.
+
+        The replicas restore the backup set as standbys next to their running database, which
+        keeps the raft quorum but can't be promoted anymore. Then the leader bootstraps the
+        restored cluster, and the replicas switch to the restored data once it's done, only
+        replaying the WAL of the new primary. The replicas that didn't start restoring by the
+        deadline of the request are cloned from the new primary instead.
+
+        Returns:
+            whether this unit is restoring, so the hook must not manage the database.
+        """
+        if (fan_out := self._restore_fan_out()) is None:
+            return False
+        request = fan_out["request"]
+
+        if self.charm.unit.is_leader():
+            return self._coordinate_restore_fan_out_leader(fan_out)
+
+        if self.charm.unit.name not in fan_out["units"]:
+            return False
+        state = self._restore_fan_out_state(request)
+        if state == RESTORE_FAN_OUT_STATE_DONE:
+            return False
+        if state is None and time.time() > fan_out["deadline"]:
+            # The leader is bootstrapping the restored cluster without waiting for this unit.
+            logger.warning("Too late to restore the backup, the new primary will be cloned")
+            self._record_restore_fan_out_state(request, RESTORE_FAN_OUT_STATE_FAILED)
+        elif state is None:
+            self._start_standby_restore(fan_out)
+        elif state == RESTORE_FAN_OUT_STATE_RESTORING:
+            self.charm.unit.status = MaintenanceStatus(
+                self.restore_status_message() or "restoring backup"
+            )
+        elif self.charm.is_cluster_restoring_backup or self.charm.is_cluster_restoring_to_time:
+            self.charm.unit.status = MaintenanceStatus(
+                "waiting for the primary to restore the backup"
+            )
+        else:
+            self._switch_to_restored_data(request, state == RESTORE_FAN_OUT_STATE_RESTORED)
+        return True
+
+    def _coordinate_restore_fan_out_leader(self, fan_out: dict) -> bool:
+        request = fan_out["request"]
+        # The units removed meanwhile don't hold the restore.
+        peers = {unit.name: unit for unit in self.charm._peers.units}
+        states = {
+            unit_name: self._restore_fan_out_state(
+                request, self.charm._peers.data[peers[unit_name]]
+            )
+            for unit_name in fan_out["units"]
+            if unit_name in peers
+        }
+
+        if self._restore_fan_out_state(request) is None:
+            # The units that are offline or in error don't hold the restore past the deadline.
+            if silent_units := [name for name, state in states.items() if state is None]:
+                if time.time() <= fan_out["deadline"]:
+                    self.charm.unit.status = MaintenanceStatus(
+                        "waiting for the replicas to start restoring"
+                    )
+                    return True
+                logger.warning(
+                    f"{', '.join(silent_units)} didn't start restoring the backup in time,"
+                    " they will be cloned from the new primary"
+                )
+            self._record_restore_fan_out_state(request, RESTORE_FAN_OUT_STATE_BOOTSTRAPPING)
+            if error_message := self._start_restored_cluster():
+                logger.error(f"Restore failed: {error_message}")
+                self.charm.unit.status = BlockedStatus("Failed to restore backup")
+            return False
+
+        if all(state == RESTORE_FAN_OUT_STATE_DONE for state in states.values()):
+            logger.info("All the units switched to the restored data")
+            self.charm.app_peer_data.update({"restore-fan-out": ""})
+        return False
+
+    def _standby_restore_command(self) -> list[str]:
+        fan_out = self._restore_fan_out()
+        return [
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            f"--stanza={self.charm.app_peer_data.get('restore-stanza')}",
+            f"--pg1-path={POSTGRESQL_STANDBY_RESTORE_PATH}",
+            f"--set={fan_out['set']}",
+            # Follow the timeline of the new primary (the latest one) instead of promoting.
+            "--type=standby",
+            "restore",
+        ]
+
+    def _start_standby_restore(self, fan_out: dict) -> None:
+        """Restores the backup set of the new primary next to the running database."""
+        if self.charm.background_jobs.running(RESTORE_JOB_TYPE):
+            logger.debug("Waiting for the restore of a previous request to finish")
             return
 
-        event.set_results({"restore-status": "restore started"})
+        # Prevent Patroni from promoting this unit before publishing that it's restoring.
+        self.charm.update_config()
+        try:
+            if Path(POSTGRESQL_STANDBY_RESTORE_PATH).exists():
+                shutil.rmtree(POSTGRESQL_STANDBY_RESTORE_PATH)
+            # The backup is restored next to the running database, so both must fit.
+            try:
+                backup = self._backup_info(fan_out["set"])
+            except ListBackupsError as e:
+                logger.warning(f"Failed to read the size of the backup: {e!s}")
+                backup = None
+            free_space = shutil.disk_usage(Path(POSTGRESQL_STANDBY_RESTORE_PATH).parent).free
+            if backup is not None and free_space < backup["info"]["size"]:
+                logger.warning(
+                    f"Not enough free space to restore backup {fan_out['set']} next to the"
+                    f" database ({free_space} bytes free, {backup['info']['size']} needed),"
+                    " the new primary will be cloned"
+                )
+                self._record_restore_fan_out_state(
+                    fan_out["request"], RESTORE_FAN_OUT_STATE_FAILED
+                )
+                return
+            job_id = self.charm.background_jobs.start(
+                RESTORE_JOB_TYPE, self._standby_restore_command(), {"request": fan_out["request"]}
+            )
+        except OSError as e:
+            logger.error(f"Failed to start the restore of the backup: {e!s}")
+            self._record_restore_fan_out_state(fan_out["request"], RESTORE_FAN_OUT_STATE_FAILED)
+            return
+        self._record_restore_fan_out_state(fan_out["request"], RESTORE_FAN_OUT_STATE_RESTORING)
+        logger.info(f"Restoring backup {fan_out['set']} in background job {job_id}")
+        self.charm.unit.status = MaintenanceStatus("restoring backup")
+
+    def _process_standby_restore_result(self, job: dict) -> None:
+        fan_out = self._restore_fan_out()
+        if fan_out is None or job["metadata"]["request"] != fan_out["request"]:
+            logger.info(f"Ignoring the restore of a previous request in job {job['id']}")
+            return
+
+        if job["state"] == JOB_STATE_LOST or job.get("return-code") != 0:
+            _, stderr = self.charm.background_jobs.read_output(job)
+            logger.error(
+                f"Failed to restore the backup in job {job['id']}, the unit will be cloned"
+                f" from the new primary: {stderr.strip()}"
+            )
+            self._record_restore_fan_out_state(fan_out["request"], RESTORE_FAN_OUT_STATE_FAILED)
+            return
+
+        logger.info(f"Restored backup {fan_out['set']} in job {job['id']}")
+        self._record_restore_fan_out_state(fan_out["request"], RESTORE_FAN_OUT_STATE_RESTORED)
+
+    def _is_new_timeline_archived(self) -> bool:
+        """Returns whether the history file of the new primary's timeline is archived.
+
+        The restored data follows the latest timeline in the archive. Started before the
+        history file of the new timeline is archived, it replays the old timeline past the
+        branch point and can't follow the new primary anymore.
+        """
+        try:
+            timeline = next(
+                (
+                    member.get("timeline")
+                    for member in self.charm._patroni.cluster_status()
+                    if member["role"] == "leader"
+                ),
+                None,
+            )
+        except RetryError:
+            timeline = None
+        if not timeline:
+            logger.debug("Waiting for the timeline of the new primary")
+            return False
+
+        fan_out = self._restore_fan_out() or {}
+        stanza = fan_out.get("stanza") or self.stanza_name
+        history_file = f"{int(timeline):08X}.history"
+        # The new timeline was created after the last listing.
+        self.catalog.invalidate()
+        try:
+            history_files = self.catalog.timelines()
+        except ListBackupsError as e:
+            logger.warning(f"Failed to list the archived timelines: {e!s}")
+            return False
+        if not any(
+            path.startswith(f"{stanza}/") and path.endswith(f"/{history_file}")
+            for path in history_files
+        ):
+            logger.info(
+                f"Waiting for {history_file} to be archived to switch to the restored data"
+            )
+            return False
+        return True
+
+    def _switch_to_restored_data(self, request: str, restored: bool) -> None:
+        """Replaces the data directory with the restored one and starts the database.
+
+        Without a restored data directory, Patroni clones the replica from the new primary.
+        """
+        if restored and not self._is_new_timeline_archived():
+            self.charm.unit.status = MaintenanceStatus(
+                "waiting for the new timeline to be archived"
+            )
+            return
+
+        self.charm.unit.status = MaintenanceStatus("switching to the restored data")
+        if not self.charm._patroni.stop_patroni():
+            logger.error("Failed to stop the database service to switch to the restored data")
+            return
+
+        if not self._empty_data_files():
+            self.charm._patroni.start_patroni()
+            return
+        try:
+            if restored:
+                os.rename(POSTGRESQL_STANDBY_RESTORE_PATH, POSTGRESQL_DATA_PATH)
+            elif Path(POSTGRESQL_STANDBY_RESTORE_PATH).exists():
+                shutil.rmtree(POSTGRESQL_STANDBY_RESTORE_PATH)
+        except OSError as e:
+            logger.warning(f"Failed to switch to the restored data, cloning the primary: {e!s}")
+
+        self._record_restore_fan_out_state(request, RESTORE_FAN_OUT_STATE_DONE)
+        # Allow Patroni to promote this unit again.
+        self.charm.update_config()
+        self.charm._patroni.start_patroni()
+        logger.info(
+            "Switched to the restored data"
+            if restored
+            else "Cloning the new primary instead of restoring the backup"
+        )
 
     def _generate_fake_backup_id(self, backup_type: str) -> str:
         """Creates a backup id for failed backup operations (to store log file)."""
-        if backup_type == "full":
+        if backup_type in ["full", LOCAL_BACKUP_TYPE]:
             return datetime.strftime(datetime.now(), "%Y%m%d-%H%M%SF")
         if backup_type == "differential":
             backups = list(self._list_backups(show_failed=False, parse=False).keys())
@@ -1255,16 +3051,32 @@ Stderr:
             return f"{backups[-1]}_{datetime.strftime(datetime.now(), '%Y%m%d-%H%M%SI')}"
         raise TypeError(f"Invalid backup type: {backup_type}")
 
-    def _fetch_backup_from_id(self, backup_id: str) -> str | None:
+    def _fetch_backup_from_id(self, backup_id: str, include_local: bool = False) -> str | None:
         """Fetches backup's pgbackrest label from backup id."""
         timestamp = f"{datetime.strftime(datetime.strptime(backup_id, '%Y-%m-%dT%H:%M:%SZ'), '%Y%m%d-%H%M%S')}"
-        backups = self._list_backups(show_failed=False, parse=False).keys()
+        backups = self._list_backups(
+            show_failed=False, parse=False, include_local=include_local
+        ).keys()
         for label in backups:
             if timestamp in label:
                 return label
 
         return None
 
+    def _backup_info(self, label: str) -> dict | None:
+        """Returns the backup listed by `pgbackrest info` with the given label, if any."""
+        repository_info = next(iter(self.catalog.info()), None)
+        for backup in (repository_info or {}).get("backup") or []:
+            if backup["label"] == label:
+                return backup
+        return None
+
+    def _backup_repository(self, label: str) -> int | None:
+        """Returns the index of the repository that holds a backup, if it's listed."""
+        if (backup := self._backup_info(label)) is None:
+            return None
+        return backup.get("database", {}).get("repo-key", 1)
+
     def _pre_restore_checks(self, event: ActionEvent) -> bool:
         """Run some checks before starting the restore.
 
@@ -1311,9 +3123,10 @@ Stderr:
             return False
 
         logger.info("Checking that the cluster does not have more than one unit")
-        if self.charm.app.planned_units() > 1:
+        if self.charm.app.planned_units() > 1 and not event.params.get("cluster-wide", False):
             error_message = (
                 "Unit cannot restore backup as there are more than one unit in the cluster"
+                " (use cluster-wide=true to restore it on all the units)"
             )
             logger.error(f"Restore failed: {error_message}")
             event.fail(error_message)
@@ -1328,6 +3141,74 @@ Stderr:
 
         return True
 
+    def _pgbackrest_process_max(self, value: str | int, limit: int | None = None) -> int:
+        """Returns the number of pgBackRest processes for a process-max config option.
+
+        Args:
+            value: the config option value ("auto" or a number of processes).
+            limit: maximum number of processes for the "auto" value.
+        """
+        if value != "auto":
+            return int(value)
+        process_max = max(self.charm.cpu_count - PGBACKREST_CPU_HEADROOM, 1)
+        return min(process_max, limit) if limit else process_max
+
+    @staticmethod
+    def _pgbackrest_compress_level(value: str | int) -> int | None:
+        """Returns the configured compression level, or None for the pgBackRest default."""
+        return None if value == "auto" else int(value)
+
+    def _on_local_backups_storage_attached(self, _) -> None:
+        """Adds the local repository to the pgBackRest configuration."""
+        self.update_pgbackrest_conf_file()
+        self.initialise_local_repository()
+
+    def _on_local_backups_storage_detaching(self, _) -> None:
+        """Removes the local repository from the pgBackRest configuration."""
+        self._local_repository_detaching = True
+        self.charm.unit_peer_data.pop("local-repository-stanza", None)
+        self.update_pgbackrest_conf_file()
+
+    def initialise_local_repository(self) -> None:
+        """Creates the stanza in the local repository, if it doesn't exist yet.
+
+        The primary pushes the WAL to all the repositories, so every unit creates the stanza
+        as soon as it has the storage, for it to exist already after a failover. It's created
+        offline, from the data directory, as the unit may be a replica.
+        """
+        if (
+            self.local_repository_path is None
+            or self.charm._peers is None
+            or self.charm.app_peer_data.get("stanza") != self.stanza_name
+            or self.charm.unit_peer_data.get("local-repository-stanza") == self.stanza_name
+        ):
+            return
+
+        return_code, stdout, stderr = self._execute_command([
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            f"--stanza={self.stanza_name}",
+            "--repo=1",
+            "--no-online",
+            "stanza-create",
+        ])
+        if return_code != 0:
+            logger.warning(
+                "Failed to create the stanza in the local repository:"
+                f" {self._extract_error_message(stdout, stderr)}"
+            )
+            return
+        self.charm.unit_peer_data["local-repository-stanza"] = self.stanza_name
+        logger.info(f"Created the stanza in the local repository {self.local_repository_path}")
+        # Archive the WAL to the local repository too from now on.
+        self.update_pgbackrest_conf_file()
+
+    def update_pgbackrest_conf_file(self) -> None:
+        """Updates the pgBackRest configuration after a change of the config options or storage."""
+        are_backup_settings_ok, _ = self._are_backup_settings_ok()
+        if are_backup_settings_ok:
+            self._render_pgbackrest_conf_file()
+
     def _render_pgbackrest_conf_file(self) -> bool:
         # Open the template pgbackrest.conf file.
         s3_parameters, missing_parameters = self._retrieve_s3_parameters()
@@ -1342,6 +3223,12 @@ Stderr:
                 self._tls_ca_chain_filename, "\n".join(s3_parameters["tls-ca-chain"]), 0o644
             )
 
+        if self.charm.config.backup_archive_async:
+            self.charm._patroni._create_directory(PGBACKREST_SPOOL_PATH, 0o750)
+
+        if self.local_repository_path:
+            self.charm._patroni._create_directory(self.local_repository_path, 0o750)
+
         with open("templates/pgbackrest.conf.j2") as file:
             template = Template(file.read())
         # Render the template file with the correct values.
@@ -1362,7 +3249,30 @@ Stderr:
             storage_path=self.charm._storage_path,
             user=BACKUP_USER,
             retention_full=s3_parameters["delete-older-than-days"],
-            process_max=max(self.charm.cpu_count - 2, 1),
+            process_max=self._pgbackrest_process_max("auto"),
+            backup_process_max=self._pgbackrest_process_max(self.charm.config.backup_process_max),
+            archive_push_process_max=self._pgbackrest_process_max(
+                self.charm.config.backup_archive_push_process_max, PGBACKREST_ARCHIVE_PROCESS_MAX
+            ),
+            archive_get_process_max=self._pgbackrest_process_max(
+                self.charm.config.backup_archive_get_process_max, PGBACKREST_ARCHIVE_PROCESS_MAX
+            ),
+            archive_async=self.charm.config.backup_archive_async,
+            archive_push_queue_max=self.charm.config.backup_archive_push_queue_max,
+            spool_path=PGBACKREST_SPOOL_PATH,
+            compress_type=self.charm.config.backup_compress_type,
+            compress_level=self._pgbackrest_compress_level(
+                self.charm.config.backup_compress_level
+            ),
+            archive_push_compress_type=self.charm.config.backup_archive_push_compress_type,
+            archive_push_compress_level=self._pgbackrest_compress_level(
+                self.charm.config.backup_archive_push_compress_level
+            ),
+            s3_repo=self._s3_repository,
+            local_repository_path=self.local_repository_path,
+            local_repository_initialised=self.charm.unit_peer_data.get("local-repository-stanza")
+            == self.stanza_name,
+            local_retention_full=self.charm.config.backup_local_retention_full,
         )
         # Render pgBackRest config file.
         self.charm._patroni.render_file(f"{PGBACKREST_CONF_PATH}/pgbackrest.conf", rendered, 0o640)
@@ -1473,6 +3383,36 @@ Stderr:
                 The following are expected keys in the dictionary: bucket, region,
                 endpoint, access-key and secret-key
 
+        Returns:
+            a boolean indicating success.
+        """
+        with BytesIO(content.encode("utf-8")) as buf:
+            return self._upload_stream_to_s3(buf, s3_path, s3_parameters)
+
+    def _upload_backup_logs(
+        self,
+        stdout_file: str,
+        stderr_file: str,
+        s3_path: str,
+        s3_parameters: dict,
+        summary: str | None = None,
+    ) -> bool:
+        """Uploads the output of a backup command (and its summary) to S3 as a single log.
+
+        Returns:
+            a boolean indicating success.
+        """
+        parts = [b"Stdout:\n", Path(stdout_file), b"\n\nStderr:\n", Path(stderr_file), b"\n"]
+        if summary:
+            parts.append(f"\nSummary:\n{summary}\n".encode())
+        with concatenate_files(parts) as stream:
+            return self._upload_stream_to_s3(stream, s3_path, s3_parameters)
+
+    def _upload_stream_to_s3(self, stream: BinaryIO, s3_path: str, s3_parameters: dict) -> bool:
+        """Uploads a stream to the S3 bucket relative to the path from the S3 config.
+
+        Large streams are uploaded in parts, so only a part at a time is held in memory.
+
         Returns:
             a boolean indicating success.
         """
@@ -1482,11 +3422,7 @@ Stderr:
             logger.info(f"Uploading content to bucket={bucket_name}, path={processed_s3_path}")
             s3 = self._get_s3_session_resource(s3_parameters)
             bucket = s3.Bucket(bucket_name)
-
-            with tempfile.NamedTemporaryFile() as temp_file:
-                temp_file.write(content.encode("utf-8"))
-                temp_file.flush()
-                bucket.upload_file(temp_file.name, processed_s3_path)
+            bucket.upload_fileobj(stream, processed_s3_path)
         except Exception as e:
             logger.exception(
                 f"Failed to upload content to S3 bucket={bucket_name}, path={processed_s3_path}",
@@ -1538,30 +3474,15 @@ Stderr:
 
         return None
 
-    def _s3_initialization_set_failure(
-        self, block_message: str, update_leader_status: bool = True
-    ):
-        """Sets failed s3 initialization status with corresponding block_message in the app_peer_data (leader) or unit_peer_data (primary).
+    def _s3_initialization_set_failure(self, block_message: str, request: str | None = None):
+        """Publishes a failed stanza initialisation with the corresponding block message.
 
         Args:
             block_message: s3 initialization block message
-            update_leader_status: whether to update leader status (with s3-initialization-block-message set already)
-                immediately; defaults to True
+            request: the initialisation request that failed; defaults to the pending one
         """
-        if self.charm.unit.is_leader():
-            # If performed on the leader, then leader == primary and there is no need to sync s3 data between two
-            # different units. Therefore, there is no need for s3-initialization-done key, and it is sufficient to clear
-            # s3-initialization-start key only.
-            self.charm.app_peer_data.update({
-                "s3-initialization-block-message": block_message,
-                "s3-initialization-start": "",
-                "stanza": "",
-            })
-            if update_leader_status:
-                self.charm._set_primary_status_message()
-        else:
-            self.charm.unit_peer_data.update({
-                "s3-initialization-block-message": block_message,
-                "s3-initialization-done": "True",
-                "stanza": "",
-            })
+        if request is None:
+            request = self.charm.app_peer_data.get("s3-initialization-start", "")
+        self._record_stanza_initialisation(request, STANZA_STATE_DONE, block_message=block_message)
+        # The leader publishes the failure right away when it's also the primary.
+        self.coordinate_stanza_fields()
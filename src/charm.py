@@ -8,7 +8,6 @@ import json
 import logging
 import os
 import platform
-import re
 import subprocess
 import sys
 import time
@@ -48,6 +47,7 @@ from ops.charm import (
     SecretRemoveEvent,
     StartEvent,
 )
+from ops.framework import EventSource
 from ops.model import (
     ActiveStatus,
     BlockedStatus,
@@ -62,7 +62,9 @@ from ops.model import (
 from ops_tracing import Tracing, set_destination
 from tenacity import RetryError, Retrying, retry, stop_after_attempt, stop_after_delay, wait_fixed
 
-from backups import CANNOT_RESTORE_PITR, S3_BLOCK_MESSAGES, PostgreSQLBackups
+from background_jobs import BackgroundJobCompletedEvent, BackgroundJobs
+from backup_scheduler import BackupScheduler, ScheduledBackupEvent
+from backups import CANNOT_RESTORE_PITR, PostgreSQLBackups
 from cluster import (
     NotReadyError,
     Patroni,
@@ -78,6 +80,7 @@ from config import CharmConfig
 from constants import (
     APP_SCOPE,
     BACKUP_USER,
+    BACKUP_VERIFICATION_METRICS_PORT,
     DATABASE_DEFAULT_NAME,
     DATABASE_PORT,
     METRICS_PORT,
@@ -122,9 +125,12 @@ from relations.async_replication import (
 from relations.db import EXTENSIONS_BLOCKING_MESSAGE, DbProvides
 from relations.postgresql_provider import PostgreSQLProvider
 from relations.tls_transfer import TLSTransfer
+from resources import get_effective_cpu_count, get_effective_memory
 from rotate_logs import RotateLogs
+from tuning import PARAMETER_CONFIG_OPTIONS, compute_tuning
 from upgrade import PostgreSQLUpgrade, get_postgresql_dependencies_model
 from utils import new_password, snap_refreshed
+from verification_metrics import VerificationMetrics
 
 logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -136,6 +142,8 @@ logging.getLogger("botocore").setLevel(logging.WARNING)
 PRIMARY_NOT_REACHABLE_MESSAGE = "waiting for primary to be reachable from this unit"
 EXTENSIONS_DEPENDENCY_MESSAGE = "Unsatisfied plugin dependencies. Please check the logs"
 EXTENSION_OBJECT_MESSAGE = "Cannot disable plugins: Existing objects depend on it. See logs"
+# Logged by Patroni when it starts restoring a backup (a custom bootstrap method).
+PATRONI_BOOTSTRAP_START_PATTERN = r"Running custom bootstrap script"
 
 Scopes = Literal["app", "unit"]
 PASSWORD_USERS = [*SYSTEM_USERS, "patroni"]
@@ -149,6 +157,13 @@ class StorageUnavailableError(Exception):
     """Cannot find storage mountpoint."""
 
 
+class PostgresqlOperatorCharmEvents(ClusterTopologyChangeCharmEvents):
+    """A CharmEvents extension with the events dispatched by the charm background processes."""
+
+    background_job_completed = EventSource(BackgroundJobCompletedEvent)
+    scheduled_backup = EventSource(ScheduledBackupEvent)
+
+
 def charm_tracing_config(endpoint_requirer: COSAgentProvider) -> None:
     """Utility function to set tracing destination."""
     if not endpoint_requirer.is_ready():
@@ -177,7 +192,7 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
     """Charmed Operator for the PostgreSQL database."""
 
     config_type = CharmConfig
-    on = ClusterTopologyChangeCharmEvents()
+    on = PostgresqlOperatorCharmEvents()
 
     def __init__(self, *args):
         super().__init__(*args)
@@ -210,6 +225,9 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         )
         self._observer = ClusterTopologyObserver(self, run_cmd)
         self._rotate_logs = RotateLogs(self)
+        self.background_jobs = BackgroundJobs(self, run_cmd)
+        self.backup_scheduler = BackupScheduler(self, run_cmd)
+        self.verification_metrics = VerificationMetrics(self)
         self.framework.observe(self.on.cluster_topology_change, self._on_cluster_topology_change)
         self.framework.observe(self.on.databases_change, self._on_databases_change)
         self.framework.observe(self.on.install, self._on_install)
@@ -221,6 +239,7 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         self.framework.observe(self.on[PEER].relation_departed, self._on_peer_relation_departed)
         self.framework.observe(self.on.start, self._on_start)
         self.framework.observe(self.on.get_password_action, self._on_get_password)
+        self.framework.observe(self.on.get_tuning_action, self._on_get_tuning)
         self.framework.observe(self.on.set_password_action, self._on_set_password)
         self.framework.observe(self.on.promote_to_primary_action, self._on_promote_to_primary)
         self.framework.observe(self.on.update_status, self._on_update_status)
@@ -255,6 +274,7 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
             metrics_endpoints=[
                 {"path": "/metrics", "port": METRICS_PORT},
                 {"path": "/metrics", "port": PGBACKREST_METRICS_PORT},
+                {"path": "/metrics", "port": BACKUP_VERIFICATION_METRICS_PORT},
             ],
             scrape_configs=self.patroni_scrape_config,
             refresh_events=[
@@ -494,6 +514,24 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         except RetryError as e:
             logger.error(f"failed to get primary with error {e}")
 
+    def _on_get_tuning(self, event: ActionEvent) -> None:
+        """Show the PostgreSQL parameters computed for the workload profile."""
+        if self.config.profile != "production" or self.config.profile_workload == "none":
+            event.fail(
+                "Workload profile tuning is only enabled with profile=production and"
+                " profile_workload set to one of oltp, olap or mixed"
+            )
+            return
+
+        tuning = self._calculate_tuning_parameters(self._build_postgresql_parameters())
+        event.set_results({
+            "workload": self.config.profile_workload,
+            "storage-type": self.config.profile_storage_type,
+            "parameters": {
+                parameter.replace("_", "-"): dict(tuned) for parameter, tuned in tuning.items()
+            },
+        })
+
     def updated_synchronous_node_count(self) -> bool:
         """Tries to update synchronous_node_count configuration and reports the result."""
         try:
@@ -765,6 +803,10 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
             logger.debug("on_peer_relation_changed early exit: Unit in blocked status")
             return
 
+        if self.backup.coordinate_restore_fan_out():
+            logger.debug("on_peer_relation_changed early exit: Cluster-wide restore in progress")
+            return
+
         if (
             self.is_cluster_restoring_backup or self.is_cluster_restoring_to_time
         ) and not self._was_restore_successful():
@@ -785,23 +827,8 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
 
         self._start_stop_pgbackrest_service(event)
 
-        # This is intended to be executed only when leader is reinitializing S3 connection due to the leader change.
-        if (
-            "s3-initialization-start" in self.app_peer_data
-            and "s3-initialization-done" not in self.unit_peer_data
-            and self.is_primary
-            and not self.backup._on_s3_credential_changed_primary(event)
-        ):
-            return
-
-        # Clean-up unit initialization data after successful sync to the leader.
-        if "s3-initialization-done" in self.app_peer_data and not self.unit.is_leader():
-            self.unit_peer_data.update({
-                "stanza": "",
-                "s3-initialization-block-message": "",
-                "s3-initialization-done": "",
-                "s3-initialization-start": "",
-            })
+        # Start the scheduled backup the leader assigned to this unit, if any.
+        self.backup_scheduler.start_claimed_backup()
 
         self._update_new_unit_status()
 
@@ -1241,6 +1268,11 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         if self.is_blocked and "Configuration Error" in self.unit.status.message:
             self.unit.status = ActiveStatus()
 
+        # Apply the pgBackRest parallelism settings.
+        self.backup.update_pgbackrest_conf_file()
+        # Reschedule the backups, in case their schedules changed.
+        self.backup_scheduler.start_scheduler()
+
         # Update the sync-standby endpoint in the async replication data.
         self.async_replication.update_async_replication_data()
 
@@ -1475,7 +1507,7 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         ldap_bind_password = ldap_params["ldapbindpasswd"]
         ldap_group_mappings = self.postgresql.build_postgresql_group_map(self.config.ldap_map)
 
-        postgres_snap.set({
+        ldap_sync_settings = {
             "ldap-sync.ldap_host": ldap_host,
             "ldap-sync.ldap_port": ldap_port,
             "ldap-sync.ldap_base_dn": ldap_base_dn,
@@ -1488,10 +1520,25 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
             "ldap-sync.postgres_database": DATABASE_DEFAULT_NAME,
             "ldap-sync.postgres_username": USER,
             "ldap-sync.postgres_password": self._get_password(),
-        })
+        }
+
+        # Restarting the service triggers a full re-sync of every group and user from the
+        # directory, so only do it when the settings it runs with actually changed.
+        settings_hash = shake_128(
+            json.dumps(ldap_sync_settings, sort_keys=True).encode()
+        ).hexdigest(16)
+        if (
+            postgres_snap.services["ldap-sync"]["active"]
+            and self.unit_peer_data.get("ldap-sync-settings-hash") == settings_hash
+        ):
+            logger.debug("LDAP sync settings unchanged, keeping the running service")
+            return
+
+        postgres_snap.set(ldap_sync_settings)
 
         logger.debug("Starting LDAP sync service")
         postgres_snap.restart(services=["ldap-sync"])
+        self.unit_peer_data.update({"ldap-sync-settings-hash": settings_hash})
 
     def _start_primary(self, event: StartEvent) -> None:
         """Bootstrap the cluster."""
@@ -1706,6 +1753,9 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         if not self._can_run_on_update_status():
             return
 
+        if self.backup.coordinate_restore_fan_out():
+            return
+
         if (
             self.is_cluster_restoring_backup or self.is_cluster_restoring_to_time
         ) and not self._was_restore_successful():
@@ -1725,12 +1775,27 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         # Update the sync-standby endpoint in the async replication data.
         self.async_replication.update_async_replication_data()
 
-        self.backup.coordinate_stanza_fields()
+        self.backup.coordinate_stanza_fields(retry_timed_out=True)
+        self.backup.refresh_replica_bootstrap()
+        self.backup.publish_load_average()
 
-        self._set_primary_status_message()
+        if self.backup.is_backup_running_in_background:
+            self.unit.status = MaintenanceStatus(self.backup.background_backup_status_message())
+        elif self.backup.is_analyze_running:
+            self.unit.status = MaintenanceStatus(self.backup.analyze_status_message())
+        else:
+            self._set_primary_status_message()
 
         # Restart topology observer if it is gone
         self._observer.start_observer()
+        # Restart the timer of the next scheduled backup if it is gone.
+        self.backup_scheduler.start_scheduler()
+        # Start the scheduled backup the leader assigned to this unit, if it was missed.
+        self.backup_scheduler.start_claimed_backup()
+        # Refresh the verification metrics, in case another unit verified the repository since.
+        self.verification_metrics.update()
+        # Create the stanza in the local repository, if it couldn't be created yet.
+        self.backup.initialise_local_repository()
 
     def _was_restore_successful(self) -> bool:
         if self.is_cluster_restoring_to_time and all(self.is_pitr_failed()):
@@ -1749,11 +1814,14 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
 
         if not self._patroni.member_started:
             logger.debug("Restore check early exit: Patroni has not started yet")
+            if restore_status_message := self.backup.restore_status_message():
+                self.unit.status = MaintenanceStatus(restore_status_message)
             return False
 
         restoring_backup = self.app_peer_data.get("restoring-backup")
         restore_timeline = self.app_peer_data.get("restore-timeline")
         restore_to_time = self.app_peer_data.get("restore-to-time")
+        restore_analyze = self.app_peer_data.get("restore-analyze")
         try:
             current_timeline = self.postgresql.get_current_timeline()
         except PostgreSQLGetCurrentTimelineError:
@@ -1766,6 +1834,9 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
             "restore-stanza": "",
             "restore-to-time": "",
             "restore-timeline": "",
+            "restore-repository": "",
+            "restore-delta": "",
+            "restore-analyze": "",
         })
         self.update_config()
         self.restore_patroni_restart_condition()
@@ -1778,15 +1849,20 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
             f". Currently tracking the newly created timeline {current_timeline}."
         )
 
+        # The restored cluster switched to a new timeline in the repository.
+        self.backup.catalog.invalidate()
+        self.backup.catalog.invalidate_timeline_switches()
         can_use_s3_repository, validation_message = self.backup.can_use_s3_repository()
         if not can_use_s3_repository:
             self.app_peer_data.update({
                 "stanza": "",
                 "s3-initialization-start": "",
-                "s3-initialization-done": "",
                 "s3-initialization-block-message": validation_message,
             })
 
+        if restore_analyze:
+            self.backup.start_post_restore_analyze(json.loads(restore_analyze))
+
         return True
 
     def _can_run_on_update_status(self) -> bool:
@@ -1801,7 +1877,7 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
             logger.debug("Early exit on_update_status: upgrade in progress")
             return False
 
-        if self.is_blocked and self.unit.status not in S3_BLOCK_MESSAGES:
+        if self.is_blocked and not self.backup.is_s3_block_message(self.unit.status.message):
             # If charm was failing to disable plugin, try again (user may have removed the objects)
             if self.unit.status.message == EXTENSION_OBJECT_MESSAGE:
                 self.enable_disable_extensions()
@@ -1838,6 +1914,9 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
                     self.app_peer_data["s3-initialization-block-message"]
                 )
                 return
+            if block_message := self.backup.stanza_initialisation_timed_out_message:
+                self.unit.status = BlockedStatus(block_message)
+                return
             if (
                 self._patroni.get_primary(unit_name_pattern=True) == self.unit.name
                 or self.is_standby_leader
@@ -2052,10 +2131,8 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
 
     @cached_property
     def cpu_count(self) -> int:
-        """Property with numbers of cpus."""
-        if cpus := os.cpu_count():
-            return cpus
-        return 0
+        """Property with numbers of cpus available to the unit (cgroup limits included)."""
+        return get_effective_cpu_count()
 
     @property
     def _can_connect_to_postgresql(self) -> bool:
@@ -2197,13 +2274,56 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
 
         return result
 
+    def _calculate_max_connections(self) -> int:
+        """Return max_connections from the config value if set, calculate it otherwise."""
+        if self.config.experimental_max_connections:
+            return self.config.experimental_max_connections
+        return max(4 * (self.cpu_count or 1), 100)
+
+    def _calculate_tuning_parameters(
+        self, pg_parameters: dict[str, str] | None
+    ) -> dict[str, dict[str, str]]:
+        """Calculate the PostgreSQL parameters for the configured workload profile.
+
+        Args:
+            pg_parameters: parameters built from the charm config, used to get the
+                shared_buffers size.
+
+        Returns:
+            Dictionary with the value, the reason and the source ("tuning" or "config") of
+            each parameter. Parameters explicitly set through their own config option keep
+            the config value.
+        """
+        if self.config.profile != "production" or self.config.profile_workload == "none":
+            return {}
+
+        available_memory = self.get_available_memory()
+        if self.config.profile_limit_memory:
+            available_memory = min(available_memory, self.config.profile_limit_memory * 10**6)
+        # shared_buffers is expressed in 8kB pages (PostgreSQL's default is 128MB).
+        shared_buffers = int((pg_parameters or {}).get("shared_buffers", 16384)) * 8 * 1024
+
+        tuning = {}
+        for parameter, tuned in compute_tuning(
+            self.config.profile_workload,
+            self.config.profile_storage_type,
+            available_memory,
+            shared_buffers,
+            self._calculate_max_connections(),
+        ).items():
+            option = PARAMETER_CONFIG_OPTIONS.get(parameter)
+            if option is not None and self.model.config.get(option) is not None:
+                tuning[parameter] = {
+                    "value": str(self.model.config[option]),
+                    "reason": f"explicitly set through the {option} config option",
+                    "source": "config",
+                }
+            else:
+                tuning[parameter] = {**tuned, "source": "tuning"}
+        return tuning
+
     def _api_update_config(self) -> bool:
-        # Use config value if set, calculate otherwise
-        max_connections = (
-            self.config.experimental_max_connections
-            if self.config.experimental_max_connections
-            else max(4 * (os.cpu_count() or 1), 100)
-        )
+        max_connections = self._calculate_max_connections()
 
         # Build parameters for Patroni API update (restart-required parameters)
         cfg_patch = {
@@ -2258,6 +2378,13 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         else:
             pg_parameters = worker_config
 
+        # Add the parameters tuned for the workload profile (if enabled).
+        pg_parameters.update({
+            parameter: tuned["value"]
+            for parameter, tuned in self._calculate_tuning_parameters(pg_parameters).items()
+            if tuned["source"] == "tuning"
+        })
+
         # Add WAL compression configuration
         if self.config.cpu_wal_compression is not None:
             if pg_parameters is None:
@@ -2276,14 +2403,20 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         # Update and reload configuration based on TLS files availability.
         self._patroni.render_patroni_yml_file(
             connectivity=self.is_connectivity_enabled,
-            is_creating_backup=is_creating_backup,
+            # Keep the flag while a backup is being created in the background.
+            is_creating_backup=is_creating_backup or self.backup.is_backup_running_in_background,
+            # Keep the replicas restoring a backup from taking over the cluster with the old data.
+            no_failover=self.backup.is_restore_fan_out_pending,
             enable_ldap=self.is_ldap_enabled,
             enable_tls=enable_tls,
             backup_id=self.app_peer_data.get("restoring-backup"),
+            restore_repository=self.app_peer_data.get("restore-repository"),
             pitr_target=self.app_peer_data.get("restore-to-time"),
             restore_timeline=self.app_peer_data.get("restore-timeline"),
             restore_to_latest=self.app_peer_data.get("restore-to-time", None) == "latest",
-            stanza=self.app_peer_data.get("stanza", self.unit_peer_data.get("stanza")),
+            delta_restore=self.app_peer_data.get("restore-delta") == "True",
+            replica_bootstrap_from_repository=self.backup.replica_bootstrap_from_repository,
+            stanza=self.backup.configured_stanza,
             restore_stanza=self.app_peer_data.get("restore-stanza"),
             parameters=pg_parameters,
             no_peers=no_peers,
@@ -2414,13 +2547,8 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
         self.legacy_db_admin_relation.update_endpoints()
 
     def get_available_memory(self) -> int:
-        """Returns the system available memory in bytes."""
-        with open("/proc/meminfo") as meminfo:
-            for line in meminfo:
-                if "MemTotal" in line:
-                    return int(line.split()[1]) * 1024
-
-        return 0
+        """Returns the memory available to the unit in bytes (cgroup limits included)."""
+        return get_effective_memory()
 
     @property
     def client_relations(self) -> list[Relation]:
@@ -2597,38 +2725,34 @@ class PostgresqlOperatorCharm(TypedCharmBase[CharmConfig]):
                 - Is patroni service failed to bootstrap cluster.
                 - Is it new fail, that wasn't observed previously.
         """
-        patroni_exceptions = []
+        patroni_exception = None
         count = 0
-        while len(patroni_exceptions) == 0 and count < 10:
+        while patroni_exception is None and count < 10:
             if count > 0:
                 time.sleep(3)
-            patroni_logs = self._patroni.patroni_logs(num_lines="all")
-            patroni_exceptions = re.findall(
+            # Only the failures of the last bootstrap attempt count.
+            patroni_exception = self._patroni.search_patroni_logs(
                 r"^([0-9-:TZ]+).*patroni\.exceptions\.PatroniFatalException: Failed to bootstrap cluster$",
-                patroni_logs,
-                re.MULTILINE,
+                stop_pattern=PATRONI_BOOTSTRAP_START_PATTERN,
             )
             count += 1
 
-        if len(patroni_exceptions) > 0:
+        if patroni_exception is not None:
             logger.debug("Failures to bootstrap cluster detected on Patroni service logs")
             old_pitr_fail_id = self.unit_peer_data.get("last_pitr_fail_id", None)
-            self.unit_peer_data["last_pitr_fail_id"] = patroni_exceptions[-1]
-            return True, patroni_exceptions[-1] != old_pitr_fail_id
+            self.unit_peer_data["last_pitr_fail_id"] = patroni_exception.group(1)
+            return True, patroni_exception.group(1) != old_pitr_fail_id
 
         logger.debug("No failures detected on Patroni service logs")
         return False, False
 
     def log_pitr_last_transaction_time(self) -> None:
         """Log to user last completed transaction time acquired from postgresql logs."""
-        postgresql_logs = self._patroni.last_postgresql_logs()
-        log_time = re.findall(
-            r"last completed transaction was at log time (.*)$",
-            postgresql_logs,
-            re.MULTILINE,
+        log_time = self._patroni.search_postgresql_logs(
+            r"last completed transaction was at log time (.*)$"
         )
-        if len(log_time) > 0:
-            logger.info(f"Last completed transaction was at {log_time[-1]}")
+        if log_time is not None:
+            logger.info(f"Last completed transaction was at {log_time.group(1)}")
         else:
             logger.error("Can't tell last completed transaction time")
 
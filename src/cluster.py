@@ -4,7 +4,6 @@
 
 """Helper class used to manage cluster lifecycle."""
 
-import glob
 import json
 import logging
 import os
@@ -13,6 +12,7 @@ import re
 import shutil
 import subprocess
 from asyncio import as_completed, create_task, run, wait
+from collections.abc import Iterator
 from contextlib import suppress
 from functools import cached_property
 from pathlib import Path
@@ -46,10 +46,12 @@ from constants import (
     PATRONI_CONF_PATH,
     PATRONI_LOGS_PATH,
     PATRONI_SERVICE_DEFAULT_PATH,
+    PATRONI_SERVICE_NAME,
     PEER,
     PGBACKREST_CONFIGURATION_FILE,
     POSTGRESQL_CONF_PATH,
     POSTGRESQL_DATA_PATH,
+    POSTGRESQL_DELTA_RESTORE_PATH,
     POSTGRESQL_LOGS_PATH,
     POSTGRESQL_SNAP_NAME,
     RAFT_PARTNER_PREFIX,
@@ -58,7 +60,7 @@ from constants import (
     TLS_CA_FILE,
     USER,
 )
-from utils import label2name
+from utils import label2name, search_file_backwards, search_reversed_lines, tail_file
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +71,12 @@ RUNNING_STATES = [*STARTED_STATES, "starting"]
 
 PATRONI_TIMEOUT = 10
 
+# Number of log lines kept in memory when reading the service logs.
+POSTGRESQL_LOGS_TAIL_LINES = 1000
+
+# Number of users listed in a single pg_hba line, to keep the lines at a readable length.
+PG_HBA_MAX_USERS_PER_LINE = 100
+
 if TYPE_CHECKING:
     from charm import PostgresqlOperatorCharm
 
@@ -208,6 +216,31 @@ class Patroni:
 
         return " ".join(f"{key}={value}" for key, value in _dict.items())
 
+    @staticmethod
+    def _group_users_by_databases(
+        user_databases_map: dict[str, str] | None,
+    ) -> list[tuple[str, str]]:
+        """Collapse a user->databases map into compact pg_hba (databases, users) entries.
+
+        Users that can access exactly the same set of databases share a single pg_hba line
+        (with a comma separated list of users) instead of one line per user, so the file
+        stays small (and quick to parse and to match) with thousands of relation users.
+        """
+        users_by_databases = {}
+        for user, databases in (user_databases_map or {}).items():
+            key = ",".join(sorted(set(databases.split(","))))
+            users_by_databases.setdefault(key, []).append(user)
+
+        entries = []
+        for databases, users in sorted(users_by_databases.items()):
+            users = sorted(users)
+            for index in range(0, len(users), PG_HBA_MAX_USERS_PER_LINE):
+                entries.append((
+                    databases,
+                    ",".join(users[index : index + PG_HBA_MAX_USERS_PER_LINE]),
+                ))
+        return entries
+
     def bootstrap_cluster(self) -> bool:
         """Bootstrap a PostgreSQL cluster using Patroni."""
         # Render the configuration files and start the cluster.
@@ -648,15 +681,19 @@ class Patroni:
         self,
         connectivity: bool = False,
         is_creating_backup: bool = False,
+        no_failover: bool = False,
         enable_ldap: bool = False,
         enable_tls: bool = False,
         stanza: str | None = None,
         restore_stanza: str | None = None,
         disable_pgbackrest_archiving: bool = False,
         backup_id: str | None = None,
+        restore_repository: str | None = None,
         pitr_target: str | None = None,
         restore_timeline: str | None = None,
         restore_to_latest: bool = False,
+        delta_restore: bool = False,
+        replica_bootstrap_from_repository: bool = False,
         parameters: dict[str, str] | None = None,
         no_peers: bool = False,
         user_databases_map: dict[str, str] | None = None,
@@ -666,15 +703,21 @@ class Patroni:
         Args:
             connectivity: whether to allow external connections to the database.
             is_creating_backup: whether this unit is creating a backup.
+            no_failover: whether Patroni must not promote this unit.
             enable_ldap: whether to enable LDAP authentication.
             enable_tls: whether to enable TLS.
             stanza: name of the stanza created by pgBackRest.
             restore_stanza: name of the stanza used when restoring a backup.
             disable_pgbackrest_archiving: whether to force disable pgBackRest WAL archiving.
             backup_id: id of the backup that is being restored.
+            restore_repository: index of the pgBackRest repository holding that backup.
             pitr_target: point-in-time-recovery target for the restore.
             restore_timeline: timeline to restore from.
             restore_to_latest: restore all the WAL transaction logs from the stanza.
+            delta_restore: whether to restore over the data directory kept aside,
+                fetching only the files that changed.
+            replica_bootstrap_from_repository: whether to create replicas by restoring
+                the latest backup instead of cloning the primary.
             parameters: PostgreSQL parameters to be added to the postgresql.conf file.
             no_peers: Don't include peers.
             user_databases_map: map of databases to be accessible by each user.
@@ -690,6 +733,7 @@ class Patroni:
             conf_path=PATRONI_CONF_PATH,
             connectivity=connectivity,
             is_creating_backup=is_creating_backup,
+            no_failover=no_failover,
             log_path=PATRONI_LOGS_PATH,
             postgresql_log_path=POSTGRESQL_LOGS_PATH,
             data_path=POSTGRESQL_DATA_PATH,
@@ -712,10 +756,14 @@ class Patroni:
             and disable_pgbackrest_archiving is False,
             restoring_backup=backup_id is not None or pitr_target is not None,
             backup_id=backup_id,
+            restore_repository=restore_repository,
             pitr_target=pitr_target if not restore_to_latest else None,
             restore_timeline=restore_timeline,
             restore_to_latest=restore_to_latest,
+            delta_restore_path=POSTGRESQL_DELTA_RESTORE_PATH if delta_restore else None,
             stanza=stanza,
+            replica_bootstrap_from_repository=stanza is not None
+            and replica_bootstrap_from_repository,
             restore_stanza=restore_stanza,
             version=self.get_postgresql_version().split(".")[0],
             synchronous_node_count=self._synchronous_node_count,
@@ -726,7 +774,7 @@ class Patroni:
             raft_password=self.raft_password,
             ldap_parameters=self._dict_to_hba_string(ldap_params),
             patroni_password=self.patroni_password,
-            user_databases_map=user_databases_map,
+            hba_user_groups=self._group_users_by_databases(user_databases_map),
         )
         self.render_file(f"{PATRONI_CONF_PATH}/patroni.yaml", rendered, 0o600)
 
@@ -765,26 +813,111 @@ class Patroni:
             logger.exception(error_message, exc_info=e)
             return ""
 
-    def last_postgresql_logs(self) -> str:
-        """Get last log file content of Postgresql service.
+    def _reversed_patroni_logs(self) -> Iterator[str]:
+        """Yield the Patroni snap service log lines, from the last one to the first one."""
+        try:
+            process = subprocess.Popen(  # noqa: S603
+                [
+                    "/usr/bin/journalctl",
+                    f"--unit={PATRONI_SERVICE_NAME}",
+                    "--reverse",
+                    "--output=short-iso",
+                    "--no-pager",
+                    "--quiet",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+        except OSError as e:
+            logger.exception("Failed to read the patroni snap service logs", exc_info=e)
+            return
+        try:
+            for line in process.stdout:
+                yield line.rstrip("\n")
+        finally:
+            # The search usually stops long before the beginning of the journal.
+            process.kill()
+            process.wait()
+
+    def search_patroni_logs(
+        self, pattern: str | re.Pattern, stop_pattern: str | re.Pattern | None = None
+    ) -> re.Match | None:
+        """Find the last Patroni snap service log line that matches a pattern.
+
+        The journal is read from its end, without a limit on the number of lines, until a
+        matching line or a line matching stop_pattern (the start of the operation being
+        checked), so the cost doesn't grow with the age of the unit.
+
+        Args:
+            pattern: regular expression to search for in each log line.
+            stop_pattern: regular expression of the line before which no match is searched for.
+
+        Returns:
+            The match for the last matching log line, or None if no line matches.
+        """
+        lines = self._reversed_patroni_logs()
+        try:
+            return search_reversed_lines(lines, pattern, stop_pattern)
+        finally:
+            lines.close()
+
+    def _last_postgresql_log_file(self) -> str | None:
+        """Return the path of the most recently written log file of Postgresql service."""
+        try:
+            with os.scandir(POSTGRESQL_LOGS_PATH) as entries:
+                log_files = [
+                    (entry.stat().st_mtime, entry.path)
+                    for entry in entries
+                    if entry.name.endswith(".log") and entry.is_file()
+                ]
+        except OSError as e:
+            logger.exception("Failed to list postgresql log files", exc_info=e)
+            return None
+        if not log_files:
+            return None
+        return max(log_files)[1]
+
+    def last_postgresql_logs(self, num_lines: int = POSTGRESQL_LOGS_TAIL_LINES) -> str:
+        """Get the last lines of the last log file of Postgresql service.
 
         If there is no available log files, empty line will be returned.
 
+        Args:
+            num_lines: number of log last lines being returned.
+
         Returns:
-            Content of last log file of Postgresql service.
+            Last lines of the last log file of Postgresql service.
         """
-        log_files = glob.glob(f"{POSTGRESQL_LOGS_PATH}/*.log")
-        if len(log_files) == 0:
+        if (log_file := self._last_postgresql_log_file()) is None:
             return ""
-        log_files.sort(reverse=True)
         try:
-            with open(log_files[0]) as last_log_file:
-                return last_log_file.read()
+            return tail_file(log_file, num_lines)
         except OSError as e:
             error_message = "Failed to read last postgresql log file"
             logger.exception(error_message, exc_info=e)
             return ""
 
+    def search_postgresql_logs(self, pattern: str | re.Pattern) -> re.Match | None:
+        """Find the last line of the last log file of Postgresql service that matches a pattern.
+
+        The file is scanned backwards, so lines before the last match are never read.
+
+        Args:
+            pattern: regular expression to search for in each log line.
+
+        Returns:
+            The match for the last matching log line, or None if no line matches.
+        """
+        if (log_file := self._last_postgresql_log_file()) is None:
+            return None
+        try:
+            return search_file_backwards(log_file, pattern)
+        except OSError as e:
+            error_message = "Failed to read last postgresql log file"
+            logger.exception(error_message, exc_info=e)
+            return None
+
     def stop_patroni(self) -> bool:
         """Stop Patroni service using systemd.
 
@@ -0,0 +1,115 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark of the pgBackRest compression settings on a sample of the data directory.
+
+pgBackRest has no benchmark command, so the sample is compressed with the command line
+tools of each algorithm (gzip, lz4 and zstd), which use the same libraries and levels.
+"""
+
+import os
+import shutil
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from subprocess import PIPE, Popen
+from typing import BinaryIO
+
+from progress import MB, format_size
+
+# Command line tool of each pgBackRest compression type.
+COMPRESS_TOOLS = {"gz": "gzip", "lz4": "lz4", "zst": "zstd"}
+# Levels benchmarked for each compression type (besides the configured ones): the fastest,
+# the pgBackRest default and a strong one.
+BENCHMARK_LEVELS = {"gz": [1, 6, 9], "lz4": [1, 6, 12], "zst": [1, 3, 9, 19]}
+# pgBackRest compression level used when the config option is "auto".
+DEFAULT_COMPRESS_LEVELS = {"gz": 6, "lz4": 1, "zst": 3}
+# Bytes read from each relation file in turn, so the sample covers many relations.
+SAMPLE_CHUNK_SIZE = MB
+# Size of the reads of the compressed output.
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+
+def _relation_files(data_path: str) -> Iterator[Path]:
+    """Yields the relation files of the databases, largest first."""
+    files = []
+    for directory in ["base", "global"]:
+        for root, _, names in os.walk(Path(data_path) / directory):
+            for name in names:
+                path = Path(root) / name
+                try:
+                    files.append((path.stat().st_size, path))
+                except OSError:
+                    continue
+    yield from (path for size, path in sorted(files, reverse=True) if size > 0)
+
+
+def write_sample(data_path: str, sample_size: int, sample: BinaryIO) -> int:
+    """Copies up to sample_size bytes of the relation files to the sample file.
+
+    A chunk is taken from each file (largest first), then a second chunk from each, and so on,
+    so the sample has the mix of tables and indexes of the largest relations.
+
+    Returns:
+        The size of the sample.
+    """
+    files = list(_relation_files(data_path))
+    written = 0
+    offset = 0
+    while files and written < sample_size:
+        remaining_files = []
+        for path in files:
+            try:
+                with open(path, "rb") as relation_file:
+                    relation_file.seek(offset)
+                    chunk = relation_file.read(min(SAMPLE_CHUNK_SIZE, sample_size - written))
+            except OSError:
+                continue
+            if not chunk:
+                continue
+            sample.write(chunk)
+            written += len(chunk)
+            remaining_files.append(path)
+            if written >= sample_size:
+                break
+        files = remaining_files
+        offset += SAMPLE_CHUNK_SIZE
+    sample.flush()
+    return written
+
+
+def compress_command(compress_type: str, level: int) -> list[str]:
+    """Returns the command that compresses stdin to stdout like pgBackRest would."""
+    tool = COMPRESS_TOOLS[compress_type]
+    # Negative levels are the "fast" levels of lz4 and zstd.
+    level_option = f"--fast={-level}" if level < 0 else f"-{level}"
+    return [tool, level_option, "-c"]
+
+
+def is_available(compress_type: str) -> bool:
+    """Returns whether the tool of a compression type is installed."""
+    return shutil.which(COMPRESS_TOOLS[compress_type]) is not None
+
+
+def run_benchmark(command: list[str], sample: BinaryIO, sample_size: int) -> dict[str, str]:
+    """Compresses the sample with the command and reports the throughput and ratio.
+
+    Raises:
+        OSError: if the command fails.
+    """
+    sample.seek(0)
+    compressed_size = 0
+    started_at = time.monotonic()
+    # Input is generated by the charm
+    with Popen(command, stdin=sample, stdout=PIPE, stderr=PIPE) as process:  # noqa: S603
+        while chunk := process.stdout.read(OUTPUT_BUFFER_SIZE):
+            compressed_size += len(chunk)
+        stderr = process.stderr.read()
+    elapsed = max(time.monotonic() - started_at, 0.001)
+    if process.returncode != 0:
+        raise OSError(f"{command} failed: {stderr.decode(errors='replace').strip()}")
+    return {
+        "ratio": f"{sample_size / max(compressed_size, 1):.2f}",
+        "throughput": f"{sample_size / MB / elapsed:.1f}MB/s",
+        "compressed-size": format_size(compressed_size),
+    }
@@ -10,6 +10,8 @@ from typing import Annotated, Literal
 from charms.data_platform_libs.v0.data_models import BaseConfigModel
 from pydantic import Field, NonNegativeInt, PositiveInt, validator
 
+from backup_scheduler import CronSchedule
+from constants import PGBACKREST_COMPRESS_LEVELS
 from locales import SNAP_LOCALES
 
 logger = logging.getLogger(__name__)
@@ -43,6 +45,8 @@ GeqoSelectionBiasFloat = Annotated[float, Field(ge=1.5, le=2)]
 ParallelScanSizeInt = Annotated[int, Field(ge=0, le=715827882)]
 OldSnapshotThresholdInt = Annotated[int, Field(ge=-1, le=86400)]
 BgwriterLruMaxpagesInt = Annotated[int, Field(ge=0, le=1073741823)]
+CgroupWeightInt = Annotated[int, Field(ge=1, le=10000)]
+NiceInt = Annotated[int, Field(ge=0, le=19)]
 BgwriterLruMultiplierFloat = Annotated[float, Field(ge=0, le=10)]
 TrackActivityQuerySizeInt = Annotated[int, Field(ge=100, le=1048576)]
 GinPendingListLimitInt = Annotated[int, Field(ge=64, le=2147483647)]
@@ -64,6 +68,33 @@ class CharmConfig(BaseConfigModel):
 
     synchronous_node_count: Literal["all", "majority"] | PositiveInt
     synchronous_mode_strict: bool = Field(default=True)
+    backup_archive_async: bool = Field(default=True)
+    backup_archive_get_process_max: Literal["auto"] | PositiveInt
+    # The compression types come before their levels, whose validator checks them.
+    backup_archive_push_compress_type: Literal["zst", "lz4", "gz", "none"]
+    backup_archive_push_compress_level: Literal["auto"] | int
+    backup_archive_push_process_max: Literal["auto"] | PositiveInt
+    backup_archive_push_queue_max: PositiveInt | None
+    backup_auto_full_changed_ratio: UnitIntervalFloat = 0.5
+    backup_auto_full_max_age: PositiveInt = Field(default=7)
+    backup_auto_incremental_chain_max: PositiveInt = Field(default=6)
+    backup_cgroup_cpu_weight: CgroupWeightInt | None
+    backup_cgroup_io_weight: CgroupWeightInt | None
+    backup_compress_type: Literal["zst", "lz4", "gz", "none"]
+    backup_compress_level: Literal["auto"] | int
+    backup_ionice_class: Literal["none", "best-effort", "idle"]
+    backup_local_retention_full: PositiveInt = Field(default=1)
+    backup_nice: NiceInt
+    backup_process_max: Literal["auto"] | PositiveInt
+    backup_replica_bootstrap: bool = Field(default=False)
+    backup_replica_bootstrap_max_age: PositiveInt = Field(default=24)
+    backup_schedule_auto: str
+    backup_schedule_differential: str
+    backup_schedule_full: str
+    backup_schedule_incremental: str
+    backup_schedule_jitter: NonNegativeInt
+    backup_schedule_local: str
+    backup_schedule_verify: str
     connection_authentication_timeout: AuthTimeoutInt | None
     connection_statement_timeout: PgIntMax | None
     cpu_max_logical_replication_workers: Literal["auto"] | WorkerProcessInt | None
@@ -145,6 +176,8 @@ class CharmConfig(BaseConfigModel):
     optimizer_track_functions: Literal["none", "pl", "all"]
     profile: str
     profile_limit_memory: int | None
+    profile_storage_type: Literal["ssd", "hdd", "network"]
+    profile_workload: Literal["none", "oltp", "olap", "mixed"]
     plugin_address_standardizer_data_us_enable: bool
     plugin_address_standardizer_enable: bool
     plugin_audit_enable: bool
@@ -259,6 +292,36 @@ class CharmConfig(BaseConfigModel):
         """Return plugin config names in a iterable."""
         return filter(lambda x: x.startswith("plugin_"), cls.keys())
 
+    @validator(
+        "backup_schedule_auto",
+        "backup_schedule_differential",
+        "backup_schedule_full",
+        "backup_schedule_incremental",
+        "backup_schedule_local",
+        "backup_schedule_verify",
+    )
+    @classmethod
+    def backup_schedule_values(cls, value: str) -> str | None:
+        """Check the backup schedule config options are empty or cron expressions."""
+        if value:
+            CronSchedule(value)
+
+        return value
+
+    @validator("backup_archive_push_compress_level", "backup_compress_level")
+    @classmethod
+    def backup_compress_level_values(cls, value: str | int, values: dict, field) -> str | int:
+        """Check the compression levels are in the range of their compression type."""
+        compress_type = values.get(field.name.replace("_level", "_type"))
+        if value != "auto" and compress_type in PGBACKREST_COMPRESS_LEVELS:
+            minimum, maximum = PGBACKREST_COMPRESS_LEVELS[compress_type]
+            if not minimum <= value <= maximum:
+                raise ValueError(
+                    f"Value not in range {minimum} to {maximum} of {compress_type} compression"
+                )
+
+        return value
+
     @validator("durability_synchronous_commit")
     @classmethod
     def durability_synchronous_commit_values(cls, value: str) -> str | None:
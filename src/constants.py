@@ -33,6 +33,7 @@ SYSTEM_USERS = [BACKUP_USER, REPLICATION_USER, REWIND_USER, USER, MONITORING_USE
 # Snap constants.
 PGBACKREST_EXECUTABLE = "charmed-postgresql.pgbackrest"
 # pgBackRest error codes
+PGBACKREST_TIMEOUT_ERROR_CODE = 49  # Connection timeout - unable to reach the repository
 PGBACKREST_ARCHIVE_TIMEOUT_ERROR_CODE = (
     82  # Archive timeout - unable to archive WAL files within configured timeout period
 )
@@ -56,9 +57,15 @@ PATRONI_LOGS_PATH = f"{SNAP_LOGS_PATH}/patroni"
 
 PGBACKREST_CONF_PATH = f"{SNAP_CONF_PATH}/pgbackrest"
 PGBACKREST_LOGS_PATH = f"{SNAP_LOGS_PATH}/pgbackrest"
+# Queue of the WAL segments pushed and fetched asynchronously, on the data volume.
+PGBACKREST_SPOOL_PATH = f"{SNAP_DATA_PATH}/pgbackrest"
 
 POSTGRESQL_CONF_PATH = f"{SNAP_CONF_PATH}/postgresql"
 POSTGRESQL_DATA_PATH = f"{SNAP_DATA_PATH}/postgresql"
+# Data directory kept aside while Patroni bootstraps a delta restore over it.
+POSTGRESQL_DELTA_RESTORE_PATH = f"{SNAP_DATA_PATH}/postgresql-delta-restore"
+# Where the replicas restore the backup during a cluster-wide restore, next to the running database.
+POSTGRESQL_STANDBY_RESTORE_PATH = f"{SNAP_DATA_PATH}/postgresql-standby-restore"
 POSTGRESQL_LOGS_PATH = f"{SNAP_LOGS_PATH}/postgresql"
 
 UPDATE_CERTS_BIN_PATH = "/usr/sbin/update-ca-certificates"
@@ -67,6 +74,7 @@ PGBACKREST_CONFIGURATION_FILE = f"--config={PGBACKREST_CONF_PATH}/pgbackrest.con
 
 METRICS_PORT = 9187
 PGBACKREST_METRICS_PORT = 9854
+BACKUP_VERIFICATION_METRICS_PORT = 9855
 
 # Labels are not confidential
 REPLICATION_PASSWORD_KEY = "replication-password"  # noqa: S105
@@ -90,12 +98,36 @@ ENDPOINT_SIMULTANEOUSLY_BLOCKING_MESSAGE = (
 TRACING_PROTOCOL = "otlp_http"
 TRACING_RELATION_NAME = "tracing"
 
-BACKUP_TYPE_OVERRIDES = {"full": "full", "differential": "diff", "incremental": "incr"}
+# A full backup into the local repository (the local-backups storage).
+LOCAL_BACKUP_TYPE = "local"
+# A backup whose type (full, differential or incremental) is chosen by the charm.
+AUTO_BACKUP_TYPE = "auto"
+BACKUP_TYPE_OVERRIDES = {
+    "full": "full",
+    "differential": "diff",
+    "incremental": "incr",
+    LOCAL_BACKUP_TYPE: "full",
+}
 PLUGIN_OVERRIDES = {"audit": "pgaudit", "uuid_ossp": '"uuid-ossp"'}
 
 SPI_MODULE = ["refint", "autoinc", "insert_username", "moddatetime"]
 
 PGBACKREST_LOGROTATE_FILE = "/etc/logrotate.d/pgbackrest.logrotate"
 
+# Compression levels accepted by pgBackRest for each compression type.
+PGBACKREST_COMPRESS_LEVELS = {"gz": (0, 9), "lz4": (-5, 12), "zst": (-7, 22)}
+
+# Storage of the optional local pgBackRest repository.
+LOCAL_BACKUPS_STORAGE = "local-backups"
+
+# Status and output files of the commands run in the background (e.g. backups).
+BACKGROUND_JOBS_PATH = "/var/lib/charmed-postgresql-operator/jobs"
+# Output files of the backups created by the create-backup action (the last ones are kept).
+BACKUP_OUTPUT_PATH = "/var/lib/charmed-postgresql-operator/backup-output"
+# Prometheus metrics of the last verification of the backup repository.
+BACKUP_VERIFICATION_METRICS_FILE = (
+    "/var/lib/charmed-postgresql-operator/backup-verification-metrics.prom"
+)
+
 RAFT_PORT = 2222
 RAFT_PARTNER_PREFIX = "partner_node_status_server_"
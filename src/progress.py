@@ -0,0 +1,115 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Progress of the pgBackRest backup and restore commands.
+
+Running backups report the bytes already copied in the lock status of `pgbackrest info`.
+Restores are run by Patroni, so their progress is read from the detail lines that
+pgBackRest writes to the restore log for each restored file.
+"""
+
+import re
+from datetime import datetime
+
+from utils import search_file_backwards
+
+# Seconds between two progress reports of a running command.
+PROGRESS_REPORT_INTERVAL = 30
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+TB = 1024 * GB
+
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# e.g. "2025-01-01 10:00:00.123 P00   INFO: restore command begin 2.54.2: ..."
+RESTORE_BEGIN_PATTERN = re.compile(
+    r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\.\d+ P00\s+INFO: restore command begin"
+)
+# e.g. "2025-01-01 10:00:05.456 P01 DETAIL: restore file /path/base/1/1249 (456KB, 12.34%) ..."
+RESTORE_FILE_PATTERN = re.compile(
+    r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\.\d+ P\d+\s+DETAIL: restore file .*"
+    r" \([^,()]+, (\d+(?:\.\d+)?)%\)"
+)
+
+
+def format_size(size_in_bytes: float) -> str:
+    """Format a size in the largest unit that keeps it above one."""
+    for unit, unit_size in (("TB", TB), ("GB", GB), ("MB", MB), ("KB", KB)):
+        if size_in_bytes >= unit_size:
+            return f"{size_in_bytes / unit_size:.1f}{unit}"
+    return f"{int(size_in_bytes)}B"
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration as hours, minutes and seconds (e.g. 1h02m, 3m12s or 45s)."""
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_throughput(size_in_bytes: float, seconds: float) -> str:
+    """Format the average throughput of a transfer in MB/s."""
+    return f"{size_in_bytes / MB / max(seconds, 1):.1f}MB/s"
+
+
+def format_progress(fraction: float, elapsed: float, total_size: int | None = None) -> str:
+    """Describe the progress of a transfer.
+
+    Args:
+        fraction: completed fraction of the transfer (between 0 and 1).
+        elapsed: seconds since the transfer started.
+        total_size: size of the whole transfer in bytes, if known.
+
+    Returns:
+        A message like "45.1% (1.2GB of 2.7GB), 85.2MB/s, ETA 3m12s".
+    """
+    fraction = min(max(fraction, 0.0), 1.0)
+    message = f"{fraction * 100:.1f}%"
+    if total_size:
+        message += f" ({format_size(fraction * total_size)} of {format_size(total_size)})"
+        if elapsed > 0:
+            message += f", {format_throughput(fraction * total_size, elapsed)}"
+    if 0 < fraction < 1 and elapsed > 0:
+        message += f", ETA {format_duration(elapsed * (1 - fraction) / fraction)}"
+    return message
+
+
+def backup_progress(info: list[dict], stanza: str) -> tuple[int, int] | None:
+    """Return the copied and total bytes of the backup running for a stanza, if any.
+
+    Args:
+        info: parsed output of `pgbackrest info --output=json`.
+        stanza: name of the stanza.
+    """
+    for stanza_info in info:
+        if stanza_info.get("name") != stanza:
+            continue
+        lock = stanza_info.get("status", {}).get("lock", {}).get("backup", {})
+        if lock.get("held") and lock.get("size"):
+            return lock.get("size-cplt", 0), lock["size"]
+    return None
+
+
+def restore_progress(log_file: str) -> tuple[float, float] | None:
+    """Return the completed fraction and the elapsed seconds of the last restore, if running.
+
+    Args:
+        log_file: path of the pgBackRest restore log file.
+    """
+    try:
+        begin = search_file_backwards(log_file, RESTORE_BEGIN_PATTERN)
+        restored_file = search_file_backwards(log_file, RESTORE_FILE_PATTERN)
+    except OSError:
+        return None
+    # Ignore the files restored by a previous run.
+    if not begin or not restored_file or restored_file.group(1) < begin.group(1):
+        return None
+    started_at = datetime.strptime(begin.group(1), LOG_TIMESTAMP_FORMAT)
+    elapsed = (datetime.now() - started_at).total_seconds()
+    return float(restored_file.group(2)) / 100, elapsed
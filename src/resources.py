@@ -0,0 +1,167 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Detection of the memory and CPU resources effectively available to the unit.
+
+Inside LXD containers and VMs with resource limits, /proc/meminfo and os.cpu_count()
+can report the host resources instead of the quota set for the unit. The limits are
+read from the cgroup hierarchy (v1 and v2) the charm runs in, taking the lowest limit
+set on the cgroup or any of its ancestors.
+"""
+
+import logging
+import math
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+PROC_ROOT = "/proc"
+
+# Memory limits at or above this value mean "unlimited" in cgroup v1
+# (the kernel reports the page counter maximum, rounded to the page size).
+CGROUP_V1_UNLIMITED_MEMORY = 2**60
+
+
+def _read(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _cgroup_paths(proc_root: str) -> dict[str, str]:
+    """Return the cgroup path of the current process per controller.
+
+    The cgroup v2 unified hierarchy is returned under the empty string key.
+    """
+    paths = {}
+    content = _read(Path(proc_root, "self", "cgroup")) or ""
+    for line in content.splitlines():
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        _, controllers, path = parts
+        if controllers == "":
+            paths[""] = path
+            continue
+        for controller in controllers.split(","):
+            paths[controller] = path
+    return paths
+
+
+def _cgroup_dirs(cgroup_root: str, proc_root: str, controller: str) -> list[Path]:
+    """Return the directories of a controller's cgroup and its ancestors, leaf first."""
+    paths = _cgroup_paths(proc_root)
+    if controller not in paths:
+        return []
+    if controller == "":
+        # Pure cgroup v2 mounts the unified hierarchy at the root, while hybrid
+        # setups mount it under "unified".
+        base = Path(cgroup_root)
+        if not (base / "cgroup.controllers").exists():
+            base = base / "unified"
+    else:
+        base = Path(cgroup_root, controller)
+        if not base.exists():
+            # Co-mounted controllers, e.g. "cpu,cpuacct".
+            base = next(
+                (
+                    mount
+                    for mount in Path(cgroup_root).glob(f"*{controller}*")
+                    if controller in mount.name.split(",")
+                ),
+                base,
+            )
+
+    directories = []
+    current = Path(paths[controller].lstrip("/"))
+    while True:
+        directory = base / current
+        if directory.is_dir():
+            directories.append(directory)
+        if current == current.parent:
+            break
+        current = current.parent
+    return directories
+
+
+def _parse_cpu_list(cpus: str) -> int:
+    """Return the number of CPUs in a cpuset list (e.g. "0-3,6,8-9")."""
+    count = 0
+    for cpu_range in cpus.split(","):
+        if not cpu_range.strip():
+            continue
+        start, _, end = cpu_range.partition("-")
+        count += int(end or start) - int(start) + 1
+    return count
+
+
+def get_memory_limit(cgroup_root: str = CGROUP_ROOT, proc_root: str = PROC_ROOT) -> int | None:
+    """Return the lowest cgroup memory limit in bytes, or None if the memory is unlimited."""
+    limits = []
+    for directory in _cgroup_dirs(cgroup_root, proc_root, ""):
+        if (value := _read(directory / "memory.max")) and value != "max":
+            limits.append(int(value))
+    for directory in _cgroup_dirs(cgroup_root, proc_root, "memory"):
+        if (value := _read(directory / "memory.limit_in_bytes")) and (
+            int(value) < CGROUP_V1_UNLIMITED_MEMORY
+        ):
+            limits.append(int(value))
+    return min(limits) if limits else None
+
+
+def get_cpu_limit(cgroup_root: str = CGROUP_ROOT, proc_root: str = PROC_ROOT) -> int | None:
+    """Return the lowest number of CPUs allowed by cgroup quotas and cpusets, if any."""
+    limits = []
+    for directory in _cgroup_dirs(cgroup_root, proc_root, ""):
+        if (value := _read(directory / "cpu.max")) and not value.startswith("max"):
+            quota, _, period = value.partition(" ")
+            limits.append(math.ceil(int(quota) / int(period or 100000)))
+    # The effective cpuset of the leaf cgroup already accounts for the ancestors.
+    for directory in _cgroup_dirs(cgroup_root, proc_root, "")[:1]:
+        if cpus := _read(directory / "cpuset.cpus.effective"):
+            limits.append(_parse_cpu_list(cpus))
+    for directory in _cgroup_dirs(cgroup_root, proc_root, "cpu"):
+        quota = _read(directory / "cpu.cfs_quota_us")
+        period = _read(directory / "cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            limits.append(math.ceil(int(quota) / int(period)))
+    for directory in _cgroup_dirs(cgroup_root, proc_root, "cpuset")[:1]:
+        if cpus := _read(directory / "cpuset.effective_cpus") or _read(directory / "cpuset.cpus"):
+            limits.append(_parse_cpu_list(cpus))
+    limits = [limit for limit in limits if limit > 0]
+    return min(limits) if limits else None
+
+
+def get_effective_memory(cgroup_root: str = CGROUP_ROOT, proc_root: str = PROC_ROOT) -> int:
+    """Returns the memory available to the unit in bytes.
+
+    This is the system total memory, capped by any cgroup memory limit.
+    """
+    total_memory = 0
+    meminfo = _read(Path(proc_root, "meminfo")) or ""
+    for line in meminfo.splitlines():
+        if "MemTotal" in line:
+            total_memory = int(line.split()[1]) * 1024
+            break
+
+    limit = get_memory_limit(cgroup_root, proc_root)
+    if limit is not None and (total_memory == 0 or limit < total_memory):
+        logger.debug(f"Using cgroup memory limit of {limit} bytes")
+        return limit
+    return total_memory
+
+
+def get_effective_cpu_count(cgroup_root: str = CGROUP_ROOT, proc_root: str = PROC_ROOT) -> int:
+    """Returns the number of CPUs available to the unit.
+
+    This is the number of online CPUs, capped by any cgroup CPU quota or cpuset.
+    """
+    cpus = os.cpu_count() or 0
+    limit = get_cpu_limit(cgroup_root, proc_root)
+    if limit is not None and (cpus == 0 or limit < cpus):
+        logger.debug(f"Using cgroup CPU limit of {limit} CPUs")
+        return limit
+    return cpus
@@ -0,0 +1,139 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Workload-profile based tuning of PostgreSQL parameters.
+
+The values are derived from the memory and CPUs available to the unit, the number of
+allowed connections and the storage class of the data volume, following the usual
+sizing guidelines for each workload type:
+
+- oltp: many short transactions, small per-query memory, aggressive autovacuum.
+- olap: few large analytical queries, large per-query memory and WAL.
+- mixed: a balance between the two.
+"""
+
+from typing import TypedDict
+
+WORKLOAD_PROFILES = ("oltp", "olap", "mixed")
+STORAGE_TYPES = ("ssd", "hdd", "network")
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+# Share of the memory left after shared_buffers given to each connection's sort and
+# hash operations (a query can use several times work_mem, hence the divisor).
+WORK_MEM_CONNECTION_DIVISOR = {"oltp": 4, "mixed": 2, "olap": 1}
+# Share of the available memory given to maintenance operations.
+MAINTENANCE_WORK_MEM_DIVISOR = {"oltp": 16, "mixed": 16, "olap": 8}
+MAINTENANCE_WORK_MEM_MAX = 2 * GB
+# WAL sizes between checkpoints (min_wal_size, max_wal_size).
+WAL_SIZES = {"oltp": (2 * GB, 8 * GB), "mixed": (1 * GB, 4 * GB), "olap": (4 * GB, 16 * GB)}
+# Autovacuum scale factors (vacuum, analyze).
+AUTOVACUUM_SCALE_FACTORS = {"oltp": (0.05, 0.02), "mixed": (0.1, 0.05), "olap": (0.2, 0.1)}
+# Planner cost of a random page read and number of concurrent I/O requests.
+STORAGE_IO_SETTINGS = {"ssd": (1.1, 200), "hdd": (4.0, 2), "network": (1.1, 300)}
+
+# Charm config options that set the same PostgreSQL parameter as the tuning engine. They
+# have no default, so they're only set when the operator sets them (to any value).
+PARAMETER_CONFIG_OPTIONS = {
+    "work_mem": "memory_work_mem",
+    "maintenance_work_mem": "memory_maintenance_work_mem",
+    "autovacuum_vacuum_scale_factor": "vacuum_autovacuum_vacuum_scale_factor",
+    "autovacuum_analyze_scale_factor": "vacuum_autovacuum_analyze_scale_factor",
+}
+
+
+class TunedParameter(TypedDict):
+    """Value computed for a PostgreSQL parameter and the reason for it."""
+
+    value: str
+    reason: str
+
+
+def _format_size(size_in_bytes: int) -> str:
+    """Format a size in the largest PostgreSQL memory unit that represents it exactly."""
+    for unit, unit_size in (("GB", GB), ("MB", MB)):
+        if size_in_bytes >= unit_size and size_in_bytes % unit_size == 0:
+            return f"{size_in_bytes // unit_size}{unit}"
+    return f"{size_in_bytes // KB}kB"
+
+
+def compute_tuning(
+    workload: str,
+    storage_type: str,
+    available_memory: int,
+    shared_buffers: int,
+    max_connections: int,
+) -> dict[str, TunedParameter]:
+    """Compute the PostgreSQL parameters for a workload profile.
+
+    Args:
+        workload: workload profile (one of WORKLOAD_PROFILES).
+        storage_type: storage class of the data volume (one of STORAGE_TYPES).
+        available_memory: memory available to the unit in bytes.
+        shared_buffers: size of the shared buffers in bytes.
+        max_connections: maximum number of connections.
+
+    Returns:
+        Dictionary with the computed value and the reason for each parameter.
+    """
+    remaining_memory = max(available_memory - shared_buffers, 0)
+    work_mem = remaining_memory // (max_connections * 3 * WORK_MEM_CONNECTION_DIVISOR[workload])
+    work_mem = max(work_mem // KB * KB, 64 * KB)
+    maintenance_work_mem = min(
+        available_memory // MAINTENANCE_WORK_MEM_DIVISOR[workload] // MB * MB,
+        MAINTENANCE_WORK_MEM_MAX,
+    )
+    maintenance_work_mem = max(maintenance_work_mem, 64 * MB)
+    min_wal_size, max_wal_size = WAL_SIZES[workload]
+    # 3% of shared_buffers, between 64kB and one WAL segment (16MB).
+    wal_buffers = min(max(shared_buffers * 3 // 100 // (8 * KB) * (8 * KB), 64 * KB), 16 * MB)
+    vacuum_scale_factor, analyze_scale_factor = AUTOVACUUM_SCALE_FACTORS[workload]
+    random_page_cost, effective_io_concurrency = STORAGE_IO_SETTINGS[storage_type]
+
+    return {
+        "work_mem": {
+            "value": _format_size(work_mem),
+            "reason": f"memory left after shared_buffers split across {max_connections}"
+            f" connections for the {workload} workload",
+        },
+        "maintenance_work_mem": {
+            "value": _format_size(maintenance_work_mem),
+            "reason": f"1/{MAINTENANCE_WORK_MEM_DIVISOR[workload]} of the available memory"
+            f" (at most {_format_size(MAINTENANCE_WORK_MEM_MAX)})",
+        },
+        "min_wal_size": {
+            "value": _format_size(min_wal_size),
+            "reason": f"WAL kept between checkpoints for the {workload} workload",
+        },
+        "max_wal_size": {
+            "value": _format_size(max_wal_size),
+            "reason": f"checkpoint spacing for the {workload} workload write volume",
+        },
+        "checkpoint_completion_target": {
+            "value": "0.9",
+            "reason": "spread checkpoint writes over most of the checkpoint interval",
+        },
+        "wal_buffers": {
+            "value": _format_size(wal_buffers),
+            "reason": "3% of shared_buffers, between 64kB and one WAL segment (16MB)",
+        },
+        "random_page_cost": {
+            "value": str(random_page_cost),
+            "reason": f"random reads cost on {storage_type} storage",
+        },
+        "effective_io_concurrency": {
+            "value": str(effective_io_concurrency),
+            "reason": f"concurrent I/O requests supported by {storage_type} storage",
+        },
+        "autovacuum_vacuum_scale_factor": {
+            "value": str(vacuum_scale_factor),
+            "reason": f"share of changed rows that triggers a vacuum for the {workload} workload",
+        },
+        "autovacuum_analyze_scale_factor": {
+            "value": str(analyze_scale_factor),
+            "reason": f"share of changed rows that triggers an analyze for the {workload}"
+            " workload",
+        },
+    }
@@ -3,9 +3,14 @@
 
 """A collection of utility functions that are used in the charm."""
 
+import io
+import mmap
 import platform
+import re
 import secrets
 import string
+from collections.abc import Iterable, Iterator
+from pathlib import Path
 
 from constants import POSTGRESQL_SNAP_NAME, SNAP_PACKAGES
 
@@ -44,3 +49,140 @@ def label2name(label: str) -> str:
         The converted name.
     """
     return label.rsplit("-", 1)[0] + "/" + label.rsplit("-", 1)[1]
+
+
+def _reverse_file_lines(path: str) -> Iterator[str]:
+    """Yield the lines of a file from the last to the first one.
+
+    The file is memory mapped and scanned backwards, so only the pages holding the
+    lines that are consumed get read, regardless of the file size.
+    """
+    with open(path, "rb") as file:
+        try:
+            content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be memory mapped.
+            return
+        with content:
+            end = len(content)
+            if end and content[end - 1 : end] == b"\n":
+                end -= 1
+            while end > 0:
+                start = content.rfind(b"\n", 0, end) + 1
+                yield content[start:end].decode(errors="replace")
+                end = start - 1
+
+
+def tail_file(path: str, num_lines: int) -> str:
+    """Return the last lines of a file without reading the whole file.
+
+    Args:
+        path: path of the file to read.
+        num_lines: maximum number of lines to return.
+
+    Returns:
+        Multi-line string with the last lines of the file, in their original order.
+    """
+    lines = []
+    for line in _reverse_file_lines(path):
+        if len(lines) >= num_lines:
+            break
+        lines.append(line)
+    return "\n".join(reversed(lines))
+
+
+def search_file_backwards(
+    path: str, pattern: str | re.Pattern, max_lines: int | None = None
+) -> re.Match | None:
+    """Find the last line of a file that matches a pattern, scanning from the end of the file.
+
+    Args:
+        path: path of the file to search.
+        pattern: regular expression to search for in each line.
+        max_lines: maximum number of lines (from the end of the file) to look at.
+
+    Returns:
+        The match for the last matching line, or None if no line matches.
+    """
+    return _search_reversed_lines(_reverse_file_lines(path), pattern, max_lines)
+
+
+def search_reversed_lines(
+    lines: Iterable[str], pattern: str | re.Pattern, stop_pattern: str | re.Pattern | None = None
+) -> re.Match | None:
+    """Find the first line, of lines read from the end of a log, that matches a pattern.
+
+    Args:
+        lines: lines to search, from the last one to the first one.
+        pattern: regular expression to search for in each line.
+        stop_pattern: regular expression of a line before which no match is searched for.
+
+    Returns:
+        The match for the last matching line, or None if no line matches before the stop line.
+    """
+    if isinstance(stop_pattern, str):
+        stop_pattern = re.compile(stop_pattern)
+    return _search_reversed_lines(lines, pattern, None, stop_pattern)
+
+
+def _search_reversed_lines(
+    lines: Iterable[str],
+    pattern: str | re.Pattern,
+    max_lines: int | None,
+    stop_pattern: re.Pattern | None = None,
+) -> re.Match | None:
+    if isinstance(pattern, str):
+        pattern = re.compile(pattern)
+    for count, line in enumerate(lines):
+        if max_lines is not None and count >= max_lines:
+            break
+        if match := pattern.search(line):
+            return match
+        if stop_pattern is not None and stop_pattern.search(line):
+            break
+    return None
+
+
+class _ConcatenatedReader(io.RawIOBase):
+    """Read-only stream over byte strings and files, read one after the other."""
+
+    def __init__(self, parts: list[bytes | Path]):
+        self._parts = iter(parts)
+        self._current = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            if self._current is None:
+                if (part := next(self._parts, None)) is None:
+                    return 0
+                if isinstance(part, bytes):
+                    self._current = io.BytesIO(part)
+                else:
+                    try:
+                        self._current = open(part, "rb")  # noqa: SIM115
+                    except OSError:
+                        # A missing file is read as an empty one.
+                        continue
+            if read := self._current.readinto(buffer):
+                return read
+            self._current.close()
+            self._current = None
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.close()
+        super().close()
+
+
+def concatenate_files(parts: list[bytes | Path]) -> io.BufferedReader:
+    """Return a stream with the concatenated contents of byte strings and files.
+
+    The files are read as the stream is consumed, so large files aren't loaded in memory.
+
+    Args:
+        parts: byte strings and paths of the files, in the order they are read.
+    """
+    return io.BufferedReader(_ConcatenatedReader(parts))
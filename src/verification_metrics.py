@@ -0,0 +1,162 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Prometheus metrics of the verifications of the backup repository.
+
+pgbackrest_exporter doesn't report the results of `pgbackrest verify` (and can't read them
+from a file), so the charm writes them to BACKUP_VERIFICATION_METRICS_FILE and spawns
+scripts/verification_metrics.py, which serves that file on the unit address and
+BACKUP_VERIFICATION_METRICS_PORT as snap_daemon. The server only runs while the
+verifications are scheduled. Only the unit that ran the last verification exports it, so the
+results of an older verification don't keep firing alerts.
+"""
+
+import logging
+import os
+import pwd
+import signal
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from ops.framework import Object, StoredState
+
+from constants import (
+    BACKUP_ID_FORMAT,
+    BACKUP_VERIFICATION_METRICS_FILE,
+    BACKUP_VERIFICATION_METRICS_PORT,
+)
+
+if TYPE_CHECKING:
+    from charm import PostgresqlOperatorCharm
+
+logger = logging.getLogger(__name__)
+
+# File path for the spawned metrics server process to write logs.
+LOG_FILE_PATH = "/var/log/verification_metrics.log"
+
+# Values of pgbackrest_verify_status.
+VERIFY_STATUS_VALUES = {"ok": 0, "error": 1, "failed": 2}
+# Status of the valid backups in the output of `pgbackrest verify`.
+VALID_BACKUP_STATUS = "valid"
+
+
+def format_metrics(verification: dict) -> str:
+    """Format the result of a verification in the Prometheus text format."""
+    stanza = verification["stanza"]
+    finished_at = datetime.strptime(verification["finished-at"], BACKUP_ID_FORMAT).replace(
+        tzinfo=timezone.utc
+    )
+    lines = [
+        "# HELP pgbackrest_verify_status Result of the last verification"
+        " (0: ok, 1: invalid files found, 2: verification failed).",
+        "# TYPE pgbackrest_verify_status gauge",
+        f'pgbackrest_verify_status{{stanza="{stanza}"}}'
+        f" {VERIFY_STATUS_VALUES.get(verification['status'], VERIFY_STATUS_VALUES['failed'])}",
+        "# HELP pgbackrest_verify_duration_seconds Duration of the last verification.",
+        "# TYPE pgbackrest_verify_duration_seconds gauge",
+        f'pgbackrest_verify_duration_seconds{{stanza="{stanza}"}} {verification["duration"]}',
+        "# HELP pgbackrest_verify_last_completion_timestamp_seconds Time when the last"
+        " verification finished.",
+        "# TYPE pgbackrest_verify_last_completion_timestamp_seconds gauge",
+        f'pgbackrest_verify_last_completion_timestamp_seconds{{stanza="{stanza}"}}'
+        f" {int(finished_at.timestamp())}",
+        "# HELP pgbackrest_verify_backup_status Result of the last verification of each backup"
+        " (0: valid, 1: invalid).",
+        "# TYPE pgbackrest_verify_backup_status gauge",
+    ]
+    lines.extend(
+        f'pgbackrest_verify_backup_status{{stanza="{stanza}",backup="{backup}"}}'
+        f" {int(status != VALID_BACKUP_STATUS)}"
+        for backup, status in sorted(verification["backups"].items())
+    )
+    return "\n".join(lines) + "\n"
+
+
+class VerificationMetrics(Object):
+    """Exports the result of the last verification of the backup repository."""
+
+    _stored = StoredState()
+
+    def __init__(self, charm: "PostgresqlOperatorCharm"):
+        super().__init__(charm, "verification-metrics")
+        self._charm = charm
+        self._stored.set_default(pid=0, address="")
+
+    def _is_server_running(self) -> bool:
+        if not self._stored.pid:
+            return False
+        try:
+            os.kill(self._stored.pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def _stop_server(self) -> None:
+        if self._is_server_running():
+            try:
+                os.kill(self._stored.pid, signal.SIGTERM)
+                logger.info(
+                    f"Stopped the backup verification metrics server with PID {self._stored.pid}"
+                )
+            except OSError:
+                pass
+        self._stored.pid = 0
+
+    def update(self) -> None:
+        """Write the metrics of the last verification and start the server if it's not running."""
+        if (
+            self._charm._peers is None
+            or "stanza" not in self._charm.app_peer_data
+            or not self._charm.config.backup_schedule_verify
+        ):
+            self._stop_server()
+            return
+
+        verification = self._charm.backup.catalog.last_verification()
+        metrics = (
+            format_metrics(verification)
+            if verification and verification["unit"] == self._charm.unit.name
+            else ""
+        )
+        metrics_file = Path(BACKUP_VERIFICATION_METRICS_FILE)
+        try:
+            metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            temporary_file = metrics_file.with_suffix(".tmp")
+            temporary_file.write_text(metrics)
+            temporary_file.replace(metrics_file)
+        except OSError as e:
+            logger.warning(f"Failed to write the backup verification metrics: {e!s}")
+            return
+
+        address = self._charm._unit_ip
+        if self._is_server_running():
+            if self._stored.address == address:
+                return
+            # Listen on the new address of the unit.
+            self._stop_server()
+
+        pw_record = pwd.getpwnam("snap_daemon")
+        # Input is generated by the charm
+        pid = subprocess.Popen(  # noqa: S603
+            [
+                "/usr/bin/python3",
+                "scripts/verification_metrics.py",
+                address,
+                str(BACKUP_VERIFICATION_METRICS_PORT),
+                BACKUP_VERIFICATION_METRICS_FILE,
+            ],
+            # File shouldn't close
+            stdout=open(LOG_FILE_PATH, "a"),  # noqa: SIM115
+            stderr=subprocess.STDOUT,
+            # It only needs to read the metrics file.
+            user=pw_record.pw_uid,
+            group=pw_record.pw_gid,
+            extra_groups=[],
+            # Keep the server running after the hook finishes.
+            start_new_session=True,
+        ).pid
+        self._stored.pid = pid
+        self._stored.address = address
+        logger.info(f"Started the backup verification metrics server with PID {pid}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+import logging
+import os
+import time
+
+import pytest
+from pytest_operator.plugin import OpsTest
+
+from .conftest import ConnectionInformation
+from .helpers import (
+    CHARM_BASE,
+    DATABASE_APP_NAME,
+    db_connect,
+    get_password,
+    get_unit_address,
+)
+
+logger = logging.getLogger(__name__)
+
+S3_INTEGRATOR_APP_NAME = "s3-integrator"
+# Number of rows loaded before the backups (about 130MB of data for each million rows).
+BENCHMARK_ROWS = int(os.environ.get("BENCHMARK_ROWS", "5000000"))
+# Values of the backup_process_max config option to compare.
+PROCESS_MAX_VALUES = ["1", "2", "auto"]
+
+
+@pytest.fixture(scope="session")
+def cloud_credentials(microceph: ConnectionInformation) -> dict[str, str]:
+    """Read cloud credentials."""
+    return {
+        "access-key": microceph.access_key_id,
+        "secret-key": microceph.secret_access_key,
+    }
+
+
+@pytest.fixture(scope="session")
+def cloud_configs(microceph: ConnectionInformation):
+    return {
+        "endpoint": f"https://{microceph.host}",
+        "bucket": microceph.bucket,
+        "path": "/pg-benchmark",
+        "region": "",
+        "s3-uri-style": "path",
+        "tls-ca-chain": microceph.cert,
+    }
+
+
+async def test_backup_throughput(
+    ops_test: OpsTest, cloud_configs, cloud_credentials, charm
+) -> None:
+    """Report the full backup throughput for different backup_process_max values."""
+    await ops_test.model.deploy(S3_INTEGRATOR_APP_NAME)
+    await ops_test.model.deploy(
+        charm,
+        application_name=DATABASE_APP_NAME,
+        num_units=1,
+        base=CHARM_BASE,
+        config={"profile": "testing"},
+    )
+    await ops_test.model.applications[S3_INTEGRATOR_APP_NAME].set_config(cloud_configs)
+    action = await ops_test.model.units.get(f"{S3_INTEGRATOR_APP_NAME}/0").run_action(
+        "sync-s3-credentials",
+        **cloud_credentials,
+    )
+    await action.wait()
+    await ops_test.model.relate(DATABASE_APP_NAME, S3_INTEGRATOR_APP_NAME)
+    async with ops_test.fast_forward(fast_interval="60s"):
+        await ops_test.model.wait_for_idle(
+            apps=[DATABASE_APP_NAME, S3_INTEGRATOR_APP_NAME], status="active", timeout=1500
+        )
+
+    unit_name = f"{DATABASE_APP_NAME}/0"
+    password = await get_password(ops_test, unit_name)
+    address = get_unit_address(ops_test, unit_name)
+    logger.info(f"loading {BENCHMARK_ROWS} rows")
+    with db_connect(host=address, password=password) as connection:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE benchmark AS SELECT id, md5(random()::text) AS a,"
+                " md5(random()::text) AS b FROM generate_series(1, %s) AS id;",
+                (BENCHMARK_ROWS,),
+            )
+            cursor.execute("SELECT pg_database_size('postgres');")
+            database_size = cursor.fetchone()[0]
+    connection.close()
+
+    results = []
+    for process_max in PROCESS_MAX_VALUES:
+        await ops_test.model.applications[DATABASE_APP_NAME].set_config({
+            "backup_process_max": process_max
+        })
+        await ops_test.model.wait_for_idle(apps=[DATABASE_APP_NAME], status="active")
+
+        logger.info(f"creating a full backup with backup_process_max={process_max}")
+        started_at = time.monotonic()
+        action = await ops_test.model.units.get(unit_name).run_action(
+            "create-backup", **{"type": "full"}
+        )
+        await action.wait()
+        duration = time.monotonic() - started_at
+        assert action.results.get("backup-status") == "backup created", "backup hasn't succeeded"
+        results.append((process_max, duration, database_size / 1024 / 1024 / duration))
+        await ops_test.model.wait_for_idle(apps=[DATABASE_APP_NAME], status="active")
+
+    logger.info(f"Full backup throughput for a {database_size / 1024 / 1024:.0f}MB database:")
+    for process_max, duration, throughput in results:
+        logger.info(
+            f"  backup_process_max={process_max:<5s} {duration:8.1f}s {throughput:8.1f}MB/s"
+        )
@@ -0,0 +1,169 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+import json
+import sys
+from unittest.mock import Mock, patch
+
+import pytest
+from ops.charm import CharmBase
+from ops.testing import Harness
+
+from background_jobs import PROCESSED_JOBS_TO_KEEP, BackgroundJobs
+from scripts.background_job import main, run_job
+
+
+class MockCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+        self.background_jobs = BackgroundJobs(self, "/usr/bin/juju-exec")
+
+
+@pytest.fixture(autouse=True)
+def harness(tmp_path):
+    harness = Harness(MockCharm, meta="name: test-charm")
+    harness.begin()
+    harness.charm.background_jobs._jobs_path = tmp_path / "jobs"
+    yield harness
+    harness.cleanup()
+
+
+def test_start(harness, tmp_path):
+    with (
+        patch("builtins.open") as _open,
+        patch("subprocess.Popen") as _popen,
+    ):
+        assert harness.charm.background_jobs.jobs() == []
+
+        job_id = harness.charm.background_jobs.start(
+            "backup", ["pgbackrest", "backup"], metadata={"backup-type": "full"}
+        )
+
+        assert job_id.startswith("backup-")
+        job_file = tmp_path / "jobs" / f"{job_id}.json"
+        _popen.assert_called_once_with(
+            [
+                "/usr/bin/python3",
+                "scripts/background_job.py",
+                str(job_file),
+                "/usr/bin/juju-exec",
+                harness.charm.unit.name,
+                harness.charm.charm_dir,
+            ],
+            stdout=_open.return_value,
+            stderr=-2,
+            env=_popen.call_args.kwargs["env"],
+            start_new_session=True,
+        )
+        assert "JUJU_CONTEXT_ID" not in _popen.call_args.kwargs["env"]
+
+        job = harness.charm.background_jobs.get(job_id)
+        assert job["state"] == "pending"
+        assert job["command"] == ["pgbackrest", "backup"]
+        assert job["user"] == "snap_daemon"
+        assert job["metadata"] == {"backup-type": "full"}
+        assert harness.charm.background_jobs.running("backup") == [job]
+        assert harness.charm.background_jobs.running("verify") == []
+        assert harness.charm.background_jobs.completed() == []
+
+
+def test_job_states(harness, tmp_path):
+    jobs_path = tmp_path / "jobs"
+    jobs_path.mkdir()
+
+    def write(job_id: str, **job) -> None:
+        (jobs_path / f"{job_id}.json").write_text(
+            json.dumps({
+                "id": job_id,
+                "type": "backup",
+                "created-at": "2023-01-01T09:00:00Z",
+                "stdout-file": str(jobs_path / f"{job_id}.stdout"),
+                "stderr-file": str(jobs_path / f"{job_id}.stderr"),
+                "processed": False,
+                **job,
+            })
+        )
+
+    write("backup-1", state="finished", **{"return-code": 0})
+    write("backup-2", state="running", **{"worker-pid": 1})
+    write("backup-3", state="running", **{"worker-pid": 2})
+    # The worker process never started.
+    write("backup-4", state="pending")
+    (jobs_path / "backup-1.stdout").write_text("fake stdout")
+
+    def kill(pid: int, _) -> None:
+        # Only the worker process of the second job is alive.
+        if pid != 1:
+            raise OSError()
+
+    with patch("os.kill", side_effect=kill):
+        assert [job["id"] for job in harness.charm.background_jobs.running()] == ["backup-2"]
+        completed = harness.charm.background_jobs.completed()
+    assert [(job["id"], job["state"]) for job in completed] == [
+        ("backup-1", "finished"),
+        ("backup-3", "lost"),
+        ("backup-4", "lost"),
+    ]
+    assert harness.charm.background_jobs.read_output(completed[0]) == ("fake stdout", "")
+
+    with patch("os.kill", side_effect=kill):
+        harness.charm.background_jobs.mark_processed(completed[0])
+        assert harness.charm.background_jobs.get("backup-1")["processed"]
+
+        # Test that only the most recent processed jobs are kept.
+        for index in range(PROCESSED_JOBS_TO_KEEP + 1):
+            write(f"backup-5-{index:02d}", state="finished", processed=True)
+        harness.charm.background_jobs.mark_processed(completed[2])
+    assert not (jobs_path / "backup-1.json").exists()
+    assert not (jobs_path / "backup-1.stdout").exists()
+    assert not (jobs_path / "backup-4.json").exists()
+    assert len(list(jobs_path.glob("backup-5-*.json"))) == PROCESSED_JOBS_TO_KEEP
+
+
+def test_run_job(tmp_path):
+    job_file = tmp_path / "job.json"
+    job = {
+        "id": "backup-1",
+        "command": [sys.executable, "-c", "import sys; print('out'); sys.exit(3)"],
+        "user": None,
+        "state": "pending",
+        "stdout-file": str(tmp_path / "job.stdout"),
+        "stderr-file": str(tmp_path / "job.stderr"),
+    }
+    job_file.write_text(json.dumps(job))
+
+    result = run_job(str(job_file))
+
+    assert json.loads(job_file.read_text()) == result
+    assert result["state"] == "finished"
+    assert result["return-code"] == 3
+    assert "pid" in result and "started-at" in result and "finished-at" in result
+    assert (tmp_path / "job.stdout").read_text() == "out\n"
+
+    # Test when the command cannot be started.
+    job["command"] = [str(tmp_path / "missing")]
+    job_file.write_text(json.dumps(job))
+    result = run_job(str(job_file))
+    assert result["state"] == "finished"
+    assert result["return-code"] == -1
+    assert "Failed to start the command" in (tmp_path / "job.stderr").read_text()
+
+
+def test_main():
+    with (
+        patch.object(
+            sys, "argv", ["cmd", "/jobs/backup-1.json", "run_cmd", "unit/0", "charm_dir"]
+        ),
+        patch("scripts.background_job.run_job") as _run_job,
+        patch("scripts.background_job.subprocess") as _subprocess,
+    ):
+        _subprocess.run = Mock()
+        main()
+
+        _run_job.assert_called_once_with("/jobs/backup-1.json")
+        _subprocess.run.assert_called_once_with([
+            "run_cmd",
+            "-u",
+            "unit/0",
+            "JUJU_DISPATCH_PATH=hooks/background_job_completed charm_dir/dispatch",
+        ])
@@ -0,0 +1,285 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+import json
+import sys
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+from ops.testing import Harness
+
+from backup_scheduler import CronSchedule
+from charm import PostgresqlOperatorCharm
+from constants import PEER
+from scripts.backup_scheduler import main
+
+
+@pytest.fixture(autouse=True)
+def harness():
+    harness = Harness(PostgresqlOperatorCharm)
+
+    # Set up the initial relation and hooks.
+    peer_rel_id = harness.add_relation(PEER, "postgresql")
+    harness.add_relation_unit(peer_rel_id, "postgresql/0")
+    harness.begin()
+    yield harness
+    harness.cleanup()
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "expression,moment,expected",
+    [
+        ("30 2 * * *", utc(2026, 1, 1, 2, 30), utc(2026, 1, 2, 2, 30)),
+        ("30 2 * * *", utc(2026, 1, 1, 2, 29, 59), utc(2026, 1, 1, 2, 30)),
+        ("*/15 * * * *", utc(2026, 1, 1, 10, 7), utc(2026, 1, 1, 10, 15)),
+        ("0 */4 * * *", utc(2026, 1, 1, 21, 0), utc(2026, 1, 2, 0, 0)),
+        ("0 1 * * 0", utc(2026, 1, 1, 0, 0), utc(2026, 1, 4, 1, 0)),  # Sunday.
+        ("0 1 * * 7", utc(2026, 1, 1, 0, 0), utc(2026, 1, 4, 1, 0)),
+        ("0 1 * * 1-5", utc(2026, 1, 3, 0, 0), utc(2026, 1, 5, 1, 0)),  # Monday.
+        ("0 0 1 */3 *", utc(2026, 2, 10, 0, 0), utc(2026, 4, 1, 0, 0)),
+        ("0 0 31 * *", utc(2026, 2, 1, 0, 0), utc(2026, 3, 31, 0, 0)),
+        ("0 0 29 2 *", utc(2026, 3, 1, 0, 0), utc(2028, 2, 29, 0, 0)),
+        # Both days restricted: either the 15th or a Monday.
+        ("0 0 15 * 1", utc(2026, 1, 6, 0, 0), utc(2026, 1, 12, 0, 0)),
+        ("5,35 8-9 * * *", utc(2026, 1, 1, 8, 40), utc(2026, 1, 1, 9, 5)),
+    ],
+)
+def test_cron_schedule_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["", "* * * *", "60 * * * *", "* 24 * * *", "0 0 0 * *", "*/0 * * * *", "a * * * *"],
+)
+def test_cron_schedule_invalid(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_schedule_never_matches():
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 31 2 *").next_after(utc(2026, 1, 1))
+
+
+def test_next_scheduled_backup(harness):
+    scheduler = harness.charm.backup_scheduler
+
+    # Test when no backups are scheduled.
+    harness.update_config({"backup_schedule_jitter": 0})
+    assert scheduler.next_scheduled_backup(utc(2026, 1, 1)) is None
+
+    # Test that a full backup takes precedence over an incremental one scheduled at the same time.
+    harness.update_config({
+        "backup_schedule_full": "0 2 * * 0",
+        "backup_schedule_incremental": "0 */2 * * *",
+    })
+    assert scheduler.next_scheduled_backup(utc(2026, 1, 3, 23, 0)) == (
+        utc(2026, 1, 4, 0, 0),
+        "incremental",
+    )
+    assert scheduler.next_scheduled_backup(utc(2026, 1, 4, 0, 0)) == (
+        utc(2026, 1, 4, 2, 0),
+        "full",
+    )
+
+    # Test that the cluster delay is applied (and that a delayed backup isn't skipped).
+    harness.update_config({"backup_schedule_jitter": 900})
+    assert 0 <= scheduler.jitter <= 900
+    with patch("backup_scheduler.zlib.crc32", return_value=1000):
+        assert scheduler.jitter == 99
+        assert scheduler.next_scheduled_backup(utc(2026, 1, 4, 2, 1)) == (
+            utc(2026, 1, 4, 2, 1, 39),
+            "full",
+        )
+
+
+def test_start_scheduler(harness):
+    with (
+        patch("builtins.open") as _open,
+        patch("subprocess.Popen") as _popen,
+        patch("os.kill") as _kill,
+        patch("backup_scheduler.datetime") as _datetime,
+    ):
+        _datetime.now.return_value = utc(2026, 1, 1)
+        _popen.return_value.pid = 1234
+        peer_rel_id = harness.model.get_relation(PEER).id
+        harness.update_config({"backup_schedule_full": "0 2 * * *", "backup_schedule_jitter": 0})
+
+        # Test that nothing is done before the stanza is created.
+        harness.charm.backup_scheduler.start_scheduler()
+        _popen.assert_not_called()
+
+        # Test that the timer is started.
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.app.name, {"stanza": "test"})
+        harness.charm.backup_scheduler.start_scheduler()
+        _popen.assert_called_once_with(
+            [
+                "/usr/bin/python3",
+                "scripts/backup_scheduler.py",
+                str(utc(2026, 1, 1, 2, 0).timestamp()),
+                "/usr/bin/juju-run",
+                harness.charm.unit.name,
+                harness.charm.charm_dir,
+            ],
+            stdout=_open.return_value,
+            stderr=-2,
+            env=_popen.call_args.kwargs["env"],
+            start_new_session=True,
+        )
+
+        # Test that nothing is done when the timer is already running.
+        _popen.reset_mock()
+        harness.charm.backup_scheduler.start_scheduler()
+        _popen.assert_not_called()
+        _kill.assert_called_once_with(1234, 0)
+
+        # Test that the timer is restarted when the schedule changes.
+        _kill.reset_mock()
+        harness.update_config({"backup_schedule_full": "0 3 * * *"})
+        harness.charm.backup_scheduler.start_scheduler()
+        _kill.assert_any_call(1234, 15)
+        assert _popen.call_args.args[0][2] == str(utc(2026, 1, 1, 3, 0).timestamp())
+
+        # Test that the timer is stopped when the backups aren't scheduled anymore.
+        _kill.reset_mock()
+        _popen.reset_mock()
+        harness.update_config({"backup_schedule_full": ""})
+        harness.charm.backup_scheduler.start_scheduler()
+        _kill.assert_any_call(1234, 15)
+        _popen.assert_not_called()
+
+
+def test_on_scheduled_backup(harness):
+    with (
+        patch("charm.PostgreSQLBackups.create_scheduled_backup") as _create_scheduled_backup,
+        patch("charm.PostgreSQLBackups.scheduled_backup_unit") as _scheduled_backup_unit,
+        patch("backup_scheduler.BackupScheduler.start_scheduler") as _start_scheduler,
+        patch("backup_scheduler.time.time", return_value=1000.0),
+    ):
+        # Test that a non-leader unit waits for the leader to assign the backup.
+        harness.charm.backup_scheduler._stored.pid = 1234
+        harness.charm.backup_scheduler._stored.backup_type = "differential"
+        harness.charm.on.scheduled_backup.emit()
+        _scheduled_backup_unit.assert_not_called()
+        _create_scheduled_backup.assert_not_called()
+        _start_scheduler.assert_called_once()
+        assert harness.charm.backup_scheduler._stored.pid == 0
+
+        # Test that the leader assigns the backup and starts it when it takes it itself.
+        with harness.hooks_disabled():
+            harness.set_leader()
+        _scheduled_backup_unit.return_value = "postgresql/0"
+        harness.charm.on.scheduled_backup.emit()
+        _scheduled_backup_unit.assert_called_once_with("differential")
+        assert json.loads(harness.charm.app_peer_data["scheduled-backup"]) == {
+            "requested-at": 1000.0,
+            "type": "differential",
+            "unit": "postgresql/0",
+        }
+        _create_scheduled_backup.assert_called_once_with("differential")
+
+        # Test that the same claim isn't started twice.
+        _create_scheduled_backup.reset_mock()
+        harness.charm.backup_scheduler.start_claimed_backup()
+        _create_scheduled_backup.assert_not_called()
+
+        # Test that the leader doesn't start a backup assigned to another unit.
+        _scheduled_backup_unit.return_value = "postgresql/1"
+        harness.charm.on.scheduled_backup.emit()
+        assert json.loads(harness.charm.app_peer_data["scheduled-backup"])["unit"] == (
+            "postgresql/1"
+        )
+        _create_scheduled_backup.assert_not_called()
+
+        # Test that nothing is assigned when no unit can take the backup.
+        _scheduled_backup_unit.return_value = None
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                harness.model.get_relation(PEER).id,
+                harness.charm.app.name,
+                {"scheduled-backup": ""},
+            )
+        harness.charm.on.scheduled_backup.emit()
+        assert "scheduled-backup" not in harness.charm.app_peer_data
+        _create_scheduled_backup.assert_not_called()
+
+        # Test that the scheduled verification of the repository is started.
+        _scheduled_backup_unit.reset_mock()
+        harness.charm.backup_scheduler._stored.backup_type = "verify"
+        with patch(
+            "charm.PostgreSQLBackups.create_scheduled_verification"
+        ) as _create_scheduled_verification:
+            harness.charm.on.scheduled_backup.emit()
+            _create_scheduled_verification.assert_called_once_with()
+        _scheduled_backup_unit.assert_not_called()
+        _create_scheduled_backup.assert_not_called()
+
+
+def test_start_claimed_backup(harness):
+    with (
+        patch("charm.PostgreSQLBackups.create_scheduled_backup") as _create_scheduled_backup,
+        patch("backup_scheduler.time.time", return_value=5000.0),
+    ):
+        rel_id = harness.model.get_relation(PEER).id
+
+        # Test when there is no claim.
+        harness.charm.backup_scheduler.start_claimed_backup()
+        _create_scheduled_backup.assert_not_called()
+
+        # Test that an expired claim isn't started.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                rel_id,
+                harness.charm.app.name,
+                {
+                    "scheduled-backup": json.dumps({
+                        "requested-at": 1000.0,
+                        "type": "full",
+                        "unit": "postgresql/0",
+                    })
+                },
+            )
+        harness.charm.backup_scheduler.start_claimed_backup()
+        _create_scheduled_backup.assert_not_called()
+        assert harness.charm.backup_scheduler._stored.claimed_backup == 1000.0
+
+        # Test that a recent claim is started once.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                rel_id,
+                harness.charm.app.name,
+                {
+                    "scheduled-backup": json.dumps({
+                        "requested-at": 4990.0,
+                        "type": "full",
+                        "unit": "postgresql/0",
+                    })
+                },
+            )
+        harness.charm.backup_scheduler.start_claimed_backup()
+        harness.charm.backup_scheduler.start_claimed_backup()
+        _create_scheduled_backup.assert_called_once_with("full")
+
+
+def test_main():
+    with (
+        patch.object(sys, "argv", ["cmd", "1000.0", "run_cmd", "unit/0", "charm_dir"]),
+        patch("scripts.backup_scheduler.time", side_effect=[900.0, 990.0, 1000.0]),
+        patch("scripts.backup_scheduler.sleep") as _sleep,
+        patch("scripts.backup_scheduler.subprocess") as _subprocess,
+    ):
+        main()
+
+        assert [call.args[0] for call in _sleep.call_args_list] == [60, 10.0]
+        _subprocess.run.assert_called_once_with([
+            "run_cmd",
+            "-u",
+            "unit/0",
+            "JUJU_DISPATCH_PATH=hooks/scheduled_backup charm_dir/dispatch",
+        ])
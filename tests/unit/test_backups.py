@@ -1,18 +1,19 @@
 # Copyright 2023 Canonical Ltd.
 # See LICENSE file for licensing details.
-from os import cpu_count
+import json
+from datetime import datetime
 from pathlib import PosixPath
-from subprocess import CompletedProcess, TimeoutExpired
-from unittest.mock import ANY, MagicMock, PropertyMock, call, mock_open, patch
+from subprocess import CompletedProcess, TimeoutExpired, run
+from unittest.mock import ANY, DEFAULT, MagicMock, PropertyMock, call, mock_open, patch
 
 import botocore as botocore
 import pytest
 from boto3.exceptions import S3UploadFailedError
 from botocore.exceptions import ClientError
 from jinja2 import Template
-from ops import ActiveStatus, BlockedStatus, MaintenanceStatus, Unit
+from ops import ActiveStatus, BlockedStatus, MaintenanceStatus
 from ops.testing import Harness
-from tenacity import RetryError, wait_fixed
+from tenacity import RetryError
 
 from backups import (
     STANDBY_CLUSTER_CREATE_BACKUP_ERROR_MESSAGE,
@@ -22,7 +23,7 @@ from backups import (
     PostgreSQLBackups,
 )
 from charm import PostgresqlOperatorCharm
-from constants import PEER
+from constants import PEER, PGBACKREST_CONFIGURATION_FILE, PGBACKREST_EXECUTABLE
 
 ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE = "the S3 repository has backups from another cluster"
 FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE = (
@@ -286,6 +287,178 @@ def test_can_unit_perform_backup(harness):
         _are_backup_settings_ok.return_value = (True, None)
         assert harness.charm.backup._can_unit_perform_backup() == (True, None)
 
+        # Test when running the check in a replica that isn't the best backup source.
+        _is_primary.return_value = False
+        with (
+            harness.hooks_disabled(),
+            patch("charm.PostgreSQLBackups.backup_source") as _backup_source,
+        ):
+            harness.update_relation_data(peer_rel_id, harness.charm.unit.name, {"tls": "True"})
+            _backup_source.return_value = "postgresql/2"
+            assert harness.charm.backup._can_unit_perform_backup() == (
+                False,
+                "Unit cannot perform backups as postgresql/2 is a better backup source",
+            )
+
+            # Test when the replica is the best backup source (or there is no preference).
+            _backup_source.return_value = harness.charm.unit.name
+            assert harness.charm.backup._can_unit_perform_backup() == (True, None)
+            _backup_source.return_value = None
+            assert harness.charm.backup._can_unit_perform_backup() == (True, None)
+
+            # Test that the backup source isn't checked when the leader already chose the unit.
+            _backup_source.reset_mock()
+            _backup_source.return_value = "postgresql/2"
+            assert harness.charm.backup._can_unit_perform_backup(check_backup_source=False) == (
+                True,
+                None,
+            )
+            _backup_source.assert_not_called()
+
+
+def test_can_unit_perform_local_backup(harness):
+    with (
+        patch("charm.PostgreSQLBackups._are_backup_settings_ok") as _are_backup_settings_ok,
+        patch("charm.PostgreSQLBackups._is_standby_cluster") as _is_standby_cluster,
+        patch(
+            "charm.PostgresqlOperatorCharm.is_primary", new_callable=PropertyMock
+        ) as _is_primary,
+        patch(
+            "charm.PostgreSQLBackups.stanza_name",
+            new_callable=PropertyMock,
+            return_value="test-stanza",
+        ),
+    ):
+        # Test when the unit has no local repository.
+        _is_standby_cluster.return_value = False
+        assert harness.charm.backup._can_unit_perform_local_backup() == (
+            False,
+            "Unit has no local-backups storage",
+        )
+
+        # Test when the unit is a replica.
+        _are_backup_settings_ok.return_value = (True, None)
+        _is_primary.return_value = False
+        harness.add_storage("local-backups", attach=True)
+        assert harness.charm.backup._can_unit_perform_local_backup() == (
+            False,
+            "Local backups are taken by the primary",
+        )
+
+        # Test when the stanza wasn't created in the local repository.
+        _is_primary.return_value = True
+        assert harness.charm.backup._can_unit_perform_local_backup() == (
+            False,
+            "The local repository was not initialised",
+        )
+
+        # Test when the unit can take the backup.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                harness.model.get_relation(PEER).id,
+                harness.charm.unit.name,
+                {"local-repository-stanza": "test-stanza"},
+            )
+        assert harness.charm.backup._can_unit_perform_local_backup() == (True, None)
+
+
+def test_initialise_local_repository(harness):
+    with (
+        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+        patch(
+            "charm.PostgreSQLBackups.update_pgbackrest_conf_file"
+        ) as _update_pgbackrest_conf_file,
+        patch(
+            "charm.PostgreSQLBackups.stanza_name",
+            new_callable=PropertyMock,
+            return_value="test-stanza",
+        ),
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"stanza": "test-stanza"}
+            )
+
+        # Test when the unit has no local repository.
+        harness.charm.backup.initialise_local_repository()
+        _execute_command.assert_not_called()
+
+        # Test when the stanza creation fails (on any unit, as it's created offline).
+        _execute_command.return_value = (1, "", "ERROR: [041]: unable to open path")
+        storage_id = harness.add_storage("local-backups", attach=True)[0]
+        _execute_command.reset_mock()
+        _update_pgbackrest_conf_file.reset_mock()
+        harness.charm.backup.initialise_local_repository()
+        _execute_command.assert_called_once_with([
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            "--stanza=test-stanza",
+            "--repo=1",
+            "--no-online",
+            "stanza-create",
+        ])
+        assert "local-repository-stanza" not in harness.charm.unit_peer_data
+        _update_pgbackrest_conf_file.assert_not_called()
+
+        # Test when the stanza is created (and that it's only created once).
+        _execute_command.return_value = (0, "", "")
+        harness.charm.backup.initialise_local_repository()
+        assert harness.charm.unit_peer_data["local-repository-stanza"] == "test-stanza"
+        _update_pgbackrest_conf_file.assert_called_once_with()
+        _execute_command.reset_mock()
+        harness.charm.backup.initialise_local_repository()
+        _execute_command.assert_not_called()
+
+        # Test that the S3 repository becomes repo1 again when the storage is detached.
+        assert harness.charm.backup._repository_option(2) == ["--repo=2"]
+        harness.detach_storage(storage_id)
+        assert harness.charm.backup.local_repository_path is None
+        assert harness.charm.backup._s3_repository == 1
+        assert harness.charm.backup._repository_option(1) == []
+        assert "local-repository-stanza" not in harness.charm.unit_peer_data
+
+
+def test_backup_source(harness):
+    with patch("charm.Patroni.cluster_status") as _cluster_status:
+        peer_rel_id = harness.model.get_relation(PEER).id
+        with harness.hooks_disabled():
+            for unit_id in range(1, 4):
+                harness.add_relation_unit(peer_rel_id, f"postgresql/{unit_id}")
+            harness.update_relation_data(peer_rel_id, "postgresql/1", {"load-average": "0.25"})
+            harness.update_relation_data(peer_rel_id, "postgresql/2", {"load-average": "0.75"})
+            harness.update_relation_data(peer_rel_id, "postgresql/3", {"load-average": "0.00"})
+
+        def member(name: str, role: str, lag: int | str = 0, state: str = "streaming") -> dict:
+            return {"name": name, "role": role, "state": state, "lag": lag}
+
+        # Test when the cluster members cannot be retrieved.
+        _cluster_status.side_effect = RetryError(last_attempt=1)
+        assert harness.charm.backup.backup_source() is None
+
+        # Test when there are no standbys.
+        _cluster_status.side_effect = None
+        _cluster_status.return_value = [member("postgresql-0", "leader", state="running")]
+        assert harness.charm.backup.backup_source() is None
+
+        # Test that asynchronous standbys are preferred over synchronous ones.
+        _cluster_status.return_value = [
+            member("postgresql-0", "leader", state="running"),
+            member("postgresql-1", "replica"),
+            member("postgresql-2", "replica"),
+            member("postgresql-3", "sync_standby"),
+        ]
+        assert harness.charm.backup.backup_source() == "postgresql/1"
+
+        # Test that the least lagged standby is preferred over the least loaded one.
+        _cluster_status.return_value[1] = member("postgresql-1", "replica", lag=64 * 1024 * 1024)
+        assert harness.charm.backup.backup_source() == "postgresql/2"
+
+        # Test that an unknown lag and a stopped member are skipped.
+        _cluster_status.return_value[1] = member("postgresql-1", "replica", state="stopped")
+        _cluster_status.return_value[2] = member("postgresql-2", "replica", lag="unknown")
+        assert harness.charm.backup.backup_source() == "postgresql/3"
+
 
 def test_is_standby_cluster(harness):
     with (
@@ -314,7 +487,136 @@ def test_is_standby_cluster(harness):
         _is_primary_cluster.assert_called_once()
 
 
+def test_publish_load_average(harness):
+    with (
+        patch("backups.os.getloadavg") as _getloadavg,
+        patch(
+            "charm.PostgresqlOperatorCharm.cpu_count", new_callable=PropertyMock, return_value=4
+        ),
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+        _getloadavg.return_value = (3.0, 2.2, 1.0)
+        harness.charm.backup.publish_load_average()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit)["load-average"] == "0.50"
+
+        # Test that the peer relation isn't written while the load stays in the same step.
+        with patch.object(harness.charm.unit_peer_data, "update") as _update:
+            _getloadavg.return_value = (3.0, 2.9, 1.0)
+            harness.charm.backup.publish_load_average()
+            _update.assert_not_called()
+
+        _getloadavg.return_value = (3.0, 3.1, 1.0)
+        harness.charm.backup.publish_load_average()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit)["load-average"] == "0.75"
+
+
+def test_can_bootstrap_replicas_from_repository(harness):
+    with (
+        patch("charm.PostgreSQLBackups._are_backup_settings_ok") as _are_backup_settings_ok,
+        patch("charm.PostgreSQLBackups._is_standby_cluster") as _is_standby_cluster,
+        patch("backups.BackupCatalog.info") as _info,
+        patch("time.time", return_value=100000),
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+        _are_backup_settings_ok.return_value = (True, None)
+        _is_standby_cluster.return_value = False
+        _info.return_value = [
+            {
+                "backup": [
+                    {"error": False, "timestamp": {"stop": 90000}},
+                    {"error": True, "timestamp": {"stop": 99000}},
+                ]
+            }
+        ]
+
+        # Test when the option is disabled.
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.app.name, {"stanza": "test"})
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+        _info.assert_not_called()
+
+        # Test when the stanza wasn't created yet.
+        harness.update_config({"backup_replica_bootstrap": True})
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.app.name, {"stanza": ""})
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+        _info.assert_not_called()
+
+        # Test when the last successful backup is recent enough.
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.app.name, {"stanza": "test"})
+        assert harness.charm.backup.can_bootstrap_replicas_from_repository()
+
+        # Test when the last successful backup is too old.
+        harness.update_config({"backup_replica_bootstrap_max_age": 1})
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+
+        # Test that a recent backup in the local repository isn't restored from.
+        harness.add_storage("local-backups", attach=True)
+        _info.return_value = [
+            {
+                "backup": [
+                    {"error": False, "timestamp": {"stop": 90000}, "database": {"repo-key": 2}},
+                    {"error": False, "timestamp": {"stop": 99000}, "database": {"repo-key": 1}},
+                ]
+            }
+        ]
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+
+        # Test when the repository has no backups or cannot be read.
+        harness.update_config({"backup_replica_bootstrap_max_age": 24})
+        _info.return_value = [{"backup": []}]
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+        _info.side_effect = ListBackupsError
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+
+        # Test when this is a standby cluster.
+        _info.side_effect = None
+        _is_standby_cluster.return_value = True
+        assert not harness.charm.backup.can_bootstrap_replicas_from_repository()
+
+
+def test_refresh_replica_bootstrap(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
+        patch(
+            "charm.PostgreSQLBackups.can_bootstrap_replicas_from_repository"
+        ) as _can_bootstrap_replicas_from_repository,
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+
+        # Test that only the leader reads the repository.
+        harness.charm.backup.refresh_replica_bootstrap()
+        _can_bootstrap_replicas_from_repository.assert_not_called()
+
+        # Test that the Patroni configuration isn't updated when nothing changed.
+        with harness.hooks_disabled():
+            harness.set_leader()
+        _can_bootstrap_replicas_from_repository.return_value = False
+        harness.charm.backup.refresh_replica_bootstrap()
+        _update_config.assert_not_called()
+        assert not harness.charm.backup.replica_bootstrap_from_repository
+
+        # Test that the result is published for all the units when it changes.
+        _can_bootstrap_replicas_from_repository.return_value = True
+        harness.charm.backup.refresh_replica_bootstrap()
+        _update_config.assert_called_once()
+        assert (
+            harness.get_relation_data(peer_rel_id, harness.charm.app)[
+                "replica-bootstrap-from-repository"
+            ]
+            == "True"
+        )
+
+        # Test that the published result is only used while the option is enabled.
+        assert not harness.charm.backup.replica_bootstrap_from_repository
+        harness.update_config({"backup_replica_bootstrap": True})
+        assert harness.charm.backup.replica_bootstrap_from_repository
+
+
 def test_can_use_s3_repository(harness):
+    # Read the repository on every call instead of using the cached catalog.
+    harness.charm.backup.catalog.ttl = 0
     with (
         patch("charm.Patroni.reload_patroni_configuration") as _reload_patroni_configuration,
         patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
@@ -615,6 +917,36 @@ def test_empty_data_files(harness):
         _rmtree.assert_called_once_with(path)
 
 
+def test_keep_data_files_for_delta_restore(harness):
+    with (
+        patch("shutil.rmtree") as _rmtree,
+        patch("os.rename") as _rename,
+        patch("pathlib.Path.exists") as _exists,
+    ):
+        delta_restore_path = PosixPath(
+            "/var/snap/charmed-postgresql/common/var/lib/postgresql-delta-restore"
+        )
+
+        # Test when the data directory is moved aside.
+        _exists.return_value = False
+        assert harness.charm.backup._keep_data_files_for_delta_restore()
+        _rmtree.assert_not_called()
+        _rename.assert_called_once_with(
+            "/var/snap/charmed-postgresql/common/var/lib/postgresql", delta_restore_path
+        )
+
+        # Test when the leftovers of a previous delta restore are removed first.
+        _rename.reset_mock()
+        _exists.return_value = True
+        assert harness.charm.backup._keep_data_files_for_delta_restore()
+        _rmtree.assert_called_once_with(delta_restore_path)
+        _rename.assert_called_once()
+
+        # Test when the data directory cannot be moved.
+        _rename.side_effect = OSError
+        assert not harness.charm.backup._keep_data_files_for_delta_restore()
+
+
 def test_change_connectivity_to_database(harness):
     with patch("charm.PostgresqlOperatorCharm.update_config") as _update_config:
         peer_rel_id = harness.model.get_relation(PEER).id
@@ -667,6 +999,307 @@ def test_execute_command(harness):
         )
         _getpwnam.assert_called_once_with("snap_daemon")
 
+        # Test that systemd-run is run as root, as it switches to snap_daemon by itself.
+        _run.reset_mock()
+        _getpwnam.reset_mock()
+        systemd_run_command = ["systemd-run", "--scope", "--uid=snap_daemon", "--", *command]
+        harness.charm.backup._execute_command(systemd_run_command)
+        _run.assert_called_once_with(
+            systemd_run_command, input=None, capture_output=True, preexec_fn=None, timeout=None
+        )
+        _getpwnam.assert_not_called()
+
+
+def test_stream_command(harness, tmp_path):
+    command = [PGBACKREST_EXECUTABLE, "backup"]
+    stdout_file = str(tmp_path / "backup.stdout")
+    stderr_file = str(tmp_path / "backup.stderr")
+    with (
+        patch("backups.Popen") as _popen,
+        patch("pwd.getpwnam"),
+    ):
+        # Test that the output goes to the files and the progress callback is called
+        # while the command runs.
+        progress_callback = MagicMock()
+        process = _popen.return_value.__enter__.return_value
+        process.wait.side_effect = [TimeoutExpired(command, 30), TimeoutExpired(command, 30), 0]
+        process.returncode = 1
+        assert (
+            harness.charm.backup._stream_command(
+                command, stdout_file, stderr_file, progress_callback=progress_callback
+            )
+            == 1
+        )
+        _popen.assert_called_once_with(command, stdout=ANY, stderr=ANY, preexec_fn=ANY)
+        assert _popen.call_args.kwargs["stdout"].name == stdout_file
+        assert _popen.call_args.kwargs["stderr"].name == stderr_file
+        process.wait.assert_called_with(timeout=30)
+        assert progress_callback.call_count == 2
+
+
+def test_rotate_backup_output(harness, tmp_path):
+    with patch("backups.BACKUP_OUTPUT_PATH", str(tmp_path / "output")):
+        # Test the first backup.
+        assert harness.charm.backup._rotate_backup_output() == (
+            str(tmp_path / "output" / "backup.stdout"),
+            str(tmp_path / "output" / "backup.stderr"),
+        )
+
+        # Test that the outputs of the previous backups are kept.
+        for backup in range(4):
+            (tmp_path / "output" / "backup.stdout").write_text(f"backup {backup}")
+            harness.charm.backup._rotate_backup_output()
+        assert sorted(path.name for path in (tmp_path / "output").iterdir()) == [
+            "backup.stdout.1",
+            "backup.stdout.2",
+        ]
+        assert (tmp_path / "output" / "backup.stdout.1").read_text() == "backup 3"
+        assert (tmp_path / "output" / "backup.stdout.2").read_text() == "backup 2"
+
+
+def test_process_backup_result(harness, tmp_path):
+    with (
+        patch("charm.PostgreSQLBackups._upload_backup_logs") as _upload_backup_logs,
+        patch("charm.PostgreSQLBackups._list_backups") as _list_backups,
+        patch("charm.PostgreSQLBackups._backup_summary") as _backup_summary,
+        patch("backups.BACKUP_OUTPUT_TAIL_LINES", 2),
+    ):
+        stdout_file = tmp_path / "backup.stdout"
+        stderr_file = tmp_path / "backup.stderr"
+        stdout_file.write_text(
+            "P00   INFO: backup command begin\n"
+            "P00   INFO: new backup label = 20250101-100000F\n"
+            "P00  DEBUG: first debug line\n"
+            "P00  DEBUG: second debug line\n"
+        )
+        stderr_file.write_text("P00  ERROR: [082]: WAL segment was not archived\n")
+        s3_parameters = {"bucket": "test-bucket"}
+
+        # Test when the backup failed (only the end of the output is used for the error).
+        assert harness.charm.backup._process_backup_result(
+            1, str(stdout_file), str(stderr_file), s3_parameters, "2025-01-01T10:00:00Z", "full"
+        ) == ("Failed to backup PostgreSQL with error: ERROR: [082]: WAL segment was not archived")
+        _upload_backup_logs.assert_called_once_with(
+            str(stdout_file),
+            str(stderr_file),
+            f"backup/{harness.charm.backup.stanza_name}/20250101-100000F/backup.log",
+            s3_parameters,
+        )
+
+        # Test when the backup succeeded.
+        _upload_backup_logs.reset_mock()
+        _list_backups.return_value = {"20250101-100000F": harness.charm.backup.stanza_name}
+        _backup_summary.return_value = "Backup size: 1.0GB"
+        assert (
+            harness.charm.backup._process_backup_result(
+                0,
+                str(stdout_file),
+                str(stderr_file),
+                s3_parameters,
+                "2025-01-01T10:00:00Z",
+                "full",
+            )
+            is None
+        )
+        _upload_backup_logs.assert_called_once_with(
+            str(stdout_file),
+            str(stderr_file),
+            f"backup/{harness.charm.backup.stanza_name}/20250101-100000F/backup.log",
+            s3_parameters,
+            "Backup size: 1.0GB",
+        )
+
+        # Test that the logs can't be uploaded.
+        _upload_backup_logs.return_value = False
+        assert (
+            harness.charm.backup._process_backup_result(
+                0,
+                str(stdout_file),
+                str(stderr_file),
+                s3_parameters,
+                "2025-01-01T10:00:00Z",
+                "full",
+            )
+            == "Error uploading logs to S3"
+        )
+
+
+def test_upload_backup_logs(harness, tmp_path):
+    with patch("charm.PostgreSQLBackups._upload_stream_to_s3") as _upload_stream_to_s3:
+        uploaded_logs = []
+        _upload_stream_to_s3.side_effect = lambda stream, *_: (
+            uploaded_logs.append(stream.read().decode()) or DEFAULT
+        )
+        (tmp_path / "backup.stdout").write_text("fake stdout")
+
+        # Test that a missing output file is uploaded as empty.
+        assert harness.charm.backup._upload_backup_logs(
+            str(tmp_path / "backup.stdout"),
+            str(tmp_path / "backup.stderr"),
+            "backup/test-stanza/backup.log",
+            {"bucket": "test-bucket"},
+            "Backup size: 1.0GB",
+        )
+        _upload_stream_to_s3.assert_called_once_with(
+            ANY, "backup/test-stanza/backup.log", {"bucket": "test-bucket"}
+        )
+        assert uploaded_logs == [
+            "Stdout:\nfake stdout\n\nStderr:\n\n\nSummary:\nBackup size: 1.0GB\n"
+        ]
+
+
+def test_throttle_command(harness):
+    command = [PGBACKREST_EXECUTABLE, "backup"]
+
+    # Test when no throttling is configured.
+    assert harness.charm.backup._throttle_command(command) == command
+
+    # Test the CPU and I/O scheduling priority.
+    harness.update_config({"backup_nice": 10, "backup_ionice_class": "idle"})
+    assert harness.charm.backup._throttle_command(command) == [
+        "nice",
+        "-n",
+        "10",
+        "ionice",
+        "-c",
+        "3",
+        *command,
+    ]
+    harness.update_config({"backup_nice": 0, "backup_ionice_class": "best-effort"})
+    assert harness.charm.backup._throttle_command(command) == [
+        "ionice",
+        "-c",
+        "2",
+        "-n",
+        "7",
+        *command,
+    ]
+
+    # Test the cgroup weights, which run the command in a systemd scope as root.
+    harness.update_config({
+        "backup_ionice_class": "none",
+        "backup_cgroup_cpu_weight": 20,
+        "backup_cgroup_io_weight": 10,
+    })
+    throttled_command = harness.charm.backup._throttle_command(command)
+    assert throttled_command == [
+        "systemd-run",
+        "--scope",
+        "--quiet",
+        "--uid=snap_daemon",
+        "--gid=snap_daemon",
+        "--property",
+        "CPUWeight=20",
+        "--property",
+        "IOWeight=10",
+        "--",
+        *command,
+    ]
+    assert harness.charm.backup._command_user(throttled_command) is None
+    assert harness.charm.backup._command_user(command) == "snap_daemon"
+
+
+def test_backup_progress_message(harness):
+    with (
+        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+        patch("backups.time.time", return_value=1100.0),
+    ):
+        # Test when pgBackRest fails.
+        _execute_command.return_value = (1, "", "fake error")
+        assert harness.charm.backup._backup_progress_message(1000.0) is None
+        _execute_command.assert_called_once_with(
+            [
+                PGBACKREST_EXECUTABLE,
+                PGBACKREST_CONFIGURATION_FILE,
+                f"--stanza={harness.charm.backup.stanza_name}",
+                "info",
+                "--output=json",
+            ],
+            timeout=30,
+        )
+
+        # Test when no backup is running.
+        stanza = harness.charm.backup.stanza_name
+        _execute_command.return_value = (
+            0,
+            f'[{{"name": "{stanza}", "status": {{"lock": {{"backup": {{"held": false}}}}}}}}]',
+            "",
+        )
+        assert harness.charm.backup._backup_progress_message(1000.0) is None
+
+        # Test when a backup is running.
+        _execute_command.return_value = (
+            0,
+            f'[{{"name": "{stanza}", "status": {{"lock": {{"backup": {{"held": true, '
+            f'"size": 4194304000, "size-cplt": 1048576000}}}}}}}}]',
+            "",
+        )
+        assert (
+            harness.charm.backup._backup_progress_message(1000.0)
+            == "25.0% (1000.0MB of 3.9GB), 10.0MB/s, ETA 5m00s"
+        )
+
+
+def test_backup_summary(harness):
+    with patch("charm.PostgreSQLBackups._execute_command") as _execute_command:
+        # Test when the repository can't be read.
+        _execute_command.return_value = (1, "", "fake error")
+        assert harness.charm.backup._backup_summary() is None
+
+        # Test when the last backup is read from the repository.
+        harness.charm.backup.catalog.invalidate()
+        _execute_command.return_value = (
+            0,
+            '[{"backup": [{"label": "20230101-090000F", "info": {"size": 2147483648}, '
+            '"timestamp": {"start": 1672563600, "stop": 1672563728}}]}]',
+            "",
+        )
+        assert (
+            harness.charm.backup._backup_summary()
+            == "Backup 20230101-090000F: 2.0GB in 2m08s (16.0MB/s)"
+        )
+
+
+def test_restore_status_message(harness):
+    with (
+        patch("backups.restore_progress") as _restore_progress,
+        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+    ):
+        # Test when no restore is running.
+        assert harness.charm.backup.restore_status_message() is None
+        _restore_progress.assert_not_called()
+
+        # Test when the restore didn't restore any file yet.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                harness.model.get_relation(PEER).id,
+                harness.charm.app.name,
+                {"restore-stanza": "test-stanza", "restoring-backup": "20230101-090000F"},
+            )
+        _restore_progress.return_value = None
+        assert harness.charm.backup.restore_status_message() is None
+        _restore_progress.assert_called_once_with(
+            "/var/snap/charmed-postgresql/common/var/log/pgbackrest/test-stanza-restore.log"
+        )
+
+        # Test when the size of the restored backup is unknown.
+        _restore_progress.return_value = (0.5, 60.0)
+        _execute_command.return_value = (1, "", "fake error")
+        assert (
+            harness.charm.backup.restore_status_message() == "restoring backup: 50.0%, ETA 1m00s"
+        )
+
+        # Test when the size of the restored backup is known.
+        _execute_command.return_value = (
+            0,
+            '[{"backup": [{"label": "20230101-090000F", "info": {"size": 1258291200}}]}]',
+            "",
+        )
+        assert (
+            harness.charm.backup.restore_status_message()
+            == "restoring backup: 50.0% (600.0MB of 1.2GB), 10.0MB/s, ETA 1m00s"
+        )
+
 
 def test_format_backup_list(harness):
     with patch(
@@ -684,8 +1317,8 @@ def test_format_backup_list(harness):
             == """Storage bucket name: test-bucket
 Backups base path: /test-path/backup/
 
-backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | backup-path
------------------------------------------------------------------------------------------------------------------------------------------------------------------------------"""
+backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | verification | backup-path
+--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------"""
         )
 
         # Test when there are backups.
@@ -699,6 +1332,7 @@ backup-id            | action              | status   | reference-backup-id  | L
                 "2023-01-01T09:00:00Z",
                 "2023-01-01T09:00:05Z",
                 "1",
+                "invalid",
                 "a/b/c",
             ),
             (
@@ -710,6 +1344,7 @@ backup-id            | action              | status   | reference-backup-id  | L
                 "2023-01-01T10:00:00Z",
                 "2023-01-01T10:00:07Z",
                 "A",
+                "valid",
                 "a/b/d",
             ),
             (
@@ -722,6 +1357,7 @@ backup-id            | action              | status   | reference-backup-id  | L
                 "n/a",
                 "B",
                 "n/a",
+                "n/a",
             ),
         ]
         assert (
@@ -729,15 +1365,17 @@ backup-id            | action              | status   | reference-backup-id  | L
             == """Storage bucket name: test-bucket
 Backups base path: /test-path/backup/
 
-backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | backup-path
------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-2023-01-01T09:00:00Z | full backup         | failed: fake error | None                 | 0/3000000 / 0/5000000   | 2023-01-01T09:00:00Z | 2023-01-01T09:00:05Z | 1        | a/b/c
-2023-01-01T10:00:00Z | full backup         | finished | None                 | 0/5000000 / 0/7000000   | 2023-01-01T10:00:00Z | 2023-01-01T10:00:07Z | A        | a/b/d
-2023-01-01T11:00:00Z | restore             | finished | None                 | n/a                     | 2023-01-01T11:00:00Z | n/a                  | B        | n/a"""
+backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | verification | backup-path
+--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+2023-01-01T09:00:00Z | full backup         | failed: fake error | None                 | 0/3000000 / 0/5000000   | 2023-01-01T09:00:00Z | 2023-01-01T09:00:05Z | 1        | invalid      | a/b/c
+2023-01-01T10:00:00Z | full backup         | finished | None                 | 0/5000000 / 0/7000000   | 2023-01-01T10:00:00Z | 2023-01-01T10:00:07Z | A        | valid        | a/b/d
+2023-01-01T11:00:00Z | restore             | finished | None                 | n/a                     | 2023-01-01T11:00:00Z | n/a                  | B        | n/a          | n/a"""
         )
 
 
 def test_generate_backup_list_output(harness):
+    # Read the repository on every call instead of using the cached catalog.
+    harness.charm.backup.catalog.ttl = 0
     with (
         patch(
             "charms.data_platform_libs.v0.s3.S3Requirer.get_s3_connection_info"
@@ -751,23 +1389,42 @@ def test_generate_backup_list_output(harness):
             "path": " test-path/ ",
         }
         # Test when no backups are returned.
-        _execute_command.side_effect = [(0, '[{"backup":[]}]', ""), (0, "{}", "")]
+        _execute_command.side_effect = [
+            (0, '[{"backup":[]}]', ""),
+            (0, '[{"backup":[]}]', ""),
+            (0, "{}", ""),
+        ]
         assert (
             harness.charm.backup._generate_backup_list_output()
             == """Storage bucket name: test-bucket
 Backups base path: /test-path/backup/
 
-backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | backup-path
------------------------------------------------------------------------------------------------------------------------------------------------------------------------------"""
+backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | verification | backup-path
+--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------"""
         )
 
-        # Test when backups are returned.
+        # Test when backups are returned (and the archive has a new timeline), with the
+        # result of the last verification of the repository by another unit.
+        with harness.hooks_disabled():
+            peer_rel_id = harness.model.get_relation(PEER).id
+            harness.add_relation_unit(peer_rel_id, "postgresql/1")
+            harness.update_relation_data(
+                peer_rel_id,
+                "postgresql/1",
+                {
+                    "backup-verification": json.dumps({
+                        "stanza": "None.postgresql",
+                        "finished-at": "2024-10-15T01:00:00Z",
+                        "duration": 125,
+                        "status": "error",
+                        "backups": {"20230101-090000F": "invalid"},
+                    })
+                },
+            )
+        info_output = '[{"archive":[{"id":"14-1","max":"000000020000000000000003"}],"backup":[{"archive":{"start":"00000001000000000000000B"},"label":"20230101-090000F","error":"fake error","reference":null,"lsn":{"start":"0/3000000","stop":"0/5000000"},"timestamp":{"start":1719866711,"stop":1719866714}}],"name":"None.postgresql"}]'
         _execute_command.side_effect = [
-            (
-                0,
-                '[{"backup":[{"archive":{"start":"00000001000000000000000B"},"label":"20230101-090000F","error":"fake error","reference":null,"lsn":{"start":"0/3000000","stop":"0/5000000"},"timestamp":{"start":1719866711,"stop":1719866714}}]}]',
-                "",
-            ),
+            (0, info_output, ""),
+            (0, info_output, ""),
             (
                 0,
                 '{"None.postgresql/14-1/00000002.history":{"type": "file","size": 32,"time": 1728937652}}',
@@ -779,14 +1436,18 @@ backup-id            | action              | status   | reference-backup-id  | L
             == """Storage bucket name: test-bucket
 Backups base path: /test-path/backup/
 
-backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | backup-path
------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-2023-01-01T09:00:00Z | full backup         | failed: fake error | None                 | 0/3000000 / 0/5000000   | 2024-07-01T20:45:11Z | 2024-07-01T20:45:14Z | 1        | /None.postgresql/20230101-090000F
-2024-10-14T20:27:32Z | restore             | finished | None                 | n/a                     | 2024-10-14T20:27:32Z | n/a                  | 2        | n/a"""
+backup-id            | action              | status   | reference-backup-id  | LSN start/stop          | start-time           | finish-time          | timeline | verification | backup-path
+--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+2023-01-01T09:00:00Z | full backup         | failed: fake error | None                 | 0/3000000 / 0/5000000   | 2024-07-01T20:45:11Z | 2024-07-01T20:45:14Z | 1        | invalid      | /None.postgresql/20230101-090000F
+2024-10-14T20:27:32Z | restore             | finished | None                 | n/a                     | 2024-10-14T20:27:32Z | n/a                  | 2        | n/a          | n/a
+
+Last verification: error at 2024-10-15T01:00:00Z on postgresql/1 (took 2m05s)"""
         )
 
 
 def test_list_backups(harness):
+    # Read the repository on every call instead of using the cached catalog.
+    harness.charm.backup.catalog.ttl = 0
     with patch("charm.PostgreSQLBackups._execute_command") as _execute_command:
         # Test when the command that list the backups fails.
         _execute_command.return_value = (1, "", "fake stderr")
@@ -814,250 +1475,399 @@ def test_list_backups(harness):
             ("2023-01-01T10:00:00Z", ("test-stanza", "A"))
         ])
 
+        # Test that the backups in the local repository are only listed when requested.
+        harness.add_storage("local-backups", attach=True)
+        _execute_command.return_value = (
+            0,
+            '[{"backup":[{"archive":{"start":"0000000A000000000000000B"},"label":"20230101-100000F","error":null,"database":{"repo-key":2}},{"archive":{"start":"0000000A000000000000000C"},"label":"20230101-110000F","error":null,"database":{"repo-key":1}}],"name":"test-stanza"}]',
+            "",
+        )
+        assert harness.charm.backup._list_backups(show_failed=False) == dict[str, tuple[str, str]]([
+            ("2023-01-01T10:00:00Z", ("test-stanza", "A"))
+        ])
+        assert harness.charm.backup._list_backups(show_failed=False, include_local=True) == dict[
+            str, tuple[str, str]
+        ]([
+            ("2023-01-01T10:00:00Z", ("test-stanza", "A")),
+            ("2023-01-01T11:00:00Z", ("test-stanza", "A")),
+        ])
+
 
-def test_initialise_stanza(harness):
+def test_start_stanza_initialisation(harness):
     with (
-        patch("charm.Patroni.reload_patroni_configuration") as _reload_patroni_configuration,
-        patch("charm.Patroni.member_started", new_callable=PropertyMock) as _member_started,
-        patch("backups.wait_fixed", return_value=wait_fixed(0)),
         patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
-        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+        patch(
+            "charm.PostgreSQLBackups._create_bucket_if_not_exists"
+        ) as _create_bucket_if_not_exists,
         patch(
             "charm.PostgreSQLBackups._s3_initialization_set_failure"
         ) as _s3_initialization_set_failure,
+        patch("charm.PostgreSQLBackups.can_use_s3_repository") as _can_use_s3_repository,
+        patch.object(harness.charm.background_jobs, "start") as _start,
     ):
         peer_rel_id = harness.model.get_relation(PEER).id
 
-        mock_event = MagicMock()
-
         # Test when it's in a blocked state other than the ones can be solved by new S3 settings.
         harness.charm.unit.status = BlockedStatus("fake blocked state")
-        harness.charm.backup._initialise_stanza(mock_event)
-        _execute_command.assert_not_called()
-        mock_event.defer.assert_called_once()
+        harness.charm.backup._start_stanza_initialisation("test-request")
+        _create_bucket_if_not_exists.assert_not_called()
+        _start.assert_not_called()
 
-        # Test when the blocked state is any of the blocked stated that can be solved
-        # by new S3 settings, but the stanza creation fails.
-        mock_event.reset_mock()
-        stanza_creation_command = [
-            "charmed-postgresql.pgbackrest",
-            "--config=/var/snap/charmed-postgresql/current/etc/pgbackrest/pgbackrest.conf",
+        # Test when the bucket can't be accessed or created.
+        harness.charm.unit.status = BlockedStatus(FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE)
+        _create_bucket_if_not_exists.side_effect = ValueError()
+        harness.charm.backup._start_stanza_initialisation("test-request")
+        _s3_initialization_set_failure.assert_called_once_with(
+            FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE
+        )
+        _can_use_s3_repository.assert_not_called()
+
+        # Test when the repository has backups from another cluster.
+        _s3_initialization_set_failure.reset_mock()
+        _create_bucket_if_not_exists.side_effect = None
+        _can_use_s3_repository.return_value = (False, ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE)
+        harness.charm.backup._start_stanza_initialisation("test-request")
+        _s3_initialization_set_failure.assert_called_once_with(
+            ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
+        )
+        _start.assert_not_called()
+
+        # Test that the stanza is created and checked in the background.
+        _s3_initialization_set_failure.reset_mock()
+        _can_use_s3_repository.return_value = (True, None)
+        _start.return_value = "stanza-1"
+        harness.charm.backup._start_stanza_initialisation("test-request")
+        command = _start.call_args[0][1]
+        assert command[4:] == [
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
             f"--stanza={harness.charm.backup.stanza_name}",
-            "stanza-create",
         ]
-        _execute_command.return_value = (1, "", "fake stderr")
-        for blocked_state in [
-            ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE,
-            FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE,
-            FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE,
-        ]:
-            _s3_initialization_set_failure.reset_mock()
-            _execute_command.reset_mock()
-            harness.charm.unit.status = BlockedStatus(blocked_state)
-            harness.charm.backup._initialise_stanza(mock_event)
-            _execute_command.assert_called_with(stanza_creation_command)
-            mock_event.defer.assert_not_called()
-            # Only the leader will display the blocked status.
-            assert isinstance(harness.charm.unit.status, MaintenanceStatus)
-            _s3_initialization_set_failure.assert_called_once_with(
-                FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE
-            )
+        assert 'retry "$@" stanza-create && retry "$@" check' in command[2]
+        _start.assert_called_once_with("stanza", command, {"request": "test-request"})
+        _update_config.assert_called_once()
+        _s3_initialization_set_failure.assert_not_called()
+        assert json.loads(
+            harness.get_relation_data(peer_rel_id, harness.charm.unit)["stanza-initialisation"]
+        ) == {
+            "request": "test-request",
+            "state": "running",
+            "stanza": harness.charm.backup.stanza_name,
+            "block-message": "",
+        }
+        assert harness.charm.unit.status == MaintenanceStatus("initialising stanza")
 
-        # Test when the failure in the stanza creation is due to a timeout.
-        _execute_command.reset_mock()
-        _execute_command.return_value = (49, "", "fake stderr")
-        with pytest.raises(TimeoutError):
-            harness.charm.backup._initialise_stanza(mock_event)
-            assert False
-        mock_event.defer.assert_not_called()
+        # Test when the job can't be started.
+        _start.side_effect = OSError
+        harness.charm.backup._start_stanza_initialisation("test-request")
+        _s3_initialization_set_failure.assert_called_once_with(
+            FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE
+        )
 
-        # Test when the archiving is working correctly (pgBackRest check command succeeds)
-        # and the unit is not the leader.
-        _execute_command.reset_mock()
-        _execute_command.return_value = (0, "fake stdout", "")
-        _member_started.return_value = True
-        harness.charm.backup._initialise_stanza(mock_event)
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {}
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {
-            "stanza": f"{harness.charm.model.name}.postgresql",
-        }
-        assert isinstance(harness.charm.unit.status, MaintenanceStatus)
-        mock_event.defer.assert_not_called()
 
-        # Test when the unit is the leader.
-        with harness.hooks_disabled():
-            harness.set_leader()
-            harness.update_relation_data(peer_rel_id, harness.charm.unit.name, {"stanza": ""})
-        harness.charm.backup._initialise_stanza(mock_event)
-        _update_config.assert_not_called()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
-            "stanza": f"{harness.charm.model.name}.postgresql",
-        }
-        _member_started.assert_not_called()
-        _reload_patroni_configuration.assert_not_called()
-        mock_event.defer.assert_not_called()
-        assert isinstance(harness.charm.unit.status, MaintenanceStatus)
+def test_stanza_initialisation_command(harness, tmp_path):
+    # Test that each step is retried and that the error of the last attempt is returned.
+    with (
+        patch("backups.STANZA_INITIALISATION_RETRY_INTERVAL", 0),
+        patch("backups.STANZA_INITIALISATION_ATTEMPTS", 3),
+    ):
+        command = harness.charm.backup._stanza_initialisation_command()
+    attempts_file = tmp_path / "attempts"
+    fake_pgbackrest = (
+        f'echo "$3" >> {attempts_file}; [ "$3" = stanza-create ] && [ $(wc -l < {attempts_file})'
+        ' -lt 2 ] && exit 49; [ "$3" = check ] && exit 82; exit 0'
+    )
+    process = run(
+        [*command[:4], "/bin/sh", "-c", fake_pgbackrest, "pgbackrest", *command[5:]],
+        check=False,
+    )
+    assert process.returncode == 82
+    assert attempts_file.read_text().split() == [
+        "stanza-create",
+        "stanza-create",
+        "check",
+        "check",
+        "check",
+    ]
 
 
-def test_check_stanza(harness):
+def test_process_stanza_initialisation_result(harness):
     with (
-        patch("charm.PostgresqlOperatorCharm.update_config"),
-        patch("backups.wait_fixed", return_value=wait_fixed(0)),
-        patch("charm.Patroni.reload_patroni_configuration") as _reload_patroni_configuration,
-        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+        patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
         patch(
             "charm.PostgresqlOperatorCharm._set_primary_status_message"
         ) as _set_primary_status_message,
+        patch(
+            "charm.PostgreSQLBackups.start_stop_pgbackrest_service"
+        ) as _start_stop_pgbackrest_service,
+        patch(
+            "charm.PostgreSQLBackups._retrieve_s3_parameters",
+            return_value=({"path": "example"}, None),
+        ),
+        patch("charm.PostgreSQLBackups._upload_content_to_s3") as _upload_content_to_s3,
         patch(
             "charm.PostgreSQLBackups._s3_initialization_set_failure"
         ) as _s3_initialization_set_failure,
-        patch(
-            "charm.PostgresqlOperatorCharm.is_primary", new_callable=PropertyMock
-        ) as _is_primary,
+        patch.object(
+            harness.charm.background_jobs, "read_output", return_value=("", "fake stderr")
+        ),
     ):
         peer_rel_id = harness.model.get_relation(PEER).id
-        # Set peer data flag
+        job = {
+            "id": "stanza-1",
+            "state": "finished",
+            "return-code": 0,
+            "metadata": {"request": "test-request"},
+        }
+
+        # Test when the repository couldn't be reached (the initialisation is retried later).
         with harness.hooks_disabled():
             harness.update_relation_data(
-                peer_rel_id,
-                harness.charm.app.name,
-                {"s3-initialization-start": "test-stanza"},
+                peer_rel_id, harness.charm.app.name, {"s3-initialization-start": "test-request"}
             )
-
-        _execute_command.return_value = (49, "", "fake stderr")
-        assert not harness.charm.backup.check_stanza()
-        _reload_patroni_configuration.assert_not_called()
-        _set_primary_status_message.assert_not_called()
+        for timed_out_job in [
+            {**job, "return-code": 49},
+            {**job, "return-code": 82},
+            {**job, "state": "lost", "return-code": None},
+        ]:
+            _update_config.reset_mock()
+            with harness.hooks_disabled():
+                harness.update_relation_data(
+                    peer_rel_id, harness.charm.unit.name, {"stanza-initialisation": "{}"}
+                )
+            with patch("backups.time.time", return_value=1000.0):
+                harness.charm.backup._process_stanza_initialisation_result(timed_out_job)
+            block_message = "stanza initialisation timed out, retrying: fake stderr"
+            assert json.loads(
+                harness.get_relation_data(peer_rel_id, harness.charm.unit)["stanza-initialisation"]
+            ) == {
+                "request": "test-request",
+                "state": "timed-out",
+                "stanza": "",
+                "block-message": block_message,
+                "retry-after": 1300.0,
+            }
+            assert harness.charm.backup.stanza_initialisation_timed_out_message == block_message
+            assert harness.charm.unit.status == BlockedStatus(block_message)
+            # The WAL isn't archived to the stanza anymore.
+            assert harness.charm.backup.configured_stanza is None
+            _update_config.assert_called_once()
+            _s3_initialization_set_failure.assert_not_called()
+
+        # Test when the stanza creation or check failed.
+        harness.charm.backup._process_stanza_initialisation_result({**job, "return-code": 1})
         _s3_initialization_set_failure.assert_called_once_with(
-            FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE
+            FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE, request="test-request"
         )
+        _upload_content_to_s3.assert_not_called()
+        _set_primary_status_message.assert_not_called()
 
-        # Test when the failure in the stanza check is due to an archive timeout.
-        _execute_command.reset_mock()
-        _s3_initialization_set_failure.reset_mock()
-        _execute_command.return_value = (82, "", "fake stderr")
-        with pytest.raises(TimeoutError):
-            harness.charm.backup.check_stanza()
-            assert False
-        _s3_initialization_set_failure.assert_not_called()
-
-        _execute_command.reset_mock()
+        # Test when the stanza was initialised.
         _s3_initialization_set_failure.reset_mock()
-        _execute_command.return_value = (0, "fake stdout", "")
-        assert harness.charm.backup.check_stanza()
-        _execute_command.assert_called_once()
-        _set_primary_status_message.assert_called_once()
+        harness.charm.backup._process_stanza_initialisation_result(job)
         _s3_initialization_set_failure.assert_not_called()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {
-            "s3-initialization-done": "True"
+        _start_stop_pgbackrest_service.assert_called_once()
+        _set_primary_status_message.assert_called_once_with()
+        _upload_content_to_s3.assert_called_once_with(
+            harness.charm.model.uuid, "model-uuid.txt", {"path": "example"}
+        )
+        assert json.loads(
+            harness.get_relation_data(peer_rel_id, harness.charm.unit)["stanza-initialisation"]
+        ) == {
+            "request": "test-request",
+            "state": "done",
+            "stanza": harness.charm.backup.stanza_name,
+            "block-message": "",
         }
 
-        with harness.hooks_disabled():
-            harness.set_leader()
-        assert harness.charm.backup.check_stanza()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {}
-
 
 def test_coordinate_stanza_fields(harness):
     with (
         patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
-        patch("charm.Patroni.reload_patroni_configuration") as _reload_patroni_configuration,
+        patch(
+            "charm.PostgresqlOperatorCharm._set_primary_status_message"
+        ) as _set_primary_status_message,
+        patch(
+            "charm.PostgresqlOperatorCharm.is_primary", new_callable=PropertyMock
+        ) as _is_primary,
+        patch(
+            "charm.PostgreSQLBackups._start_stanza_initialisation"
+        ) as _start_stanza_initialisation,
+        patch.object(harness.charm.background_jobs, "running", return_value=[]) as _running,
     ):
         peer_rel_id = harness.model.get_relation(PEER).id
         stanza_name = f"{harness.charm.model.name}.{harness.charm.app.name}"
+        new_unit_name = "postgresql/1"
+        with harness.hooks_disabled():
+            harness.add_relation_unit(peer_rel_id, new_unit_name)
+
+        def initialisation(request, state="done", stanza=stanza_name, block_message=""):
+            return {
+                "stanza-initialisation": json.dumps({
+                    "request": request,
+                    "state": state,
+                    "stanza": stanza,
+                    "block-message": block_message,
+                })
+            }
+
+        # Test when no initialisation was requested.
+        _is_primary.return_value = True
+        harness.charm.backup.coordinate_stanza_fields()
+        _start_stanza_initialisation.assert_not_called()
+        assert harness.charm.backup.configured_stanza is None
 
-        peer_data_primary_error = {
-            "s3-initialization-done": "True",
-            "s3-initialization-block-message": ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE,
-        }
-        peer_data_primary_ok = {
-            "s3-initialization-done": "True",
-            "stanza": stanza_name,
-        }
-        peer_data_leader_start = {
-            "s3-initialization-start": "Thu Feb 24 05:00:00 2022",
-        }
-        peer_data_leader_error = {
-            "s3-initialization-done": "True",
-            "s3-initialization-block-message": ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE,
-        }
-        peer_data_leader_ok = {"s3-initialization-done": "True", "stanza": stanza_name}
-        peer_data_clean = {
-            "s3-initialization-start": "",
-            "s3-initialization-done": "",
-            "s3-initialization-block-message": "",
-            "stanza": "",
-        }
+        # Test that the primary starts the requested initialisation.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"s3-initialization-start": "request-2"}
+            )
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.unit.name, initialisation("request-1")
+            )
+        harness.charm.backup.coordinate_stanza_fields()
+        _start_stanza_initialisation.assert_called_once_with("request-2")
+        # The stanza of older requests isn't used.
+        assert harness.charm.backup.configured_stanza is None
 
-        # Add a new unit to the relation.
-        new_unit_name = "postgresql-k8s/1"
-        new_unit = Unit(new_unit_name, None, harness.charm.app._backend, {})
-        harness.add_relation_unit(peer_rel_id, new_unit_name)
+        # Test that the primary doesn't start it again while it's running.
+        _start_stanza_initialisation.reset_mock()
+        _running.return_value = [{"id": "stanza-1"}]
+        harness.charm.backup.coordinate_stanza_fields()
+        _start_stanza_initialisation.assert_not_called()
+        _running.return_value = []
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.unit.name, initialisation("request-2", "running")
+            )
+        harness.charm.backup.coordinate_stanza_fields()
+        _start_stanza_initialisation.assert_not_called()
+        # The primary archives the WAL to the stanza it's checking.
+        assert harness.charm.backup.configured_stanza == stanza_name
 
-        # Test with clear values.
+        # Test that an initialisation that timed out is only started again on update status,
+        # once its retry delay elapsed.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.unit.name,
+                {
+                    "stanza-initialisation": json.dumps({
+                        "request": "request-2",
+                        "state": "timed-out",
+                        "stanza": "",
+                        "block-message": "fake block message",
+                        "retry-after": 1300.0,
+                    })
+                },
+            )
+        with patch("backups.time.time", return_value=1200.0):
+            harness.charm.backup.coordinate_stanza_fields()
+            harness.charm.backup.coordinate_stanza_fields(retry_timed_out=True)
+        with patch("backups.time.time", return_value=1300.0):
+            harness.charm.backup.coordinate_stanza_fields()
+            _start_stanza_initialisation.assert_not_called()
+            harness.charm.backup.coordinate_stanza_fields(retry_timed_out=True)
+        _start_stanza_initialisation.assert_called_once_with("request-2")
+        _start_stanza_initialisation.reset_mock()
+
+        # Test that the replicas don't start it.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.unit.name, {"stanza-initialisation": ""}
+            )
+        _is_primary.return_value = False
         harness.charm.backup.coordinate_stanza_fields()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {}
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
-        assert harness.get_relation_data(peer_rel_id, new_unit) == {}
+        _start_stanza_initialisation.assert_not_called()
+        _update_config.assert_not_called()
 
-        # Test with primary failed prior leader s3 initialization sequence started.
+        # Test that the leader waits for the result of the primary.
         with harness.hooks_disabled():
-            harness.update_relation_data(peer_rel_id, new_unit_name, peer_data_primary_error)
+            harness.set_leader()
+            harness.update_relation_data(
+                peer_rel_id, new_unit_name, initialisation("request-2", "running")
+            )
         harness.charm.backup.coordinate_stanza_fields()
         _update_config.assert_not_called()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {}
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
-        assert harness.get_relation_data(peer_rel_id, new_unit) == peer_data_primary_error
+        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
+            "s3-initialization-start": "request-2"
+        }
 
-        # Test with non-leader unit.
+        # Test that the leader ignores the results of older requests.
         with harness.hooks_disabled():
             harness.update_relation_data(
-                peer_rel_id, harness.charm.app.name, peer_data_leader_start
+                peer_rel_id,
+                new_unit_name,
+                initialisation(
+                    "request-1", stanza="", block_message=ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
+                ),
             )
         harness.charm.backup.coordinate_stanza_fields()
         _update_config.assert_not_called()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == peer_data_leader_start
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
-        assert harness.get_relation_data(peer_rel_id, new_unit) == peer_data_primary_error
 
-        # Leader should sync fail result from the primary.
+        # Test that the leader publishes a failure of the primary.
         with harness.hooks_disabled():
-            harness.set_leader()
+            harness.update_relation_data(
+                peer_rel_id,
+                new_unit_name,
+                initialisation(
+                    "request-2", stanza="", block_message=ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
+                ),
+            )
         harness.charm.backup.coordinate_stanza_fields()
         _update_config.assert_called_once()
-        _reload_patroni_configuration.assert_not_called()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == peer_data_leader_error
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
-        assert harness.get_relation_data(peer_rel_id, new_unit) == peer_data_primary_error
+        _set_primary_status_message.assert_called_once()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
+            "s3-initialization-block-message": ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
+        }
 
-        # Test with successful result from the primary.
+        # Test that the leader publishes the stanza initialised by the primary in one update.
         _update_config.reset_mock()
         with harness.hooks_disabled():
-            harness.update_relation_data(peer_rel_id, harness.charm.app.name, peer_data_clean)
             harness.update_relation_data(
-                peer_rel_id, harness.charm.app.name, peer_data_leader_start
+                peer_rel_id,
+                harness.charm.app.name,
+                {"s3-initialization-start": "request-3", "s3-initialization-block-message": ""},
             )
-            harness.update_relation_data(peer_rel_id, new_unit_name, peer_data_clean)
-            harness.update_relation_data(peer_rel_id, new_unit_name, peer_data_primary_ok)
+            harness.update_relation_data(peer_rel_id, new_unit_name, initialisation("request-3"))
         harness.charm.backup.coordinate_stanza_fields()
         _update_config.assert_called_once()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == peer_data_leader_ok
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
-        assert harness.get_relation_data(peer_rel_id, new_unit) == peer_data_primary_ok
+        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {"stanza": stanza_name}
+        assert harness.charm.backup.configured_stanza == stanza_name
+        _start_stanza_initialisation.assert_not_called()
 
-        # Test when leader is waiting for the primary result.
-        _update_config.reset_mock()
+
+def test_s3_initialization_set_failure(harness):
+    with patch("charm.PostgreSQLBackups.coordinate_stanza_fields") as _coordinate_stanza_fields:
+        peer_rel_id = harness.model.get_relation(PEER).id
         with harness.hooks_disabled():
-            harness.update_relation_data(peer_rel_id, harness.charm.app.name, peer_data_clean)
             harness.update_relation_data(
-                peer_rel_id, harness.charm.app.name, peer_data_leader_start
+                peer_rel_id, harness.charm.app.name, {"s3-initialization-start": "request-1"}
             )
-            harness.update_relation_data(peer_rel_id, new_unit_name, peer_data_clean)
-        harness.charm.backup.coordinate_stanza_fields()
-        _update_config.assert_not_called()
-        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == peer_data_leader_start
-        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
-        assert harness.get_relation_data(peer_rel_id, new_unit) == {}
+
+        # Test that the failure is recorded for the pending request by default.
+        harness.charm.backup._s3_initialization_set_failure(
+            ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
+        )
+        assert json.loads(
+            harness.get_relation_data(peer_rel_id, harness.charm.unit)["stanza-initialisation"]
+        ) == {
+            "request": "request-1",
+            "state": "done",
+            "stanza": "",
+            "block-message": ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE,
+        }
+        _coordinate_stanza_fields.assert_called_once_with()
+
+        harness.charm.backup._s3_initialization_set_failure(
+            FAILED_TO_INITIALIZE_STANZA_ERROR_MESSAGE, request="request-0"
+        )
+        assert (
+            json.loads(
+                harness.get_relation_data(peer_rel_id, harness.charm.unit)["stanza-initialisation"]
+            )["request"]
+            == "request-0"
+        )
 
 
 def test_is_primary_pgbackrest_service_running(harness):
@@ -1105,9 +1915,7 @@ def test_on_s3_credential_changed(harness):
         patch(
             "charm.PostgresqlOperatorCharm.is_primary", new_callable=PropertyMock
         ) as _is_primary,
-        patch(
-            "charm.PostgreSQLBackups._on_s3_credential_changed_primary"
-        ) as _on_s3_credential_changed_primary,
+        patch("charm.PostgreSQLBackups.coordinate_stanza_fields") as _coordinate_stanza_fields,
         patch("ops.framework.EventBase.defer") as _defer,
         patch(
             "charm.PostgresqlOperatorCharm.is_standby_leader", new_callable=PropertyMock
@@ -1157,6 +1965,7 @@ def test_on_s3_credential_changed(harness):
         harness.charm.backup.s3_client.on.credentials_changed.emit(
             relation=harness.model.get_relation(S3_PARAMETERS_RELATION, s3_rel_id)
         )
+        _coordinate_stanza_fields.assert_called_once_with()
         _is_standby_leader.assert_called_once()
         assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
             "cluster_initialised": "True"
@@ -1164,13 +1973,14 @@ def test_on_s3_credential_changed(harness):
 
         # Test when unit is a leader but not primary
         _is_standby_leader.reset_mock()
+        _coordinate_stanza_fields.reset_mock()
         with harness.hooks_disabled():
             harness.set_leader()
         harness.charm.backup.s3_client.on.credentials_changed.emit(
             relation=harness.model.get_relation(S3_PARAMETERS_RELATION, s3_rel_id)
         )
         _set_primary_status_message.assert_called_once()
-        _on_s3_credential_changed_primary.assert_not_called()
+        _coordinate_stanza_fields.assert_called_once_with()
         _is_standby_leader.assert_called_once()
         assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
             "cluster_initialised": "True",
@@ -1180,74 +1990,18 @@ def test_on_s3_credential_changed(harness):
         # Test when unit is a leader and primary
         _is_primary.return_value = True
         _is_standby_leader.reset_mock()
+        _coordinate_stanza_fields.reset_mock()
         _set_primary_status_message.reset_mock()
         with harness.hooks_disabled():
             harness.set_leader()
         harness.charm.backup.s3_client.on.credentials_changed.emit(
             relation=harness.model.get_relation(S3_PARAMETERS_RELATION, s3_rel_id)
         )
-        _on_s3_credential_changed_primary.assert_called_once()
+        _coordinate_stanza_fields.assert_called_once_with()
         _set_primary_status_message.assert_not_called()
         _is_standby_leader.assert_called_once()
 
 
-def test_on_s3_credential_changed_primary(harness):
-    with (
-        patch("charm.PostgresqlOperatorCharm.update_config"),
-        patch("charm.Patroni.reload_patroni_configuration") as _reload_patroni_configuration,
-        patch(
-            "charm.PostgreSQLBackups._create_bucket_if_not_exists"
-        ) as _create_bucket_if_not_exists,
-        patch(
-            "charm.PostgreSQLBackups._s3_initialization_set_failure"
-        ) as _s3_initialization_set_failure,
-        patch("charm.PostgreSQLBackups.can_use_s3_repository") as _can_use_s3_repository,
-        patch("charm.PostgreSQLBackups._initialise_stanza") as _initialise_stanza,
-        patch("charm.PostgreSQLBackups.check_stanza") as _check_stanza,
-        patch(
-            "charm.PostgreSQLBackups._retrieve_s3_parameters",
-            return_value=({"path": "example"}, None),
-        ),
-        patch("charm.PostgreSQLBackups._upload_content_to_s3") as _upload_content_to_s3,
-    ):
-        mock_event = MagicMock()
-
-        _create_bucket_if_not_exists.side_effect = ValueError()
-        assert not harness.charm.backup._on_s3_credential_changed_primary(mock_event)
-        _reload_patroni_configuration.assert_not_called()
-        _create_bucket_if_not_exists.assert_called_once()
-        _s3_initialization_set_failure.assert_called_once_with(
-            FAILED_TO_ACCESS_CREATE_BUCKET_ERROR_MESSAGE
-        )
-        _can_use_s3_repository.assert_not_called()
-
-        _s3_initialization_set_failure.reset_mock()
-        _create_bucket_if_not_exists.side_effect = None
-        _can_use_s3_repository.return_value = (False, ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE)
-        assert not harness.charm.backup._on_s3_credential_changed_primary(mock_event)
-        _can_use_s3_repository.assert_called_once()
-        _s3_initialization_set_failure.assert_called_once_with(
-            ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE
-        )
-        _initialise_stanza.assert_not_called()
-
-        _can_use_s3_repository.return_value = (True, None)
-        _initialise_stanza.return_value = False
-        assert not harness.charm.backup._on_s3_credential_changed_primary(mock_event)
-        _initialise_stanza.assert_called_once()
-        _check_stanza.assert_not_called()
-
-        _initialise_stanza.return_value = True
-        _check_stanza.return_value = False
-        assert not harness.charm.backup._on_s3_credential_changed_primary(mock_event)
-        _check_stanza.assert_called_once()
-        _upload_content_to_s3.assert_not_called()
-
-        _check_stanza.return_value = True
-        assert harness.charm.backup._on_s3_credential_changed_primary(mock_event)
-        _upload_content_to_s3.assert_called_once()
-
-
 def test_on_s3_credential_gone(harness):
     with patch(
         "charm.PostgresqlOperatorCharm._set_primary_status_message"
@@ -1255,9 +2009,11 @@ def test_on_s3_credential_gone(harness):
         full_peer_s3_parameters = {
             "stanza": "test-stanza",
             "s3-initialization-start": "Thu Feb 24 05:00:00 2022",
-            "s3-initialization-done": "True",
             "s3-initialization-block-message": ANOTHER_CLUSTER_REPOSITORY_ERROR_MESSAGE,
         }
+        stanza_initialisation = {
+            "stanza-initialisation": '{"request": "Thu Feb 24 05:00:00 2022", "state": "done"}'
+        }
 
         peer_rel_id = harness.model.get_relation(PEER).id
         # Test that unrelated blocks will remain
@@ -1280,7 +2036,7 @@ def test_on_s3_credential_gone(harness):
             harness.update_relation_data(
                 peer_rel_id,
                 harness.charm.unit.name,
-                full_peer_s3_parameters,
+                stanza_initialisation,
             )
         harness.charm.backup._on_s3_credential_gone(None)
         assert harness.get_relation_data(peer_rel_id, harness.charm.app) == full_peer_s3_parameters
@@ -1292,14 +2048,14 @@ def test_on_s3_credential_gone(harness):
             harness.update_relation_data(
                 peer_rel_id,
                 harness.charm.unit.name,
-                full_peer_s3_parameters,
+                stanza_initialisation,
             )
         harness.charm.backup._on_s3_credential_gone(None)
         assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {}
         assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == {}
 
 
-def test_on_create_backup_action(harness):
+def test_on_create_backup_action(harness, tmp_path):
     with (
         patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
         patch(
@@ -1307,6 +2063,9 @@ def test_on_create_backup_action(harness):
         ) as _change_connectivity_to_database,
         patch("charm.PostgreSQLBackups._list_backups") as _list_backups,
         patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+        patch("charm.PostgreSQLBackups._rotate_backup_output") as _rotate_backup_output,
+        patch("charm.PostgreSQLBackups._stream_command") as _stream_command,
+        patch("charm.PostgreSQLBackups._upload_stream_to_s3") as _upload_stream_to_s3,
         patch(
             "charm.PostgresqlOperatorCharm.is_primary", new_callable=PropertyMock
         ) as _is_primary,
@@ -1316,6 +2075,14 @@ def test_on_create_backup_action(harness):
         patch("charm.PostgreSQLBackups._retrieve_s3_parameters") as _retrieve_s3_parameters,
         patch("charm.PostgreSQLBackups._can_unit_perform_backup") as _can_unit_perform_backup,
     ):
+        stdout_file = tmp_path / "backup.stdout"
+        stderr_file = tmp_path / "backup.stderr"
+        _rotate_backup_output.return_value = (str(stdout_file), str(stderr_file))
+        uploaded_logs = []
+        _upload_stream_to_s3.side_effect = lambda stream, *_: (
+            uploaded_logs.append(stream.read().decode()) or DEFAULT
+        )
+
         # Test when the unit cannot perform a backup because of type.
         mock_event = MagicMock()
         mock_event.params = {"type": "wrong"}
@@ -1331,6 +2098,19 @@ def test_on_create_backup_action(harness):
         mock_event.fail.assert_called_once()
         mock_event.set_results.assert_not_called()
 
+        # Test that the planned type of an auto backup is returned with its inputs.
+        mock_event = MagicMock()
+        mock_event.params = {"type": "auto"}
+        plan = {"type": "differential", "reason": "fake reason", "incremental-chain": "6"}
+        _list_backups.return_value = {"2023-01-01T09:00:00Z": ("full", "finished")}
+        with patch("charm.PostgreSQLBackups._plan_backup", return_value=plan):
+            harness.charm.backup._on_create_backup_action(mock_event)
+        mock_event.set_results.assert_called_once_with({"backup-plan": plan})
+        _list_backups.assert_called_once_with(show_failed=False)
+        mock_event.fail.assert_called_once_with("fake validation message")
+        _list_backups.reset_mock(return_value=True)
+        mock_event.params = {"type": "full"}
+
         # Test when the charm fails to upload a file to S3.
         mock_event.reset_mock()
         _can_unit_perform_backup.return_value = (True, None)
@@ -1378,7 +2158,9 @@ Juju Version: test-juju-version
         mock_event.params = {"type": "full"}
         _upload_content_to_s3.return_value = True
         _is_primary.return_value = True
-        _execute_command.return_value = (1, "", "fake error")
+        stdout_file.write_text("")
+        stderr_file.write_text("fake error")
+        _stream_command.return_value = 1
         harness.charm.backup._on_create_backup_action(mock_event)
         update_config_calls = [
             call(is_creating_backup=True),
@@ -1391,24 +2173,27 @@ Juju Version: test-juju-version
         # Test when the backup succeeds but the charm fails to upload the backup logs.
         mock_event.reset_mock()
         _upload_content_to_s3.reset_mock()
-        _upload_content_to_s3.side_effect = [True, False]
-        _execute_command.side_effect = None
+        _upload_stream_to_s3.reset_mock()
+        _upload_stream_to_s3.return_value = False
+        uploaded_logs.clear()
+        stdout_file.write_text("fake stdout")
+        stderr_file.write_text("fake stderr")
+        _stream_command.return_value = 0
         _execute_command.return_value = (0, "fake stdout", "fake stderr")
         _list_backups.return_value = {"2023-01-01T09:00:00Z": harness.charm.backup.stanza_name}
         _update_config.reset_mock()
         harness.charm.backup._on_create_backup_action(mock_event)
-        _upload_content_to_s3.assert_has_calls([
-            call(
-                expected_metadata,
-                f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/latest",
-                mock_s3_parameters,
-            ),
-            call(
-                "Stdout:\nfake stdout\n\nStderr:\nfake stderr\n",
-                f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/2023-01-01T09:00:00Z/backup.log",
-                mock_s3_parameters,
-            ),
-        ])
+        _upload_content_to_s3.assert_called_once_with(
+            expected_metadata,
+            f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/latest",
+            mock_s3_parameters,
+        )
+        _upload_stream_to_s3.assert_called_once_with(
+            ANY,
+            f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/2023-01-01T09:00:00Z/backup.log",
+            mock_s3_parameters,
+        )
+        assert uploaded_logs == ["Stdout:\nfake stdout\n\nStderr:\nfake stderr\n"]
         _update_config.assert_has_calls(update_config_calls)
         mock_event.fail.assert_called_once()
         mock_event.set_results.assert_not_called()
@@ -1416,22 +2201,22 @@ Juju Version: test-juju-version
         # Test when the backup succeeds (including the upload of the backup logs).
         mock_event.reset_mock()
         _upload_content_to_s3.reset_mock()
-        _upload_content_to_s3.side_effect = None
-        _upload_content_to_s3.return_value = True
+        _upload_stream_to_s3.reset_mock()
+        _upload_stream_to_s3.return_value = True
+        uploaded_logs.clear()
         _update_config.reset_mock()
         harness.charm.backup._on_create_backup_action(mock_event)
-        _upload_content_to_s3.assert_has_calls([
-            call(
-                expected_metadata,
-                f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/latest",
-                mock_s3_parameters,
-            ),
-            call(
-                "Stdout:\nfake stdout\n\nStderr:\nfake stderr\n",
-                f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/2023-01-01T09:00:00Z/backup.log",
-                mock_s3_parameters,
-            ),
-        ])
+        _upload_content_to_s3.assert_called_once_with(
+            expected_metadata,
+            f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/latest",
+            mock_s3_parameters,
+        )
+        _upload_stream_to_s3.assert_called_once_with(
+            ANY,
+            f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/2023-01-01T09:00:00Z/backup.log",
+            mock_s3_parameters,
+        )
+        assert uploaded_logs == ["Stdout:\nfake stdout\n\nStderr:\nfake stderr\n"]
         _change_connectivity_to_database.assert_not_called()
         _update_config.assert_has_calls(update_config_calls)
         mock_event.fail.assert_not_called()
@@ -1440,25 +2225,782 @@ Juju Version: test-juju-version
         # Test when this unit is a replica (the connectivity to the database should be changed).
         mock_event.reset_mock()
         _upload_content_to_s3.reset_mock()
+        _upload_stream_to_s3.reset_mock()
+        uploaded_logs.clear()
         _is_primary.return_value = False
         harness.charm.backup._on_create_backup_action(mock_event)
-        _upload_content_to_s3.assert_has_calls([
-            call(
-                expected_metadata,
-                f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/latest",
-                mock_s3_parameters,
-            ),
-            call(
-                "Stdout:\nfake stdout\n\nStderr:\nfake stderr\n",
-                f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/2023-01-01T09:00:00Z/backup.log",
-                mock_s3_parameters,
-            ),
-        ])
+        _upload_content_to_s3.assert_called_once_with(
+            expected_metadata,
+            f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/latest",
+            mock_s3_parameters,
+        )
+        _upload_stream_to_s3.assert_called_once_with(
+            ANY,
+            f"backup/{harness.charm.model.name}.{harness.charm.cluster_name}/2023-01-01T09:00:00Z/backup.log",
+            mock_s3_parameters,
+        )
+        assert uploaded_logs == ["Stdout:\nfake stdout\n\nStderr:\nfake stderr\n"]
         assert _change_connectivity_to_database.call_count == 2
         mock_event.fail.assert_not_called()
         mock_event.set_results.assert_called_once_with({"backup-status": "backup created"})
 
-
+        # Test when the backup is created in the background (the unit state is restored
+        # only when the job completes).
+        mock_event.reset_mock()
+        mock_event.params = {"type": "full", "background": True}
+        _stream_command.reset_mock()
+        _change_connectivity_to_database.reset_mock()
+        _update_config.reset_mock()
+        with patch.object(
+            harness.charm.background_jobs, "start", return_value="backup-1"
+        ) as _start:
+            harness.charm.backup._on_create_backup_action(mock_event)
+            _start.assert_called_once_with(
+                "backup",
+                [
+                    PGBACKREST_EXECUTABLE,
+                    PGBACKREST_CONFIGURATION_FILE,
+                    f"--stanza={harness.charm.backup.stanza_name}",
+                    "--log-level-console=debug",
+                    "--type=full",
+                    "backup",
+                ],
+                metadata={
+                    "backup-type": "full",
+                    "datetime-backup-requested": "2023-01-01T09:00:00Z",
+                    "restore-connectivity": True,
+                },
+                user="snap_daemon",
+            )
+        _stream_command.assert_not_called()
+        _change_connectivity_to_database.assert_called_once_with(connectivity=False)
+        _update_config.assert_called_once_with(is_creating_backup=True)
+        assert harness.charm.unit.status == MaintenanceStatus("creating backup")
+        assert json.loads(harness.charm.unit_peer_data["backup-job"]) == {
+            "job-id": "backup-1",
+            "backup-type": "full",
+            "started-at": "2023-01-01T09:00:00Z",
+        }
+        mock_event.fail.assert_not_called()
+        mock_event.set_results.assert_called_once_with({
+            "backup-status": "backup started",
+            "job-id": "backup-1",
+        })
+
+        # Test that only one backup can be created in the background at a time.
+        mock_event.reset_mock()
+        with patch(
+            "charm.PostgreSQLBackups.is_backup_running_in_background",
+            new_callable=PropertyMock,
+            return_value=True,
+        ):
+            harness.charm.backup._on_create_backup_action(mock_event)
+        mock_event.fail.assert_called_once_with(
+            "A backup is already being created in the background"
+        )
+        mock_event.set_results.assert_not_called()
+
+
+def test_scheduled_backup_type(harness):
+    with (
+        patch("backups.BackupCatalog.info") as _info,
+        patch("charm.PostgreSQLBackups._retrieve_s3_parameters") as _retrieve_s3_parameters,
+        patch("backups.time.time", return_value=1000000),
+    ):
+        # Test that full (and local) backups are kept as they are.
+        assert harness.charm.backup._scheduled_backup_type("full") == "full"
+        assert harness.charm.backup._scheduled_backup_type("local") == "local"
+        _info.assert_not_called()
+
+        # Test when there is no full backup to reference.
+        _info.return_value = [
+            {"backup": [{"type": "full", "error": True, "timestamp": {"stop": 999000}}]}
+        ]
+        assert harness.charm.backup._scheduled_backup_type("incremental") == "full"
+        _info.side_effect = ListBackupsError
+        assert harness.charm.backup._scheduled_backup_type("incremental") == "full"
+
+        # Test when the last full backup is older than the retention period.
+        _info.side_effect = None
+        _info.return_value = [
+            {
+                "backup": [
+                    {"type": "full", "error": False, "timestamp": {"stop": 100000}},
+                    {"type": "incr", "error": False, "timestamp": {"stop": 999000}},
+                ]
+            }
+        ]
+        _retrieve_s3_parameters.return_value = ({"delete-older-than-days": "9"}, [])
+        assert harness.charm.backup._scheduled_backup_type("differential") == "full"
+
+        # Test when the last full backup is within the retention period.
+        _retrieve_s3_parameters.return_value = ({"delete-older-than-days": "11"}, [])
+        assert harness.charm.backup._scheduled_backup_type("differential") == "differential"
+
+        # Test that the type of the auto backups is planned.
+        with patch(
+            "charm.PostgreSQLBackups._plan_backup",
+            return_value={"type": "incremental", "reason": "fake reason"},
+        ):
+            assert harness.charm.backup._scheduled_backup_type("auto") == "incremental"
+
+
+def test_plan_backup(harness):
+    with (
+        patch("backups.BackupCatalog.info") as _info,
+        patch("charm.PostgreSQLBackups._retrieve_s3_parameters") as _retrieve_s3_parameters,
+        patch("backups.time.time", return_value=10 * 24 * 60 * 60),
+    ):
+        _retrieve_s3_parameters.return_value = ({"delete-older-than-days": "30"}, [])
+        day = 24 * 60 * 60
+
+        def backup(backup_type, stop, delta, size=1000, **kwargs):
+            return {
+                "type": backup_type,
+                "error": False,
+                "timestamp": {"stop": stop},
+                "info": {"size": size, "delta": delta},
+                **kwargs,
+            }
+
+        # Test when there is no full backup to reference.
+        _info.return_value = [{"backup": [{**backup("full", 0, 1000), "error": True}]}]
+        assert harness.charm.backup._plan_backup() == {
+            "type": "full",
+            "reason": "no full backup to reference",
+        }
+
+        # Test when the last full backup is older than the retention period.
+        _retrieve_s3_parameters.return_value = ({"delete-older-than-days": "9"}, [])
+        _info.return_value = [{"backup": [backup("full", 0, 1000)]}]
+        assert harness.charm.backup._plan_backup()["reason"] == (
+            "the last full backup is older than the retention period"
+        )
+
+        # Test when the last full backup is older than backup_auto_full_max_age.
+        _retrieve_s3_parameters.return_value = ({"delete-older-than-days": "30"}, [])
+        assert harness.charm.backup._plan_backup() == {
+            "type": "full",
+            "reason": "the last full backup is older than 7 days",
+            "last-full-age": "10.0 days",
+            "changed-ratio": "0.00",
+            "incremental-chain": "0",
+            "chain-length": "1",
+        }
+
+        # Test when a short chain of incremental backups follows the last full backup
+        # (the backups of the local repository and the failed ones are ignored).
+        _info.return_value = [
+            {
+                "backup": [
+                    backup("full", 5 * day, 1000),
+                    backup("incr", 6 * day, 100),
+                    backup("full", 7 * day, 1000, database={"repo-key": 2}),
+                    {**backup("incr", 8 * day, 900), "error": True},
+                    backup("incr", 9 * day, 100, size=1100),
+                ]
+            }
+        ]
+        assert harness.charm.backup._plan_backup() == {
+            "type": "incremental",
+            "reason": "few changes since the last full backup and a short chain of backups",
+            "last-full-age": "5.0 days",
+            "changed-ratio": "0.18",
+            "incremental-chain": "2",
+            "chain-length": "3",
+        }
+
+        # Test when the chain of incremental backups is too long.
+        _info.return_value = [
+            {
+                "backup": [
+                    backup("full", 5 * day, 1000),
+                    backup("diff", 6 * day, 200),
+                    *[backup("incr", 7 * day, 10) for _ in range(6)],
+                ]
+            }
+        ]
+        plan = harness.charm.backup._plan_backup()
+        assert plan["type"] == "differential"
+        assert plan["reason"] == (
+            "6 incremental backups since the last full or differential backup"
+        )
+        assert plan["changed-ratio"] == "0.26"
+
+        # Test when most of the database changed since the last full backup.
+        with harness.hooks_disabled():
+            harness.update_config({"backup_auto_full_changed_ratio": 0.25})
+        assert harness.charm.backup._plan_backup()["reason"] == (
+            "26% of the database changed since the last full backup"
+        )
+
+
+def test_create_scheduled_backup(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
+        patch(
+            "charm.PostgreSQLBackups._change_connectivity_to_database"
+        ) as _change_connectivity_to_database,
+        patch(
+            "charm.PostgresqlOperatorCharm.is_primary", new_callable=PropertyMock
+        ) as _is_primary,
+        patch(
+            "charm.PostgreSQLBackups.is_backup_running_in_background", new_callable=PropertyMock
+        ) as _is_backup_running_in_background,
+        patch(
+            "charm.Patroni.is_creating_backup", new_callable=PropertyMock
+        ) as _is_creating_backup,
+        patch("charm.PostgreSQLBackups._can_unit_perform_backup") as _can_unit_perform_backup,
+        patch("charm.PostgreSQLBackups._scheduled_backup_type") as _scheduled_backup_type,
+        patch("charm.PostgreSQLBackups._retrieve_s3_parameters") as _retrieve_s3_parameters,
+        patch("charm.PostgreSQLBackups._upload_backup_metadata") as _upload_backup_metadata,
+        patch("charm.PostgreSQLBackups._start_backup_job") as _start_backup_job,
+        patch("backups.datetime") as _datetime,
+    ):
+        # Test when a backup is already running.
+        _is_backup_running_in_background.return_value = True
+        _is_creating_backup.return_value = False
+        harness.charm.backup.create_scheduled_backup("full")
+        _can_unit_perform_backup.assert_not_called()
+        _start_backup_job.assert_not_called()
+
+        # Test when the unit shouldn't take the backup.
+        _is_backup_running_in_background.return_value = False
+        _can_unit_perform_backup.return_value = (False, "fake validation message")
+        harness.charm.backup.create_scheduled_backup("full")
+        _can_unit_perform_backup.assert_called_once_with(check_backup_source=False)
+        _upload_backup_metadata.assert_not_called()
+        _start_backup_job.assert_not_called()
+
+        # Test when the metadata can't be uploaded.
+        _can_unit_perform_backup.return_value = (True, None)
+        _scheduled_backup_type.return_value = "full"
+        _retrieve_s3_parameters.return_value = ({"path": "test-path"}, [])
+        _datetime.now.return_value.strftime.return_value = "2023-01-01T09:00:00Z"
+        _upload_backup_metadata.return_value = False
+        harness.charm.backup.create_scheduled_backup("incremental")
+        _scheduled_backup_type.assert_called_once_with("incremental")
+        _upload_backup_metadata.assert_called_once_with(
+            "2023-01-01T09:00:00Z", {"path": "test-path"}
+        )
+        _update_config.assert_not_called()
+        _start_backup_job.assert_not_called()
+
+        # Test when the backup is started in a replica.
+        _upload_backup_metadata.return_value = True
+        _is_primary.return_value = False
+        harness.charm.backup.create_scheduled_backup("incremental")
+        _change_connectivity_to_database.assert_called_once_with(connectivity=False)
+        _update_config.assert_called_once_with(is_creating_backup=True)
+        _start_backup_job.assert_called_once_with("2023-01-01T09:00:00Z", "full")
+        assert isinstance(harness.charm.unit.status, MaintenanceStatus)
+
+        # Test when the backup job fails to start.
+        _change_connectivity_to_database.reset_mock()
+        _update_config.reset_mock()
+        _start_backup_job.side_effect = OSError
+        harness.charm.backup.create_scheduled_backup("incremental")
+        _change_connectivity_to_database.assert_has_calls([
+            call(connectivity=False),
+            call(connectivity=True),
+        ])
+        _update_config.assert_has_calls([
+            call(is_creating_backup=True),
+            call(is_creating_backup=False),
+        ])
+        assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_scheduled_backup_unit(harness):
+    with (
+        patch("charm.Patroni.get_primary") as _get_primary,
+        patch("charm.PostgreSQLBackups.backup_source") as _backup_source,
+        patch("ops.model.Application.planned_units") as _planned_units,
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+        _get_primary.return_value = "postgresql/0"
+        _backup_source.return_value = "postgresql/1"
+        _planned_units.return_value = 2
+
+        # Test that the primary takes the backups when the standbys can't (no TLS).
+        assert harness.charm.backup.scheduled_backup_unit("full") == "postgresql/0"
+        _get_primary.assert_called_once_with(unit_name_pattern=True)
+
+        # Test that the best backup source takes the S3 backups.
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.unit.name, {"tls": "True"})
+        assert harness.charm.backup.scheduled_backup_unit("incremental") == "postgresql/1"
+
+        # Test that the primary always takes the local backups.
+        assert harness.charm.backup.scheduled_backup_unit("local") == "postgresql/0"
+
+        # Test that the primary takes the backups in a single unit cluster.
+        _planned_units.return_value = 1
+        assert harness.charm.backup.scheduled_backup_unit("full") == "postgresql/0"
+
+        # Test when the primary can't be determined.
+        _get_primary.return_value = None
+        assert harness.charm.backup.scheduled_backup_unit("full") is None
+
+
+def test_backup_repository(harness):
+    with patch("backups.BackupCatalog.info") as _info:
+        _info.return_value = [
+            {
+                "backup": [
+                    {"label": "20230101-090000F", "database": {"id": 1, "repo-key": 2}},
+                    {"label": "20230102-090000F", "database": {"id": 1, "repo-key": 1}},
+                ],
+                "name": "test-stanza",
+            }
+        ]
+        assert harness.charm.backup._backup_repository("20230101-090000F") == 2
+        assert harness.charm.backup._backup_repository("20230102-090000F") == 1
+        assert harness.charm.backup._backup_repository("20230103-090000F") is None
+
+        _info.return_value = []
+        assert harness.charm.backup._backup_repository("20230101-090000F") is None
+
+
+def test_can_unit_verify_repository(harness):
+    with (
+        patch("charm.PostgreSQLBackups._is_standby_cluster") as _is_standby_cluster,
+        patch("charm.PostgreSQLBackups.backup_source") as _backup_source,
+        patch("charm.PostgreSQLBackups._are_backup_settings_ok") as _are_backup_settings_ok,
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+
+        # Test when the unit belongs to a standby cluster.
+        _is_standby_cluster.return_value = True
+        assert harness.charm.backup._can_unit_verify_repository() == (
+            False,
+            "The repository is verified by the primary cluster",
+        )
+
+        # Test when the stanza wasn't initialised.
+        _is_standby_cluster.return_value = False
+        assert harness.charm.backup._can_unit_verify_repository() == (
+            False,
+            "Stanza was not initialised",
+        )
+
+        # Test when the cluster has a single unit (it verifies the repository itself).
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.app.name, {"stanza": "test"})
+        harness.set_planned_units(1)
+        _are_backup_settings_ok.return_value = (True, None)
+        assert harness.charm.backup._can_unit_verify_repository() == (True, None)
+        _backup_source.assert_not_called()
+
+        # Test when another unit is the backup source.
+        harness.set_planned_units(2)
+        _backup_source.return_value = "postgresql/1"
+        assert harness.charm.backup._can_unit_verify_repository() == (
+            False,
+            "Unit doesn't verify the repository as postgresql/1 is the backup source",
+        )
+
+        # Test when this unit is the backup source.
+        _backup_source.return_value = harness.charm.unit.name
+        assert harness.charm.backup._can_unit_verify_repository() == (True, None)
+
+
+def test_create_scheduled_verification(harness):
+    with (
+        patch(
+            "charm.PostgreSQLBackups._can_unit_verify_repository"
+        ) as _can_unit_verify_repository,
+        patch(
+            "charm.PostgreSQLBackups.stanza_name",
+            new_callable=PropertyMock,
+            return_value="test-stanza",
+        ),
+        patch.object(harness.charm.background_jobs, "running") as _running,
+        patch.object(harness.charm.background_jobs, "start") as _start,
+    ):
+        # Test when a verification is already running.
+        _running.return_value = [{"id": "verify-1"}]
+        harness.charm.backup.create_scheduled_verification()
+        _running.assert_called_once_with("verify")
+        _can_unit_verify_repository.assert_not_called()
+        _start.assert_not_called()
+
+        # Test when the unit shouldn't verify the repository.
+        _running.return_value = []
+        _can_unit_verify_repository.return_value = (False, "fake validation message")
+        harness.charm.backup.create_scheduled_verification()
+        _start.assert_not_called()
+
+        # Test when the verification is started (with a single process and throttled).
+        _can_unit_verify_repository.return_value = (True, None)
+        harness.update_config({"backup_nice": 10, "backup_ionice_class": "idle"})
+        command = [
+            "nice",
+            "-n",
+            "10",
+            "ionice",
+            "-c",
+            "3",
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            "--stanza=test-stanza",
+            "--process-max=1",
+            "--output=text",
+            "--verbose",
+            "verify",
+        ]
+        harness.charm.backup.create_scheduled_verification()
+        _start.assert_called_once_with(
+            "verify", command, metadata={"stanza": "test-stanza"}, user="snap_daemon"
+        )
+
+        # Test when the job fails to start.
+        _start.side_effect = OSError
+        harness.charm.backup.create_scheduled_verification()
+
+
+def test_process_verification_result(harness):
+    with patch.object(harness.charm.background_jobs, "read_output") as _read_output:
+        job = {
+            "id": "verify-1",
+            "state": "finished",
+            "return-code": 0,
+            "started-at": "2023-01-01T09:00:00Z",
+            "finished-at": "2023-01-01T09:03:20Z",
+            "metadata": {"stanza": "test-stanza"},
+        }
+
+        # Test when the repository is valid.
+        _read_output.return_value = (
+            "stanza: test-stanza\n"
+            "status: ok\n"
+            "  archiveId: 16-1, total WAL checked: 3, total valid WAL: 3\n"
+            "  backup: 20230101-080000F, status: valid, total files checked: 10,"
+            " total valid files: 10\n"
+            "  backup: 20230101-083000F_20230101-084000I, status: valid,"
+            " total files checked: 2, total valid files: 2\n",
+            "",
+        )
+        harness.charm.backup._process_verification_result(job)
+        assert json.loads(harness.charm.unit_peer_data["backup-verification"]) == {
+            "stanza": "test-stanza",
+            "finished-at": "2023-01-01T09:03:20Z",
+            "duration": 200,
+            "status": "ok",
+            "backups": {
+                "20230101-080000F": "valid",
+                "20230101-083000F_20230101-084000I": "valid",
+            },
+        }
+
+        # Test when invalid files are found.
+        _read_output.return_value = (
+            "stanza: test-stanza\n"
+            "status: error\n"
+            "  backup: 20230101-080000F, status: invalid, total files checked: 10,"
+            " total valid files: 9\n"
+            "    checksum invalid: 1\n",
+            "",
+        )
+        harness.charm.backup._process_verification_result(job)
+        verification = json.loads(harness.charm.unit_peer_data["backup-verification"])
+        assert verification["status"] == "error"
+        assert verification["backups"] == {"20230101-080000F": "invalid"}
+
+        # Test when the command failed before verifying the repository.
+        _read_output.return_value = ("", "ERROR: [049]: unable to get info for path/file")
+        harness.charm.backup._process_verification_result({**job, "return-code": 49})
+        verification = json.loads(harness.charm.unit_peer_data["backup-verification"])
+        assert verification["status"] == "failed"
+        assert verification["backups"] == {}
+
+
+def test_on_background_job_completed(harness, tmp_path):
+    with (
+        patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
+        patch(
+            "charm.PostgreSQLBackups._change_connectivity_to_database"
+        ) as _change_connectivity_to_database,
+        patch("charm.PostgreSQLBackups._process_backup_result") as _process_backup_result,
+        patch("charm.PostgreSQLBackups._retrieve_s3_parameters") as _retrieve_s3_parameters,
+        patch.object(harness.charm.background_jobs, "completed") as _completed,
+        patch.object(harness.charm.background_jobs, "mark_processed") as _mark_processed,
+    ):
+        _retrieve_s3_parameters.return_value = ({"bucket": "test-bucket"}, [])
+        (tmp_path / "backup-1.stderr").write_text("fake stderr")
+        job = {
+            "id": "backup-1",
+            "state": "finished",
+            "return-code": 0,
+            "stdout-file": str(tmp_path / "backup-1.stdout"),
+            "stderr-file": str(tmp_path / "backup-1.stderr"),
+            "metadata": {
+                "backup-type": "full",
+                "datetime-backup-requested": "2023-01-01T09:00:00Z",
+                "restore-connectivity": True,
+            },
+        }
+
+        # Test when there are no completed jobs.
+        completed_jobs = {}
+        _completed.side_effect = lambda job_type: completed_jobs.get(job_type, [])
+        harness.charm.backup._on_background_job_completed(None)
+        _process_backup_result.assert_not_called()
+        _update_config.assert_not_called()
+
+        # Test when the backup job finished.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                harness.model.get_relation(PEER).id,
+                harness.charm.unit.name,
+                {"backup-job": '{"job-id": "backup-1"}'},
+            )
+        completed_jobs["backup"] = [job]
+        _process_backup_result.return_value = None
+        harness.charm.backup._on_background_job_completed(None)
+        _process_backup_result.assert_called_once_with(
+            0,
+            str(tmp_path / "backup-1.stdout"),
+            str(tmp_path / "backup-1.stderr"),
+            {"bucket": "test-bucket"},
+            "2023-01-01T09:00:00Z",
+            "full",
+        )
+        _mark_processed.assert_called_once_with(job)
+        _change_connectivity_to_database.assert_called_once_with(connectivity=True)
+        _update_config.assert_called_once_with(is_creating_backup=False)
+        assert "backup-job" not in harness.charm.unit_peer_data
+        assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+        # Test when the worker process was lost (the backup is handled as failed).
+        _process_backup_result.reset_mock()
+        _change_connectivity_to_database.reset_mock()
+        completed_jobs["backup"] = [
+            {**job, "state": "lost", "return-code": None, "metadata": {**job["metadata"]}}
+        ]
+        completed_jobs["backup"][0]["metadata"]["restore-connectivity"] = False
+        harness.charm.backup._on_background_job_completed(None)
+        _process_backup_result.assert_called_once_with(
+            -1,
+            str(tmp_path / "backup-1.stdout"),
+            str(tmp_path / "backup-1.stderr"),
+            {"bucket": "test-bucket"},
+            "2023-01-01T09:00:00Z",
+            "full",
+        )
+        assert (tmp_path / "backup-1.stderr").read_text() == (
+            "fake stderr\nThe backup process was interrupted before finishing."
+        )
+        _change_connectivity_to_database.assert_not_called()
+
+        # Test when a verification of the repository finished.
+        _process_backup_result.reset_mock()
+        _mark_processed.reset_mock()
+        verify_job = {"id": "verify-1", "state": "finished", "return-code": 0, "metadata": {}}
+        completed_jobs.clear()
+        completed_jobs["verify"] = [verify_job]
+        with (
+            patch(
+                "charm.PostgreSQLBackups._process_verification_result"
+            ) as _process_verification_result,
+            patch.object(harness.charm.verification_metrics, "update") as _update_metrics,
+        ):
+            harness.charm.backup._on_background_job_completed(None)
+            _process_verification_result.assert_called_once_with(verify_job)
+            _mark_processed.assert_called_once_with(verify_job)
+            _update_metrics.assert_called_once_with()
+            _process_backup_result.assert_not_called()
+
+        # Test when the analyze of the restored databases finished (or failed).
+        _mark_processed.reset_mock()
+        completed_jobs.clear()
+        for state, return_code in [("finished", 0), ("finished", 1), ("lost", None)]:
+            analyze_job = {
+                "id": "analyze-1",
+                "state": state,
+                "return-code": return_code,
+                "stdout-file": str(tmp_path / "analyze-1.stdout"),
+                "stderr-file": str(tmp_path / "analyze-1.stderr"),
+                "metadata": {},
+            }
+            completed_jobs["analyze"] = [analyze_job]
+            with patch(
+                "charm.PostgresqlOperatorCharm._set_primary_status_message"
+            ) as _set_primary_status_message:
+                harness.charm.backup._on_background_job_completed(None)
+                _mark_processed.assert_called_once_with(analyze_job)
+                _set_primary_status_message.assert_called_once_with()
+            _mark_processed.reset_mock()
+
+        # Test that the databases that failed to be analyzed are logged.
+        (tmp_path / "analyze-1.stdout").write_text(
+            'vacuumdb: failed to analyze database "app-db" (stage minimal)\n'
+            'vacuumdb: failed to analyze database "app-db" (stage medium)\n'
+            'vacuumdb: failed to analyze database "test-db" (stage medium)\n'
+        )
+        (tmp_path / "analyze-1.stderr").write_text("fake stderr\n")
+        completed_jobs["analyze"] = [{**analyze_job, "state": "finished", "return-code": 1}]
+        with (
+            patch("charm.PostgresqlOperatorCharm._set_primary_status_message"),
+            patch("backups.logger") as _logger,
+        ):
+            harness.charm.backup._on_background_job_completed(None)
+            _logger.error.assert_called_once_with(
+                "Failed to analyze the restored databases app-db, test-db in job analyze-1:"
+                " fake stderr"
+            )
+
+
+def test_analyze_command(harness, tmp_path):
+    with (
+        patch("charm.Patroni.get_postgresql_version", return_value="16.9"),
+        patch("charm.PostgresqlOperatorCharm.cpu_count", new_callable=PropertyMock) as _cpu_count,
+        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+    ):
+        _cpu_count.return_value = 4
+        vacuumdb = "/snap/charmed-postgresql/current/usr/lib/postgresql/16/bin/vacuumdb"
+
+        # Test that all the databases are analyzed at once when none is skipped.
+        assert harness.charm.backup._analyze_command([]) == [
+            vacuumdb,
+            "--host=/tmp",
+            "--username=backup",
+            "--jobs=4",
+            "--analyze-in-stages",
+            "--all",
+        ]
+        _execute_command.assert_not_called()
+
+        # Test when some databases are skipped: the stages are run one by one over the other
+        # databases, and a database that fails doesn't stop the others.
+        _execute_command.return_value = (0, "app-db\nother-db\npostgres\n", "")
+        command = harness.charm.backup._analyze_command(["other-db"])
+        assert command[:2] == ["/bin/sh", "-c"]
+        assert _execute_command.call_args[0][0][0] == (
+            "/snap/charmed-postgresql/current/usr/lib/postgresql/16/bin/psql"
+        )
+        fake_vacuumdb = tmp_path / "vacuumdb"
+        fake_vacuumdb.write_text(
+            '#!/bin/sh\necho "$PGOPTIONS $*" >&2\n[ "$5" != --dbname=app-db ]\n'
+        )
+        fake_vacuumdb.chmod(0o755)
+        result = run(
+            [*command[:2], command[2].replace(vacuumdb, str(fake_vacuumdb))],
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 1
+        assert result.stdout.splitlines() == [
+            line
+            for stage in ["minimal", "medium", "default"]
+            for line in [
+                f'vacuumdb: processing database "app-db": Generating {stage} optimizer statistics',
+                f'vacuumdb: failed to analyze database "app-db" (stage {stage})',
+                f'vacuumdb: processing database "postgres": Generating {stage} optimizer'
+                " statistics",
+            ]
+        ]
+        assert result.stderr.splitlines() == [
+            f"{options} --host=/tmp --username=backup --jobs=4 --analyze-only --dbname={database}"
+            for options in [
+                "-c default_statistics_target=1 -c vacuum_cost_delay=0",
+                "-c default_statistics_target=10 -c vacuum_cost_delay=0",
+                "",
+            ]
+            for database in ["app-db", "postgres"]
+        ]
+
+        # Test when all the databases are skipped.
+        assert harness.charm.backup._analyze_command(["app-db", "other-db", "postgres"]) is None
+
+        # Test when the databases can't be listed.
+        _execute_command.return_value = (2, "", "fake error")
+        with pytest.raises(Exception, match="fake error"):
+            harness.charm.backup._analyze_command(["other-db"])
+
+
+def test_start_post_restore_analyze(harness):
+    with (
+        patch("charm.PostgreSQLBackups._analyze_command") as _analyze_command,
+        patch.object(harness.charm.background_jobs, "start") as _start,
+        patch.object(harness.charm.background_jobs, "running", return_value=[]),
+    ):
+        # Test when the databases can't be listed.
+        _analyze_command.side_effect = Exception("fake error")
+        harness.charm.backup.start_post_restore_analyze(["test-db"])
+        _start.assert_not_called()
+
+        # Test when all the databases are skipped.
+        _analyze_command.side_effect = None
+        _analyze_command.return_value = None
+        harness.charm.backup.start_post_restore_analyze(["test-db"])
+        _start.assert_not_called()
+
+        _analyze_command.return_value = ["vacuumdb", "--all"]
+        harness.charm.backup.start_post_restore_analyze([])
+        _start.assert_called_once_with("analyze", ["vacuumdb", "--all"], {"skip-databases": []})
+        assert harness.charm.unit.status == MaintenanceStatus("analyzing restored databases")
+
+
+def test_analyze_status_message(harness):
+    with (
+        patch.object(harness.charm.background_jobs, "running") as _running,
+        patch.object(harness.charm.background_jobs, "read_output") as _read_output,
+    ):
+        _running.return_value = [{"id": "analyze-1"}]
+        _read_output.return_value = ("", "")
+        assert harness.charm.backup.is_analyze_running
+        assert harness.charm.backup.analyze_status_message() == "analyzing restored databases"
+
+        _read_output.return_value = (
+            'vacuumdb: processing database "app-db": Generating minimal optimizer statistics'
+            " (1 target)\n"
+            'vacuumdb: processing database "postgres": Generating minimal optimizer statistics'
+            " (1 target)\n"
+            'vacuumdb: processing database "app-db": Generating medium optimizer statistics'
+            " (10 targets)\n",
+            "",
+        )
+        assert harness.charm.backup.analyze_status_message() == (
+            "analyzing restored databases: stage 2/3 (app-db)"
+        )
+
+        _running.return_value = []
+        assert not harness.charm.backup.is_analyze_running
+
+
+def test_running_backup_jobs(harness):
+    # Test when no unit is creating a backup in the background.
+    assert harness.charm.backup._running_backup_jobs() == []
+
+    # Test when units are creating backups in the background.
+    with harness.hooks_disabled():
+        peer_rel_id = harness.model.get_relation(PEER).id
+        harness.add_relation_unit(peer_rel_id, "postgresql/1")
+        harness.update_relation_data(
+            peer_rel_id,
+            "postgresql/1",
+            {
+                "backup-job": '{"job-id": "backup-1", "backup-type": "full", '
+                '"started-at": "2023-01-01T09:00:00Z"}'
+            },
+        )
+    assert harness.charm.backup._running_backup_jobs() == [
+        (
+            "2023-01-01T09:00:00Z",
+            "full backup",
+            "running",
+            "None",
+            "n/a",
+            "2023-01-01T09:00:00Z",
+            "n/a",
+            "",
+            "n/a",
+            "postgresql/1 (job backup-1)",
+        )
+    ]
+
+
 def test_on_list_backups_action(harness):
     with (
         patch(
@@ -1514,19 +3056,181 @@ def test_on_list_backups_action(harness):
         mock_event.fail.assert_not_called()
 
 
+def test_on_benchmark_compression_action(harness):
+    with (
+        patch("charm.PostgreSQLBackups._throttle_command", side_effect=lambda command: command),
+        patch("backups.write_sample") as _write_sample,
+        patch("backups.is_available") as _is_available,
+        patch("backups.run_benchmark") as _run_benchmark,
+    ):
+        # Test when an unknown compression type is requested.
+        mock_event = MagicMock()
+        mock_event.params = {"sample-size": 8, "types": "zst,bz2"}
+        harness.charm.backup._on_benchmark_compression_action(mock_event)
+        mock_event.fail.assert_called_once_with("Unknown compression types: bz2")
+        _write_sample.assert_not_called()
+
+        # Test when there is no data to benchmark.
+        mock_event.reset_mock()
+        mock_event.params = {"sample-size": 8, "types": "zst,lz4,gz"}
+        _write_sample.return_value = 0
+        harness.charm.backup._on_benchmark_compression_action(mock_event)
+        mock_event.fail.assert_called_once_with(
+            "There is no data to benchmark in the data directory"
+        )
+        assert _write_sample.call_args[0][:2] == (
+            "/var/snap/charmed-postgresql/common/var/lib/postgresql",
+            8 * 1024 * 1024,
+        )
+        _run_benchmark.assert_not_called()
+
+        # Test that the configured levels are benchmarked besides the default ones.
+        mock_event.reset_mock()
+        with harness.hooks_disabled():
+            harness.update_config({
+                "backup_compress_level": "6",
+                "backup_archive_push_compress_type": "lz4",
+                "backup_archive_push_compress_level": "-2",
+            })
+        _write_sample.return_value = 4 * 1024 * 1024
+        _is_available.side_effect = lambda compress_type: compress_type != "gz"
+        result = {"ratio": "2.00", "throughput": "100.0MB/s", "compressed-size": "2.0MB"}
+
+        def run_benchmark(command, *_):
+            if command == ["zstd", "-19", "-c"]:
+                raise OSError("zstd failed")
+            return result
+
+        _run_benchmark.side_effect = run_benchmark
+        harness.charm.backup._on_benchmark_compression_action(mock_event)
+        mock_event.fail.assert_not_called()
+        mock_event.set_results.assert_called_once_with({
+            "sample-size": "4.0MB",
+            "results": {
+                "zst-1": result,
+                "zst-3": result,
+                "zst-6": result,
+                "zst-9": result,
+                "zst-19": "failed",
+                "lz4-fast-2": result,
+                "lz4-1": result,
+                "lz4-6": result,
+                "lz4-12": result,
+                "gz": "unavailable",
+            },
+        })
+
+
+def test_backup_catalog(harness):
+    with (
+        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+        patch("charm.PostgreSQLBackups._retrieve_s3_parameters") as _retrieve_s3_parameters,
+        patch("backups.time.time", return_value=1000.0) as _time,
+    ):
+        catalog = harness.charm.backup.catalog
+        _retrieve_s3_parameters.return_value = ({"bucket": "test-bucket", "path": "/"}, [])
+        _execute_command.return_value = (0, '[{"name": "test-stanza", "backup": []}]', "")
+
+        # The first access reads the repository, the next ones use the cached contents.
+        assert catalog.info() == [{"name": "test-stanza", "backup": []}]
+        assert catalog.info() == [{"name": "test-stanza", "backup": []}]
+        _execute_command.assert_called_once_with(
+            [PGBACKREST_EXECUTABLE, PGBACKREST_CONFIGURATION_FILE, "info", "--output=json"],
+            timeout=None,
+        )
+
+        _execute_command.reset_mock()
+        _execute_command.return_value = (0, '{"test-stanza/14-1/00000002.history": {}}', "")
+        assert catalog.timelines() == {"test-stanza/14-1/00000002.history": {}}
+        assert catalog.timelines() == {"test-stanza/14-1/00000002.history": {}}
+        _execute_command.assert_called_once()
+
+        # The contents are read again after they expire.
+        _execute_command.reset_mock()
+        _execute_command.return_value = (0, "[]", "")
+        _time.return_value = 1000.0 + catalog.ttl
+        assert catalog.info() == []
+        _execute_command.assert_called_once()
+
+        # The contents are read again after being invalidated.
+        _execute_command.reset_mock()
+        catalog.invalidate()
+        assert catalog.info() == []
+        _execute_command.assert_called_once()
+
+        # The contents are read again when the repository changes.
+        _execute_command.reset_mock()
+        _retrieve_s3_parameters.return_value = ({"bucket": "other-bucket", "path": "/"}, [])
+        assert catalog.info() == []
+        _execute_command.assert_called_once()
+
+        # Failures aren't cached.
+        _execute_command.reset_mock()
+        catalog.invalidate()
+        _execute_command.return_value = (1, "", "fake stderr")
+        with pytest.raises(ListBackupsError):
+            catalog.info()
+        with pytest.raises(ListBackupsError):
+            catalog.timelines()
+        assert _execute_command.call_count == 2
+
+
 def test_list_timelines(harness):
-    with patch("charm.PostgreSQLBackups._execute_command") as _execute_command:
-        _execute_command.return_value = (0, "{}", "")
+    with (
+        patch("backups.BackupCatalog.info") as _info,
+        patch("backups.BackupCatalog.timelines") as _timelines,
+    ):
+        # Test when there are no timelines.
+        _info.return_value = [{"archive": [], "backup": [], "name": "test-stanza"}]
+        _timelines.return_value = {}
         assert harness.charm.backup._list_timelines() == dict[str, tuple[str, str]]()
 
-        _execute_command.return_value = (
-            0,
-            '{"test-stanza/14-1/00000002.history":{"type": "file","size": 32,"time": 1728937652}}',
-            "",
-        )
-        assert harness.charm.backup._list_timelines() == dict[str, tuple[str, str]]([
+        # Test that the switch points are only listed again when the archive has a new timeline.
+        _info.return_value = [
+            {
+                "archive": [{"id": "14-1", "max": "000000020000000000000003"}],
+                "backup": [],
+                "name": "test-stanza",
+            }
+        ]
+        _timelines.reset_mock()
+        _timelines.return_value = {
+            "test-stanza/14-1/00000002.history": {"type": "file", "size": 32, "time": 1728937652},
+            "test-stanza/14-1/000000010000000000000003.00000028.backup.history": {
+                "type": "file",
+                "size": 32,
+                "time": 1728937000,
+            },
+        }
+        expected_timelines = dict[str, tuple[str, str]]([
             ("2024-10-14T20:27:32Z", ("test-stanza", "2"))
         ])
+        assert harness.charm.backup._list_timelines() == expected_timelines
+        assert harness.charm.backup._list_timelines() == expected_timelines
+        _timelines.assert_called_once()
+
+        # Test that the switch points are listed again after a restore created a timeline,
+        # with the archive time of its history file as switch point.
+        _timelines.reset_mock()
+        harness.charm.backup.catalog.invalidate_timeline_switches()
+        _timelines.return_value["test-stanza/14-1/00000003.history"] = {
+            "type": "file",
+            "size": 64,
+            "time": 1728986400,
+        }
+        expected_timelines["2024-10-15T10:00:00Z"] = ("test-stanza", "3")
+        assert harness.charm.backup._list_timelines() == expected_timelines
+        _timelines.assert_called_once()
+        _timelines.reset_mock()
+
+        # Test that the switch points are listed again when the repository changes.
+        with patch(
+            "charm.PostgreSQLBackups.stanza_name",
+            new_callable=PropertyMock,
+            return_value="other-stanza",
+        ):
+            harness.charm.backup._list_timelines()
+        _timelines.assert_called_once()
 
 
 def test_get_nearest_timeline(harness):
@@ -1561,6 +3265,49 @@ def test_get_nearest_timeline(harness):
         assert harness.charm.backup._get_nearest_timeline("2022-01-01 00:00:00") is None
 
 
+def test_wal_archived_until(harness):
+    with (
+        patch("backups.BackupCatalog.info") as _info,
+        patch("charm.PostgreSQLBackups._execute_command") as _execute_command,
+    ):
+        # Test when no WAL was archived.
+        _info.return_value = [{"archive": [], "backup": [], "name": "test-stanza"}]
+        assert harness.charm.backup._wal_archived_until() is None
+        _execute_command.assert_not_called()
+
+        # Test that only the directory of the last archived segment is listed.
+        _info.return_value = [
+            {
+                "archive": [
+                    {"id": "14-1", "max": "000000020000000000000003"},
+                    {"id": "16-2", "max": "000000030000000100000004"},
+                ],
+                "backup": [],
+                "name": "test-stanza",
+            }
+        ]
+        _execute_command.return_value = (
+            0,
+            '{"000000030000000100000004-2b0d4a5e.zst":{"type":"file","size":32,"time":1728937652}}',
+            "",
+        )
+        assert harness.charm.backup._wal_archived_until() == datetime(2024, 10, 14, 20, 27, 32)
+        _execute_command.assert_called_once_with([
+            PGBACKREST_EXECUTABLE,
+            PGBACKREST_CONFIGURATION_FILE,
+            "repo-ls",
+            "archive/test-stanza/16-2/0000000300000001",
+            "--filter",
+            "^000000030000000100000004",
+            "--output=json",
+        ])
+
+        # Test when the repository can't be listed.
+        _execute_command.return_value = (1, "", "fake stderr")
+        with pytest.raises(ListBackupsError):
+            harness.charm.backup._wal_archived_until()
+
+
 def test_is_psql_timestamp(harness):
     assert harness.charm.backup._is_psql_timestamp("2022-02-24 05:00:00") is True
     assert harness.charm.backup._is_psql_timestamp("2022-02-24 05:00:00+0000") is True
@@ -1594,6 +3341,7 @@ def test_on_restore_action(harness):
         patch("charm.PostgreSQLBackups._list_timelines") as _list_timelines,
         patch("charm.PostgreSQLBackups._fetch_backup_from_id") as _fetch_backup_from_id,
         patch("charm.PostgreSQLBackups._pre_restore_checks") as _pre_restore_checks,
+        patch("charm.PostgreSQLBackups._wal_archived_until") as _wal_archived_until,
         patch(
             "charm.PostgresqlOperatorCharm.override_patroni_restart_condition"
         ) as _override_patroni_restart_condition,
@@ -1629,7 +3377,7 @@ def test_on_restore_action(harness):
         }
         harness.charm.unit.status = ActiveStatus()
         harness.charm.backup._on_restore_action(mock_event)
-        _list_backups.assert_called_once_with(show_failed=False)
+        _list_backups.assert_called_once_with(show_failed=False, include_local=True)
         _list_timelines.assert_called_once()
         _fetch_backup_from_id.assert_not_called()
         mock_event.fail.assert_called_once()
@@ -1741,10 +3489,22 @@ def test_on_restore_action(harness):
         mock_event.fail.assert_not_called()
         mock_event.set_results.assert_called_once_with({"restore-status": "restore started"})
 
-        # Test a successful PITR with only the timestamp.
+        # Test a PITR to a time whose WAL isn't archived yet.
         mock_event.reset_mock()
         mock_event.params = {"restore-to-time": "2025-02-24 05:00:00.001+00"}
         _restart_database.reset_mock()
+        _stop_patroni.reset_mock()
+        _wal_archived_until.return_value = datetime(2025, 2, 24, 5, 0)
+        harness.charm.backup._on_restore_action(mock_event)
+        mock_event.fail.assert_called_once_with(
+            "The WAL needed to restore to 2025-02-24 05:00:00.001+00 is not archived yet"
+            " (archived up to 2025-02-24T05:00:00Z)"
+        )
+        _stop_patroni.assert_not_called()
+
+        # Test a successful PITR with only the timestamp.
+        mock_event.reset_mock()
+        _wal_archived_until.return_value = datetime(2025, 2, 24, 5, 1)
         _execute_command.return_value = (0, "fake stdout", "")
         _fetch_backup_from_id.return_value = "20230101-090000F"
         harness.charm.backup._on_restore_action(mock_event)
@@ -1788,17 +3548,150 @@ def test_on_restore_action(harness):
             "2023-01-01T09:00:00Z": (harness.charm.backup.stanza_name, "1"),
             "2024-02-24T05:00:00Z": (harness.charm.backup.stanza_name, "2"),
         }
-        harness.charm.backup._on_restore_action(mock_event)
-        _empty_data_files.assert_called_once()
-        _restart_database.assert_not_called()
+        harness.charm.backup._on_restore_action(mock_event)
+        _empty_data_files.assert_called_once()
+        _restart_database.assert_not_called()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
+            "restore-timeline": "2",
+            "restore-to-time": "latest",
+            "restore-stanza": f"{harness.charm.model.name}.{harness.charm.cluster_name}",
+        }
+        _update_config.assert_called_once()
+        mock_event.fail.assert_not_called()
+        mock_event.set_results.assert_called_once_with({"restore-status": "restore started"})
+
+        # Test a delta restore, which keeps the data directory instead of emptying it.
+        mock_event.reset_mock()
+        _empty_data_files.reset_mock()
+        mock_event.params = {"backup-id": "2023-01-01T09:00:00Z", "delta": True}
+        with (
+            patch("pathlib.Path.is_dir", return_value=True),
+            patch(
+                "charm.PostgreSQLBackups._keep_data_files_for_delta_restore"
+            ) as _keep_data_files_for_delta_restore,
+        ):
+            # Test when the data directory cannot be moved aside.
+            _keep_data_files_for_delta_restore.return_value = False
+            harness.charm.backup._on_restore_action(mock_event)
+            _keep_data_files_for_delta_restore.assert_called_once()
+            _empty_data_files.assert_not_called()
+            mock_event.fail.assert_called_once()
+            _restart_database.assert_called_once()
+
+            mock_event.reset_mock()
+            _restart_database.reset_mock()
+            _keep_data_files_for_delta_restore.return_value = True
+            harness.charm.backup._on_restore_action(mock_event)
+            _empty_data_files.assert_not_called()
+            _restart_database.assert_not_called()
+            assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
+                "restoring-backup": "20230101-090000F",
+                "restore-stanza": f"{harness.charm.model.name}.{harness.charm.cluster_name}",
+                "restore-delta": "True",
+            }
+            mock_event.fail.assert_not_called()
+            mock_event.set_results.assert_called_once_with({"restore-status": "restore started"})
+
+        # Test a restore followed by the analyze of the databases.
+        mock_event.reset_mock()
+        mock_event.params = {
+            "backup-id": "2023-01-01T09:00:00Z",
+            "analyze": True,
+            "analyze-skip-databases": "test-db, other-db,",
+        }
+        harness.charm.backup._on_restore_action(mock_event)
+        assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
+            "restoring-backup": "20230101-090000F",
+            "restore-stanza": f"{harness.charm.model.name}.{harness.charm.cluster_name}",
+            "restore-analyze": '["test-db", "other-db"]',
+        }
+        mock_event.fail.assert_not_called()
+
+        # Test that a backup is restored from the repository that holds it when the local
+        # repository is attached.
+        mock_event.reset_mock()
+        mock_event.params = {"backup-id": "2023-01-01T09:00:00Z"}
+        with (
+            patch(
+                "charm.PostgreSQLBackups.local_repository_path",
+                new_callable=PropertyMock,
+                return_value="/var/snap/charmed-postgresql/common/local-backups/pgbackrest",
+            ),
+            patch("charm.PostgreSQLBackups._backup_repository", return_value=1),
+        ):
+            harness.charm.backup._on_restore_action(mock_event)
+        _fetch_backup_from_id.assert_called_with("2023-01-01T09:00:00Z", include_local=True)
         assert harness.get_relation_data(peer_rel_id, harness.charm.app) == {
-            "restore-timeline": "2",
-            "restore-to-time": "latest",
+            "restoring-backup": "20230101-090000F",
+            "restore-repository": "1",
             "restore-stanza": f"{harness.charm.model.name}.{harness.charm.cluster_name}",
         }
-        _update_config.assert_called_once()
         mock_event.fail.assert_not_called()
-        mock_event.set_results.assert_called_once_with({"restore-status": "restore started"})
+
+        # Test a cluster-wide restore, whose bootstrap waits for the replicas.
+        mock_event.reset_mock()
+        _start_patroni.reset_mock()
+        _execute_command.reset_mock()
+        with harness.hooks_disabled():
+            harness.add_relation_unit(peer_rel_id, "postgresql/1")
+        mock_event.params = {"backup-id": "2023-01-01T09:00:00Z", "cluster-wide": True}
+        with (
+            patch("time.asctime", return_value="Thu Feb 24 05:00:00 2022"),
+            patch("time.time", return_value=1645678800.5),
+        ):
+            harness.charm.backup._on_restore_action(mock_event)
+        assert json.loads(
+            harness.get_relation_data(peer_rel_id, harness.charm.app)["restore-fan-out"]
+        ) == {
+            "request": "Thu Feb 24 05:00:00 2022",
+            "deadline": 1645679400,
+            "units": ["postgresql/1"],
+            "set": "20230101-090000F",
+            "stanza": f"{harness.charm.model.name}.{harness.charm.cluster_name}",
+        }
+        _start_patroni.assert_not_called()
+        _execute_command.assert_not_called()
+        assert harness.charm.unit.status == MaintenanceStatus(
+            "waiting for the replicas to start restoring"
+        )
+        mock_event.fail.assert_not_called()
+        mock_event.set_results.assert_called_once_with({
+            "restore-status": "restore started on all the units"
+        })
+        # The other units can only restore the backups in S3.
+        _list_backups.assert_called_with(show_failed=False, include_local=False)
+        _fetch_backup_from_id.assert_called_with("2023-01-01T09:00:00Z", include_local=False)
+
+        # Test a cluster-wide restore of a backup in the local repository of this unit.
+        mock_event.reset_mock()
+        _stop_patroni.reset_mock()
+        mock_event.params = {"backup-id": "2023-01-02T09:00:00Z", "cluster-wide": True}
+        _list_backups.side_effect = lambda show_failed, include_local=False: {
+            "2023-01-01T09:00:00Z": (harness.charm.backup.stanza_name, "1"),
+            **(
+                {"2023-01-02T09:00:00Z": (harness.charm.backup.stanza_name, "1")}
+                if include_local
+                else {}
+            ),
+        }
+        harness.charm.backup._on_restore_action(mock_event)
+        mock_event.fail.assert_called_once_with(
+            "Backup 2023-01-02T09:00:00Z is in the local repository of this unit, which the"
+            " other units can't restore from"
+        )
+        _stop_patroni.assert_not_called()
+        _list_backups.side_effect = None
+
+        # Test a cluster-wide PITR without a backup to restore the replicas from.
+        mock_event.reset_mock()
+        _stop_patroni.reset_mock()
+        mock_event.params = {"restore-to-time": "2025-02-24 05:00:00+00", "cluster-wide": True}
+        with patch("charm.PostgreSQLBackups._last_backup_before", return_value=None):
+            harness.charm.backup._on_restore_action(mock_event)
+        mock_event.fail.assert_called_once_with(
+            "There is no backup before 2025-02-24 05:00:00+00 to restore the replicas from"
+        )
+        _stop_patroni.assert_not_called()
 
 
 def test_pre_restore_checks(harness):
@@ -1856,6 +3749,500 @@ def test_pre_restore_checks(harness):
         assert harness.charm.backup._pre_restore_checks(mock_event)
         mock_event.fail.assert_not_called()
 
+        # Test that a cluster-wide restore is allowed with more than one unit.
+        _planned_units.return_value = 2
+        assert not harness.charm.backup._pre_restore_checks(mock_event)
+        mock_event.params["cluster-wide"] = True
+        assert harness.charm.backup._pre_restore_checks(mock_event)
+
+
+def test_last_backup_before(harness):
+    with patch.object(harness.charm.backup.catalog, "info") as _info:
+        # Test when there are no backups.
+        _info.return_value = []
+        assert harness.charm.backup._last_backup_before("latest") is None
+
+        _info.return_value = [
+            {
+                "name": "test-stanza",
+                "backup": [
+                    {
+                        "label": "20230101-090000F",
+                        "error": False,
+                        "archive": {"start": "000000010000000000000003"},
+                        "timestamp": {"stop": 1672563660},
+                    },
+                    {
+                        "label": "20230102-090000F",
+                        "error": True,
+                        "archive": {"start": "000000010000000000000005"},
+                        "timestamp": {"stop": 1672650060},
+                    },
+                    {
+                        "label": "20230101-090000F_20230103-090000I",
+                        "error": False,
+                        "archive": {"start": "000000020000000000000007"},
+                        "timestamp": {"stop": 1672736460},
+                    },
+                ],
+            }
+        ]
+        assert harness.charm.backup._last_backup_before("latest") == (
+            "20230101-090000F_20230103-090000I"
+        )
+        # The failed backups aren't restored.
+        assert (
+            harness.charm.backup._last_backup_before("2023-01-02 12:00:00+00")
+            == "20230101-090000F"
+        )
+        assert (
+            harness.charm.backup._last_backup_before("2023-01-03 11:00:00+01")
+            == "20230101-090000F_20230103-090000I"
+        )
+        assert harness.charm.backup._last_backup_before("2023-01-01 09:00:00") is None
+
+        # Test that only the backups on the requested timeline are restored.
+        assert harness.charm.backup._last_backup_before("latest", "1") == "20230101-090000F"
+        assert harness.charm.backup._last_backup_before("2023-01-02 12:00:00+00", "2") is None
+
+        # Test that the backups in the local repository aren't restored.
+        harness.add_storage("local-backups", attach=True)
+        for backup in _info.return_value[0]["backup"]:
+            backup["database"] = {"repo-key": 2}
+        _info.return_value[0]["backup"].append({
+            "label": "20230104-090000F",
+            "error": False,
+            "archive": {"start": "000000020000000000000009"},
+            "timestamp": {"stop": 1672822860},
+            "database": {"repo-key": 1},
+        })
+        assert harness.charm.backup._last_backup_before("latest") == (
+            "20230101-090000F_20230103-090000I"
+        )
+
+
+def test_coordinate_restore_fan_out(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
+        patch("charm.PostgreSQLBackups._start_restored_cluster") as _start_restored_cluster,
+        patch("charm.PostgreSQLBackups._switch_to_restored_data") as _switch_to_restored_data,
+        patch("charm.PostgreSQLBackups.restore_status_message", return_value=None),
+        patch("backups.shutil.rmtree") as _rmtree,
+        patch("backups.shutil.disk_usage") as _disk_usage,
+        patch("charm.PostgreSQLBackups._backup_info") as _backup_info,
+        patch.object(harness.charm.background_jobs, "running", return_value=[]) as _running,
+        patch.object(harness.charm.background_jobs, "start", return_value="restore-1") as _start,
+        patch("time.time", return_value=1000),
+    ):
+        _disk_usage.return_value.free = 2000
+        _backup_info.return_value = {"info": {"size": 1000, "repository": {"size": 100}}}
+        peer_rel_id = harness.model.get_relation(PEER).id
+        other_unit_name = "postgresql/1"
+        with harness.hooks_disabled():
+            harness.add_relation_unit(peer_rel_id, other_unit_name)
+
+        def state(request, value):
+            return {"restore-fan-out": json.dumps({"request": request, "state": value})}
+
+        # Test when no cluster-wide restore was requested.
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        assert not harness.charm.backup.is_restore_fan_out_pending
+
+        # Test when this unit doesn't take part in the restore (it joined later).
+        fan_out = {
+            "request": "request-1",
+            "deadline": 1600,
+            "units": [other_unit_name],
+            "set": "20230101-090000F",
+        }
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {"restore-fan-out": json.dumps(fan_out), "restore-stanza": "test-stanza"},
+            )
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        _start.assert_not_called()
+
+        # Test that a replica restores the backup set next to its database.
+        fan_out["units"].append(harness.charm.unit.name)
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"restore-fan-out": json.dumps(fan_out)}
+            )
+        assert harness.charm.backup.is_restore_fan_out_pending
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _update_config.assert_called_once()
+        _start.assert_called_once_with(
+            "restore",
+            [
+                PGBACKREST_EXECUTABLE,
+                PGBACKREST_CONFIGURATION_FILE,
+                "--stanza=test-stanza",
+                "--pg1-path=/var/snap/charmed-postgresql/common/var/lib/postgresql-standby-restore",
+                "--set=20230101-090000F",
+                "--type=standby",
+                "restore",
+            ],
+            {"request": "request-1"},
+        )
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == state(
+            "request-1", "restoring"
+        )
+        assert harness.charm.unit.status == MaintenanceStatus("restoring backup")
+
+        # Test that the restore isn't started twice.
+        _start.reset_mock()
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _start.assert_not_called()
+
+        # Test that the replica waits for the primary to be restored.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.unit.name, state("request-1", "restored")
+            )
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"restoring-backup": "20230101-090000F"}
+            )
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _switch_to_restored_data.assert_not_called()
+        assert harness.charm.unit.status == MaintenanceStatus(
+            "waiting for the primary to restore the backup"
+        )
+
+        # Test that the replica switches to the restored data once the primary is restored.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"restoring-backup": ""}
+            )
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _switch_to_restored_data.assert_called_once_with("request-1", True)
+
+        # Test that a failed restore is replaced by a clone of the primary.
+        _switch_to_restored_data.reset_mock()
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.unit.name, state("request-1", "failed")
+            )
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _switch_to_restored_data.assert_called_once_with("request-1", False)
+
+        # Test that nothing is done once the replica switched.
+        _switch_to_restored_data.reset_mock()
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.unit.name, state("request-1", "done")
+            )
+        assert not harness.charm.backup.is_restore_fan_out_pending
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        _switch_to_restored_data.assert_not_called()
+
+        # Test that a replica that didn't start restoring by the deadline is cloned instead.
+        _start.reset_mock()
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {"restore-fan-out": json.dumps({**fan_out, "request": "late", "deadline": 900})},
+            )
+        assert harness.charm.backup.is_restore_fan_out_pending
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _start.assert_not_called()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == state(
+            "late", "failed"
+        )
+
+        # Test that a replica without the space to restore the backup is cloned instead.
+        _disk_usage.return_value.free = 999
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {"restore-fan-out": json.dumps({**fan_out, "request": "no-space"})},
+            )
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _backup_info.assert_called_with("20230101-090000F")
+        _start.assert_not_called()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == state(
+            "no-space", "failed"
+        )
+
+        # Test that the leader waits for the replicas to start restoring.
+        fan_out = {
+            "request": "request-2",
+            "deadline": 1600,
+            "units": [other_unit_name],
+            "set": "20230101-090000F",
+        }
+        with harness.hooks_disabled():
+            harness.set_leader()
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"restore-fan-out": json.dumps(fan_out)}
+            )
+        assert harness.charm.backup.coordinate_restore_fan_out()
+        _start_restored_cluster.assert_not_called()
+        assert harness.charm.unit.status == MaintenanceStatus(
+            "waiting for the replicas to start restoring"
+        )
+
+        # Test that the leader bootstraps the restored cluster anyway after the deadline.
+        _start_restored_cluster.return_value = None
+        with (
+            harness.hooks_disabled(),
+            patch("time.time", return_value=1601),
+        ):
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {"restore-fan-out": json.dumps({**fan_out, "request": "request-late"})},
+            )
+            assert not harness.charm.backup.coordinate_restore_fan_out()
+        _start_restored_cluster.assert_called_once_with()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == state(
+            "request-late", "bootstrapping"
+        )
+        _start_restored_cluster.reset_mock()
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, harness.charm.app.name, {"restore-fan-out": json.dumps(fan_out)}
+            )
+
+        # Test that the leader bootstraps the restored cluster once they're restoring.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id, other_unit_name, state("request-2", "restoring")
+            )
+        _start_restored_cluster.return_value = None
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        _start_restored_cluster.assert_called_once_with()
+        assert harness.get_relation_data(peer_rel_id, harness.charm.unit) == state(
+            "request-2", "bootstrapping"
+        )
+
+        # Test that it's bootstrapped only once.
+        _start_restored_cluster.reset_mock()
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        _start_restored_cluster.assert_not_called()
+        assert "restore-fan-out" in harness.get_relation_data(peer_rel_id, harness.charm.app)
+
+        # Test that the request is removed once all the replicas switched to the restored data.
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, other_unit_name, state("request-2", "done"))
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        assert "restore-fan-out" not in harness.get_relation_data(peer_rel_id, harness.charm.app)
+
+        # Test when the previous cluster information can't be removed.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {"restore-fan-out": json.dumps({**fan_out, "request": "request-3"})},
+            )
+            harness.update_relation_data(
+                peer_rel_id, other_unit_name, state("request-3", "failed")
+            )
+        _start_restored_cluster.return_value = "fake error"
+        assert not harness.charm.backup.coordinate_restore_fan_out()
+        assert harness.charm.unit.status == BlockedStatus("Failed to restore backup")
+
+
+def test_process_standby_restore_result(harness):
+    with patch.object(
+        harness.charm.background_jobs, "read_output", return_value=("", "fake stderr")
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {
+                    "restore-fan-out": json.dumps({
+                        "request": "request-2",
+                        "units": [harness.charm.unit.name],
+                        "set": "20230101-090000F",
+                    })
+                },
+            )
+        job = {
+            "id": "restore-1",
+            "state": "finished",
+            "return-code": 0,
+            "metadata": {"request": "request-2"},
+        }
+
+        def recorded_state():
+            unit_data = harness.get_relation_data(peer_rel_id, harness.charm.unit)
+            return json.loads(unit_data.get("restore-fan-out", "{}")).get("state")
+
+        # Test that the restores of previous requests are ignored.
+        harness.charm.backup._process_standby_restore_result({
+            **job,
+            "metadata": {"request": "request-1"},
+        })
+        assert recorded_state() is None
+
+        # Test a failed restore.
+        harness.charm.backup._process_standby_restore_result({**job, "return-code": 1})
+        assert recorded_state() == "failed"
+        harness.charm.backup._process_standby_restore_result({
+            **job,
+            "state": "lost",
+            "return-code": None,
+        })
+        assert recorded_state() == "failed"
+
+        # Test a successful restore.
+        harness.charm.backup._process_standby_restore_result(job)
+        assert recorded_state() == "restored"
+
+
+def test_switch_to_restored_data(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.update_config") as _update_config,
+        patch("charm.Patroni.stop_patroni") as _stop_patroni,
+        patch("charm.Patroni.start_patroni") as _start_patroni,
+        patch("charm.PostgreSQLBackups._empty_data_files") as _empty_data_files,
+        patch("backups.os.rename") as _rename,
+        patch("backups.shutil.rmtree") as _rmtree,
+        patch("backups.Path.exists", return_value=True),
+        patch("charm.PostgreSQLBackups._is_new_timeline_archived") as _is_new_timeline_archived,
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+
+        # Test that the replica waits for the history file of the new timeline.
+        _is_new_timeline_archived.return_value = False
+        harness.charm.backup._switch_to_restored_data("request-1", True)
+        _stop_patroni.assert_not_called()
+        assert harness.charm.unit.status == MaintenanceStatus(
+            "waiting for the new timeline to be archived"
+        )
+
+        # Test when the database can't be stopped.
+        _is_new_timeline_archived.return_value = True
+        _stop_patroni.return_value = False
+        harness.charm.backup._switch_to_restored_data("request-1", True)
+        _empty_data_files.assert_not_called()
+        _start_patroni.assert_not_called()
+
+        # Test when the old data can't be removed (it's retried in the next hook).
+        _stop_patroni.return_value = True
+        _empty_data_files.return_value = False
+        harness.charm.backup._switch_to_restored_data("request-1", True)
+        _rename.assert_not_called()
+        _start_patroni.assert_called_once()
+        assert "restore-fan-out" not in harness.get_relation_data(peer_rel_id, harness.charm.unit)
+
+        # Test the switch to the restored data.
+        _start_patroni.reset_mock()
+        _empty_data_files.return_value = True
+        harness.charm.backup._switch_to_restored_data("request-1", True)
+        _rename.assert_called_once_with(
+            "/var/snap/charmed-postgresql/common/var/lib/postgresql-standby-restore",
+            "/var/snap/charmed-postgresql/common/var/lib/postgresql",
+        )
+        _rmtree.assert_not_called()
+        _update_config.assert_called_once()
+        _start_patroni.assert_called_once()
+        assert json.loads(
+            harness.get_relation_data(peer_rel_id, harness.charm.unit)["restore-fan-out"]
+        ) == {"request": "request-1", "state": "done"}
+
+        # Test that the leftovers of a failed restore are removed before cloning the primary.
+        _rename.reset_mock()
+        harness.charm.backup._switch_to_restored_data("request-1", False)
+        _rename.assert_not_called()
+        _rmtree.assert_called_once_with(
+            "/var/snap/charmed-postgresql/common/var/lib/postgresql-standby-restore"
+        )
+
+        # Test that a replica cloning the primary doesn't wait for the new timeline.
+        _is_new_timeline_archived.reset_mock()
+        harness.charm.backup._switch_to_restored_data("request-1", False)
+        _is_new_timeline_archived.assert_not_called()
+
+
+def test_is_new_timeline_archived(harness):
+    with (
+        patch("charm.Patroni.cluster_status") as _cluster_status,
+        patch("backups.BackupCatalog.timelines") as _timelines,
+        patch("backups.BackupCatalog.invalidate") as _invalidate,
+    ):
+        peer_rel_id = harness.model.get_relation(PEER).id
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.app.name,
+                {
+                    "restore-fan-out": json.dumps({
+                        "request": "request-1",
+                        "units": [harness.charm.unit.name],
+                        "set": "20230101-090000F",
+                        "stanza": "test-stanza",
+                    })
+                },
+            )
+
+        # Test when the new primary can't be reached.
+        _cluster_status.side_effect = RetryError(last_attempt=1)
+        assert not harness.charm.backup._is_new_timeline_archived()
+        _timelines.assert_not_called()
+
+        # Test when the history file of the new timeline isn't archived yet.
+        _cluster_status.side_effect = None
+        _cluster_status.return_value = [
+            {"name": "postgresql-0", "role": "leader", "timeline": 11},
+            {"name": "postgresql-1", "role": "replica"},
+        ]
+        _timelines.return_value = {
+            "test-stanza/14-1/0000000A.history": {},
+            "other-stanza/14-1/0000000B.history": {},
+        }
+        assert not harness.charm.backup._is_new_timeline_archived()
+        _invalidate.assert_called_once_with()
+
+        # Test when it's archived.
+        _timelines.return_value["test-stanza/14-1/0000000B.history"] = {}
+        assert harness.charm.backup._is_new_timeline_archived()
+
+        # Test when the archive can't be listed.
+        _timelines.side_effect = ListBackupsError("fake error")
+        assert not harness.charm.backup._is_new_timeline_archived()
+
+
+def test_pgbackrest_process_max(harness):
+    with patch("charm.PostgresqlOperatorCharm.cpu_count", new_callable=PropertyMock) as _cpu_count:
+        # Test the value derived from the CPUs, leaving headroom for PostgreSQL.
+        _cpu_count.return_value = 16
+        assert harness.charm.backup._pgbackrest_process_max("auto") == 14
+        assert harness.charm.backup._pgbackrest_process_max("auto", 4) == 4
+
+        # Test that at least one process is used on small units.
+        _cpu_count.return_value = 2
+        assert harness.charm.backup._pgbackrest_process_max("auto") == 1
+        assert harness.charm.backup._pgbackrest_process_max("auto", 4) == 1
+
+        # Test an explicit number of processes.
+        assert harness.charm.backup._pgbackrest_process_max(8) == 8
+        assert harness.charm.backup._pgbackrest_process_max(8, 4) == 8
+
+
+def test_update_pgbackrest_conf_file(harness):
+    with (
+        patch("charm.PostgreSQLBackups._are_backup_settings_ok") as _are_backup_settings_ok,
+        patch(
+            "charm.PostgreSQLBackups._render_pgbackrest_conf_file"
+        ) as _render_pgbackrest_conf_file,
+    ):
+        # Test when the S3 relation isn't set up.
+        _are_backup_settings_ok.return_value = (False, "fake validation message")
+        harness.charm.backup.update_pgbackrest_conf_file()
+        _render_pgbackrest_conf_file.assert_not_called()
+
+        # Test when the backup settings are ok.
+        _are_backup_settings_ok.return_value = (True, None)
+        harness.charm.backup.update_pgbackrest_conf_file()
+        _render_pgbackrest_conf_file.assert_called_once_with()
+
 
 @pytest.mark.parametrize(
     "tls_ca_chain_filename",
@@ -1864,6 +4251,7 @@ def test_pre_restore_checks(harness):
 def test_render_pgbackrest_conf_file(harness, tls_ca_chain_filename):
     with (
         patch("charm.Patroni.render_file") as _render_file,
+        patch("charm.Patroni._create_directory") as _create_directory,
         patch(
             "charm.PostgreSQLBackups._tls_ca_chain_filename",
             new_callable=PropertyMock(return_value=tls_ca_chain_filename),
@@ -1884,6 +4272,7 @@ def test_render_pgbackrest_conf_file(harness, tls_ca_chain_filename):
 
         mock.assert_not_called()
         _render_file.assert_not_called()
+        _create_directory.assert_not_called()
 
         # Test when all parameters are provided.
         _retrieve_s3_parameters.return_value = (
@@ -1922,7 +4311,20 @@ def test_render_pgbackrest_conf_file(harness, tls_ca_chain_filename):
             storage_path=harness.charm._storage_path,
             user="backup",
             retention_full=30,
-            process_max=max(cpu_count() - 2, 1),
+            process_max=max(harness.charm.cpu_count - 2, 1),
+            backup_process_max=max(harness.charm.cpu_count - 2, 1),
+            archive_push_process_max=min(max(harness.charm.cpu_count - 2, 1), 4),
+            archive_get_process_max=min(max(harness.charm.cpu_count - 2, 1), 4),
+            archive_async=True,
+            archive_push_queue_max=None,
+            spool_path="/var/snap/charmed-postgresql/common/var/lib/pgbackrest",
+            s3_repo=1,
+            local_repository_path=None,
+            local_retention_full=1,
+            compress_type="zst",
+            compress_level=None,
+            archive_push_compress_type="zst",
+            archive_push_compress_level=None,
         )
 
         # Patch the `open` method with our mock.
@@ -1932,6 +4334,13 @@ def test_render_pgbackrest_conf_file(harness, tls_ca_chain_filename):
 
         # Check the template is opened read-only in the call to open.
         assert mock.call_args_list[0][0] == ("templates/pgbackrest.conf.j2",)
+        assert "archive-async=y" in expected_content
+        assert (
+            "spool-path=/var/snap/charmed-postgresql/common/var/lib/pgbackrest" in expected_content
+        )
+        _create_directory.assert_called_once_with(
+            "/var/snap/charmed-postgresql/common/var/lib/pgbackrest", 0o750
+        )
 
         # Get the expected content from a file.
         with open("templates/pgbackrest.conf.j2") as file:
@@ -1956,6 +4365,39 @@ def test_render_pgbackrest_conf_file(harness, tls_ca_chain_filename):
             calls.insert(0, call(tls_ca_chain_filename, "fake-tls-ca-chain", 0o644))
         _render_file.assert_has_calls(calls)
 
+        # Test that the local repository comes before the S3 one when its storage is attached.
+        _render_file.reset_mock()
+        _create_directory.reset_mock()
+        harness.add_storage("local-backups", attach=True)
+        local_repository_path = harness.charm.backup.local_repository_path
+        with patch("builtins.open", mock, create=True):
+            harness.charm.backup._render_pgbackrest_conf_file()
+        _create_directory.assert_called_with(local_repository_path, 0o750)
+        rendered = _render_file.call_args_list[-2].args[1]
+        # Until the stanza exists in it, only stanza-create uses the local repository.
+        assert (
+            f"[global:stanza-create]\nrepo1-type=posix\nrepo1-path={local_repository_path}\n"
+            in rendered
+            and "repo1-retention-full" not in rendered
+            and "repo2-type=s3\nrepo2-path=test-path/\n" in rendered
+        )
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                harness.model.get_relation(PEER).id,
+                harness.charm.unit.name,
+                {"local-repository-stanza": harness.charm.backup.stanza_name},
+            )
+        with patch("builtins.open", mock, create=True):
+            harness.charm.backup._render_pgbackrest_conf_file()
+        rendered = _render_file.call_args_list[-2].args[1]
+        assert (
+            "[global:stanza-create]" not in rendered
+            and f"repo1-type=posix\nrepo1-path={local_repository_path}\n" in rendered
+            and "repo1-retention-full-type=count\nrepo1-retention-full=1\n" in rendered
+            and "repo2-type=s3\nrepo2-path=test-path/\n" in rendered
+            and "repo1-s3" not in rendered
+        )
+
 
 def test_restart_database(harness):
     with (
@@ -2125,7 +4567,6 @@ def test_start_stop_pgbackrest_service(harness):
 )
 def test_upload_content_to_s3(harness, tls_ca_chain_filename):
     with (
-        patch("tempfile.NamedTemporaryFile") as _named_temporary_file,
         patch("charm.PostgreSQLBackups._construct_endpoint") as _construct_endpoint,
         patch("boto3.session.Session.resource") as _resource,
         patch("backups.Config") as _config,
@@ -2147,10 +4588,9 @@ def test_upload_content_to_s3(harness, tls_ca_chain_filename):
         }
 
         # Test when any exception happens.
-        upload_file = _resource.return_value.Bucket.return_value.upload_file
+        upload_fileobj = _resource.return_value.Bucket.return_value.upload_fileobj
         _resource.side_effect = ValueError
         _construct_endpoint.return_value = "https://s3.us-east-1.amazonaws.com"
-        _named_temporary_file.return_value.__enter__.return_value.name = "/tmp/test-file"
         assert not harness.charm.backup._upload_content_to_s3(content, s3_path, s3_parameters)
         _resource.assert_called_once_with(
             "s3",
@@ -2163,13 +4603,12 @@ def test_upload_content_to_s3(harness, tls_ca_chain_filename):
             request_checksum_calculation="when_required",
             response_checksum_validation="when_required",
         )
-        _named_temporary_file.assert_not_called()
-        upload_file.assert_not_called()
+        upload_fileobj.assert_not_called()
 
         _resource.reset_mock()
         _config.reset_mock()
         _resource.side_effect = None
-        upload_file.side_effect = S3UploadFailedError
+        upload_fileobj.side_effect = S3UploadFailedError
         assert not harness.charm.backup._upload_content_to_s3(content, s3_path, s3_parameters)
         _resource.assert_called_once_with(
             "s3",
@@ -2182,26 +4621,19 @@ def test_upload_content_to_s3(harness, tls_ca_chain_filename):
             request_checksum_calculation="when_required",
             response_checksum_validation="when_required",
         )
-        _named_temporary_file.assert_called_once()
-        upload_file.assert_called_once_with("/tmp/test-file", "test-path/test-file.")
+        upload_fileobj.assert_called_once_with(ANY, "test-path/test-file.")
 
-        # Test when the upload succeeds
+        # Test when the upload succeeds (reusing the S3 resource).
         _resource.reset_mock()
-        _config.reset_mock()
-        _named_temporary_file.reset_mock()
-        upload_file.reset_mock()
-        upload_file.side_effect = None
+        upload_fileobj.reset_mock()
+        uploaded = []
+        upload_fileobj.side_effect = lambda buf, _: uploaded.append(buf.read())
         assert harness.charm.backup._upload_content_to_s3(content, s3_path, s3_parameters)
-        _resource.assert_called_once_with(
-            "s3",
-            endpoint_url="https://s3.us-east-1.amazonaws.com",
-            verify=(tls_ca_chain_filename or None),
-            config=_config.return_value,
-        )
-        _config.assert_called_once_with(
-            # https://github.com/boto/boto3/issues/4400#issuecomment-2600742103
-            request_checksum_calculation="when_required",
-            response_checksum_validation="when_required",
-        )
-        _named_temporary_file.assert_called_once()
-        upload_file.assert_called_once_with("/tmp/test-file", "test-path/test-file.")
+        _resource.assert_not_called()
+        upload_fileobj.assert_called_once_with(ANY, "test-path/test-file.")
+        assert uploaded == [b"test-content"]
+
+        # Test that a new S3 resource is created when the credentials change.
+        s3_parameters["secret-key"] = "new-secret-key"
+        assert harness.charm.backup._upload_content_to_s3(content, s3_path, s3_parameters)
+        _resource.assert_called_once()
@@ -5,7 +5,7 @@ import json
 import logging
 import platform
 import subprocess
-from unittest.mock import MagicMock, Mock, PropertyMock, call, mock_open, patch, sentinel
+from unittest.mock import MagicMock, Mock, PropertyMock, call, patch, sentinel
 
 import psycopg2
 import pytest
@@ -775,7 +775,7 @@ def test_on_update_status(harness):
         patch("charm.PostgreSQLProvider.oversee_users") as _oversee_users,
         patch("upgrade.PostgreSQLUpgrade.idle", return_value=True),
         patch("charm.Patroni.last_postgresql_logs") as _last_postgresql_logs,
-        patch("charm.Patroni.patroni_logs") as _patroni_logs,
+        patch("cluster.subprocess.Popen") as _popen,
         patch("charm.Patroni.get_member_status") as _get_member_status,
         patch(
             "charm.PostgreSQLBackups.can_use_s3_repository", return_value=(True, None)
@@ -810,7 +810,9 @@ def test_on_update_status(harness):
                 },
             )
         harness.charm.unit.status = ActiveStatus()
-        _patroni_logs.return_value = "2022-02-24 02:00:00 UTC patroni.exceptions.PatroniFatalException: Failed to bootstrap cluster"
+        _popen.return_value.stdout = iter([
+            "2022-02-24 02:00:00 UTC patroni.exceptions.PatroniFatalException: Failed to bootstrap cluster\n"
+        ])
         harness.charm.on.update_status.emit()
         _set_primary_status_message.assert_not_called()
         assert harness.charm.unit.status.message == CANNOT_RESTORE_PITR
@@ -838,6 +840,22 @@ def test_on_update_status(harness):
         _restart_patroni.assert_called_once()
         _start_observer.assert_called_once()
 
+        # Test that a unit blocked by a stanza initialisation that timed out retries it.
+        _set_primary_status_message.reset_mock()
+        _member_started.return_value = True
+        harness.charm.unit.status = BlockedStatus("fake block message")
+        with (
+            patch(
+                "charm.PostgreSQLBackups.stanza_initialisation_timed_out_message",
+                new_callable=PropertyMock,
+                return_value="fake block message",
+            ),
+            patch("charm.PostgreSQLBackups.coordinate_stanza_fields") as _coordinate_stanza_fields,
+        ):
+            harness.charm.on.update_status.emit()
+            _coordinate_stanza_fields.assert_called_once_with(retry_timed_out=True)
+            _set_primary_status_message.assert_called_once()
+
 
 def test_on_update_status_after_restore_operation(harness):
     with (
@@ -857,6 +875,10 @@ def test_on_update_status_after_restore_operation(harness):
             "charm.PostgresqlOperatorCharm._handle_processes_failures"
         ) as _handle_processes_failures,
         patch("charm.PostgreSQLBackups.can_use_s3_repository") as _can_use_s3_repository,
+        patch(
+            "backups.BackupCatalog.invalidate_timeline_switches"
+        ) as _invalidate_timeline_switches,
+        patch("charm.PostgreSQLBackups.start_post_restore_analyze") as _start_post_restore_analyze,
         patch(
             "charms.postgresql_k8s.v0.postgresql.PostgreSQL.get_current_timeline"
         ) as _get_current_timeline,
@@ -913,6 +935,7 @@ def test_on_update_status_after_restore_operation(harness):
         _update_relation_endpoints.assert_called_once()
         _set_primary_status_message.assert_called_once()
         assert isinstance(harness.charm.unit.status, ActiveStatus)
+        _invalidate_timeline_switches.assert_called_once_with()
 
         # Assert that the backup id is not in the application relation databag anymore.
         assert harness.get_relation_data(rel_id, harness.charm.app) == {
@@ -937,6 +960,18 @@ def test_on_update_status_after_restore_operation(harness):
             "cluster_initialised": "True",
             "s3-initialization-block-message": "fake validation message",
         }
+        _start_post_restore_analyze.assert_not_called()
+
+        # Test that the restored databases are analyzed when requested.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                rel_id,
+                harness.charm.app.name,
+                {"restoring-backup": "20230101-090000F", "restore-analyze": '["test-db"]'},
+            )
+        harness.charm.on.update_status.emit()
+        _start_post_restore_analyze.assert_called_once_with(["test-db"])
+        assert "restore-analyze" not in harness.get_relation_data(rel_id, harness.charm.app)
 
 
 def test_install_snap_packages(harness):
@@ -1096,6 +1131,66 @@ def test_restart(harness):
         mock_event.defer.assert_not_called()
 
 
+def test_update_config_replica_bootstrap_from_repository(harness):
+    with (
+        patch("subprocess.check_output", return_value=b"C"),
+        patch("charm.snap_refreshed", return_value=True),
+        patch("charm.snap.SnapCache"),
+        patch("charm.PostgresqlOperatorCharm._handle_postgresql_restart_need"),
+        patch("charm.PostgresqlOperatorCharm._restart_metrics_service"),
+        patch("charm.PostgresqlOperatorCharm._restart_ldap_sync_service"),
+        patch("charm.Patroni.member_started", new_callable=PropertyMock, return_value=False),
+        patch(
+            "charm.PostgresqlOperatorCharm._is_workload_running",
+            new_callable=PropertyMock,
+            return_value=False,
+        ),
+        patch("charm.Patroni.get_postgresql_version", return_value="16.9"),
+        patch("charm.Patroni._create_directory"),
+        patch("charm.Patroni.render_file") as _render_file,
+        patch.object(PostgresqlOperatorCharm, "postgresql", Mock()) as postgresql_mock,
+        patch("charm.PostgresqlOperatorCharm.get_available_memory", return_value=1024**3),
+        patch(
+            "charm.PostgreSQLBackups.can_bootstrap_replicas_from_repository"
+        ) as _can_bootstrap_replicas_from_repository,
+    ):
+        postgresql_mock.build_postgresql_parameters.return_value = {}
+        rel_id = harness.model.get_relation(PEER).id
+        harness.update_config({"backup_replica_bootstrap": True})
+
+        def rendered_patroni_configuration() -> str:
+            return next(
+                call.args[1]
+                for call in reversed(_render_file.call_args_list)
+                if call.args[0].endswith("patroni.yaml")
+            )
+
+        # Test that a new unit (not the leader) uses the result published by the leader in
+        # its first Patroni configuration, without reading the repository itself.
+        with harness.hooks_disabled():
+            harness.add_relation_unit(rel_id, "postgresql/1")
+            harness.update_relation_data(
+                rel_id,
+                harness.charm.app.name,
+                {"stanza": "test-stanza", "replica-bootstrap-from-repository": "True"},
+            )
+        harness.charm.update_config()
+        assert (
+            "create_replica_methods:\n  - pgbackrest\n  - basebackup"
+            in rendered_patroni_configuration()
+        )
+        harness.charm.backup.refresh_replica_bootstrap()
+        _can_bootstrap_replicas_from_repository.assert_not_called()
+
+        # Test that replicas are cloned once the leader publishes that the backup is too old.
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                rel_id, harness.charm.app.name, {"replica-bootstrap-from-repository": ""}
+            )
+        harness.charm.update_config()
+        assert "create_replica_methods" not in rendered_patroni_configuration()
+
+
 def test_update_config(harness):
     with (
         patch("subprocess.check_output", return_value=b"C"),
@@ -1151,6 +1246,7 @@ def test_update_config(harness):
         call_args = _render_patroni_yml_file.call_args
         assert call_args[1]["connectivity"] is True
         assert call_args[1]["is_creating_backup"] is False
+        assert call_args[1]["no_failover"] is False
         assert call_args[1]["enable_ldap"] is False
         assert call_args[1]["enable_tls"] is False
         assert call_args[1]["parameters"]["test"] == "test"
@@ -1176,14 +1272,18 @@ def test_update_config(harness):
         _render_patroni_yml_file.assert_called_once_with(
             connectivity=True,
             is_creating_backup=False,
+            no_failover=False,
             enable_ldap=False,
             enable_tls=True,
             backup_id=None,
+            restore_repository=None,
             stanza=None,
             restore_stanza=None,
             restore_timeline=None,
             pitr_target=None,
             restore_to_latest=False,
+            delta_restore=False,
+            replica_bootstrap_from_repository=False,
             parameters={
                 "test": "test",
                 "max_worker_processes": "8",
@@ -1720,21 +1820,9 @@ def test_is_workload_running(harness):
 
 
 def test_get_available_memory(harness):
-    meminfo = (
-        "MemTotal:       16089488 kB"
-        "MemFree:          799284 kB"
-        "MemAvailable:    3926924 kB"
-        "Buffers:          187232 kB"
-        "Cached:          4445936 kB"
-        "SwapCached:       156012 kB"
-        "Active:         11890336 kB"
-    )
-
-    with patch("builtins.open", mock_open(read_data=meminfo)):
+    with patch("charm.get_effective_memory", return_value=16475635712) as _get_effective_memory:
         assert harness.charm.get_available_memory() == 16475635712
-
-    with patch("builtins.open", mock_open(read_data="")):
-        assert harness.charm.get_available_memory() == 0
+        _get_effective_memory.assert_called_once_with()
 
 
 def test_juju_run_exec_divergence(harness):
@@ -2554,6 +2642,18 @@ def test_set_primary_status_message(harness, is_leader):
                 harness.charm._set_primary_status_message()
                 assert isinstance(harness.charm.unit.status, MaintenanceStatus)
 
+        # Test that the unit stays blocked while its stanza initialisation waits for a retry.
+        with patch(
+            "charm.PostgreSQLBackups.stanza_initialisation_timed_out_message",
+            new_callable=PropertyMock,
+            return_value="fake block message",
+        ):
+            _get_primary.side_effect = None
+            _get_primary.reset_mock()
+            harness.charm._set_primary_status_message()
+            assert harness.charm.unit.status == BlockedStatus("fake block message")
+            _get_primary.assert_not_called()
+
 
 def test_override_patroni_restart_condition(harness):
     with (
@@ -2780,6 +2880,46 @@ def test_get_ldap_parameters(harness):
         _get_relation_data.reset_mock()
 
 
+def test_setup_ldap_sync(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.get_ldap_parameters") as _get_ldap_parameters,
+        patch("charm.PostgresqlOperatorCharm.postgresql") as _postgresql,
+        patch("charm.PostgresqlOperatorCharm._get_password", return_value="test-password"),
+    ):
+        _get_ldap_parameters.return_value = {
+            "ldapbasedn": "dc=example,dc=net",
+            "ldapbinddn": "cn=admin,dc=example,dc=net",
+            "ldapbindpasswd": "admin-password",
+            "ldapurl": "ldap://10.0.0.10:389",
+        }
+        _postgresql.build_postgresql_group_map.return_value = [("ldap_group", "pg_group")]
+        postgres_snap = MagicMock()
+        postgres_snap.services = {"ldap-sync": {"active": False}}
+
+        # The service is started with the settings when it's not running yet.
+        harness.charm._setup_ldap_sync(postgres_snap)
+        postgres_snap.set.assert_called_once()
+        assert postgres_snap.set.call_args[0][0]["ldap-sync.ldap_host"] == "10.0.0.10"
+        assert postgres_snap.set.call_args[0][0]["ldap-sync.ldap_group_mappings"] == json.dumps([
+            ["ldap_group", "pg_group"]
+        ])
+        postgres_snap.restart.assert_called_once_with(services=["ldap-sync"])
+        assert "ldap-sync-settings-hash" in harness.charm.unit_peer_data
+
+        # A running service isn't restarted (and fully re-synced) when nothing changed.
+        postgres_snap.reset_mock()
+        postgres_snap.services = {"ldap-sync": {"active": True}}
+        harness.charm._setup_ldap_sync(postgres_snap)
+        postgres_snap.set.assert_not_called()
+        postgres_snap.restart.assert_not_called()
+
+        # A change in the group mappings reconfigures the service.
+        _postgresql.build_postgresql_group_map.return_value = [("other_group", "pg_group")]
+        harness.charm._setup_ldap_sync(postgres_snap)
+        postgres_snap.set.assert_called_once()
+        postgres_snap.restart.assert_called_once_with(services=["ldap-sync"])
+
+
 def test_relations_user_databases_map(harness):
     with (
         patch("charm.PostgresqlOperatorCharm.postgresql") as _postgresql,
@@ -3231,3 +3371,113 @@ def test_calculate_worker_process_config_all_none(harness):
             assert "max_parallel_maintenance_workers" not in result
             assert "max_logical_replication_workers" not in result
             assert "max_sync_workers_per_subscription" not in result
+
+
+def test_calculate_tuning_parameters(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.get_available_memory", return_value=16 * 1024**3),
+        patch.object(
+            PostgresqlOperatorCharm, "cpu_count", new_callable=PropertyMock
+        ) as _cpu_count,
+    ):
+        _cpu_count.return_value = 4
+
+        # Tuning is disabled by default.
+        assert harness.charm._calculate_tuning_parameters({"shared_buffers": "524288"}) == {}
+
+        harness.update_config({"profile_workload": "oltp", "profile_storage_type": "hdd"})
+        tuning = harness.charm._calculate_tuning_parameters({"shared_buffers": "524288"})
+        assert tuning["work_mem"] == {
+            "value": "10485kB",
+            "reason": "memory left after shared_buffers split across 100 connections for the"
+            " oltp workload",
+            "source": "tuning",
+        }
+        assert tuning["random_page_cost"]["value"] == "4.0"
+        assert tuning["maintenance_work_mem"]["source"] == "tuning"
+
+        # Explicitly set config options win over the tuned values.
+        harness.update_config({"memory_maintenance_work_mem": 131072})
+        tuning = harness.charm._calculate_tuning_parameters({"shared_buffers": "524288"})
+        assert tuning["maintenance_work_mem"] == {
+            "value": "131072",
+            "reason": "explicitly set through the memory_maintenance_work_mem config option",
+            "source": "config",
+        }
+
+        # Even when they're set to PostgreSQL's default value.
+        harness.update_config({"memory_work_mem": 4096})
+        tuning = harness.charm._calculate_tuning_parameters({"shared_buffers": "524288"})
+        assert tuning["work_mem"]["value"] == "4096"
+        assert tuning["work_mem"]["source"] == "config"
+        harness.update_config(unset=["memory_work_mem", "memory_maintenance_work_mem"])
+
+        # The limit memory config option is taken into account.
+        harness.update_config({"profile_limit_memory": 2048})
+        tuning = harness.charm._calculate_tuning_parameters({"shared_buffers": "32768"})
+        assert tuning["maintenance_work_mem"]["value"] == "122MB"
+        assert tuning["work_mem"]["value"] == "1448kB"
+
+        # Only the production profile is tuned.
+        harness.update_config({"profile": "testing"})
+        assert harness.charm._calculate_tuning_parameters({"shared_buffers": "524288"}) == {}
+
+
+def test_build_postgresql_parameters_with_memory_limit(harness):
+    with (
+        # A cgroup memory limit of 4GiB.
+        patch("charm.get_effective_memory", return_value=4 * 1024**3),
+        patch("charm.PostgresqlOperatorCharm._calculate_worker_process_config", return_value={}),
+    ):
+        harness.update_config({"profile_workload": "olap"})
+        parameters = harness.charm._build_postgresql_parameters()
+        # A quarter of the limit for shared_buffers (in 8kB pages) and the rest as cache.
+        assert parameters["shared_buffers"] == "137438"
+        assert parameters["effective_cache_size"] == "412288"
+        # The tuned values derive from the same limit.
+        assert parameters["maintenance_work_mem"] == "512MB"
+
+
+def test_build_postgresql_parameters_with_tuning(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm.postgresql") as _postgresql,
+        patch("charm.PostgresqlOperatorCharm._calculate_worker_process_config", return_value={}),
+        patch("charm.PostgresqlOperatorCharm._calculate_tuning_parameters") as _tuning,
+    ):
+        _postgresql.build_postgresql_parameters.return_value = {"work_mem": 8192}
+        _tuning.return_value = {
+            "work_mem": {"value": "8192", "reason": "config", "source": "config"},
+            "max_wal_size": {"value": "8GB", "reason": "tuning", "source": "tuning"},
+        }
+
+        parameters = harness.charm._build_postgresql_parameters()
+        assert parameters["work_mem"] == 8192
+        assert parameters["max_wal_size"] == "8GB"
+
+
+def test_on_get_tuning(harness):
+    with (
+        patch("charm.PostgresqlOperatorCharm._build_postgresql_parameters"),
+        patch("charm.PostgresqlOperatorCharm._calculate_tuning_parameters") as _tuning,
+    ):
+        # Test when the tuning is disabled.
+        event = MagicMock()
+        harness.charm._on_get_tuning(event)
+        event.fail.assert_called_once()
+        event.set_results.assert_not_called()
+
+        # Test when a workload profile is set.
+        harness.update_config({"profile_workload": "mixed"})
+        _tuning.return_value = {
+            "max_wal_size": {"value": "4GB", "reason": "fake-reason", "source": "tuning"},
+        }
+        event.reset_mock()
+        harness.charm._on_get_tuning(event)
+        event.fail.assert_not_called()
+        event.set_results.assert_called_once_with({
+            "workload": "mixed",
+            "storage-type": "ssd",
+            "parameters": {
+                "max-wal-size": {"value": "4GB", "reason": "fake-reason", "source": "tuning"}
+            },
+        })
@@ -1,6 +1,7 @@
 # Copyright 2021 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import os
 from pathlib import Path
 from signal import SIGHUP
 from unittest.mock import MagicMock, Mock, PropertyMock, mock_open, patch, sentinel
@@ -173,6 +174,30 @@ def test_dict_to_hba_string(harness, patroni):
     )
 
 
+def test_group_users_by_databases(harness, patroni):
+    assert patroni._group_users_by_databases(None) == []
+
+    assert patroni._group_users_by_databases({
+        "operator": "all",
+        "relation-5": "db2,db1",
+        "relation-3": "db1,db2",
+        "relation-4": "db3",
+        "replication": "all",
+    }) == [
+        ("all", "operator,replication"),
+        ("db1,db2", "relation-3,relation-5"),
+        ("db3", "relation-4"),
+    ]
+
+    # Long lists of users are split into several lines.
+    with patch("cluster.PG_HBA_MAX_USERS_PER_LINE", 2):
+        assert patroni._group_users_by_databases({
+            "relation-1": "db1",
+            "relation-2": "db1",
+            "relation-3": "db1",
+        }) == [("db1", "relation-1,relation-2"), ("db1", "relation-3")]
+
+
 def test_get_primary(peers_ips, patroni):
     with (
         patch(
@@ -648,33 +673,66 @@ def test_patroni_logs(patroni):
         assert patroni.patroni_logs() == ""
 
 
-def test_last_postgresql_logs(patroni):
-    with (
-        patch("glob.glob") as _glob,
-        patch("builtins.open", mock_open(read_data="fake-logs")) as _open,
-    ):
+def test_search_patroni_logs(patroni):
+    with patch("cluster.subprocess.Popen") as _popen:
+        # The journal is read from its end.
+        _popen.return_value.stdout = iter([
+            "fake-line\n",
+            "fake-error 2\n",
+            *["fake-line\n"] * 5000,
+            "fake-error 1\n",
+        ])
+        assert patroni.search_patroni_logs(r"fake-error (\d)").group(1) == "2"
+        assert _popen.call_args.args[0][:3] == [
+            "/usr/bin/journalctl",
+            "--unit=snap.charmed-postgresql.patroni.service",
+            "--reverse",
+        ]
+        # The journal isn't read further once the line is found.
+        _popen.return_value.kill.assert_called_once_with()
+
+        # Test that a line far from the end of the journal is still found.
+        _popen.return_value.stdout = iter([
+            *["fake-line\n"] * 5000,
+            "fake-error 1\n",
+            "fake-start\n",
+        ])
+        assert patroni.search_patroni_logs(r"fake-error (\d)", "fake-start").group(1) == "1"
+
+        # Test that the lines before the stop line aren't searched.
+        _popen.return_value.stdout = iter(["fake-line\n", "fake-start\n", "fake-error 1\n"])
+        assert patroni.search_patroni_logs(r"fake-error", "fake-start") is None
+
+        # Test when the journal can't be read.
+        _popen.side_effect = OSError
+        assert patroni.search_patroni_logs(r"fake-error") is None
+
+
+def test_last_postgresql_logs(patroni, tmp_path):
+    with patch("cluster.POSTGRESQL_LOGS_PATH", str(tmp_path)):
         # Test when there are no files to read.
         assert patroni.last_postgresql_logs() == ""
-        _open.assert_not_called()
-
-        # Test when there are multiple files in the logs directory.
-        _glob.return_value = [
-            "/var/snap/charmed-postgresql/common/var/log/postgresql/postgresql.log.1",
-            "/var/snap/charmed-postgresql/common/var/log/postgresql/postgresql.log.2",
-            "/var/snap/charmed-postgresql/common/var/log/postgresql/postgresql.log.3",
-        ]
-        assert patroni.last_postgresql_logs() == "fake-logs"
-        _open.assert_called_once_with(
-            "/var/snap/charmed-postgresql/common/var/log/postgresql/postgresql.log.3"
-        )
+        assert patroni.search_postgresql_logs("fake") is None
+
+        # Test when there are multiple files in the logs directory (the most recently
+        # written one is read, even if its name doesn't sort last).
+        for name, content, mtime in [
+            ("postgresql-6_2359.log", "old-logs\n", 100),
+            ("postgresql-0_0000.log", "line 1\nline 2 at 10:00\nline 3 at 11:00\n", 200),
+        ]:
+            (tmp_path / name).write_text(content)
+            os.utime(tmp_path / name, (mtime, mtime))
+        (tmp_path / "other-file").write_text("not a log file")
+        assert patroni.last_postgresql_logs() == "line 1\nline 2 at 10:00\nline 3 at 11:00"
+        assert patroni.last_postgresql_logs(num_lines=2) == "line 2 at 10:00\nline 3 at 11:00"
+        assert patroni.search_postgresql_logs(r"at (.*)$").group(1) == "11:00"
+        assert patroni.search_postgresql_logs(r"old-logs") is None
 
         # Test when the charm fails to read the logs.
-        _open.reset_mock()
-        _open.side_effect = OSError
-        assert patroni.last_postgresql_logs() == ""
-        _open.assert_called_with(
-            "/var/snap/charmed-postgresql/common/var/log/postgresql/postgresql.log.3"
-        )
+        with patch("cluster.tail_file", side_effect=OSError):
+            assert patroni.last_postgresql_logs() == ""
+        with patch("cluster.search_file_backwards", side_effect=OSError):
+            assert patroni.search_postgresql_logs("line") is None
 
 
 def test_get_patroni_restart_condition(patroni):
@@ -0,0 +1,56 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+import gzip
+import shutil
+from io import BytesIO
+
+import pytest
+
+from compression_benchmark import compress_command, run_benchmark, write_sample
+
+
+def test_write_sample(tmp_path):
+    (tmp_path / "base" / "1").mkdir(parents=True)
+    (tmp_path / "global").mkdir()
+    (tmp_path / "base" / "1" / "1000").write_bytes(b"a" * 3 * 1024 * 1024)
+    (tmp_path / "base" / "1" / "1001").write_bytes(b"b" * 1024 * 1024)
+    (tmp_path / "global" / "1260").write_bytes(b"c" * 10)
+    (tmp_path / "global" / "empty").write_bytes(b"")
+
+    # Test that a chunk is taken from each file, largest first.
+    sample = BytesIO()
+    assert write_sample(str(tmp_path), 2 * 1024 * 1024 + 5, sample) == 2 * 1024 * 1024 + 5
+    assert sample.getvalue() == b"a" * 1024 * 1024 + b"b" * 1024 * 1024 + b"c" * 5
+
+    # Test that the sample is smaller than requested when there isn't enough data.
+    sample = BytesIO()
+    assert write_sample(str(tmp_path), 10 * 1024 * 1024, sample) == 4 * 1024 * 1024 + 10
+    assert sample.getvalue() == (
+        b"a" * 1024 * 1024 + b"b" * 1024 * 1024 + b"c" * 10 + b"a" * 2 * 1024 * 1024
+    )
+
+    # Test when there is no data directory.
+    assert write_sample(str(tmp_path / "missing"), 1024, BytesIO()) == 0
+
+
+def test_compress_command():
+    assert compress_command("zst", 3) == ["zstd", "-3", "-c"]
+    assert compress_command("zst", -5) == ["zstd", "--fast=5", "-c"]
+    assert compress_command("lz4", 12) == ["lz4", "-12", "-c"]
+    assert compress_command("gz", 6) == ["gzip", "-6", "-c"]
+
+
+@pytest.mark.skipif(shutil.which("gzip") is None, reason="gzip is not installed")
+def test_run_benchmark(tmp_path):
+    data = b"0123456789" * 100000
+    sample_path = tmp_path / "sample"
+    sample_path.write_bytes(data)
+    with open(sample_path, "rb") as sample:
+        result = run_benchmark(["gzip", "-6", "-c"], sample, len(data))
+    compressed_size = len(gzip.compress(data, 6))
+    assert float(result["ratio"]) == pytest.approx(len(data) / compressed_size, rel=0.1)
+    assert result["throughput"].endswith("MB/s")
+
+    # Test when the command fails.
+    with open(sample_path, "rb") as sample, pytest.raises(OSError):
+        run_benchmark(["gzip", "--invalid-option"], sample, len(data))
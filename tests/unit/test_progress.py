@@ -0,0 +1,82 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+from datetime import datetime, timedelta
+
+import pytest
+
+from progress import (
+    GB,
+    MB,
+    backup_progress,
+    format_duration,
+    format_progress,
+    format_size,
+    restore_progress,
+)
+
+
+@pytest.mark.parametrize(
+    "size,expected",
+    [
+        (512, "512B"),
+        (1536, "1.5KB"),
+        (10 * MB, "10.0MB"),
+        (2.5 * GB, "2.5GB"),
+        (3 * GB * 1024, "3.0TB"),
+    ],
+)
+def test_format_size(size, expected):
+    assert format_size(size) == expected
+
+
+@pytest.mark.parametrize(
+    "seconds,expected", [(45, "45s"), (192, "3m12s"), (3720, "1h02m"), (90061, "25h01m")]
+)
+def test_format_duration(seconds, expected):
+    assert format_duration(seconds) == expected
+
+
+def test_format_progress():
+    assert format_progress(0.0, 0) == "0.0%"
+    assert format_progress(0.25, 100) == "25.0%, ETA 5m00s"
+    assert format_progress(0.25, 100, 4 * GB) == "25.0% (1.0GB of 4.0GB), 10.2MB/s, ETA 5m00s"
+    assert format_progress(1.0, 100, 4 * GB) == "100.0% (4.0GB of 4.0GB), 41.0MB/s"
+
+
+def test_backup_progress():
+    info = [
+        {"name": "other-stanza", "status": {"lock": {"backup": {"held": True, "size": 10}}}},
+        {"name": "test-stanza", "status": {"lock": {"backup": {"held": False}}}},
+    ]
+    assert backup_progress(info, "test-stanza") is None
+
+    info[1]["status"]["lock"]["backup"] = {"held": True, "size": 100, "size-cplt": 40}
+    assert backup_progress(info, "test-stanza") == (40, 100)
+    assert backup_progress([], "test-stanza") is None
+
+
+def test_restore_progress(tmp_path):
+    log_file = tmp_path / "test-stanza-restore.log"
+    # Test when the log file doesn't exist.
+    assert restore_progress(str(log_file)) is None
+
+    started_at = datetime.now() - timedelta(seconds=120)
+    begin = started_at.strftime("%Y-%m-%d %H:%M:%S")
+    previous = (started_at - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+    log_file.write_text(
+        f"{previous}.000 P00   INFO: restore command begin 2.54.2: --stanza=test-stanza\n"
+        f"{previous}.100 P01 DETAIL: restore file /data/base/1/1249 (8KB, 99.00%) checksum abc\n"
+        f"{begin}.000 P00   INFO: restore command begin 2.54.2: --stanza=test-stanza\n"
+    )
+    # Test when only the files of a previous restore were logged.
+    assert restore_progress(str(log_file)) is None
+
+    with log_file.open("a") as file:
+        file.write(
+            f"{begin}.500 P01 DETAIL: restore file /data/base/1/1247 (456KB, 12.50%) checksum abc\n"
+            f"{begin}.600 P02 DETAIL: restore file /data/base/1/1255 (1MB, 25.00%) checksum def\n"
+            f"{begin}.700 P00 DETAIL: sync path '/data/base/1'\n"
+        )
+    fraction, elapsed = restore_progress(str(log_file))
+    assert fraction == 0.25
+    assert 119 < elapsed < 130
@@ -0,0 +1,146 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from resources import (
+    get_cpu_limit,
+    get_effective_cpu_count,
+    get_effective_memory,
+    get_memory_limit,
+)
+
+GIB = 1024**3
+MEMINFO = "MemTotal:       16777216 kB\nMemFree:          799284 kB\n"
+
+
+def create_files(root: Path, files: dict[str, str]) -> None:
+    for path, content in files.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(content)
+
+
+@pytest.mark.parametrize(
+    "proc_cgroup,cgroup_files,expected_memory,expected_cpus",
+    [
+        # No cgroup information at all.
+        ("", {}, None, None),
+        # cgroup v2 without limits.
+        (
+            "0::/system.slice/jujud.service\n",
+            {
+                "cgroup.controllers": "cpu memory",
+                "system.slice/jujud.service/memory.max": "max",
+                "system.slice/jujud.service/cpu.max": "max 100000",
+            },
+            None,
+            None,
+        ),
+        # cgroup v2 with limits on the leaf cgroup.
+        (
+            "0::/system.slice/jujud.service\n",
+            {
+                "cgroup.controllers": "cpu memory",
+                "system.slice/jujud.service/memory.max": str(4 * GIB),
+                "system.slice/jujud.service/cpu.max": "250000 100000",
+            },
+            4 * GIB,
+            3,
+        ),
+        # cgroup v2 with a lower limit on an ancestor and a cpuset.
+        (
+            "0::/system.slice/jujud.service\n",
+            {
+                "cgroup.controllers": "cpu memory",
+                "memory.max": str(2 * GIB),
+                "system.slice/memory.max": str(8 * GIB),
+                "system.slice/jujud.service/memory.max": "max",
+                "system.slice/cpu.max": "800000 100000",
+                "system.slice/jujud.service/cpuset.cpus.effective": "0-1,4",
+            },
+            2 * GIB,
+            3,
+        ),
+        # cgroup v1 without limits.
+        (
+            "4:memory:/lxc.payload\n2:cpu,cpuacct:/lxc.payload\n3:cpuset:/lxc.payload\n",
+            {
+                "memory/lxc.payload/memory.limit_in_bytes": "9223372036854771712",
+                "cpu,cpuacct/lxc.payload/cpu.cfs_quota_us": "-1",
+                "cpu,cpuacct/lxc.payload/cpu.cfs_period_us": "100000",
+            },
+            None,
+            None,
+        ),
+        # cgroup v1 with limits and co-mounted cpu controllers.
+        (
+            "4:memory:/lxc.payload\n2:cpu,cpuacct:/lxc.payload\n3:cpuset:/lxc.payload\n",
+            {
+                "memory/lxc.payload/memory.limit_in_bytes": str(3 * GIB),
+                "cpu,cpuacct/lxc.payload/cpu.cfs_quota_us": "200000",
+                "cpu,cpuacct/lxc.payload/cpu.cfs_period_us": "100000",
+                "cpuset/lxc.payload/cpuset.cpus": "0-5",
+            },
+            3 * GIB,
+            2,
+        ),
+        # cgroup v1 with only a cpuset.
+        (
+            "3:cpuset:/lxc.payload\n",
+            {"cpuset/lxc.payload/cpuset.cpus": "0,2,4"},
+            None,
+            3,
+        ),
+        # Hybrid setup, with the unified hierarchy mounted under "unified".
+        (
+            "4:memory:/\n0::/user.slice\n",
+            {
+                "memory/memory.limit_in_bytes": str(6 * GIB),
+                "unified/user.slice/memory.max": str(5 * GIB),
+            },
+            5 * GIB,
+            None,
+        ),
+    ],
+)
+def test_cgroup_limits(tmp_path, proc_cgroup, cgroup_files, expected_memory, expected_cpus):
+    cgroup_root = tmp_path / "sys" / "fs" / "cgroup"
+    cgroup_root.mkdir(parents=True)
+    create_files(cgroup_root, cgroup_files)
+    create_files(tmp_path / "proc", {"self/cgroup": proc_cgroup, "meminfo": MEMINFO})
+
+    assert get_memory_limit(str(cgroup_root), str(tmp_path / "proc")) == expected_memory
+    assert get_cpu_limit(str(cgroup_root), str(tmp_path / "proc")) == expected_cpus
+
+    with patch("resources.os.cpu_count", return_value=16):
+        assert get_effective_memory(str(cgroup_root), str(tmp_path / "proc")) == (
+            expected_memory or 16 * GIB
+        )
+        assert get_effective_cpu_count(str(cgroup_root), str(tmp_path / "proc")) == (
+            expected_cpus or 16
+        )
+
+
+def test_limits_higher_than_the_host_resources(tmp_path):
+    cgroup_root = tmp_path / "cgroup"
+    create_files(
+        cgroup_root,
+        {
+            "cgroup.controllers": "cpu memory",
+            "memory.max": str(64 * GIB),
+            "cpu.max": "3200000 100000",
+        },
+    )
+    create_files(tmp_path / "proc", {"self/cgroup": "0::/\n", "meminfo": MEMINFO})
+
+    with patch("resources.os.cpu_count", return_value=4):
+        assert get_effective_memory(str(cgroup_root), str(tmp_path / "proc")) == 16 * GIB
+        assert get_effective_cpu_count(str(cgroup_root), str(tmp_path / "proc")) == 4
+
+
+def test_missing_proc_files(tmp_path):
+    with patch("resources.os.cpu_count", return_value=None):
+        assert get_effective_memory(str(tmp_path), str(tmp_path)) == 0
+        assert get_effective_cpu_count(str(tmp_path), str(tmp_path)) == 0
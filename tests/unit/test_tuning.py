@@ -0,0 +1,61 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+import pytest
+
+from tuning import GB, MB, STORAGE_TYPES, WORKLOAD_PROFILES, compute_tuning
+
+
+@pytest.mark.parametrize("workload", WORKLOAD_PROFILES)
+@pytest.mark.parametrize("storage_type", STORAGE_TYPES)
+def test_compute_tuning_parameters(workload, storage_type):
+    tuning = compute_tuning(workload, storage_type, 16 * GB, 4 * GB, 100)
+
+    assert set(tuning) == {
+        "work_mem",
+        "maintenance_work_mem",
+        "min_wal_size",
+        "max_wal_size",
+        "checkpoint_completion_target",
+        "wal_buffers",
+        "random_page_cost",
+        "effective_io_concurrency",
+        "autovacuum_vacuum_scale_factor",
+        "autovacuum_analyze_scale_factor",
+    }
+    assert all(tuned["value"] and tuned["reason"] for tuned in tuning.values())
+
+
+def test_compute_tuning_values():
+    # 12GB left after shared_buffers, split across 100 connections (3 operations each).
+    oltp = compute_tuning("oltp", "ssd", 16 * GB, 4 * GB, 100)
+    assert oltp["work_mem"]["value"] == "10485kB"
+    assert oltp["maintenance_work_mem"]["value"] == "1GB"
+    assert oltp["min_wal_size"]["value"] == "2GB"
+    assert oltp["max_wal_size"]["value"] == "8GB"
+    assert oltp["wal_buffers"]["value"] == "16MB"
+    assert oltp["random_page_cost"]["value"] == "1.1"
+    assert oltp["effective_io_concurrency"]["value"] == "200"
+    assert oltp["autovacuum_vacuum_scale_factor"]["value"] == "0.05"
+
+    # Analytical workloads get more memory per query and maintenance operation.
+    olap = compute_tuning("olap", "hdd", 16 * GB, 4 * GB, 100)
+    assert olap["work_mem"]["value"] == "41943kB"
+    assert olap["maintenance_work_mem"]["value"] == "2GB"
+    assert olap["max_wal_size"]["value"] == "16GB"
+    assert olap["random_page_cost"]["value"] == "4.0"
+    assert olap["effective_io_concurrency"]["value"] == "2"
+
+    mixed = compute_tuning("mixed", "network", 16 * GB, 4 * GB, 100)
+    assert mixed["work_mem"]["value"] == "20971kB"
+    assert mixed["autovacuum_analyze_scale_factor"]["value"] == "0.05"
+
+
+def test_compute_tuning_lower_bounds():
+    # Tiny units still get the minimum values accepted by PostgreSQL.
+    tuning = compute_tuning("oltp", "ssd", 256 * MB, 256 * MB, 1000)
+    assert tuning["work_mem"]["value"] == "64kB"
+    assert tuning["maintenance_work_mem"]["value"] == "64MB"
+    assert tuning["wal_buffers"]["value"] == "7864kB"
+
+    tuning = compute_tuning("oltp", "ssd", 256 * MB, 1 * MB, 1000)
+    assert tuning["wal_buffers"]["value"] == "64kB"
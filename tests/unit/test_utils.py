@@ -5,7 +5,14 @@ import re
 from unittest.mock import patch
 
 from constants import POSTGRESQL_SNAP_NAME
-from utils import new_password, snap_refreshed
+from utils import (
+    concatenate_files,
+    new_password,
+    search_file_backwards,
+    search_reversed_lines,
+    snap_refreshed,
+    tail_file,
+)
 
 
 def test_new_password():
@@ -34,3 +41,52 @@ def test_snap_refreshed():
     ):
         assert snap_refreshed("100") is False
         assert snap_refreshed("200") is False
+
+
+def test_tail_file(tmp_path):
+    log_file = tmp_path / "file.log"
+    log_file.write_text("")
+    assert tail_file(str(log_file), 5) == ""
+
+    log_file.write_text("".join(f"line {number}\n" for number in range(1, 1001)))
+    assert tail_file(str(log_file), 3) == "line 998\nline 999\nline 1000"
+    assert tail_file(str(log_file), 0) == ""
+
+    # Files without a trailing newline and with fewer lines than requested.
+    log_file.write_text("line 1\n\nline 3")
+    assert tail_file(str(log_file), 10) == "line 1\n\nline 3"
+
+
+def test_search_file_backwards(tmp_path):
+    log_file = tmp_path / "file.log"
+    log_file.write_text("")
+    assert search_file_backwards(str(log_file), "error") is None
+
+    log_file.write_text("error 1\ninfo\nerror 2\ninfo\ninfo\n")
+    assert search_file_backwards(str(log_file), r"error (\d)").group(1) == "2"
+    assert search_file_backwards(str(log_file), re.compile(r"^info$")).group(0) == "info"
+    assert search_file_backwards(str(log_file), "warning") is None
+    # The search is limited to the last lines of the file.
+    assert search_file_backwards(str(log_file), "error", max_lines=2) is None
+    assert search_file_backwards(str(log_file), "error", max_lines=3) is not None
+
+
+def test_search_reversed_lines():
+    assert search_reversed_lines([], "error") is None
+    assert search_reversed_lines(["error 2", "info", "error 1"], r"error (\d)").group(1) == "2"
+    # The lines before the stop line (older ones) aren't searched.
+    assert search_reversed_lines(["info", "start", "error 1"], "error", "start") is None
+    assert (
+        search_reversed_lines(["error 2", "start", "error 1"], r"error (\d)", "start").group(1)
+        == "2"
+    )
+
+
+def test_concatenate_files(tmp_path):
+    (tmp_path / "first").write_bytes(b"first file\n" * 10000)
+    (tmp_path / "empty").write_bytes(b"")
+    parts = [b"header\n", tmp_path / "first", tmp_path / "empty", tmp_path / "missing", b"end"]
+    with concatenate_files(parts) as stream:
+        assert stream.read(7) == b"header\n"
+        assert stream.read() == b"first file\n" * 10000 + b"end"
+        assert stream.read() == b""
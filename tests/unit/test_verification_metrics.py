@@ -0,0 +1,173 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+import json
+import signal
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer
+from unittest.mock import PropertyMock, patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+from ops.testing import Harness
+
+from charm import PostgresqlOperatorCharm
+from constants import PEER
+from scripts.verification_metrics import MetricsHandler
+from verification_metrics import format_metrics
+
+VERIFICATION = {
+    "stanza": "test-stanza",
+    "finished-at": "2026-01-01T00:00:00Z",
+    "duration": 125,
+    "status": "error",
+    "backups": {"20251231-000000F": "valid", "20251231-120000F": "invalid"},
+}
+
+
+@pytest.fixture(autouse=True)
+def harness():
+    harness = Harness(PostgresqlOperatorCharm)
+
+    # Set up the initial relation and hooks.
+    peer_rel_id = harness.add_relation(PEER, "postgresql")
+    harness.add_relation_unit(peer_rel_id, "postgresql/0")
+    harness.begin()
+    yield harness
+    harness.cleanup()
+
+
+def test_format_metrics():
+    samples = [
+        line for line in format_metrics(VERIFICATION).splitlines() if not line.startswith("#")
+    ]
+    assert samples == [
+        'pgbackrest_verify_status{stanza="test-stanza"} 1',
+        'pgbackrest_verify_duration_seconds{stanza="test-stanza"} 125',
+        'pgbackrest_verify_last_completion_timestamp_seconds{stanza="test-stanza"} 1767225600',
+        'pgbackrest_verify_backup_status{stanza="test-stanza",backup="20251231-000000F"} 0',
+        'pgbackrest_verify_backup_status{stanza="test-stanza",backup="20251231-120000F"} 1',
+    ]
+
+
+def test_update(harness, tmp_path):
+    metrics_file = tmp_path / "metrics.prom"
+    with (
+        patch("verification_metrics.BACKUP_VERIFICATION_METRICS_FILE", str(metrics_file)),
+        patch("verification_metrics.open", create=True) as _open,
+        patch("subprocess.Popen") as _popen,
+        patch("os.kill") as _kill,
+        patch("pwd.getpwnam") as _getpwnam,
+        patch(
+            "charm.PostgreSQLBackups.stanza_name",
+            new_callable=PropertyMock,
+            return_value="test-stanza",
+        ),
+        patch(
+            "charm.PostgresqlOperatorCharm._unit_ip",
+            new_callable=PropertyMock,
+            return_value="1.1.1.1",
+        ) as _unit_ip,
+    ):
+        _popen.return_value.pid = 1234
+        _getpwnam.return_value.pw_uid = 584788
+        _getpwnam.return_value.pw_gid = 584788
+        peer_rel_id = harness.model.get_relation(PEER).id
+
+        # Test that nothing is done before the stanza is created.
+        harness.charm.verification_metrics.update()
+        _popen.assert_not_called()
+        assert not metrics_file.exists()
+
+        # Test that nothing is done while the verifications aren't scheduled.
+        with harness.hooks_disabled():
+            harness.update_relation_data(peer_rel_id, harness.charm.app.name, {"stanza": "test"})
+        harness.charm.verification_metrics.update()
+        _popen.assert_not_called()
+        assert not metrics_file.exists()
+
+        # Test that the server is started without metrics when the repository wasn't verified.
+        harness.update_config({"backup_schedule_verify": "0 3 * * 0"})
+        harness.charm.verification_metrics.update()
+        assert metrics_file.read_text() == ""
+        _popen.assert_called_once_with(
+            [
+                "/usr/bin/python3",
+                "scripts/verification_metrics.py",
+                "1.1.1.1",
+                "9855",
+                str(metrics_file),
+            ],
+            stdout=_open.return_value,
+            stderr=-2,
+            user=584788,
+            group=584788,
+            extra_groups=[],
+            start_new_session=True,
+        )
+
+        # Test that the metrics of the verification run by this unit are exported.
+        _popen.reset_mock()
+        with harness.hooks_disabled():
+            harness.update_relation_data(
+                peer_rel_id,
+                harness.charm.unit.name,
+                {"backup-verification": json.dumps(VERIFICATION)},
+            )
+        harness.charm.verification_metrics.update()
+        assert metrics_file.read_text() == format_metrics(VERIFICATION)
+        _kill.assert_called_once_with(1234, 0)
+        _popen.assert_not_called()
+
+        # Test that they're not exported anymore once another unit verifies the repository.
+        with harness.hooks_disabled():
+            harness.add_relation_unit(peer_rel_id, "postgresql/1")
+            harness.update_relation_data(
+                peer_rel_id,
+                "postgresql/1",
+                {
+                    "backup-verification": json.dumps({
+                        **VERIFICATION,
+                        "finished-at": "2026-01-02T00:00:00Z",
+                    })
+                },
+            )
+        harness.charm.verification_metrics.update()
+        assert metrics_file.read_text() == ""
+
+        # Test that the server is restarted when the address of the unit changes.
+        _unit_ip.return_value = "2.2.2.2"
+        harness.charm.verification_metrics.update()
+        _kill.assert_called_with(1234, signal.SIGTERM)
+        _popen.assert_called_once()
+        assert _popen.call_args[0][0][2] == "2.2.2.2"
+
+        # Test that the server is stopped when the verifications aren't scheduled anymore.
+        _kill.reset_mock()
+        harness.update_config({"backup_schedule_verify": ""})
+        harness.charm.verification_metrics.update()
+        _kill.assert_called_with(1234, signal.SIGTERM)
+
+
+def test_metrics_handler(tmp_path):
+    metrics_file = tmp_path / "metrics.prom"
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(MetricsHandler, metrics_file=str(metrics_file))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        # Test when the charm didn't write the metrics yet.
+        with urlopen(f"{url}/metrics") as response:
+            assert response.read() == b""
+
+        metrics_file.write_text("pgbackrest_verify_status 0\n")
+        with urlopen(f"{url}/metrics") as response:
+            assert response.read() == b"pgbackrest_verify_status 0\n"
+
+        with pytest.raises(HTTPError):
+            urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()